@@ -11,6 +11,8 @@ import sys
 import os
 import json
 import time
+import gzip
+import hashlib
 
 try:
     sys.stdout.reconfigure(encoding='utf-8')
@@ -18,17 +20,81 @@ try:
 except:
     pass
 from pathlib import Path
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
 import re
+import requests
 
 # 添加backend目录到Python路径
 backend_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, backend_dir)
 
-from vector_knowledge_base import VectorKnowledgeBase
-from knowledge_retriever import KnowledgeRetriever
+from sharded_knowledge_base import ShardedKnowledgeBase, KnowledgeBaseBusyError
+from knowledge_retriever import KnowledgeRetriever, ANSWER_MODES
+from llm_scheduler import LLMScheduler, SchedulerRejectedError
+from ollama_pool import OllamaPool
+from conversation_sessions import SessionStore, SessionNotFoundError
+from semantic_cache import SemanticCache
+from directory_sync import DirectorySync
+from document_retrieval import AGGREGATIONS
+from async_server import start_async_server
+import fast_json
+import metrics
+import tracing
+
+
+# 响应体超过该字节数且客户端支持时使用gzip压缩
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '2048'))
+
+# 文档列表每页的默认与最大文档数
+DOCUMENTS_PAGE_SIZE = 100
+MAX_DOCUMENTS_PAGE_SIZE = 1000
+
+# 作为指标标签的路径，其余路径统一记为 other，避免标签基数无限增长
+METRIC_PATHS = {
+    '/api/stats', '/api/documents', '/api/health', '/api/collections', '/api/metrics',
+    '/api/search', '/api/ask', '/api/upload_document', '/api/add_document', '/api/rebuild',
+    '/api/admin/profiler', '/api/sessions', '/api/sessions/close'
+}
+
+# 未设置时管理接口只接受本机请求
+ADMIN_TOKEN = os.getenv('KB_ADMIN_TOKEN')
+
+# 多进程模式下工作进程转发给写入进程的请求（写入、重建与会话状态只存在于写入进程）
+WRITER_PATHS = {
+    ('POST', '/api/upload_document'), ('POST', '/api/add_document'), ('POST', '/api/rebuild'),
+    ('GET', '/api/rebuild'), ('GET', '/api/sessions'), ('POST', '/api/sessions/close')
+}
+
+# 转发时透传给写入进程的请求头与回传给客户端的响应头
+FORWARD_REQUEST_HEADERS = ('Content-Type', 'X-Admin-Token')
+FORWARD_RESPONSE_HEADERS = ('Retry-After',)
+
+
+def _env_float(name):
+    """读取可选的浮点型环境变量，未设置时返回None"""
+    value = os.getenv(name)
+    return float(value) if value not in (None, '') else None
+
+
+def _optional_float(data, key):
+    """读取请求体中可选的浮点参数"""
+    value = data.get(key)
+    return None if value is None else float(value)
+
+
+def _document_summary(doc_info):
+    """上传/添加文档响应中只返回文档摘要，不回传全文与文本块"""
+    return {
+        'doc_id': doc_info.get('doc_id'),
+        'file_name': doc_info.get('file_name'),
+        'file_path': doc_info.get('file_path'),
+        'file_size': doc_info.get('file_size'),
+        'chunk_count': doc_info.get('chunk_count'),
+        'word_count': doc_info.get('word_count'),
+        'collection': doc_info.get('collection')
+    }
 
 
 class APIHandler(BaseHTTPRequestHandler):
@@ -36,6 +102,11 @@ class APIHandler(BaseHTTPRequestHandler):
     _kb = None
     _retriever = None
     _initialized = False
+    # 多进程模式：工作进程中为写入进程的地址；写入进程中为True，信任本机工作进程传来的 X-Forwarded-For
+    _writer_url = None
+    _behind_workers = False
+    # 目录同步（KB_SYNC_DIRS，多进程模式下只在写入进程中运行）
+    _sync = None
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -54,30 +125,84 @@ class APIHandler(BaseHTTPRequestHandler):
         self.send_cors_headers()
         self.end_headers()
     
+    def send_response(self, code, message=None):
+        """记录响应状态码供指标使用"""
+        self._status = code
+        super().send_response(code, message)
+    
+    def end_headers(self):
+        """附加请求ID与各阶段耗时响应头"""
+        trace = tracing.current_trace()
+        if trace is not None:
+            self.send_header('X-Request-ID', trace.request_id)
+            if trace.spans:
+                self.send_header('Server-Timing', trace.server_timing())
+        super().end_headers()
+    
+    def _begin_request(self, method, path):
+        """开始追踪请求（沿用客户端传入的 X-Request-ID），按采样率启动分析器"""
+        request_id = (self.headers.get('X-Request-ID') or '')[:64] or None
+        tracing.start_trace(request_id, f'{method} {path}')
+        return tracing.PROFILER.maybe_start()
+    
+    def _record_request(self, method, path, started, profile=None):
+        """记录HTTP请求数量与耗时，结束追踪并检查慢查询"""
+        tracing.PROFILER.stop(profile)
+        label = path if path in METRIC_PATHS else 'other'
+        metrics.HTTP_REQUESTS.inc(method=method, path=label, status=getattr(self, '_status', None) or 0)
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=method, path=label)
+        trace = tracing.finish_trace()
+        if trace is not None:
+            trace.annotate(status=getattr(self, '_status', None))
+            try:
+                tracing.SLOW_QUERY_LOG.maybe_log(trace)
+            except OSError as e:
+                print(f"⚠️ 写入慢查询日志失败: {e}")
+    
     def do_GET(self):
         """处理GET请求"""
         parsed_path = urlparse(self.path)
         path = parsed_path.path
+        started = time.perf_counter()
+        profile = self._begin_request('GET', path)
         
         try:
-            if path == '/api/stats':
+            if APIHandler._writer_url and ('GET', path) in WRITER_PATHS:
+                self._forward_to_writer()
+            elif path == '/api/stats':
                 self.handle_stats()
             elif path == '/api/documents':
-                self.handle_documents()
+                self.handle_documents(parse_qs(parsed_path.query))
             elif path == '/api/health':
                 self.handle_health()
+            elif path == '/api/collections':
+                self.handle_collections()
+            elif path == '/api/metrics':
+                self.handle_metrics()
+            elif path == '/api/admin/profiler':
+                self.handle_profiler(parse_qs(parsed_path.query))
+            elif path == '/api/sessions':
+                self.handle_sessions(parse_qs(parsed_path.query))
+            elif path == '/api/rebuild':
+                self.handle_rebuild_status()
             else:
                 self.send_error(404, "Not Found")
         except Exception as e:
             self.send_error(500, f"Internal Server Error: {str(e)}")
+        finally:
+            self._record_request('GET', path, started, profile)
     
     def do_POST(self):
         """处理POST请求"""
         parsed_path = urlparse(self.path)
         path = parsed_path.path
+        started = time.perf_counter()
+        profile = self._begin_request('POST', path)
         
         try:
-            if path == '/api/search':
+            if APIHandler._writer_url and ('POST', path) in WRITER_PATHS:
+                self._forward_to_writer()
+            elif path == '/api/search':
                 self.handle_search()
             elif path == '/api/ask':
                 self.handle_ask()
@@ -87,17 +212,95 @@ class APIHandler(BaseHTTPRequestHandler):
                 self.handle_add_document()
             elif path == '/api/rebuild':
                 self.handle_rebuild()
+            elif path == '/api/admin/profiler':
+                self.handle_profiler_config()
+            elif path == '/api/sessions/close':
+                self.handle_close_session()
             else:
                 self.send_error(404, "Not Found")
         except Exception as e:
             self.send_error(500, f"Internal Server Error: {str(e)}")
+        finally:
+            self._record_request('POST', path, started, profile)
     
-    def send_cors_headers(self):
+    def send_cors_headers(self, content_type='application/json; charset=utf-8'):
         """发送CORS头"""
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Request-ID')
+        self.send_header('Access-Control-Expose-Headers', 'X-Request-ID, Server-Timing, ETag')
+        self.send_header('Content-Type', content_type)
+    
+    def send_json(self, data, status=200, headers=None, etag=False):
+        """
+        序列化并发送JSON响应，较大的响应体按 Accept-Encoding 进行gzip压缩
+        
+        etag 为 True 时按响应体内容生成 ETag，与请求的 If-None-Match 相同时只返回 304，
+        前端轮询的内容没有变化时不必再传输和解析响应体。
+        """
+        with tracing.span('serialize'):
+            body = fast_json.dumps(data)
+        if etag:
+            # 弱校验：同一内容的gzip与未压缩表示共用一个 ETag
+            tag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            headers = {**(headers or {}), 'ETag': tag, 'Cache-Control': 'no-cache'}
+            if_none_match = self.headers.get('If-None-Match', '') if self.headers else ''
+            if tag in (t.strip() for t in if_none_match.split(',')):
+                self.send_response(304)
+                self.send_cors_headers()
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+        accept_encoding = self.headers.get('Accept-Encoding', '') if self.headers else ''
+        compressed = len(body) >= GZIP_MIN_BYTES and 'gzip' in accept_encoding
+        if compressed:
+            body = gzip.compress(body, compresslevel=5)
+        
+        self.send_response(status)
+        self.send_cors_headers()
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _forward_to_writer(self, body=None):
+        """把请求原样转发给写入进程，并把响应回传给客户端（多进程模式的工作进程）"""
+        if body is None:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        headers = {name: self.headers[name] for name in FORWARD_REQUEST_HEADERS if self.headers.get(name)}
+        headers['X-Forwarded-For'] = self._client_ip()
+        headers['Accept-Encoding'] = 'identity'
+        trace = tracing.current_trace()
+        if trace is not None:
+            headers['X-Request-ID'] = trace.request_id
+        with tracing.span('forward'):
+            try:
+                response = requests.request(self.command, APIHandler._writer_url + self.path, data=body or None,
+                                            headers=headers, timeout=float(os.getenv('KB_WRITER_TIMEOUT', '600')))
+            except requests.exceptions.RequestException as e:
+                self.send_error(502, f"Writer process unavailable: {e}")
+                return
+        
+        self.send_response(response.status_code)
+        self.send_cors_headers(response.headers.get('Content-Type', 'application/json; charset=utf-8'))
+        for name in FORWARD_RESPONSE_HEADERS:
+            if name in response.headers:
+                self.send_header(name, response.headers[name])
+        self.send_header('Content-Length', str(len(response.content)))
+        self.end_headers()
+        self.wfile.write(response.content)
+    
+    def _client_ip(self):
+        """客户端地址；写入进程收到本机工作进程转发的请求时取 X-Forwarded-For"""
+        peer = self.client_address[0]
+        if APIHandler._behind_workers and peer in ('127.0.0.1', '::1'):
+            return self.headers.get('X-Forwarded-For') or peer
+        return peer
     
     def handle_stats(self):
         """处理统计信息请求"""
@@ -106,27 +309,116 @@ class APIHandler(BaseHTTPRequestHandler):
                 self.send_error(500, "Failed to get stats: knowledge base not initialized")
                 return
             stats = APIHandler._kb.get_stats()
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps(stats).encode())
+            if APIHandler._retriever is not None:
+                stats['ollama_pool'] = APIHandler._retriever.pool.get_stats()
+                stats['sessions'] = APIHandler._retriever.sessions.get_stats()
+                if APIHandler._retriever.semantic_cache is not None:
+                    stats['semantic_cache'] = APIHandler._retriever.semantic_cache.get_stats()
+                if APIHandler._retriever.scheduler is not None:
+                    stats['llm_scheduler'] = APIHandler._retriever.scheduler.get_stats()
+            if APIHandler._kb.rebuilding:
+                stats['rebuild'] = APIHandler._kb.get_rebuild_progress()
+            if APIHandler._sync is not None:
+                stats['sync'] = APIHandler._sync.get_stats()
+            self.send_json(stats, etag=True)
         except Exception as e:
             self.send_error(500, f"Failed to get stats: {str(e)}")
     
-    def handle_documents(self):
-        """处理文档列表请求"""
+    def handle_documents(self, query):
+        """
+        处理文档列表请求（分页）
+        
+        查询参数: limit、cursor（上一页的 next_cursor）、sort（name/path/size/chunks/mtime）、
+        order（asc/desc）、collection、q（文件名包含的文字）、type（扩展名）
+        """
         try:
             if APIHandler._kb is None:
                 self.send_error(500, "Failed to get documents: knowledge base not initialized")
                 return
-            documents = APIHandler._kb.get_documents()
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({"documents": documents}).encode())
+            
+            def param(name):
+                return (query.get(name) or [None])[0] or None
+            
+            try:
+                limit = min(max(1, int(param('limit') or DOCUMENTS_PAGE_SIZE)), MAX_DOCUMENTS_PAGE_SIZE)
+            except ValueError:
+                self.send_error(400, "limit must be an integer")
+                return
+            try:
+                result = APIHandler._kb.list_documents(
+                    collection=param('collection'), sort=param('sort') or 'name', order=param('order') or 'asc',
+                    cursor=param('cursor'), limit=limit, query=param('q'), file_type=param('type'))
+            except ValueError:
+                self.send_error(400, "Invalid sort, order or cursor")
+                return
+            except KeyError:
+                self.send_error(404, "Collection not found")
+                return
+            self.send_json(result, etag=True)
         except Exception as e:
             self.send_error(500, f"Failed to get documents: {str(e)}")
     
+    def handle_collections(self):
+        """处理集合列表请求"""
+        try:
+            if APIHandler._kb is None:
+                self.send_error(500, "Failed to get collections: knowledge base not initialized")
+                return
+            stats = APIHandler._kb.get_stats()
+            self.send_json({
+                "collections": APIHandler._kb.list_collections(),
+                "details": stats['collections']
+            })
+        except Exception as e:
+            self.send_error(500, f"Failed to get collections: {str(e)}")
+    
+    def handle_metrics(self):
+        """以 Prometheus 文本格式导出运行指标"""
+        body = metrics.REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_cors_headers('text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _check_admin(self):
+        """校验管理接口权限：配置了 KB_ADMIN_TOKEN 时校验令牌，否则只允许本机访问"""
+        if ADMIN_TOKEN:
+            allowed = self.headers.get('X-Admin-Token') == ADMIN_TOKEN
+        else:
+            allowed = self._client_ip() in ('127.0.0.1', '::1')
+        if not allowed:
+            self.send_error(403, "Forbidden")
+        return allowed
+    
+    def handle_profiler(self, query):
+        """查看采样分析器状态与累计统计"""
+        if not self._check_admin():
+            return
+        try:
+            limit = max(0, int(query.get('limit', ['30'])[0]))
+        except ValueError:
+            self.send_error(400, "limit must be an integer")
+            return
+        sort = query.get('sort', ['cumulative'])[0]
+        if sort not in ('cumulative', 'tottime', 'calls'):
+            self.send_error(400, "sort must be one of: cumulative, tottime, calls")
+            return
+        self.send_json(tracing.PROFILER.report(limit, sort))
+    
+    def handle_profiler_config(self):
+        """运行时开关采样分析器：{"enabled": true, "sample_rate": 0.1, "reset": false}"""
+        if not self._check_admin():
+            return
+        content_length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(content_length).decode() or '{}')
+        try:
+            tracing.PROFILER.configure(data.get('enabled'), data.get('sample_rate'), bool(data.get('reset')))
+        except (TypeError, ValueError) as e:
+            self.send_error(400, f"Invalid profiler config: {e}")
+            return
+        self.send_json(tracing.PROFILER.report(limit=0))
+    
     def handle_health(self):
         """处理健康检查请求"""
         try:
@@ -138,23 +430,18 @@ class APIHandler(BaseHTTPRequestHandler):
                     "kb_initialized": APIHandler._kb is not None,
                     "retriever_initialized": APIHandler._retriever is not None
                 }
-                self.send_response(200)
-                self.send_cors_headers()
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(health_data).encode())
+                self.send_json(health_data)
                 return
                 
             ollama_status = APIHandler._retriever.check_ollama_connection()
+            pool_stats = APIHandler._retriever.pool.get_stats()
             health_data = {
                 "status": "healthy", 
                 "ollama_connected": ollama_status,
+                "ollama_endpoints": {"healthy": pool_stats['healthy'], "total": pool_stats['total']},
                 "timestamp": time.time()
             }
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps(health_data).encode())
+            self.send_json(health_data)
         except Exception as e:
             self.send_error(500, f"Health check failed: {str(e)}")
     
@@ -171,34 +458,56 @@ class APIHandler(BaseHTTPRequestHandler):
             
             query = data.get('query', '')
             top_k = data.get('top_k', 10)
+            collection = data.get('collection')
+            tracing.annotate(query=query, top_k=top_k, collection=collection)
             
             if not query:
                 self.send_error(400, "Query parameter is required")
                 return
             
-            results = APIHandler._retriever.search(query, top_k)
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            # 确保所有数据都是JSON可序列化的
-            serializable_results = []
-            for result in results:
-                serializable_result = {
-                    'chunk_id': int(result['chunk_id']),
-                    'doc_id': int(result['doc_id']),
-                    'file_path': str(result['file_path']),
-                    'file_name': str(result['file_name']),
-                    'text': str(result['text']),
-                    'similarity': float(result['similarity']),
-                    'chunk_index': int(result['chunk_index'])
-                }
-                serializable_results.append(serializable_result)
-            self.wfile.write(json.dumps({"results": serializable_results}).encode())
+            try:
+                cutoffs = {key: _optional_float(data, key) for key in ('min_similarity', 'relative_cutoff', 'max_gap')}
+            except (TypeError, ValueError):
+                self.send_error(400, "min_similarity, relative_cutoff and max_gap must be numbers")
+                return
+            
+            if data.get('group_by') == 'document':
+                self.handle_document_search(data, query, top_k, collection, cutoffs['min_similarity'])
+                return
+            
+            try:
+                results = APIHandler._retriever.search(query, top_k, collection, **cutoffs)
+            except KeyError:
+                self.send_error(404, f"Collection not found: {collection}")
+                return
+            
+            # 检索结果已是原生类型（NumPy标量也可由序列化层处理），直接输出
+            self.send_json({"results": results})
         except Exception as e:
             import traceback
             error_msg = f"Search failed: {str(e)}\n{traceback.format_exc()}"
             self.send_error(500, error_msg)
     
+    def handle_document_search(self, data, query, top_k, collection, min_similarity):
+        """文档级检索：{"group_by": "document", "aggregate": "max", "top_n": 3, "passages": 3, "neighbors": 1}"""
+        aggregate = data.get('aggregate', 'max')
+        if aggregate not in AGGREGATIONS:
+            self.send_error(400, f"aggregate must be one of: {', '.join(AGGREGATIONS)}")
+            return
+        try:
+            options = {key: int(data[key]) for key in ('top_n', 'passages', 'neighbors', 'candidates')
+                       if data.get(key) is not None}
+        except (TypeError, ValueError):
+            self.send_error(400, "top_n, passages, neighbors and candidates must be integers")
+            return
+        try:
+            documents = APIHandler._retriever.search_documents(query, top_k, collection, min_similarity,
+                                                               aggregate=aggregate, **options)
+        except KeyError:
+            self.send_error(404, f"Collection not found: {collection}")
+            return
+        self.send_json({"documents": documents})
+    
     def handle_ask(self):
         """处理问答请求"""
         try:
@@ -212,31 +521,116 @@ class APIHandler(BaseHTTPRequestHandler):
             
             question = data.get('question', '')
             top_k = data.get('top_k', 5)
+            collection = data.get('collection')
+            tracing.annotate(query=question, top_k=top_k, collection=collection)
             
             if not question:
                 self.send_error(400, "Question parameter is required")
                 return
             
+            try:
+                cutoffs = {key: _optional_float(data, key) for key in ('min_similarity', 'relative_cutoff', 'max_gap')}
+            except (TypeError, ValueError):
+                self.send_error(400, "min_similarity, relative_cutoff and max_gap must be numbers")
+                return
+            
+            mode = data.get('mode') or 'auto'
+            if mode not in ANSWER_MODES:
+                self.send_error(400, f"mode must be one of: {', '.join(ANSWER_MODES)}")
+                return
+            
+            try:
+                # 优先级限制在 [-10, 10]，截止时间不超过调度器默认值
+                priority = max(-10, min(10, int(data.get('priority', 0))))
+                timeout = _optional_float(data, 'timeout')
+            except (TypeError, ValueError):
+                self.send_error(400, "priority and timeout must be numbers")
+                return
+            
+            # 多轮会话：session 为 true 时创建会话，传入 session_id 时继续该会话
+            session_id = data.get('session_id')
+            use_session = bool(session_id) or bool(data.get('session'))
+            if use_session and mode == 'extractive':
+                self.send_error(400, "Sessions are not supported in extractive mode")
+                return
+            if use_session and APIHandler._writer_url:
+                # 会话保存在写入进程中，各轮都由它处理才能复用 context
+                self._forward_to_writer(post_data)
+                return
+            
             print(f"🤖 处理问答请求: {question[:50]}...")
-            result = APIHandler._retriever.ask_question(question, top_k)
+            try:
+                if use_session:
+                    result = APIHandler._retriever.ask_in_session(question, session_id, top_k, collection,
+                                                                  priority=priority, timeout=timeout, **cutoffs)
+                else:
+                    result = APIHandler._retriever.ask_question(question, top_k, collection, mode=mode,
+                                                                priority=priority, timeout=timeout,
+                                                                use_cache=bool(data.get('cache', True)), **cutoffs)
+            except SessionNotFoundError:
+                self.send_error(404, f"Session not found or expired: {session_id}")
+                return
+            except KeyError:
+                self.send_error(404, f"Collection not found: {collection}")
+                return
+            except SchedulerRejectedError as e:
+                print(f"⚠️ 问答请求被拒绝: {e}")
+                self.send_json({'error': str(e), 'reason': e.reason}, status=503,
+                               headers={'Retry-After': str(int(e.retry_after + 0.999))})
+                return
             print(f"✅ 问答处理完成")
             
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
+            self.send_json(result)
         except Exception as e:
             import traceback
             error_msg = f"Ask failed: {str(e)}\n{traceback.format_exc()}"
             print(f"❌ 问答处理失败: {error_msg}")
             self.send_error(500, error_msg)
     
+    def handle_sessions(self, query):
+        """处理会话查询请求：带 session_id 时返回该会话，否则返回会话存储统计"""
+        if APIHandler._retriever is None:
+            self.send_error(500, "Sessions failed: retriever not initialized")
+            return
+        session_id = (query.get('session_id') or [None])[0]
+        if not session_id:
+            self.send_json(APIHandler._retriever.sessions.get_stats())
+            return
+        try:
+            session = APIHandler._retriever.sessions.get(session_id)
+        except SessionNotFoundError:
+            self.send_error(404, f"Session not found or expired: {session_id}")
+            return
+        self.send_json(session.to_dict())
+    
+    def handle_close_session(self):
+        """处理结束会话请求"""
+        try:
+            if APIHandler._retriever is None:
+                self.send_error(500, "Close session failed: retriever not initialized")
+                return
+            content_length = int(self.headers['Content-Length'])
+            data = json.loads(self.rfile.read(content_length).decode())
+            session_id = data.get('session_id')
+            if not session_id:
+                self.send_error(400, "session_id parameter is required")
+                return
+            if not APIHandler._retriever.sessions.close(session_id):
+                self.send_error(404, f"Session not found: {session_id}")
+                return
+            self.send_json({'success': True, 'session_id': session_id})
+        except Exception as e:
+            self.send_error(500, f"Close session failed: {str(e)}")
+    
     def handle_upload(self):
         """处理文件上传请求（支持文件夹上传）"""
         try:
             if APIHandler._kb is None:
                 self.send_error(500, "Upload failed: knowledge base not initialized")
                 return
+            if APIHandler._kb.rebuilding:
+                self._send_busy("Knowledge base is rebuilding, uploads are paused")
+                return
             
             # 解析multipart/form-data
             content_type = self.headers.get('Content-Type', '')
@@ -266,6 +660,7 @@ class APIHandler(BaseHTTPRequestHandler):
             upload_dir.mkdir(exist_ok=True)
             
             uploaded_files = []
+            collection = None
             supported_extensions = {'.txt', '.md', '.pdf', '.docx', '.html', '.htm'}
             
             # 处理所有上传的文件
@@ -286,6 +681,11 @@ class APIHandler(BaseHTTPRequestHandler):
                 name_match = re.search(r'name="([^"]+)"', header)
                 filename_match = re.search(r'filename="([^"]+)"', header)
                 
+                if not filename_match and name_match and name_match.group(1) == 'collection':
+                    # 普通表单字段：目标集合
+                    collection = file_data.rstrip(b'\r\n').decode('utf-8', errors='ignore').strip() or None
+                    continue
+                
                 if filename_match:
                     filename = filename_match.group(1)
                     
@@ -319,7 +719,7 @@ class APIHandler(BaseHTTPRequestHandler):
             
             for file_path in uploaded_files:
                 try:
-                    doc_info = APIHandler._kb.add_document(file_path)
+                    doc_info = APIHandler._kb.add_document(file_path, collection)
                     results.append(doc_info)
                 except Exception as e:
                     errors.append(f"{Path(file_path).name}: {str(e)}")
@@ -333,17 +733,14 @@ class APIHandler(BaseHTTPRequestHandler):
             else:
                 message = f"成功处理 {len(results)} 个文件"
             
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_json({
                 "success": True,
                 "message": message,
                 "processed_count": len(results),
                 "error_count": len(errors),
-                "documents": results,
+                "documents": [_document_summary(doc_info) for doc_info in results],
                 "errors": errors if errors else None
-            }).encode())
+            })
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -361,6 +758,7 @@ class APIHandler(BaseHTTPRequestHandler):
             data = json.loads(post_data.decode())
             
             file_path = data.get('file_path', '')
+            collection = data.get('collection')
             if not file_path:
                 self.send_error(400, "file_path parameter is required")
                 return
@@ -370,50 +768,172 @@ class APIHandler(BaseHTTPRequestHandler):
                 return
             
             # 添加文档到知识库
-            doc_info = APIHandler._kb.add_document(file_path)
+            try:
+                doc_info = APIHandler._kb.add_document(file_path, collection)
+            except KnowledgeBaseBusyError:
+                self._send_busy("Knowledge base is rebuilding, writes are paused")
+                return
             
             # 保存知识库
             APIHandler._kb.save_knowledge_base()
             
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_json({
                 "success": True,
                 "message": f"文档 {doc_info['file_name']} 添加成功",
-                "document": doc_info
-            }).encode())
+                "document": _document_summary(doc_info)
+            })
         except Exception as e:
             self.send_error(500, f"Add document failed: {str(e)}")
     
     def handle_rebuild(self):
-        """处理重建知识库请求"""
+        """
+        处理重建知识库请求
+        
+        请求体为空时清空知识库（前端“重建”按钮的行为）；
+        {"mode": "shadow", "model_name": ..., "index_type": ..., "num_shards": ..., "source": "chunks|files"}
+        在后台构建新一代索引，期间照常提供检索，完成后原子切换（管理接口，GET /api/rebuild 查看进度）。
+        """
         try:
             if APIHandler._kb is None:
                 self.send_error(500, "Rebuild failed: knowledge base not initialized")
                 return
-                
+            
+            content_length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(content_length).decode() or '{}') if content_length else {}
+            if data.get('mode') == 'shadow':
+                self.handle_shadow_rebuild(data)
+                return
+            
             # 清空现有知识库
-            APIHandler._kb.clear_knowledge_base()
+            try:
+                APIHandler._kb.clear_knowledge_base()
+            except KnowledgeBaseBusyError:
+                self._send_busy("Knowledge base is rebuilding, try again later")
+                return
             
             # 保存清空后的知识库
             APIHandler._kb.save_knowledge_base()
             
-            self.send_response(200)
-            self.send_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_json({
                 "success": True,
                 "message": "知识库已清空，请通过上传文件重新构建"
-            }).encode())
+            })
         except Exception as e:
             self.send_error(500, f"Rebuild failed: {str(e)}")
     
+    def handle_shadow_rebuild(self, data):
+        """开始影子重建"""
+        if not self._check_admin():
+            return
+        try:
+            rebuild = APIHandler._kb.start_rebuild(
+                model_name=data.get('model_name'),
+                index_type=data.get('index_type'),
+                num_shards=data.get('num_shards'),
+                source=data.get('source', 'chunks')
+            )
+        except KnowledgeBaseBusyError as e:
+            self._send_busy(f"Rebuild not started: {e}")
+            return
+        except (TypeError, ValueError) as e:
+            # 错误信息含中文，send_error 的状态行只能是 latin-1，改用JSON响应体
+            self.send_json({'error': f"Invalid rebuild request: {e}"}, status=400)
+            return
+        self.send_json({
+            "success": True,
+            "message": f"影子重建已开始（第 {rebuild.generation} 代），完成前继续使用当前索引",
+            "rebuild": rebuild.get_progress()
+        }, status=202)
+    
+    def handle_rebuild_status(self):
+        """查看影子重建进度"""
+        if APIHandler._kb is None:
+            self.send_error(500, "Knowledge base not initialized")
+            return
+        progress = APIHandler._kb.get_rebuild_progress()
+        self.send_json({
+            'rebuilding': APIHandler._kb.rebuilding,
+            'generation': APIHandler._kb.generation,
+            'rebuild': progress
+        })
+    
+    def _send_busy(self, message):
+        """知识库正在重建时拒绝写入（409）"""
+        self.send_json({'error': message, 'reason': 'rebuilding'}, status=409, headers={'Retry-After': '10'})
+    
     def log_message(self, format, *args):
         """自定义日志格式"""
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {format % args}")
 
 
+def create_retriever(kb):
+    """按环境变量创建检索器（Ollama节点池、会话、语义缓存与LLM调度器）"""
+    return KnowledgeRetriever(
+        kb,
+        min_similarity=_env_float('KB_MIN_SIMILARITY'),
+        relative_cutoff=_env_float('KB_RELATIVE_CUTOFF'),
+        max_gap=_env_float('KB_MAX_SCORE_GAP'),
+        # 抽取式答案：置信度阈值（未设置时只在Ollama不可用时使用）
+        extractive_confidence=_env_float('KB_EXTRACTIVE_CONFIDENCE'),
+        extractive_fallback=os.getenv('KB_EXTRACTIVE_FALLBACK', '1').lower() not in ('0', 'false', 'off', 'no'),
+        llm_retry_after=float(os.getenv('KB_LLM_RETRY_AFTER', '30')),
+        # Ollama节点池：OLLAMA_ENDPOINTS 配置多个节点（URL=模型，逗号分隔）
+        pool=OllamaPool.from_env(),
+        # 多轮问答会话：过期时间、数量、token与内存上限
+        sessions=SessionStore.from_env(),
+        # 问题语义缓存：相似问题直接返回缓存答案（KB_SEMANTIC_CACHE_SIZE 默认 0 关闭，设为条目上限开启）
+        semantic_cache=SemanticCache.from_env(kb.dimension),
+        # LLM调用调度：并发上限、等待队列长度、默认截止时间（秒）
+        scheduler=LLMScheduler(
+            max_concurrency=int(os.getenv('KB_LLM_CONCURRENCY', '1')),
+            max_queue=int(os.getenv('KB_LLM_QUEUE_SIZE', '16')),
+            default_timeout=float(os.getenv('KB_LLM_TIMEOUT', '120'))
+        )
+    )
+
+
+def check_ollama(retriever):
+    """检查每个Ollama节点的连接和所配置的模型，返回是否至少有一个节点可连接"""
+    print("🔍 检查Ollama服务和模型...")
+    endpoint_status = retriever.check_ollama_endpoints()
+    ollama_status = any(status['reachable'] for status in endpoint_status)
+    if not ollama_status:
+        print("=" * 60)
+        print("❌ 错误: 无法连接到Ollama服务")
+        print("=" * 60)
+        print("请确保Ollama服务正在运行:")
+        print("  1. 检查Ollama是否安装: ollama --version")
+        print("  2. 启动Ollama服务: ollama serve")
+        print("  3. 或访问 https://ollama.ai 下载安装Ollama")
+        print("=" * 60)
+        print("⚠️  注意: 即使没有Ollama，搜索功能仍然可以正常使用")
+        print("⚠️  但AI问答功能将不可用")
+        print("=" * 60)
+    else:
+        # 检查每个节点是否安装了为其配置的模型（未写标签时匹配任意标签）
+        for status in endpoint_status:
+            if not status['reachable']:
+                print(f"⚠️ 无法连接Ollama节点 {status['url']}，暂时不向其发送请求")
+            elif not status['model_installed']:
+                print(f"⚠️ Ollama节点 {status['url']} 未安装模型 {status['model']}，"
+                      f"已安装的模型: {', '.join(status['models']) if status['models'] else '无'}")
+            else:
+                print(f"✅ Ollama节点 {status['url']}: 找到模型 {status['model']}")
+        
+        if not any(status['model_installed'] for status in endpoint_status):
+            required_models = sorted({status['model'] for status in endpoint_status})
+            print("=" * 60)
+            print(f"❌ 错误: 未找到所需的Ollama模型: {', '.join(required_models)}")
+            print("=" * 60)
+            print("解决方案:")
+            for model in required_models:
+                print(f"  - 安装模型: ollama pull {model}")
+            print("  - 或通过 OLLAMA_MODEL / OLLAMA_ENDPOINTS 指定已安装的模型")
+            print("=" * 60)
+            raise Exception(f"Ollama模型 {', '.join(required_models)} 未安装")
+    return ollama_status
+
+
 def run_server(port=5000):
     """启动服务器"""
     print("=" * 60)
@@ -424,18 +944,39 @@ def run_server(port=5000):
     print("   GET  /api/stats - 获取统计信息")
     print("   GET  /api/documents - 获取文档列表")
     print("   GET  /api/health - 健康检查")
+    print("   GET  /api/collections - 获取集合列表")
+    print("   GET  /api/metrics - 运行指标 (Prometheus)")
+    print("   GET  /api/admin/profiler - 采样分析结果（POST 开关）")
     print("   POST /api/search - 搜索文档")
     print("   POST /api/ask - AI问答")
     print("   POST /api/upload_document - 上传文档")
     print("   POST /api/add_document - 添加文档")
-    print("   POST /api/rebuild - 重建知识库")
+    print("   POST /api/rebuild - 重建知识库（mode=shadow 时后台重建并原子切换）")
+    print("   GET  /api/rebuild - 影子重建进度")
+    if os.getenv('KB_ASYNC_PORT'):
+        print(f"   异步问答服务（端口 {os.getenv('KB_ASYNC_PORT')}）: POST /api/ask, POST /api/search, GET /api/health")
     print("=" * 60)
     print("⏳ 正在初始化所有AI模型，请稍候...")
     
     # 在启动HTTP服务器之前完全初始化所有模型
     try:
         print("🔄 正在加载向量模型...")
-        kb = VectorKnowledgeBase()
+        # KB_SHARDS: 每个集合的分片数，检索时各分片并发查询
+        # KB_INDEX_TYPE: FAISS索引类型（faiss.index_factory 描述串，需要训练的类型通过影子重建生成）
+        # KB_RESCORE_FACTOR: 量化索引（SQ8/SQfp16）取 top_k 的多少倍候选再用原始向量精确重排（0 不重排）
+        # KB_COMPACT_RATIO: 分片中已删除的文本块超过该比例时压缩
+        # KB_DEDUP_DISTANCE: 近重复文本块的 SimHash 汉明距离阈值，归一化文本相同的只登记为别名不写入向量（默认 -1 关闭，需显式开启）
+        # KB_PDF_WORKERS: 导入大型PDF时并行提取的进程数（默认 1 不并行，避免服务进程派生与CPU核数相同的子进程）
+        kb = ShardedKnowledgeBase(num_shards=int(os.getenv('KB_SHARDS', '1')),
+                                  index_type=os.getenv('KB_INDEX_TYPE', 'Flat'),
+                                  rescore_factor=int(os.getenv('KB_RESCORE_FACTOR', '4')),
+                                  compact_ratio=float(os.getenv('KB_COMPACT_RATIO', '0.25')),
+                                  dedup_distance=int(os.getenv('KB_DEDUP_DISTANCE', '-1')),
+                                  pdf_workers=int(os.getenv('KB_PDF_WORKERS', '1')))
+        # KB_REFRESH_INTERVAL: 检查 CURRENT 的间隔（秒），离线批量构建（bulk_build.py）安装的新一代会被热加载，0 关闭
+        refresh_interval = float(os.getenv('KB_REFRESH_INTERVAL', '1'))
+        if refresh_interval > 0:
+            kb.watch_generations(refresh_interval)
         
         # 获取知识库初始状态
         kb_stats_before = kb.get_stats()
@@ -448,7 +989,8 @@ def run_server(port=5000):
             print(f"✅ 向量模型加载完成，知识库已包含 {total_docs} 文档, {total_vectors} 向量")
         
         print("🔄 正在初始化检索器...")
-        retriever = KnowledgeRetriever(kb)
+        # 检索结果相似度阈值（未设置时不过滤）
+        retriever = create_retriever(kb)
         print("✅ 检索器初始化完成")
         
         # 验证初始化状态
@@ -464,57 +1006,7 @@ def run_server(port=5000):
         if retriever is None:
             raise Exception("检索器对象为空")
         
-        # 检查Ollama连接和模型
-        print("🔍 检查Ollama服务和模型...")
-        ollama_status = retriever.check_ollama_connection()
-        if not ollama_status:
-            print("=" * 60)
-            print("❌ 错误: 无法连接到Ollama服务")
-            print("=" * 60)
-            print("请确保Ollama服务正在运行:")
-            print("  1. 检查Ollama是否安装: ollama --version")
-            print("  2. 启动Ollama服务: ollama serve")
-            print("  3. 或访问 https://ollama.ai 下载安装Ollama")
-            print("=" * 60)
-            print("⚠️  注意: 即使没有Ollama，搜索功能仍然可以正常使用")
-            print("⚠️  但AI问答功能将不可用")
-            print("=" * 60)
-        else:
-            # 检查模型是否存在
-            available_models = retriever.get_ollama_models()
-            required_model = "gemma2:2b"
-            
-            if not available_models:
-                print("=" * 60)
-                print("❌ 错误: Ollama服务运行正常，但未安装任何模型")
-                print("=" * 60)
-                print(f"请安装所需的模型: {required_model}")
-                print(f"运行命令: ollama pull {required_model}")
-                print("=" * 60)
-                raise Exception(f"Ollama模型 {required_model} 未安装")
-            
-            # 检查是否有所需模型（支持完整匹配或部分匹配）
-            model_found = False
-            matching_models = []
-            for model in available_models:
-                if required_model.lower() in model.lower() or "gemma2" in model.lower():
-                    model_found = True
-                    matching_models.append(model)
-            
-            if not model_found:
-                print("=" * 60)
-                print(f"❌ 错误: 未找到所需的Ollama模型: {required_model}")
-                print("=" * 60)
-                print(f"已安装的模型: {', '.join(available_models) if available_models else '无'}")
-                print("")
-                print("解决方案:")
-                print(f"  1. 安装模型: ollama pull {required_model}")
-                print("  2. 或使用其他已安装的模型（需要修改代码）")
-                print("=" * 60)
-                raise Exception(f"Ollama模型 {required_model} 未安装，已安装的模型: {', '.join(available_models)}")
-            else:
-                print(f"✅ 找到模型: {', '.join(matching_models)}")
-        
+        ollama_status = check_ollama(retriever)
         print(f"🔗 Ollama连接状态: {'连接正常' if ollama_status else '连接失败'}")
         
         # 将初始化的实例设置为APIHandler的类属性
@@ -522,6 +1014,16 @@ def run_server(port=5000):
         APIHandler._retriever = retriever
         APIHandler._initialized = True
         
+        # KB_SYNC_DIRS: 监视的源目录，新增、修改、删除的文件自动同步到知识库
+        APIHandler._sync = DirectorySync.from_env(kb)
+        if APIHandler._sync is not None:
+            APIHandler._sync.start()
+        
+        # KB_ASYNC_PORT: 在该端口同时启动异步问答服务，进行中的问答不各占一个线程，客户端断开时取消生成
+        async_port = os.getenv('KB_ASYNC_PORT')
+        if async_port:
+            start_async_server(retriever, os.getenv('HOST', '127.0.0.1'), int(async_port))
+        
         # 验证API预备性
         print("🔍 验证API预备性...")
         if APIHandler._kb is None:
@@ -548,7 +1050,9 @@ def run_server(port=5000):
     print(f"📡 监听地址: {host}:{port}")
     print(f"🌐 服务地址: http://{host}:{port}")
     
-    httpd = HTTPServer(server_address, APIHandler)
+    # 每个连接一个线程：检索请求不必排在进行中的LLM调用之后，LLM并发由调度器控制
+    httpd = ThreadingHTTPServer(server_address, APIHandler)
+    httpd.daemon_threads = True
     
     print("=" * 60)
     print("✅ 服务器已就绪，可以接受连接")
@@ -566,4 +1070,10 @@ def run_server(port=5000):
 if __name__ == '__main__':
     # 从环境变量读取端口，默认为 5000
     port = int(os.getenv('PORT', '5000'))
-    run_server(port)
+    # KB_WORKERS 大于 1 时以多进程预派生模式启动（需要 fork，Windows 上退回单进程）
+    workers = int(os.getenv('KB_WORKERS', '1'))
+    if workers > 1 and hasattr(os, 'fork'):
+        from prefork_server import run_prefork
+        run_prefork(port, workers)
+    else:
+        run_server(port)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步Ollama客户端
+在事件循环中调用 /api/generate：请求以流式（NDJSON）方式读取，等待生成期间不占用线程，
+重试前的等待使用 asyncio.sleep。协程被取消（如客户端已断开）时立即关闭与Ollama的连接，
+Ollama 发现连接断开后停止生成，被放弃的请求不再占用LLM时间。
+只使用标准库 asyncio 实现所需的 HTTP/1.1 子集，不引入额外依赖
+"""
+
+import asyncio
+import json
+import ssl
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from knowledge_retriever import LLMUnavailableError
+from llm_scheduler import SchedulerRejectedError
+from ollama_pool import OllamaPool
+import metrics
+
+
+# 单次调用的超时（秒），与同步客户端一致
+REQUEST_TIMEOUT = 60.0
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+    """按 Transfer-Encoding/Content-Length 读取响应体"""
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif 'content-length' in headers:
+        yield await reader.readexactly(int(headers['content-length']))
+    else:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            yield data
+
+
+async def _post_lines(url: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    POST JSON 并逐行解析 NDJSON 响应
+    
+    连接在生成器关闭（正常结束、异常或协程被取消）时关闭。
+    
+    Raises:
+        _HTTPError: 响应状态码不是 200
+        OSError: 无法连接
+    """
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, parts.port or (443 if secure else 80),
+        ssl=ssl.create_default_context() if secure else None)
+    try:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write((f"POST {parts.path or '/'} HTTP/1.1\r\n"
+                      f"Host: {parts.netloc}\r\n"
+                      "Content-Type: application/json\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      "Connection: close\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+        
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("连接在响应前被关闭")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        if status != 200:
+            content = b''.join([data async for data in _read_body(reader, headers)])
+            raise _HTTPError(status, content.decode('utf-8', errors='replace'))
+        
+        buffer = b''
+        async for data in _read_body(reader, headers):
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if buffer.strip():
+            yield json.loads(buffer)
+    finally:
+        writer.close()
+
+
+class AsyncOllamaClient:
+    """
+    异步Ollama生成客户端
+    
+    与 KnowledgeRetriever._generate 的重试与节点切换规则相同，共用同一个 OllamaPool，
+    返回值格式也相同，同步与异步请求的在途数一起参与选点。
+    """
+    
+    def __init__(self, pool: OllamaPool, options: Optional[Dict[str, Any]] = None):
+        """
+        初始化客户端
+        
+        Args:
+            pool: Ollama节点池
+            options: 生成参数（默认与同步客户端相同）
+        """
+        self.pool = pool
+        self.options = options or {"temperature": 0.7, "top_p": 0.9, "max_tokens": 1000}
+    
+    async def generate(self, prompt: str, deadline: Optional[float] = None,
+                       resume: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        调用Ollama生成，失败时重试或切换节点
+        
+        Args:
+            prompt: 完整提示词
+            deadline: 截止时间点（time.monotonic()），各次尝试的超时不超过剩余时间
+            resume: 可复用的会话 context（endpoint、model、context、prompt）
+        
+        Returns:
+            response（答案）、context、endpoint、model、resumed 与 prompt_eval_count
+        
+        Raises:
+            LLMUnavailableError: Ollama不可用
+            SchedulerRejectedError: 重试过程中超过截止时间
+            asyncio.CancelledError: 协程被取消（连接已关闭，Ollama停止生成）
+        """
+        max_retries = max(3, len(self.pool))
+        tried = set()
+        for attempt in range(max_retries):
+            request_timeout = REQUEST_TIMEOUT
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SchedulerRejectedError("生成答案超过截止时间，请稍后重试", 'deadline')
+                request_timeout = min(request_timeout, remaining)
+            endpoint, probe = self.pool.acquire(exclude=tried, prefer=resume['endpoint'] if resume else None)
+            tried.add(endpoint.url)
+            resumed = resume is not None and endpoint.url == resume['endpoint'] and endpoint.model == resume['model']
+            payload = {
+                "model": endpoint.model,
+                "prompt": resume['prompt'] if resumed else prompt,
+                "stream": True,
+                "options": self.options
+            }
+            if resumed:
+                payload["context"] = resume['context']
+            started = time.perf_counter()
+            ok, error, eject = None, None, False
+            last = attempt == max_retries - 1
+            try:
+                print(f"🔄 尝试调用Ollama (第{attempt + 1}次, {endpoint.url}, 异步)...")
+                response, final = await asyncio.wait_for(self._stream(endpoint.url, payload), request_timeout)
+                ok = True
+                self._record_attempt('ok', started)
+                print("✅ Ollama调用成功（异步）")
+                return {
+                    'response': response or '抱歉，无法生成答案。',
+                    'context': final.get('context'),
+                    'endpoint': endpoint.url,
+                    'model': endpoint.model,
+                    'resumed': resumed,
+                    'prompt_eval_count': final.get('prompt_eval_count')
+                }
+            except _HTTPError as e:
+                ok, error = False, f"HTTP {e.status}"
+                self._record_attempt(f'http_{e.status}', started)
+                print(f"⚠️ Ollama返回错误: {e.status}")
+                text = e.body.lower()
+                if "model" in text and ("not found" in text or "does not exist" in text):
+                    error, eject = "模型未安装", True
+                    if self.pool.has_alternative(tried):
+                        print(f"🔄 节点 {endpoint.url} 缺少模型 {endpoint.model}，切换到其他节点...")
+                        continue
+                    raise LLMUnavailableError(
+                        f"错误: 模型 {endpoint.model} 未安装，请运行 'ollama pull {endpoint.model}' 安装模型")
+                if last:
+                    raise LLMUnavailableError(f"Ollama服务错误: {e.status} - {e.body}")
+                await self._retry_pause(tried, 2)
+            except asyncio.TimeoutError:
+                ok, error = False, "超时"
+                self._record_attempt('timeout', started)
+                print("⏰ 超时错误: 异步调用Ollama超时")
+                if last:
+                    raise LLMUnavailableError("Ollama服务响应超时，请稍后重试。")
+                await self._retry_pause(tried, 2)
+            except OSError as e:
+                ok, error, eject = False, "无法连接", True
+                self._record_attempt('connection_error', started)
+                print(f"❌ 连接错误: {e}")
+                if last:
+                    raise LLMUnavailableError("无法连接到Ollama服务，请确保Ollama正在运行。")
+                await self._retry_pause(tried, 3)
+            except asyncio.CancelledError:
+                self._record_attempt('cancelled', started)
+                print(f"🛑 请求已取消，停止Ollama生成 ({endpoint.url})")
+                raise
+            except (ValueError, KeyError, IndexError) as e:
+                ok, error = False, str(e)
+                self._record_attempt('error', started)
+                print(f"❌ 未知错误: {e}")
+                if last:
+                    raise LLMUnavailableError(f"生成答案时发生错误: {str(e)}")
+                await self._retry_pause(tried, 2)
+            finally:
+                self.pool.release(endpoint, ok, time.perf_counter() - started, error, eject, probe)
+        
+        raise LLMUnavailableError("多次重试失败，请检查Ollama服务状态。")
+    
+    async def _stream(self, url: str, payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """读取流式生成结果，返回 (完整答案, 最后一行)"""
+        pieces, final = [], {}
+        # 提前跳出 async for 不会关闭生成器，显式 aclose 以立即关闭连接（contextlib.aclosing 需要 3.10）
+        lines = _post_lines(f"{url}/api/generate", payload)
+        try:
+            async for message in lines:
+                if 'error' in message:
+                    raise ValueError(message['error'])
+                pieces.append(message.get('response', ''))
+                if message.get('done'):
+                    final = message
+                    break
+        finally:
+            await lines.aclose()
+        return ''.join(pieces), final
+    
+    def _record_attempt(self, status: str, started: float):
+        metrics.LLM_REQUESTS.inc(status=status)
+        metrics.LLM_SECONDS.observe(time.perf_counter() - started, status=status)
+    
+    async def _retry_pause(self, tried: set, seconds: float):
+        """还有未尝试过的可用节点时立即切换，否则等待后重试（不占用线程）"""
+        if self.pool.has_alternative(tried):
+            print("🔄 切换到其他Ollama节点重试...")
+            return
+        print(f"🔄 等待{seconds}秒后重试...")
+        await asyncio.sleep(seconds)
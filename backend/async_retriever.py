@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步知识检索器
+在事件循环中执行问答：查询编码、FAISS检索与抽取式答案等CPU密集的步骤交给有界线程池，
+LLM生成由 AsyncOllamaClient 以非阻塞方式完成，排队使用 LLMScheduler.run_async。
+一个进程可同时处理数百个进行中的问答，而线程数只取决于线程池大小；
+协程被取消（客户端断开）时停止等待，正在进行的Ollama生成随连接关闭而中止
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from async_ollama import AsyncOllamaClient
+from knowledge_retriever import ANSWER_MODES, KnowledgeRetriever, LLMUnavailableError
+import metrics
+import tracing
+
+
+class AsyncKnowledgeRetriever:
+    """
+    KnowledgeRetriever 的协程版本
+    
+    与同步检索器共用知识库、语义缓存、Ollama节点池与LLM调度器，结果格式相同。
+    """
+    
+    def __init__(self, retriever: KnowledgeRetriever, executor: Optional[ThreadPoolExecutor] = None,
+                 max_workers: Optional[int] = None):
+        """
+        初始化异步检索器
+        
+        Args:
+            retriever: 同步知识检索器
+            executor: 执行编码与检索的线程池（为None时新建）
+            max_workers: 新建线程池的线程数（默认 min(8, CPU核数)）
+        """
+        self.retriever = retriever
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers or min(8, os.cpu_count() or 1), thread_name_prefix='kb-async')
+        self.client = AsyncOllamaClient(retriever.pool)
+    
+    async def _offload(self, fn, *args, **kwargs):
+        """在线程池中执行阻塞调用，继承当前追踪上下文"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, tracing.propagate(partial(fn, *args, **kwargs)))
+    
+    async def search(self, query: str, top_k: int = 10, collection: Optional[str] = None,
+                     min_similarity: Optional[float] = None, **options) -> List[Dict[str, Any]]:
+        """搜索相关文档（参数见 KnowledgeRetriever.search）"""
+        return await self._offload(self.retriever.search, query, top_k, collection, min_similarity, **options)
+    
+    async def search_documents(self, query: str, top_k: int = 5, collection: Optional[str] = None,
+                               min_similarity: Optional[float] = None, **options) -> List[Dict[str, Any]]:
+        """文档级检索（参数见 KnowledgeRetriever.search_documents）"""
+        return await self._offload(self.retriever.search_documents, query, top_k, collection,
+                                   min_similarity, **options)
+    
+    async def ask_question(self, question: str, top_k: int = 5, collection: Optional[str] = None,
+                           min_similarity: Optional[float] = None, mode: str = 'auto',
+                           priority: int = 0, timeout: Optional[float] = None,
+                           use_cache: bool = True, relative_cutoff: Optional[float] = None,
+                           max_gap: Optional[float] = None) -> Dict[str, Any]:
+        """
+        基于知识库进行问答（规则与 KnowledgeRetriever.ask_question 相同）
+        
+        Args:
+            question: 用户问题
+            top_k: 检索相关文档数量上限
+            collection: 集合名称（默认集合为None）
+            min_similarity: 最低相似度（为None时使用默认值）
+            mode: 答案模式 auto/llm/extractive
+            priority: LLM调度优先级（越大越先执行）
+            timeout: 等待与调用LLM的截止时间（秒，None使用调度器默认值）
+            use_cache: 是否使用语义缓存
+            relative_cutoff: 相对最高分的保留比例（为None时使用默认值）
+            max_gap: 相邻结果相似度的最大落差（为None时使用默认值）
+        
+        Returns:
+            问答结果
+        
+        Raises:
+            SchedulerRejectedError: LLM调度队列已满或超过截止时间
+            asyncio.CancelledError: 协程被取消
+        """
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"不支持的答案模式: {mode}")
+        stage = 'search'
+        try:
+            with metrics.timer(metrics.ASK_SECONDS):
+                r = self.retriever
+                cutoffs = (min_similarity, relative_cutoff, max_gap)
+                query_embedding, cache_params = None, r._cache_params(top_k, collection, cutoffs, mode, use_cache)
+                if cache_params is not None:
+                    query_embedding = await self._offload(r.kb.encode_query, question)
+                    cached = r._cache_lookup(question, query_embedding, cache_params)
+                    if cached is not None:
+                        return cached
+                
+                search_results = await self._offload(r.search, question, top_k, collection, *cutoffs,
+                                                     query_embedding=query_embedding)
+                if not search_results:
+                    return r._no_results(question)
+                confidence = r._calculate_confidence(search_results)
+                
+                if mode == 'extractive' or (mode == 'auto' and r._prefer_extractive(confidence)):
+                    stage = 'extractive'
+                    return await self._offload(r._extractive_result, question, search_results, confidence)
+                
+                with metrics.timer(metrics.CONTEXT_BUILD_SECONDS), tracing.span('context_build'):
+                    context = r._build_context(search_results)
+                
+                stage = 'llm'
+                try:
+                    if r.scheduler is not None:
+                        answer = await r.scheduler.run_async(self._traced_generate, question, context,
+                                                             priority=priority, timeout=timeout)
+                    else:
+                        answer = await self._traced_generate(question, context)
+                except LLMUnavailableError as e:
+                    stage = 'extractive'
+                    fallback = await self._offload(r._llm_unavailable, e, question, search_results,
+                                                   confidence, mode)
+                    if fallback is not None:
+                        return fallback
+                    answer = str(e)
+                    cache_params = None
+                
+                return r._llm_result(question, answer, search_results, confidence, query_embedding, cache_params)
+        except asyncio.CancelledError:
+            metrics.ASK_CANCELLED.inc(stage=stage)
+            print(f"🛑 问答已取消（{stage} 阶段）: {question[:30]}")
+            raise
+    
+    async def ask_in_session(self, question: str, session_id: Optional[str] = None,
+                             **options) -> Dict[str, Any]:
+        """
+        多轮会话问答（参数见 KnowledgeRetriever.ask_in_session）
+        
+        会话的每一轮需持有会话锁并复用Ollama返回的 context，整体在线程池中执行；
+        取消只停止等待，已开始的这一轮会继续完成并写入会话。
+        """
+        return await self._offload(self.retriever.ask_in_session, question, session_id, **options)
+    
+    async def _traced_generate(self, question: str, context: str, deadline: Optional[float] = None) -> str:
+        with tracing.span('llm_generate', model=self.retriever.ollama_model):
+            prompt = self.retriever._build_prompt(question, context)
+            return (await self.client.generate(prompt, deadline))['response']
+    
+    def close(self):
+        """关闭线程池"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步问答服务
+基于 asyncio.start_server 的 HTTP/1.1 前端，与线程服务共用同一个知识库与检索器，监听单独的端口。
+每个进行中的问答只是一个协程：排队等待LLM与流式读取Ollama响应都不占用线程，
+编码与检索在有界线程池中执行。问答期间持续监视客户端连接，客户端断开时取消该问答，
+排队中的请求退出队列，生成中的请求关闭与Ollama的连接
+
+接口（请求与响应格式与线程服务相同）:
+    POST /api/ask      问答（含多轮会话）
+    POST /api/search   文本块检索与文档级检索
+    GET  /api/health   健康检查
+
+环境变量:
+    KB_ASYNC_PORT      设置后 api_server 在该端口同时启动本服务（单进程模式）
+    KB_ASYNC_WORKERS   编码与检索线程池的线程数（默认 min(8, CPU核数)）
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from async_retriever import AsyncKnowledgeRetriever
+from conversation_sessions import SessionNotFoundError
+from document_retrieval import AGGREGATIONS
+from knowledge_retriever import ANSWER_MODES
+from llm_scheduler import SchedulerRejectedError
+import fast_json
+import metrics
+import tracing
+
+
+# 响应体超过该字节数且客户端支持时使用gzip压缩（与线程服务相同）
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '2048'))
+
+# 请求头与请求体的大小上限
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+# 空闲的 keep-alive 连接保持时间（秒）
+KEEP_ALIVE_SECONDS = 30.0
+
+REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _optional_float(data, key):
+    """读取可选的数值参数（与 api_server 相同）"""
+    value = data.get(key)
+    return float(value) if value not in (None, '') else None
+
+
+class _Connection:
+    """
+    一个客户端连接
+    
+    已读到的字节保存在 buffer 中：问答期间监视连接时读到的数据（如管线化的下一个请求）不会丢失。
+    """
+    
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.buffer = bytearray()
+        self.closed = False
+    
+    async def fill(self) -> bool:
+        """读取更多数据，对端已关闭时返回False"""
+        data = await self.reader.read(65536)
+        if not data:
+            self.closed = True
+            return False
+        self.buffer += data
+        return True
+    
+    async def read_request(self) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        """读取一个请求，连接已关闭时返回None"""
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(self.buffer) > MAX_HEADER_BYTES:
+                raise _HTTPError(413, "Request headers too large")
+            if not await self.fill():
+                return None
+        head = bytes(self.buffer[:end]).decode('latin-1')
+        del self.buffer[:end + 4]
+        request_line, *lines = head.split('\r\n')
+        try:
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            raise _HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise _HTTPError(413, "Request body too large")
+        while len(self.buffer) < length:
+            if not await self.fill():
+                return None
+        body = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return method, target, headers, body
+    
+    async def watch(self, task: asyncio.Task) -> bool:
+        """
+        等待 task 完成，期间客户端断开则取消 task
+        
+        Returns:
+            客户端是否已断开
+        """
+        while not task.done():
+            reader = asyncio.ensure_future(self.fill())
+            await asyncio.wait({task, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not reader.done():
+                reader.cancel()
+                break
+            if reader.exception() is not None or not reader.result():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+                return True
+        return False
+
+
+class AsyncAPIServer:
+    """异步问答服务"""
+    
+    def __init__(self, retriever: AsyncKnowledgeRetriever, host: str = '127.0.0.1', port: int = 5001):
+        """
+        初始化服务
+        
+        Args:
+            retriever: 异步知识检索器
+            host: 监听地址
+            port: 监听端口
+        """
+        self.retriever = retriever
+        self.host = host
+        self.port = port
+        self.loop = None
+        self._server = None
+    
+    async def serve(self):
+        """在当前事件循环中启动并持续服务"""
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=512)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"⚡ 异步问答服务已就绪: {self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+    
+    def start_in_thread(self) -> threading.Thread:
+        """在后台线程中运行独立的事件循环"""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name='kb-async-server', daemon=True)
+        thread.start()
+        return thread
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = _Connection(reader, writer)
+        try:
+            while not conn.closed:
+                try:
+                    request = await asyncio.wait_for(conn.read_request(), KEEP_ALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                except _HTTPError as e:
+                    await self._send(conn, e.status, {'error': str(e)}, {}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                keep_alive = await self._handle_request(conn, *request)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _handle_request(self, conn: _Connection, method: str, target: str, headers: Dict[str, str],
+                              body: bytes) -> bool:
+        """处理一个请求，返回连接是否可以继续使用"""
+        path = target.split('?', 1)[0]
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        started = time.perf_counter()
+        trace = tracing.start_trace((headers.get('x-request-id') or '')[:64] or None, f'{method} {path}')
+        status = 500
+        try:
+            if method == 'OPTIONS':
+                status, data = 200, None
+            elif method == 'GET' and path == '/api/health':
+                status, data = 200, await self._health()
+            elif method == 'POST' and path in ('/api/ask', '/api/search'):
+                data = json.loads(body.decode() or '{}')
+                coro = self._ask(data) if path == '/api/ask' else self._search(data)
+                task = asyncio.ensure_future(coro)
+                if await conn.watch(task):
+                    status = 499
+                    print(f"🔌 客户端已断开，取消请求: {path}")
+                    return False
+                status, data = 200, task.result()
+            else:
+                raise _HTTPError(404, "Not Found")
+            extra = {}
+        except _HTTPError as e:
+            status, data, extra = e.status, {'error': str(e)}, e.headers
+        except json.JSONDecodeError:
+            status, data, extra = 400, {'error': "Request body must be JSON"}, {}
+        except Exception as e:
+            print(f"❌ 异步请求处理失败: {e}")
+            status, data, extra = 500, {'error': f"Internal Server Error: {e}"}, {}
+        finally:
+            tracing.finish_trace()
+            label = path if path in ('/api/ask', '/api/search', '/api/health') else 'other'
+            metrics.HTTP_REQUESTS.inc(method=method, path=label, status=status)
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=method, path=label)
+            trace.annotate(status=status)
+            try:
+                tracing.SLOW_QUERY_LOG.maybe_log(trace)
+            except OSError as e:
+                print(f"⚠️ 写入慢查询日志失败: {e}")
+        
+        extra = {**extra, 'X-Request-ID': trace.request_id}
+        if trace.spans:
+            extra['Server-Timing'] = trace.server_timing()
+        gzip_ok = 'gzip' in headers.get('accept-encoding', '')
+        await self._send(conn, status, data, extra, keep_alive, gzip_ok)
+        return keep_alive
+    
+    async def _send(self, conn: _Connection, status: int, data: Any, headers: Dict[str, str],
+                    keep_alive: bool, gzip_ok: bool = False):
+        body = fast_json.dumps(data) if data is not None else b''
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}",
+                 "Access-Control-Allow-Origin: *",
+                 "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+                 "Access-Control-Allow-Headers: Content-Type, X-Request-ID",
+                 "Access-Control-Expose-Headers: X-Request-ID, Server-Timing",
+                 "Content-Type: application/json; charset=utf-8",
+                 "Vary: Accept-Encoding",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if gzip_ok and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=5)
+            lines.append("Content-Encoding: gzip")
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        lines.append(f"Content-Length: {len(body)}")
+        conn.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await conn.writer.drain()
+    
+    async def _health(self) -> Dict[str, Any]:
+        pool_stats = self.retriever.retriever.pool.get_stats()
+        return {
+            "status": "healthy",
+            "ollama_endpoints": {"healthy": pool_stats['healthy'], "total": pool_stats['total']},
+            "async": True,
+            "timestamp": time.time()
+        }
+    
+    async def _search(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        query = data.get('query', '')
+        top_k = data.get('top_k', 10)
+        collection = data.get('collection')
+        tracing.annotate(query=query, top_k=top_k, collection=collection)
+        if not query:
+            raise _HTTPError(400, "Query parameter is required")
+        try:
+            cutoffs = {key: _optional_float(data, key) for key in ('min_similarity', 'relative_cutoff', 'max_gap')}
+        except (TypeError, ValueError):
+            raise _HTTPError(400, "min_similarity, relative_cutoff and max_gap must be numbers")
+        
+        try:
+            if data.get('group_by') == 'document':
+                aggregate = data.get('aggregate', 'max')
+                if aggregate not in AGGREGATIONS:
+                    raise _HTTPError(400, f"aggregate must be one of: {', '.join(AGGREGATIONS)}")
+                try:
+                    options = {key: int(data[key]) for key in ('top_n', 'passages', 'neighbors', 'candidates')
+                               if data.get(key) is not None}
+                except (TypeError, ValueError):
+                    raise _HTTPError(400, "top_n, passages, neighbors and candidates must be integers")
+                documents = await self.retriever.search_documents(query, top_k, collection, cutoffs['min_similarity'],
+                                                                  aggregate=aggregate, **options)
+                return {"documents": documents}
+            return {"results": await self.retriever.search(query, top_k, collection, **cutoffs)}
+        except KeyError:
+            raise _HTTPError(404, f"Collection not found: {collection}")
+    
+    async def _ask(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        question = data.get('question', '')
+        top_k = data.get('top_k', 5)
+        collection = data.get('collection')
+        tracing.annotate(query=question, top_k=top_k, collection=collection)
+        if not question:
+            raise _HTTPError(400, "Question parameter is required")
+        try:
+            cutoffs = {key: _optional_float(data, key) for key in ('min_similarity', 'relative_cutoff', 'max_gap')}
+        except (TypeError, ValueError):
+            raise _HTTPError(400, "min_similarity, relative_cutoff and max_gap must be numbers")
+        mode = data.get('mode') or 'auto'
+        if mode not in ANSWER_MODES:
+            raise _HTTPError(400, f"mode must be one of: {', '.join(ANSWER_MODES)}")
+        try:
+            priority = max(-10, min(10, int(data.get('priority', 0))))
+            timeout = _optional_float(data, 'timeout')
+        except (TypeError, ValueError):
+            raise _HTTPError(400, "priority and timeout must be numbers")
+        session_id = data.get('session_id')
+        use_session = bool(session_id) or bool(data.get('session'))
+        if use_session and mode == 'extractive':
+            raise _HTTPError(400, "Sessions are not supported in extractive mode")
+        
+        try:
+            if use_session:
+                return await self.retriever.ask_in_session(question, session_id, top_k=top_k,
+                                                           collection=collection, priority=priority,
+                                                           timeout=timeout, **cutoffs)
+            return await self.retriever.ask_question(question, top_k, collection, mode=mode,
+                                                     priority=priority, timeout=timeout,
+                                                     use_cache=bool(data.get('cache', True)), **cutoffs)
+        except SessionNotFoundError:
+            raise _HTTPError(404, f"Session not found or expired: {session_id}")
+        except KeyError:
+            raise _HTTPError(404, f"Collection not found: {collection}")
+        except SchedulerRejectedError as e:
+            print(f"⚠️ 问答请求被拒绝: {e}")
+            raise _HTTPError(503, str(e), {'Retry-After': str(int(e.retry_after + 0.999))})
+
+
+def start_async_server(retriever, host: str, port: int) -> AsyncAPIServer:
+    """
+    在后台线程中启动异步问答服务
+    
+    Args:
+        retriever: 同步知识检索器（异步检索器共用其知识库、缓存、节点池与调度器）
+        host: 监听地址
+        port: 监听端口
+    
+    Returns:
+        服务实例
+    """
+    workers = os.getenv('KB_ASYNC_WORKERS')
+    server = AsyncAPIServer(AsyncKnowledgeRetriever(retriever, max_workers=int(workers) if workers else None),
+                            host, port)
+    server.start_in_thread()
+    return server
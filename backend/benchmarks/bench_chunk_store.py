@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本块存储内存基准
+对比旧版 dict 列表（每块带 384 维浮点列表）与列式 ChunkStore 在 1M 文本块下的内存占用
+
+用法:
+    python benchmarks/bench_chunk_store.py --chunks 1000000 --output chunk_store.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# 添加backend目录到Python路径
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from chunk_store import ChunkStore
+
+
+def make_texts(count: int, avg_chars: int, seed: int = 42):
+    """生成中英文混合的合成文本块（从预生成的文本池中切片，避免生成本身成为瓶颈）"""
+    rng = random.Random(seed)
+    vocab = ['知识', '向量', '检索', '文档', '模型', '问答', '索引', '数据',
+             'vector', 'search', 'index', 'chunk', 'model', 'query', 'answer', 'embedding']
+    pool = ' '.join(rng.choice(vocab) for _ in range(200000))
+    for _ in range(count):
+        length = rng.randint(avg_chars // 2, avg_chars * 3 // 2)
+        start = rng.randint(0, len(pool) - length - 1)
+        yield pool[start:start + length]
+
+
+def measure(build):
+    """返回 (结果对象, 常驻字节数, 峰值字节数, 耗时)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current, peak, elapsed
+
+
+def bench_legacy(count: int, avg_chars: int, dimension: int):
+    """旧版表示：每个文本块一个 dict，含文本与向量浮点列表"""
+    def build():
+        chunks = []
+        for i, text in enumerate(make_texts(count, avg_chars)):
+            chunks.append({
+                'doc_id': i // 100,
+                'chunk_id': i % 100,
+                'text': text,
+                'embedding': [random.random() for _ in range(dimension)]
+            })
+        return chunks
+    return measure(build)
+
+
+def bench_columnar(count: int, avg_chars: int):
+    """列式表示：NumPy 列 + UTF-8 文本字节区"""
+    def build():
+        store = ChunkStore(capacity=1024)
+        batch = []
+        for i, text in enumerate(make_texts(count, avg_chars)):
+            batch.append(text)
+            if len(batch) == 100:
+                store.extend(i // 100, 0, batch, [None] * len(batch))
+                batch = []
+        if batch:
+            store.extend(count // 100, 0, batch, [None] * len(batch))
+        return store
+    return measure(build)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本块存储内存基准")
+    parser.add_argument('--chunks', type=int, default=1_000_000, help='列式存储的文本块数量')
+    parser.add_argument('--legacy-sample', type=int, default=20_000,
+                        help='旧版表示实际构建的文本块数量（结果按线性外推到 --chunks）')
+    parser.add_argument('--avg-chars', type=int, default=300, help='平均文本块长度')
+    parser.add_argument('--dimension', type=int, default=384, help='向量维度')
+    parser.add_argument('--output', help='JSON结果输出文件（默认打印到标准输出）')
+    args = parser.parse_args()
+    
+    legacy, legacy_bytes, _, legacy_time = bench_legacy(args.legacy_sample, args.avg_chars, args.dimension)
+    del legacy
+    scale = args.chunks / args.legacy_sample
+    
+    store, columnar_bytes, columnar_peak, columnar_time = bench_columnar(args.chunks, args.avg_chars)
+    
+    # 随机抽取 top-k 风格的访问，验证惰性物化的开销
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(10000):
+        store[rng.randrange(len(store))]
+    lookup_us = (time.perf_counter() - start) / 10000 * 1e6
+    
+    result = {
+        'benchmark': 'chunk_store_memory',
+        'chunks': args.chunks,
+        'avg_chars': args.avg_chars,
+        'dimension': args.dimension,
+        'legacy': {
+            'sampled_chunks': args.legacy_sample,
+            'bytes_per_chunk': round(legacy_bytes / args.legacy_sample, 1),
+            'estimated_total_mb': round(legacy_bytes * scale / 1e6, 1),
+            'build_seconds_estimated': round(legacy_time * scale, 2)
+        },
+        'columnar': {
+            'bytes_per_chunk': round(columnar_bytes / args.chunks, 1),
+            'total_mb': round(columnar_bytes / 1e6, 1),
+            'peak_mb': round(columnar_peak / 1e6, 1),
+            'text_arena_mb': round(int(store.offsets[-1]) / 1e6, 1),
+            'build_seconds': round(columnar_time, 2),
+            'record_lookup_us': round(lookup_us, 2)
+        },
+        'reduction_factor': round(legacy_bytes * scale / max(columnar_bytes, 1), 1)
+    }
+    
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
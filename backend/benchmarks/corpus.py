@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成语料生成器
+按指定格式（txt/md/html/pdf/docx）、语言（zh/en）和大小生成可复现的测试文档
+
+PDF 由内置的最小 PDF 写入器生成（不依赖 reportlab），中文通过 Type0 字体 +
+ToUnicode 映射写入，保证 PyPDF2 能提取出原文；DOCX 使用 python-docx 生成。
+
+用法:
+    python benchmarks/corpus.py --output /tmp/corpus --files 4 --size-kb 64
+"""
+
+import argparse
+import json
+import random
+import zlib
+from pathlib import Path
+from typing import Dict, List, Iterable
+
+FORMATS = ('txt', 'md', 'html', 'pdf', 'docx')
+LANGUAGES = ('zh', 'en')
+
+_ZH_WORDS = ['知识库', '向量', '检索', '文档', '模型', '问答', '索引', '数据', '系统', '用户',
+             '查询', '相似度', '分块', '嵌入', '性能', '服务', '缓存', '存储', '处理', '结果',
+             '本地', '部署', '上下文', '语义', '文本', '算法', '延迟', '吞吐', '并发', '内存']
+_EN_WORDS = ['knowledge', 'vector', 'search', 'document', 'model', 'question', 'answer', 'index',
+             'data', 'system', 'user', 'query', 'similarity', 'chunk', 'embedding', 'latency',
+             'throughput', 'service', 'cache', 'storage', 'process', 'result', 'local', 'semantic',
+             'context', 'algorithm', 'memory', 'the', 'of', 'and', 'with', 'for', 'is', 'in']
+
+
+def make_paragraphs(language: str, target_chars: int, rng: random.Random) -> List[str]:
+    """生成总长度约为 target_chars 的段落列表"""
+    paragraphs = []
+    total = 0
+    while total < target_chars:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            if language == 'zh':
+                words = [rng.choice(_ZH_WORDS) for _ in range(rng.randint(6, 16))]
+                sentences.append(''.join(words) + rng.choice('。！？'))
+            else:
+                words = [rng.choice(_EN_WORDS) for _ in range(rng.randint(6, 16))]
+                sentences.append(' '.join(words).capitalize() + rng.choice('.!?'))
+        paragraph = ('' if language == 'zh' else ' ').join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph)
+    return paragraphs
+
+
+def write_txt(path: Path, title: str, paragraphs: List[str]):
+    path.write_text(title + '\n\n' + '\n\n'.join(paragraphs) + '\n', encoding='utf-8')
+
+
+def write_md(path: Path, title: str, paragraphs: List[str]):
+    lines = [f'# {title}', '']
+    for i, paragraph in enumerate(paragraphs):
+        if i % 5 == 0:
+            lines.extend([f'## {title} {i // 5 + 1}', ''])
+        lines.extend([paragraph, ''])
+    path.write_text('\n'.join(lines), encoding='utf-8')
+
+
+def write_html(path: Path, title: str, paragraphs: List[str]):
+    body = '\n'.join(f'<p>{paragraph}</p>' for paragraph in paragraphs)
+    path.write_text(
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title>'
+        f'<style>p {{ margin: 0 }}</style><script>var x = 1;</script></head>\n'
+        f'<body><h1>{title}</h1>\n{body}\n</body></html>\n',
+        encoding='utf-8'
+    )
+
+
+def write_docx(path: Path, title: str, paragraphs: List[str]):
+    from docx import Document
+    document = Document()
+    document.add_heading(title, level=1)
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(str(path))
+
+
+def _pdf_text_ops(lines: Iterable[str], cjk: bool) -> bytes:
+    """生成一页的内容流（每行一个 Tj）"""
+    ops = ['BT', '/F1 10 Tf', '12 TL', '50 800 Td']
+    for line in lines:
+        if cjk:
+            # Identity-H 编码下每个字符对应 2 字节 CID，这里直接使用 Unicode 码位作为 CID
+            ops.append('<' + line.encode('utf-16-be').hex().upper() + '> Tj T*')
+        else:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            ops.append(f'({escaped}) Tj T*')
+    ops.append('ET')
+    return '\n'.join(ops).encode('latin-1')
+
+
+def _identity_to_unicode_cmap(chars: Iterable[str]) -> bytes:
+    """CID 与 Unicode 码位一一对应的 ToUnicode CMap（只包含文档中出现的字符，保持映射表小巧）"""
+    entries = [f'<{ord(c):04X}> <{ord(c):04X}>' for c in sorted(set(chars)) if ord(c) <= 0xFFFF]
+    blocks = []
+    for i in range(0, len(entries), 100):
+        part = entries[i:i + 100]
+        blocks.append(f'{len(part)} beginbfchar\n' + '\n'.join(part) + '\nendbfchar')
+    return ('/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+            '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+            '1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n'
+            + '\n'.join(blocks) +
+            '\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend').encode('ascii')
+
+
+def write_pdf(path: Path, title: str, paragraphs: List[str], cjk: bool, lines_per_page: int = 60):
+    """
+    最小 PDF 写入器
+    
+    Args:
+        path: 输出路径
+        title: 标题（作为首行）
+        paragraphs: 段落
+        cjk: 是否包含中文（使用 Type0 字体与 ToUnicode 映射）
+        lines_per_page: 每页行数
+    """
+    width = 40 if cjk else 90
+    lines = [title, '']
+    for paragraph in paragraphs:
+        lines.extend(paragraph[i:i + width] for i in range(0, len(paragraph), width))
+        lines.append('')
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    
+    objects = []  # 下标 i 对应对象号 i + 1
+    
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+    
+    def stream(data: bytes) -> bytes:
+        data = zlib.compress(data)
+        return (f'<< /Length {len(data)} /Filter /FlateDecode >>\nstream\n'.encode('ascii')
+                + data + b'\nendstream')
+    
+    catalog = add(b'')
+    pages_obj = add(b'')
+    if cjk:
+        to_unicode = add(stream(_identity_to_unicode_cmap(''.join(lines))))
+        descriptor = add(b'<< /Type /FontDescriptor /FontName /SyntheticCJK /Flags 4 '
+                         b'/FontBBox [0 -200 1000 900] /ItalicAngle 0 /Ascent 900 /Descent -200 '
+                         b'/CapHeight 700 /StemV 80 >>')
+        cid_font = add(f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /SyntheticCJK '
+                       f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+                       f'/FontDescriptor {descriptor} 0 R /CIDToGIDMap /Identity /DW 1000 >>'.encode('ascii'))
+        font = add(f'<< /Type /Font /Subtype /Type0 /BaseFont /SyntheticCJK /Encoding /Identity-H '
+                   f'/DescendantFonts [{cid_font} 0 R] /ToUnicode {to_unicode} 0 R >>'.encode('ascii'))
+    else:
+        font = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    
+    page_ids = []
+    for page_lines in pages:
+        content = add(stream(_pdf_text_ops(page_lines, cjk)))
+        page_ids.append(add(f'<< /Type /Page /Parent {pages_obj} 0 R /MediaBox [0 0 595 842] '
+                            f'/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>'.encode('ascii')))
+    
+    objects[catalog - 1] = f'<< /Type /Catalog /Pages {pages_obj} 0 R >>'.encode('ascii')
+    kids = ' '.join(f'{pid} 0 R' for pid in page_ids)
+    objects[pages_obj - 1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode('ascii')
+    
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n'.encode('ascii') + body + b'\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('ascii')
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode('ascii')
+    out += (f'trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n').encode('ascii')
+    path.write_bytes(bytes(out))
+
+
+def generate_corpus(output_dir: str, formats: Iterable[str] = FORMATS, languages: Iterable[str] = LANGUAGES,
+                    files_per_combo: int = 2, size_kb: int = 64, seed: int = 42) -> List[Dict]:
+    """
+    生成合成语料
+    
+    Args:
+        output_dir: 输出目录
+        formats: 文件格式
+        languages: 语言（zh/en）
+        files_per_combo: 每种 格式×语言 组合生成的文件数
+        size_kb: 每个文件的目标文本量（KB，按字符计）
+        seed: 随机种子（相同参数生成的语料完全一致）
+    
+    Returns:
+        文件清单，每项包含 path/format/language/chars/bytes
+    """
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    manifest = []
+    
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的格式: {fmt}")
+        for language in languages:
+            if language not in LANGUAGES:
+                raise ValueError(f"不支持的语言: {language}")
+            for i in range(files_per_combo):
+                title = f'{"基准文档" if language == "zh" else "Benchmark document"} {fmt}-{language}-{i}'
+                paragraphs = make_paragraphs(language, size_kb * 1024, rng)
+                path = output / f'{fmt}_{language}_{i}.{fmt}'
+                if fmt == 'txt':
+                    write_txt(path, title, paragraphs)
+                elif fmt == 'md':
+                    write_md(path, title, paragraphs)
+                elif fmt == 'html':
+                    write_html(path, title, paragraphs)
+                elif fmt == 'pdf':
+                    write_pdf(path, title, paragraphs, cjk=(language == 'zh'))
+                else:
+                    write_docx(path, title, paragraphs)
+                manifest.append({
+                    'path': str(path),
+                    'format': fmt,
+                    'language': language,
+                    'chars': sum(len(p) for p in paragraphs),
+                    'bytes': path.stat().st_size
+                })
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成语料生成器")
+    parser.add_argument('--output', required=True, help='输出目录')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='逗号分隔的格式列表')
+    parser.add_argument('--languages', default=','.join(LANGUAGES), help='逗号分隔的语言列表')
+    parser.add_argument('--files', type=int, default=2, help='每种 格式×语言 组合的文件数')
+    parser.add_argument('--size-kb', type=int, default=64, help='每个文件的目标文本量（KB）')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    args = parser.parse_args()
+    
+    manifest = generate_corpus(args.output, args.formats.split(','), args.languages.split(','),
+                               args.files, args.size_kb, args.seed)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
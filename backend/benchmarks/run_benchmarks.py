@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试套件
+测量文档解析吞吐、向量化吞吐、不同规模下的检索延迟、知识库保存/加载耗时，
+以及通过 HTTP 调用 /api/search 与 /api/ask（接本地 Ollama 桩服务）的端到端延迟
+和多轮会话相对无状态追问节省的预填充量，多进程预派生模式下检索吞吐与内存随工作进程数的变化，
+标量量化索引（SQfp16/SQ8）在有无精确重排时的 recall@k 与每向量内存，
+HTML/Markdown/DOCX 在 lxml 流式提取与原有解析（BeautifulSoup、python-docx）下的提取吞吐，
+结果以 JSON 输出，便于在版本之间比较回归
+
+用法:
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --suites search,persist --sizes 10000,100000
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --suites prefork --sizes 1000000 --workers 1,2,4,8
+    python benchmarks/run_benchmarks.py --suites quantize --sizes 100000,1000000
+    python benchmarks/run_benchmarks.py --suites extract --size-kb 4096
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+# 添加backend目录到Python路径
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(benchmarks_dir)
+sys.path.insert(0, backend_dir)
+sys.path.insert(0, benchmarks_dir)
+
+from corpus import generate_corpus, make_paragraphs, FORMATS, LANGUAGES
+from stub_ollama import StubOllamaServer
+
+SUITES = ('parse', 'embed', 'search', 'persist', 'api', 'prefork', 'quantize', 'extract')
+
+# extract 基准比较的格式（其余格式两种后端的解析相同）
+EXTRACT_FORMATS = ('md', 'html', 'docx')
+
+# quantize 基准比较的索引类型与精确重排倍数（0 为不重排）
+QUANTIZE_CONFIGS = (('Flat', 0), ('SQfp16', 0), ('SQfp16', 4), ('SQ8', 0), ('SQ8', 2), ('SQ8', 4))
+
+_QUERIES = ['向量检索的延迟是多少', '如何部署本地知识库', '文档分块与语义相似度',
+            'how does the vector index work', 'what is the query latency',
+            'semantic search over local documents', '缓存与存储的关系', 'embedding throughput']
+
+
+def summarize(samples_seconds):
+    """把一组耗时（秒）汇总为毫秒分位数"""
+    values = np.asarray(samples_seconds, dtype=np.float64) * 1000.0
+    if values.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p90_ms': round(float(np.percentile(values, 90)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'min_ms': round(float(values.min()), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+def environment():
+    """记录运行环境，便于解释不同机器上的结果差异"""
+    import faiss
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=backend_dir,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'faiss': getattr(faiss, '__version__', None),
+        'git_commit': commit
+    }
+
+
+def bench_parse(manifest, repeat: int = 1):
+    """按格式测量 DocumentProcessor.process_document 的吞吐"""
+    from document_processor import DocumentProcessor
+    processor = DocumentProcessor()
+    results = {}
+    for fmt in sorted({item['format'] for item in manifest}):
+        items = [item for item in manifest if item['format'] == fmt]
+        chunks = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for item in items:
+                chunks += processor.process_document(item['path'])['chunk_count']
+        elapsed = time.perf_counter() - start
+        total_bytes = sum(item['bytes'] for item in items) * repeat
+        total_chars = sum(item['chars'] for item in items) * repeat
+        results[fmt] = {
+            'files': len(items) * repeat,
+            'bytes': total_bytes,
+            'chunks': chunks,
+            'seconds': round(elapsed, 4),
+            'files_per_second': round(len(items) * repeat / elapsed, 2),
+            'mb_per_second': round(total_bytes / elapsed / 1e6, 3),
+            'kchars_per_second': round(total_chars / elapsed / 1e3, 1)
+        }
+        print(f"📊 解析 {fmt:<5} {results[fmt]['files_per_second']} 文件/秒, {results[fmt]['mb_per_second']} MB/秒")
+    return results
+
+
+def bench_extract(manifest, repeat: int = 1):
+    """按格式比较各文本提取后端的吞吐（只计提取与清理，不含分块）"""
+    from document_extractors import EXTRACTION_BACKENDS, lxml_available
+    from document_processor import DocumentProcessor
+    backends = [b for b in EXTRACTION_BACKENDS if b != 'lxml' or lxml_available()]
+    results = {}
+    for fmt in EXTRACT_FORMATS:
+        items = [item for item in manifest if item['format'] == fmt]
+        if not items:
+            continue
+        total_bytes = sum(item['bytes'] for item in items) * repeat
+        results[fmt] = {}
+        for backend in backends:
+            processor = DocumentProcessor(extraction_backend=backend)
+            chars = 0
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for item in items:
+                    chars += sum(len(text) for _, text in processor.iter_segments(item['path']))
+            elapsed = time.perf_counter() - start
+            results[fmt][backend] = {
+                'files': len(items) * repeat,
+                'bytes': total_bytes,
+                'extracted_chars': chars,
+                'seconds': round(elapsed, 4),
+                'mb_per_second': round(total_bytes / elapsed / 1e6, 3)
+            }
+            print(f"📊 提取 {fmt:<5} {backend:<7} {results[fmt][backend]['mb_per_second']} MB/秒")
+        if len(backends) > 1:
+            results[fmt]['speedup'] = round(results[fmt]['legacy']['seconds'] / results[fmt]['lxml']['seconds'], 2)
+    return results
+
+
+def bench_embed(model, manifest, batch_sizes=(1, 16, 64, 256), max_texts: int = 2048):
+    """测量 model.encode 在不同批大小下的吞吐"""
+    from document_processor import DocumentProcessor
+    processor = DocumentProcessor()
+    texts = []
+    for item in manifest:
+        if item['format'] == 'txt':
+            texts.extend(processor.process_document(item['path'])['chunks'])
+    if not texts:
+        texts = make_paragraphs('en', 500 * max_texts, random.Random(0))
+    texts = (texts * (max_texts // max(len(texts), 1) + 1))[:max_texts]
+    model.encode(texts[:8])  # 预热
+    
+    results = {}
+    for batch_size in batch_sizes:
+        count = min(len(texts), max(batch_size * 8, 256))
+        start = time.perf_counter()
+        for i in range(0, count, batch_size):
+            model.encode(texts[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        results[str(batch_size)] = {
+            'texts': count,
+            'seconds': round(elapsed, 4),
+            'texts_per_second': round(count / elapsed, 1)
+        }
+        print(f"📊 向量化 batch={batch_size:<4} {results[str(batch_size)]['texts_per_second']} 文本/秒")
+    return results
+
+
+def build_synthetic_kb(model, storage_dir: str, size: int, chunks_per_doc: int = 1000, seed: int = 0):
+    """构建包含 size 个随机单位向量的知识库（绕过编码，只测检索与持久化）"""
+    from vector_knowledge_base import VectorKnowledgeBase
+    kb = VectorKnowledgeBase(storage_dir=storage_dir, model=model)
+    rng = np.random.default_rng(seed)
+    added = 0
+    while added < size:
+        n = min(chunks_per_doc, size - added)
+        vectors = rng.standard_normal((n, kb.dimension), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        doc = kb.start_document(f'synthetic/doc_{added // chunks_per_doc}.txt', n * 500)
+        kb.append_chunks(doc, [f'synthetic chunk {added + i}' for i in range(n)], [None] * n, vectors)
+        kb.finish_document(doc, n * 80)
+        added += n
+    return kb
+
+
+def bench_search(model, kb, queries: int, top_k: int):
+    """测量 search（含查询编码）与 search_vectors（仅索引检索）的延迟分布"""
+    texts = [_QUERIES[i % len(_QUERIES)] for i in range(queries)]
+    embeddings = model.encode(texts)
+    for i in range(min(10, queries)):  # 预热
+        kb.search_vectors(embeddings[i:i + 1], top_k)
+    
+    index_samples = []
+    for i in range(queries):
+        start = time.perf_counter()
+        kb.search_vectors(embeddings[i:i + 1], top_k)
+        index_samples.append(time.perf_counter() - start)
+    
+    full_samples = []
+    for text in texts:
+        start = time.perf_counter()
+        kb.search(text, top_k)
+        full_samples.append(time.perf_counter() - start)
+    
+    return {
+        'top_k': top_k,
+        'search_vectors': summarize(index_samples),
+        'search': summarize(full_samples)
+    }
+
+
+def bench_persist(model, kb):
+    """测量知识库保存与重新加载的耗时及磁盘占用"""
+    from vector_knowledge_base import VectorKnowledgeBase
+    start = time.perf_counter()
+    kb.save_knowledge_base()
+    save_seconds = time.perf_counter() - start
+    disk_bytes = sum(f.stat().st_size for f in kb.storage_dir.iterdir() if f.is_file())
+    
+    start = time.perf_counter()
+    loaded = VectorKnowledgeBase(storage_dir=str(kb.storage_dir), model=model)
+    load_seconds = time.perf_counter() - start
+    assert len(loaded.chunks) == len(kb.chunks), "加载后的文本块数量不一致"
+    return {
+        'save_seconds': round(save_seconds, 4),
+        'load_seconds': round(load_seconds, 4),
+        'disk_mb': round(disk_bytes / 1e6, 2)
+    }
+
+
+def _post_json(url: str, payload) -> float:
+    return _post_json_result(url, payload)[0]
+
+
+def _post_json_result(url: str, payload):
+    """发送 JSON 请求，返回 (耗时, 响应体)"""
+    data = json.dumps(payload).encode('utf-8')
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=120) as response:
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{url} 返回 {response.status}")
+    return time.perf_counter() - start, json.loads(body)
+
+
+def _bench_conversations(base: str, stub, conversations: int, turns: int, top_k: int):
+    """同一组多轮追问分别以无状态 /api/ask 与会话方式执行，比较后续轮次的延迟与预填充token数"""
+    result = {}
+    for label in ('stateless', 'session'):
+        first, followup = [], []
+        tokens_before = stub.prompt_tokens
+        followup_tokens = 0
+        for c in range(conversations):
+            payload = {'top_k': top_k, 'session': True} if label == 'session' else {'top_k': top_k}
+            for t in range(turns):
+                payload['question'] = _QUERIES[(c + t) % len(_QUERIES)]
+                before = stub.prompt_tokens
+                seconds, body = _post_json_result(f'{base}/api/ask', payload)
+                (first if t == 0 else followup).append(seconds)
+                if t > 0:
+                    followup_tokens += stub.prompt_tokens - before
+                if label == 'session':
+                    payload = {'top_k': top_k, 'session_id': body['session_id']}
+        result[label] = {
+            'first_turn': summarize(first),
+            'followup_turns': summarize(followup),
+            'prompt_tokens': stub.prompt_tokens - tokens_before,
+            'followup_prompt_tokens_per_turn': round(followup_tokens / max(len(followup), 1), 1)
+        }
+    return result
+
+
+def bench_api(model_name: str, corpus_dir: str, storage_dir: str, requests_count: int,
+              top_k: int, stub_latency: float, stub_prefill: float = 0.0, turns: int = 4):
+    """启动 API 服务与 Ollama 桩服务，测量 /api/search 与 /api/ask 的端到端延迟及多轮会话的收益"""
+    from api_server import APIHandler
+    from knowledge_retriever import KnowledgeRetriever
+    from sharded_knowledge_base import ShardedKnowledgeBase
+    from conversation_sessions import SessionStore
+    
+    kb = ShardedKnowledgeBase(model_name=model_name, storage_dir=storage_dir)
+    kb.add_directory(corpus_dir)
+    
+    with StubOllamaServer(latency=stub_latency, prefill_per_token=stub_prefill) as stub:
+        APIHandler._kb = kb
+        # 桩服务以字符计token，会话的 context 上限相应放大
+        APIHandler._retriever = KnowledgeRetriever(kb, ollama_url=stub.url,
+                                                   sessions=SessionStore(max_context_tokens=65536))
+        APIHandler._initialized = True
+        APIHandler.log_message = lambda *args: None
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), APIHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{httpd.server_address[1]}'
+        try:
+            queries = [_QUERIES[i % len(_QUERIES)] for i in range(requests_count)]
+            _post_json(f'{base}/api/search', {'query': queries[0], 'top_k': top_k})  # 预热
+            search_samples = [_post_json(f'{base}/api/search', {'query': q, 'top_k': top_k}) for q in queries]
+            ask_samples = [_post_json(f'{base}/api/ask', {'question': q, 'top_k': top_k}) for q in queries]
+            conversation = _bench_conversations(base, stub, max(1, requests_count // turns), turns, top_k)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        stub_requests = stub.requests
+    
+    return {
+        'documents': kb.get_stats()['total_documents'],
+        'vectors': kb.get_stats()['total_vectors'],
+        'stub_latency_ms': stub_latency * 1000.0,
+        'stub_prefill_us_per_token': stub_prefill * 1e6,
+        'stub_generate_requests': stub_requests,
+        'search': summarize(search_samples),
+        'ask': summarize(ask_samples),
+        'conversation': conversation
+    }
+
+
+def bench_quantize(model, storage_dir: str, size: int, queries: int, top_k: int):
+    """
+    用同一批向量构建不同的量化索引，测量 recall@k（以精确索引结果为准）、检索延迟与每向量常驻内存
+    
+    查询取自库中向量加噪声，使近邻结构接近真实查询。
+    """
+    from vector_knowledge_base import VectorKnowledgeBase
+    import faiss
+    
+    flat = build_synthetic_kb(model, storage_dir, size)
+    vectors = flat.index.reconstruct_n(0, flat.index.ntotal)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(vectors), size=queries, replace=queries > len(vectors))
+    query_vectors = vectors[picks] + rng.standard_normal((queries, flat.dimension), dtype=np.float32) * 0.05
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    truth = [set(flat.search_raw(q[None, :], top_k)[1].tolist()) for q in query_vectors]
+    
+    results = {}
+    for index_type, factor in QUANTIZE_CONFIGS:
+        kb = VectorKnowledgeBase(storage_dir=storage_dir, model=model, index_type=index_type, rescore_factor=factor)
+        index = faiss.IndexFlatIP(flat.dimension) if index_type == 'Flat' else \
+            faiss.index_factory(flat.dimension, index_type, faiss.METRIC_INNER_PRODUCT)
+        start = time.perf_counter()
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        kb.index = index
+        kb.exact_vectors = kb._new_exact_vectors()
+        if kb.exact_vectors is not None:
+            kb.exact_vectors.extend(vectors)
+        
+        hits, samples = 0, []
+        for q, expected in zip(query_vectors, truth):
+            start = time.perf_counter()
+            _, ids, _ = kb.search_raw(q[None, :], top_k)
+            samples.append(time.perf_counter() - start)
+            hits += len(expected & set(ids.tolist()))
+        bytes_per_vector = int(getattr(index, 'code_size', flat.dimension * 4))
+        label = index_type if factor == 0 else f'{index_type}+rescore{factor}'
+        results[label] = {
+            'index_type': index_type,
+            'rescore_factor': factor,
+            f'recall@{top_k}': round(hits / (len(truth) * top_k), 4),
+            'bytes_per_vector': bytes_per_vector,
+            'index_mb': round(bytes_per_vector * len(vectors) / 1e6, 2),
+            'memory_ratio': round(flat.dimension * 4 / bytes_per_vector, 2),
+            'build_seconds': round(build_seconds, 3),
+            'search': summarize(samples)
+        }
+        print(f"📊 {label:<18} recall@{top_k} {results[label][f'recall@{top_k}']:.4f}, "
+              f"{bytes_per_vector} 字节/向量, p50 {results[label]['search']['p50_ms']}ms")
+        del kb, index
+    del flat
+    shutil.rmtree(storage_dir, ignore_errors=True)
+    return {'vectors': size, 'top_k': top_k, 'queries': queries, 'configs': results}
+
+
+def _process_tree_pss_mb(root_pid: int) -> float:
+    """进程及其全部子进程的 PSS 之和（共享页按进程数均摊，Linux）"""
+    parents = {}
+    for stat in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            fields = stat.read_text().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        parents[int(stat.parent.name)] = int(fields[1])
+    pids, frontier = {root_pid}, [root_pid]
+    while frontier:
+        children = [pid for pid, ppid in parents.items() if ppid in frontier and pid not in pids]
+        pids.update(children)
+        frontier = children
+    total_kb = 0
+    for pid in pids:
+        try:
+            for line in Path(f'/proc/{pid}/smaps_rollup').read_text().splitlines():
+                if line.startswith('Pss:'):
+                    total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total_kb / 1024.0, 1)
+
+
+def _wait_ready(base: str, timeout: float = 300.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base}/api/stats', timeout=5) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{base} 未在 {timeout:.0f} 秒内就绪")
+
+
+def bench_prefork(model, work_dir: Path, size: int, worker_counts, duration: float, top_k: int):
+    """
+    以不同工作进程数启动 api_server，测量并发 /api/search 的吞吐与整个进程树的内存（PSS）
+    
+    工作进程数为 1 时为单进程模式，作为基线。
+    """
+    storage = work_dir / 'prefork'
+    shutil.rmtree(storage, ignore_errors=True)
+    build_synthetic_kb(model, str(storage / 'knowledge_base'), size).save_knowledge_base()
+    
+    results = {}
+    for workers in worker_counts:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        env = dict(os.environ, KB_WORKERS=str(workers), PORT=str(port), HOST='127.0.0.1',
+                   OLLAMA_URL='http://127.0.0.1:9', KB_SEMANTIC_CACHE_SIZE='0')
+        server = subprocess.Popen([sys.executable, os.path.join(backend_dir, 'api_server.py')], cwd=storage,
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            _wait_ready(base)
+            for query in _QUERIES:  # 预热
+                _post_json(f'{base}/api/search', {'query': query, 'top_k': top_k})
+            
+            clients = max(4, workers * 4)
+            samples = [[] for _ in range(clients)]
+            deadline = time.perf_counter() + duration
+            
+            def client(i):
+                n = i
+                while time.perf_counter() < deadline:
+                    samples[i].append(_post_json(f'{base}/api/search',
+                                                 {'query': _QUERIES[n % len(_QUERIES)], 'top_k': top_k}))
+                    n += 1
+            
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            latencies = [s for worker_samples in samples for s in worker_samples]
+            results[str(workers)] = {
+                'clients': clients,
+                'requests': len(latencies),
+                'qps': round(len(latencies) / elapsed, 1),
+                'latency': summarize(latencies),
+                'pss_mb': _process_tree_pss_mb(server.pid)
+            }
+            print(f"📊 {workers} 个工作进程: {results[str(workers)]['qps']} 请求/秒, "
+                  f"PSS {results[str(workers)]['pss_mb']} MB")
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+    shutil.rmtree(storage, ignore_errors=True)
+    return {'vectors': size, 'top_k': top_k, 'duration_seconds': duration, 'workers': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库基准测试套件")
+    parser.add_argument('--suites', default=','.join(SUITES), help=f'逗号分隔，可选: {",".join(SUITES)}')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='句子转换模型名称')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='检索/持久化基准的向量规模')
+    parser.add_argument('--queries', type=int, default=200, help='每个规模的检索次数')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--files', type=int, default=2, help='语料中每种 格式×语言 组合的文件数')
+    parser.add_argument('--size-kb', type=int, default=64, help='语料中每个文件的目标文本量（KB）')
+    parser.add_argument('--api-requests', type=int, default=50, help='每个 API 端点的请求次数')
+    parser.add_argument('--stub-latency-ms', type=float, default=50.0, help='Ollama 桩服务的模拟生成耗时')
+    parser.add_argument('--stub-prefill-us', type=float, default=20.0,
+                        help='Ollama 桩服务每个提示词字符的模拟预填充耗时（微秒）')
+    parser.add_argument('--workers', default='1,2,4', help='prefork 基准的工作进程数（1 为单进程基线）')
+    parser.add_argument('--prefork-seconds', type=float, default=10.0, help='prefork 基准每种进程数的压测时长')
+    parser.add_argument('--work-dir', help='语料与临时知识库目录（默认临时目录，结束后删除）')
+    parser.add_argument('--quick', action='store_true', help='快速模式：小规模，用于冒烟检查')
+    parser.add_argument('--output', help='JSON结果输出文件（默认打印到标准输出）')
+    args = parser.parse_args()
+    
+    if args.quick:
+        args.sizes, args.queries, args.files, args.size_kb, args.api_requests = '10000', 50, 1, 16, 10
+        args.prefork_seconds = 2.0
+    suites = [s for s in args.suites.split(',') if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"未知的基准: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='kb_bench_'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    result = {
+        'benchmark': 'knowledge_base',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': {}
+    }
+    
+    try:
+        manifest = []
+        if {'parse', 'embed', 'api', 'extract'} & set(suites):
+            manifest = generate_corpus(str(work_dir / 'corpus'), FORMATS, LANGUAGES, args.files, args.size_kb)
+            result['corpus'] = {
+                'files': len(manifest),
+                'bytes': sum(item['bytes'] for item in manifest),
+                'chars': sum(item['chars'] for item in manifest)
+            }
+        
+        if 'parse' in suites:
+            result['results']['parse'] = bench_parse(manifest)
+        
+        if 'extract' in suites:
+            result['results']['extract'] = bench_extract(manifest)
+        
+        model = None
+        if {'embed', 'search', 'persist', 'prefork', 'quantize'} & set(suites):
+            from vector_knowledge_base import load_embedding_model
+            model = load_embedding_model(args.model)
+        
+        if 'embed' in suites:
+            result['results']['embed'] = bench_embed(model, manifest)
+        
+        if {'search', 'persist'} & set(suites):
+            for size in sizes:
+                storage = work_dir / f'kb_{size}'
+                start = time.perf_counter()
+                kb = build_synthetic_kb(model, str(storage), size)
+                entry = {'vectors': size, 'build_seconds': round(time.perf_counter() - start, 2)}
+                if 'search' in suites:
+                    entry.update(bench_search(model, kb, args.queries, args.top_k))
+                    print(f"📊 检索 {size} 向量: p50 {entry['search']['p50_ms']}ms, p99 {entry['search']['p99_ms']}ms")
+                if 'persist' in suites:
+                    entry['persist'] = bench_persist(model, kb)
+                    print(f"📊 持久化 {size} 向量: 保存 {entry['persist']['save_seconds']}s, "
+                          f"加载 {entry['persist']['load_seconds']}s")
+                result['results'].setdefault('search', {})[str(size)] = entry
+                del kb
+                shutil.rmtree(storage, ignore_errors=True)
+        
+        if 'api' in suites:
+            result['results']['api'] = bench_api(args.model, str(work_dir / 'corpus'), str(work_dir / 'kb_api'),
+                                                 args.api_requests, args.top_k, args.stub_latency_ms / 1000.0,
+                                                 args.stub_prefill_us / 1e6)
+            api = result['results']['api']
+            print(f"📊 /api/search p50 {api['search']['p50_ms']}ms, /api/ask p50 {api['ask']['p50_ms']}ms")
+            print(f"📊 追问 p50: 无状态 {api['conversation']['stateless']['followup_turns']['p50_ms']}ms, "
+                  f"会话 {api['conversation']['session']['followup_turns']['p50_ms']}ms")
+        
+        if 'quantize' in suites:
+            result['results']['quantize'] = {
+                str(size): bench_quantize(model, str(work_dir / f'kb_quantize_{size}'), size, args.queries, args.top_k)
+                for size in sizes
+            }
+        
+        if 'prefork' in suites:
+            result['results']['prefork'] = bench_prefork(model, work_dir, sizes[0],
+                                                         [int(w) for w in args.workers.split(',') if w],
+                                                         args.prefork_seconds, args.top_k)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 Ollama 桩服务
+实现 /api/tags 与 /api/generate（含流式），以固定延迟返回合成答案，
+用于在没有真实大模型的环境下测量问答链路本身的开销；
+可按提示词长度模拟预填充耗时，并像 Ollama 一样返回累积的 context，
+带 context 的请求只为新增的提示词计费
+
+用法:
+    python benchmarks/stub_ollama.py --port 11435 --latency-ms 200
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': name} for name in self.server.models]})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.path != '/api/generate':
+            self._send_json({'error': 'not found'}, 404)
+            return
+        
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        model = payload.get('model')
+        if model not in server.models:
+            self._send_json({'error': f"model '{model}' not found"}, 404)
+            return
+        
+        answer = server.answer
+        # 以字符近似token：context 中的前缀视为已缓存，只有新提示词需要预填充
+        prompt = payload.get('prompt', '')
+        context = list(payload.get('context') or []) + [ord(c) for c in prompt] + [ord(c) for c in answer]
+        prefill = len(prompt) * server.prefill_per_token
+        stats = {'prompt_eval_count': len(prompt), 'prompt_eval_duration': int(prefill * 1e9)}
+        with server.lock:
+            server.prompt_tokens += len(prompt)
+        if not payload.get('stream', True):
+            time.sleep(prefill + server.latency)
+            self._send_json({'model': model, 'response': answer, 'done': True, 'context': context, **stats})
+            return
+        
+        # 流式：把延迟均摊到每个 token 上，以 NDJSON 分块返回
+        tokens = answer.split(' ')
+        delay = server.latency / max(len(tokens), 1)
+        time.sleep(prefill)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            time.sleep(delay)
+            self._write_chunk({'model': model, 'response': token + (' ' if i < len(tokens) - 1 else ''),
+                               'done': False})
+        self._write_chunk({'model': model, 'response': '', 'done': True, 'context': context, **stats})
+        self.wfile.write(b'0\r\n\r\n')
+    
+    def _write_chunk(self, data):
+        line = json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n'
+        self.wfile.write(f'{len(line):X}\r\n'.encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+
+class StubOllamaServer:
+    """
+    Ollama 桩服务
+    
+    用作上下文管理器时在后台线程中运行，退出时关闭：
+        with StubOllamaServer(latency=0.2) as stub:
+            retriever = KnowledgeRetriever(kb, ollama_url=stub.url)
+    """
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 models=('gemma2:2b',), answer: str = None, prefill_per_token: float = 0.0):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口（0 表示随机空闲端口）
+            latency: 每次生成请求的模拟耗时（秒）
+            models: 视为已安装的模型名称
+            answer: 返回的答案文本
+            prefill_per_token: 每个提示词token（以字符计）的模拟预填充耗时（秒）
+        """
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.models = list(models)
+        self.httpd.answer = answer or ('This is a synthetic answer from the stub Ollama server '
+                                       'used for benchmarking the question answering path.')
+        self.httpd.prefill_per_token = prefill_per_token
+        self.httpd.requests = 0
+        self.httpd.prompt_tokens = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+    
+    @property
+    def requests(self) -> int:
+        return self.httpd.requests
+    
+    @property
+    def prompt_tokens(self) -> int:
+        """累计需要预填充的提示词token数"""
+        return self.httpd.prompt_tokens
+    
+    def start(self) -> 'StubOllamaServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Ollama 桩服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='每次生成的模拟耗时（毫秒）')
+    parser.add_argument('--models', default='gemma2:2b', help='逗号分隔的模型名称')
+    parser.add_argument('--prefill-us', type=float, default=0.0, help='每个提示词字符的模拟预填充耗时（微秒）')
+    args = parser.parse_args()
+    
+    stub = StubOllamaServer(args.host, args.port, args.latency_ms / 1000.0, args.models.split(','),
+                            prefill_per_token=args.prefill_us / 1e6)
+    print(f"🚀 Ollama 桩服务: {stub.url}")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        stub.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线批量构建
+不启动 HTTP 服务器，把目录树或清单文件中的文档直接导入为知识库的一个集合：
+多进程并行解析与分块，主进程跨文档凑批向量化，全部写入后按目标索引类型训练一次，
+最后原子地安装为 storage_dir 的新一代，正在运行的服务器检查 CURRENT 时热加载（KB_REFRESH_INTERVAL）。
+
+构建期间每隔 --checkpoint-seconds 保存一次检查点，中断后以相同参数重新运行即从检查点继续，
+已写入检查点的文件不再解析与编码。
+
+新一代中被构建的集合整体替换为本次构建的结果，其他集合从当前一代硬链接过去；
+构建期间通过服务器写入同一集合的文档不会出现在新一代中。
+
+用法:
+    python bulk_build.py ../docs --storage-dir ./knowledge_base
+    python bulk_build.py ../docs ../papers --index-type IVF256,SQ8 --shards 4
+    python bulk_build.py --manifest files.txt --collection papers --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 添加backend目录到Python路径
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, backend_dir)
+
+from document_processor import DocumentProcessor
+from index_rebuild import MANIFEST_FILE, convert_index
+from near_duplicates import encode_deduplicated
+from parse_cache import ParseCache
+from sharded_knowledge_base import (ShardedKnowledgeBase, collection_root, next_generation, read_current,
+                                    scan_collections, write_current)
+from vector_knowledge_base import VectorKnowledgeBase, link_shard_files, load_embedding_model, new_index
+
+
+# 构建中的数据与检查点位于 storage_dir/bulk_build（不是 gen_N，不会被服务器回收）
+STAGING_DIR = 'bulk_build'
+CHECKPOINT_FILE = 'checkpoint.json'
+# 两个检查点目录交替写入，checkpoint.json 最后原子地指向写完的那一个
+CHECKPOINT_SLOTS = ('ckpt_a', 'ckpt_b')
+OUTPUT_DIR = 'output'
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+
+_processor = None
+
+
+def _init_worker(parse_cache_dir: str):
+    """解析子进程初始化：每个子进程一个处理器（与服务器共用解析缓存），PDF 不再二次并行"""
+    global _processor
+    # Ctrl+C 由主进程处理（关闭进程池后退出），子进程不各自打印 KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _processor = DocumentProcessor(pdf_workers=1, parse_cache=ParseCache.from_env(parse_cache_dir))
+
+
+def _parse_file(file_path: str) -> Dict[str, Any]:
+    """在子进程中解析并分块一个文件（需为模块级函数以便pickle），失败时返回错误信息"""
+    try:
+        path = Path(file_path)
+        stat = path.stat()
+        stats = {'word_count': 0}
+        chunks = []
+        pages = []
+        for chunk, page in _processor.iter_chunks(_processor.iter_segments(path), stats=stats):
+            chunks.append(chunk)
+            pages.append(page)
+        return {
+            'file_path': str(path),
+            'file_size': stat.st_size,
+            'file_mtime': stat.st_mtime,
+            'chunks': chunks,
+            'pages': pages,
+            'word_count': stats['word_count']
+        }
+    except Exception as e:
+        return {'file_path': str(file_path), 'error': str(e)}
+
+
+def collect_files(sources: List[str], manifest: Optional[str] = None) -> List[str]:
+    """
+    收集待导入的文件
+    
+    Args:
+        sources: 目录或文件路径，目录递归收集受支持格式的文件
+        manifest: 清单文件，每行一个路径（# 开头为注释，相对路径相对于清单所在目录）
+    
+    Returns:
+        去重并排序后的绝对路径，顺序固定以便从检查点继续
+    """
+    supported = DocumentProcessor().supported_formats
+    files = set()
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            files.update(str(p.resolve()) for p in path.rglob('*')
+                         if p.is_file() and p.suffix.lower() in supported)
+        elif path.is_file():
+            files.add(str(path.resolve()))
+        else:
+            raise FileNotFoundError(f"路径不存在: {source}")
+    if manifest:
+        base = Path(manifest).resolve().parent
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    files.add(str((base / line).resolve()))
+    return sorted(files)
+
+
+def _shard_dirs(root: Path, num_shards: int) -> List[Path]:
+    return ShardedKnowledgeBase._shard_dirs(root, num_shards)
+
+
+def _collection_dirs(data_dir: Path, name: str, num_shards: int) -> List[Path]:
+    """集合在一代目录中存有数据的分片目录（含分片数调整前留在集合根目录下的旧数据）"""
+    root = collection_root(data_dir, name)
+    dirs = _shard_dirs(root, num_shards)
+    if num_shards > 1:
+        dirs.append(root)
+    return [d for d in dirs if (d / "config.json").exists()]
+
+
+def _current_generation(storage_dir: Path):
+    """当前一代的目录与清单（没有 CURRENT 时为 storage_dir 本身，清单中没有的分片数按目录推断）"""
+    name = read_current(storage_dir)
+    data_dir = storage_dir if name is None else storage_dir / name
+    manifest = {}
+    manifest_file = data_dir / MANIFEST_FILE
+    if manifest_file.exists():
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    manifest.setdefault('num_shards', len(list(data_dir.glob('shard_*'))) or 1)
+    return data_dir, manifest
+
+
+def _other_collections(data_dir: Path, manifest: Dict[str, Any], collection: str) -> List[str]:
+    """当前一代中有数据的其他集合"""
+    return [name for name in scan_collections(data_dir)
+            if name != collection and _collection_dirs(data_dir, name, int(manifest['num_shards']))]
+
+
+class BulkBuilder:
+    """
+    一次离线批量构建
+    
+    文档按文件路径哈希路由到集合的各个分片（与服务器相同），写入期间分片统一使用精确索引，
+    全部文件导入后每个分片按目标类型训练一次；每个文档完整写入后才可能保存检查点。
+    """
+    
+    def __init__(self, files: List[str], storage_dir: str, collection: str = ShardedKnowledgeBase.DEFAULT_COLLECTION,
+                 model_name: Optional[str] = None, index_type: Optional[str] = None,
+                 num_shards: Optional[int] = None, workers: Optional[int] = None, batch_size: int = 256,
+                 checkpoint_seconds: float = 300.0, rescore_factor: int = 4, dedup_distance: Optional[int] = None):
+        """
+        初始化批量构建
+        
+        Args:
+            files: collect_files 返回的文件列表
+            storage_dir: 知识库存储根目录（与服务器相同）
+            collection: 构建的集合名称
+            model_name: 向量模型（默认沿用当前一代的模型）
+            index_type: 目标 faiss.index_factory 描述串（默认沿用当前一代的索引类型）
+            num_shards: 集合的分片数（默认沿用当前一代的分片数）
+            workers: 解析进程数（默认CPU核数）
+            batch_size: 每次送入模型编码的文本块数量
+            checkpoint_seconds: 检查点间隔（秒，0 表示只在导入结束时保存）
+            rescore_factor: 量化索引精确重排的候选倍数
+            dedup_distance: 近重复文本块的 SimHash 汉明距离阈值（None 或负数不去重）
+        """
+        self.files = files
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.collection = collection
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.batch_size = max(1, int(batch_size))
+        self.checkpoint_seconds = checkpoint_seconds
+        self.rescore_factor = rescore_factor
+        self.dedup_distance = dedup_distance if dedup_distance is not None and dedup_distance >= 0 else None
+        
+        # 新一代只有一份清单，其他集合仍在使用当前一代的模型与分片数，构建结果必须与之一致
+        data_dir, manifest = _current_generation(self.storage_dir)
+        others = _other_collections(data_dir, manifest, collection)
+        current_model = manifest.get('model_name', DEFAULT_MODEL)
+        current_shards = int(manifest.get('num_shards', 1))
+        self.model_name = model_name or current_model
+        self.index_type = index_type or manifest.get('index_type', 'Flat')
+        self.num_shards = max(1, int(num_shards or current_shards))
+        if others and (self.model_name, self.num_shards) != (current_model, current_shards):
+            raise ValueError(f"当前一代的其他集合（{', '.join(others)}）使用模型 {current_model}、"
+                             f"{current_shards} 分片，批量构建须保持一致（更换请用影子重建）")
+        
+        self.staging = self.storage_dir / STAGING_DIR
+        self.files_done = 0
+        self.errors = []
+        self.documents = 0
+        self.chunks = 0
+        self.model = None
+        self.shards = []
+        self._slot = None
+        self._pending = []
+        self._pending_chunks = 0
+        self._last_checkpoint = time.monotonic()
+    
+    def _settings(self) -> Dict[str, Any]:
+        """决定检查点能否复用的构建参数"""
+        digest = hashlib.blake2b('\n'.join(self.files).encode('utf-8'), digest_size=16).hexdigest()
+        return {
+            'collection': self.collection,
+            'model_name': self.model_name,
+            'num_shards': self.num_shards,
+            'files': len(self.files),
+            'files_digest': digest
+        }
+    
+    def _new_shards(self, root: Optional[Path]) -> List[VectorKnowledgeBase]:
+        """打开 root 下的检查点分片（root 为None时在暂存目录下新建空分片）"""
+        root = root or self.staging / CHECKPOINT_SLOTS[0]
+        return [
+            VectorKnowledgeBase(self.model_name, str(d), model=self.model, rescore_factor=self.rescore_factor,
+                                dedup_distance=self.dedup_distance)
+            for d in _shard_dirs(root, self.num_shards)
+        ]
+    
+    def _resume(self, fresh: bool):
+        """读取检查点；参数或文件列表变化（或 fresh）时丢弃旧的暂存目录重新开始"""
+        checkpoint_file = self.staging / CHECKPOINT_FILE
+        if not fresh and checkpoint_file.exists():
+            with open(checkpoint_file, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('settings') == self._settings():
+                self._slot = checkpoint['slot']
+                self.files_done = checkpoint['files_done']
+                self.errors = checkpoint['errors']
+                self.documents = checkpoint['documents']
+                self.chunks = checkpoint['chunks']
+                self.shards = self._new_shards(self.staging / self._slot)
+                print(f"♻️ 从检查点继续: 已完成 {self.files_done}/{len(self.files)} 文件, {self.chunks} 块")
+                return
+            print("⚠️ 构建参数或文件列表与检查点不一致，重新开始")
+        shutil.rmtree(self.staging, ignore_errors=True)
+        self.staging.mkdir(parents=True)
+        self.shards = self._new_shards(None)
+    
+    def _checkpoint(self):
+        """把分片写入另一个检查点目录，再原子地更新 checkpoint.json 指向它"""
+        slot = CHECKPOINT_SLOTS[1] if self._slot == CHECKPOINT_SLOTS[0] else CHECKPOINT_SLOTS[0]
+        target = self.staging / slot
+        shutil.rmtree(target, ignore_errors=True)
+        for shard, shard_dir in zip(self.shards, _shard_dirs(target, self.num_shards)):
+            shard.save_knowledge_base(shard_dir)
+        
+        checkpoint_file = self.staging / CHECKPOINT_FILE
+        tmp = checkpoint_file.with_name(f'{CHECKPOINT_FILE}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'settings': self._settings(),
+                'slot': slot,
+                'files_done': self.files_done,
+                'documents': self.documents,
+                'chunks': self.chunks,
+                'errors': self.errors,
+                'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, checkpoint_file)
+        self._slot = slot
+        self._last_checkpoint = time.monotonic()
+        print(f"💾 检查点已保存: {self.files_done}/{len(self.files)} 文件, {self.chunks} 块")
+    
+    def _flush(self):
+        """把积累的文档一次编码并逐个完整写入所属分片"""
+        if not self._pending:
+            return
+        texts = [chunk for doc in self._pending for chunk in doc['chunks']]
+        if not texts:
+            embeddings = np.empty((0, self.model.get_sentence_embedding_dimension()), dtype='float32')
+        elif self.dedup_distance is not None:
+            # 与已写入各分片的文本块近重复的复用其向量（写入时再在所属分片内登记为别名）
+            embeddings, _ = encode_deduplicated(texts, self.shards,
+                                                lambda batch: self.model.encode(batch, batch_size=self.batch_size))
+        else:
+            embeddings = self.model.encode(texts, batch_size=self.batch_size)
+        offset = 0
+        for doc in self._pending:
+            count = len(doc['chunks'])
+            shard = self.shards[ShardedKnowledgeBase.route_index(doc['file_path'], self.num_shards)]
+            record = shard.start_document(doc['file_path'], doc['file_size'], doc['file_mtime'])
+            shard.append_chunks(record, doc['chunks'], doc['pages'], embeddings[offset:offset + count])
+            shard.finish_document(record, doc['word_count'])
+            offset += count
+        self.documents += len(self._pending)
+        self.chunks += len(texts)
+        self._pending = []
+        self._pending_chunks = 0
+    
+    def _ingest(self):
+        """并行解析剩余文件，按文件顺序消费结果，保证检查点记录的是一个连续前缀"""
+        remaining = self.files[self.files_done:]
+        started = time.monotonic()
+        started_chunks = self.chunks
+        base = self.files_done
+        consumed = 0
+        # 子进程只解析不编码，用 spawn 启动，不继承主进程已加载的模型与其线程池
+        context = multiprocessing.get_context('spawn')
+        window = self.workers * 4
+        
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(str(self.storage_dir / "parse_cache"),)) as executor:
+            pending = deque()
+            next_file = 0
+            while next_file < len(remaining) or pending:
+                while next_file < len(remaining) and len(pending) < window:
+                    pending.append(executor.submit(_parse_file, remaining[next_file]))
+                    next_file += 1
+                result = pending.popleft().result()
+                
+                consumed += 1
+                
+                if 'error' in result:
+                    print(f"❌ 处理失败: {result['file_path']} - {result['error']}")
+                    self.errors.append(result)
+                else:
+                    self._pending.append(result)
+                    self._pending_chunks += len(result['chunks'])
+                if self._pending_chunks >= self.batch_size:
+                    self._flush()
+                if self._pending:
+                    continue
+                # 没有积累的文档时，前 files_done 个文件都已写入分片，此时才能保存检查点
+                self.files_done = base + consumed
+                if self.checkpoint_seconds and time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+                    self._checkpoint()
+                    rate = (self.chunks - started_chunks) / (time.monotonic() - started)
+                    print(f"📈 导入速度: {rate:.1f} 块/秒")
+            self._flush()
+            self.files_done = len(self.files)
+    
+    def _install(self) -> int:
+        """训练目标索引、写出新一代目录，并原子地切换 CURRENT"""
+        output = self.staging / OUTPUT_DIR
+        shutil.rmtree(output, ignore_errors=True)
+        
+        print(f"🏋️ 训练索引: {self.index_type}")
+        for shard in self.shards:
+            warning = convert_index(shard, self.index_type)
+            if warning:
+                print(f"⚠️ {warning}")
+        for shard, shard_dir in zip(self.shards, _shard_dirs(collection_root(output, self.collection),
+                                                                self.num_shards)):
+            shard.save_knowledge_base(shard_dir)
+        
+        # 其他集合从安装时的当前一代硬链接过来
+        data_dir, manifest = _current_generation(self.storage_dir)
+        for name in _other_collections(data_dir, manifest, self.collection):
+            source_root = collection_root(data_dir, name)
+            for source in _collection_dirs(data_dir, name, int(manifest['num_shards'])):
+                link_shard_files(source, collection_root(output, name) / source.relative_to(source_root))
+        
+        generation = next_generation(self.storage_dir)
+        with open(output / MANIFEST_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generation': generation,
+                'model_name': self.model_name,
+                'index_type': self.index_type,
+                'num_shards': self.num_shards,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'source': 'bulk_build',
+                'collection': self.collection,
+                'total_documents': self.documents,
+                'total_chunks': self.chunks
+            }, f, ensure_ascii=False, indent=2)
+        
+        target = self.storage_dir / f"gen_{generation}"
+        os.rename(output, target)
+        write_current(self.storage_dir, target.name)
+        if not target.is_dir():
+            # 极小的窗口内，旧版本的服务器可能在 CURRENT 切换前回收了这个目录
+            raise RuntimeError(f"新一代目录在安装过程中被删除: {target}")
+        return generation
+    
+    def run(self, fresh: bool = False) -> Dict[str, Any]:
+        """
+        执行构建（中断后再次调用从检查点继续）
+        
+        Args:
+            fresh: 忽略已有检查点，从头开始
+        
+        Returns:
+            构建摘要
+        """
+        started = time.monotonic()
+        self.model = load_embedding_model(self.model_name)
+        new_index(self.model.get_sentence_embedding_dimension(), self.index_type)  # 索引描述串无效时尽早失败
+        self._resume(fresh)
+        print(f"📦 批量构建: {len(self.files)} 文件 → 集合 {self.collection}, "
+              f"{self.num_shards} 分片, 索引 {self.index_type}, {self.workers} 个解析进程")
+        
+        if self.files_done < len(self.files):
+            self._ingest()
+            # 导入结束先保存检查点，训练或安装失败时重新运行无需再次导入
+            self._checkpoint()
+        generation = self._install()
+        shutil.rmtree(self.staging, ignore_errors=True)
+        
+        elapsed = time.monotonic() - started
+        return {
+            'generation': generation,
+            'collection': self.collection,
+            'files': len(self.files),
+            'documents': self.documents,
+            'chunks': self.chunks,
+            'errors': self.errors,
+            'model_name': self.model_name,
+            'index_type': self.index_type,
+            'num_shards': self.num_shards,
+            'elapsed_seconds': round(elapsed, 2)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量构建知识库（无需启动服务器）")
+    parser.add_argument('sources', nargs='*', help='文档目录或文件')
+    parser.add_argument('--manifest', help='清单文件，每行一个文档路径')
+    parser.add_argument('--storage-dir', default='./knowledge_base', help='知识库存储根目录')
+    parser.add_argument('--collection', default=ShardedKnowledgeBase.DEFAULT_COLLECTION, help='构建的集合')
+    parser.add_argument('--model', help='向量模型（默认沿用当前一代）')
+    parser.add_argument('--index-type', help='faiss.index_factory 描述串，如 IVF256,SQ8（默认沿用当前一代）')
+    parser.add_argument('--shards', type=int, help='分片数（默认沿用当前一代）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='解析进程数')
+    parser.add_argument('--batch-size', type=int, default=256, help='每次编码的文本块数量')
+    parser.add_argument('--checkpoint-seconds', type=float, default=300.0, help='检查点间隔（秒）')
+    parser.add_argument('--fresh', action='store_true', help='忽略已有检查点，从头开始')
+    args = parser.parse_args()
+    
+    if not args.sources and not args.manifest:
+        parser.error("需要指定文档目录/文件或 --manifest")
+    files = collect_files(args.sources, args.manifest)
+    if not files:
+        parser.error("没有找到受支持格式的文件")
+    
+    try:
+        builder = BulkBuilder(files, args.storage_dir, collection=args.collection, model_name=args.model,
+                              index_type=args.index_type, num_shards=args.shards, workers=args.workers,
+                              batch_size=args.batch_size, checkpoint_seconds=args.checkpoint_seconds,
+                              rescore_factor=int(os.getenv('KB_RESCORE_FACTOR', '4')),
+                              dedup_distance=int(os.getenv('KB_DEDUP_DISTANCE', '-1')))
+        summary = builder.run(fresh=args.fresh)
+    except KeyboardInterrupt:
+        print("\n🛑 已中断，以相同参数重新运行即可从最近的检查点继续")
+        sys.exit(130)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    
+    print("=" * 60)
+    print(f"✅ 批量构建完成: 第 {summary['generation']} 代, {summary['documents']} 文档, {summary['chunks']} 块, "
+          f"失败 {len(summary['errors'])} 个, 耗时 {summary['elapsed_seconds']}s")
+    print(f"📂 {Path(args.storage_dir) / ('gen_' + str(summary['generation']))}（运行中的服务器会自动切换）")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式文本块存储
+用 NumPy 数组保存文本块的编号与偏移，所有文本连续存放在一块 UTF-8 字节区中，
+避免每个文本块一个 dict 及向量浮点列表带来的对象开销
+"""
+
+import mmap
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Union
+
+import numpy as np
+
+
+class ChunkStore:
+    """
+    列式文本块存储类
+    
+    每个文本块对应的列：
+        doc_ids   - 所属文档ID (int32)
+        chunk_ids - 在文档内的序号 (int32)
+        pages     - 起始页码，无页码为 -1 (int32)
+        offsets   - 文本在字节区中的起止偏移，长度为 n + 1 (int64)
+    按下标访问时才构造 dict，检索只为 top-k 结果物化记录。
+    """
+    
+    # 持久化文件名
+    FILES = {
+        'doc_ids': 'chunks_doc_ids.npy',
+        'chunk_ids': 'chunks_chunk_ids.npy',
+        'pages': 'chunks_pages.npy',
+        'offsets': 'chunks_offsets.npy',
+    }
+    TEXT_FILE = 'chunks_text.bin'
+    
+    def __init__(self, capacity: int = 1024):
+        capacity = max(1, int(capacity))
+        self._size = 0
+        self._doc_ids = np.empty(capacity, dtype=np.int32)
+        self._chunk_ids = np.empty(capacity, dtype=np.int32)
+        self._pages = np.empty(capacity, dtype=np.int32)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._arena = bytearray()
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        """构造单个文本块的记录（惰性物化）"""
+        idx = int(idx)
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError(idx)
+        page = int(self._pages[idx])
+        return {
+            'doc_id': int(self._doc_ids[idx]),
+            'chunk_id': int(self._chunk_ids[idx]),
+            'text': self.text(idx),
+            'page': page if page >= 0 else None
+        }
+    
+    def __iter__(self):
+        for idx in range(self._size):
+            yield self[idx]
+    
+    @property
+    def doc_ids(self) -> np.ndarray:
+        return self._doc_ids[:self._size]
+    
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self._chunk_ids[:self._size]
+    
+    @property
+    def pages(self) -> np.ndarray:
+        return self._pages[:self._size]
+    
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._offsets[:self._size + 1]
+    
+    def text(self, idx: int) -> str:
+        """读取单个文本块的文本"""
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        return bytes(self._arena[start:end]).decode('utf-8')
+    
+    def nbytes(self) -> int:
+        """列数组与文本字节区占用的字节数（按已分配容量计）"""
+        return (self._doc_ids.nbytes + self._chunk_ids.nbytes + self._pages.nbytes
+                + self._offsets.nbytes + len(self._arena))
+    
+    def _ensure_writable(self, extra: int):
+        """扩容列数组；从 mmap 加载的只读数据在首次写入时复制到内存"""
+        if isinstance(self._arena, (mmap.mmap, bytes)):
+            self._arena = bytearray(self._arena[:self._offsets[self._size]])
+        needed = self._size + extra
+        capacity = len(self._doc_ids)
+        if needed <= capacity and self._doc_ids.flags.writeable:
+            return
+        capacity = max(needed, capacity * 2)
+        for name in ('_doc_ids', '_chunk_ids', '_pages'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+        offsets = np.zeros(capacity + 1, dtype=np.int64)
+        offsets[:self._size + 1] = self._offsets[:self._size + 1]
+        self._offsets = offsets
+    
+    def extend(self, doc_id: int, chunk_ids: Union[int, Iterable[int]], texts: List[str],
+               pages: Iterable[Optional[int]]):
+        """
+        追加同一文档的一批文本块
+        
+        Args:
+            doc_id: 所属文档ID
+            chunk_ids: 第一个文本块在文档内的序号（其余依次加一），或每个文本块的序号
+            texts: 文本块
+            pages: 每个文本块的起始页码（无页码为None）
+        """
+        n = len(texts)
+        if n == 0:
+            return
+        self._ensure_writable(n)
+        start, end = self._size, self._size + n
+        self._doc_ids[start:end] = doc_id
+        if isinstance(chunk_ids, (int, np.integer)):
+            chunk_ids = np.arange(chunk_ids, chunk_ids + n, dtype=np.int32)
+        self._chunk_ids[start:end] = chunk_ids
+        self._pages[start:end] = [-1 if page is None else page for page in pages]
+        pos = int(self._offsets[start])
+        for i, text in enumerate(texts):
+            encoded = text.encode('utf-8')
+            self._arena += encoded
+            pos += len(encoded)
+            self._offsets[start + i + 1] = pos
+        self._size = end
+    
+    def append(self, doc_id: int, chunk_id: int, text: str, page: Optional[int] = None):
+        """追加单个文本块"""
+        self.extend(doc_id, chunk_id, [text], [page])
+    
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> 'ChunkStore':
+        """由旧版 chunks.json 的记录列表构建（丢弃其中的向量浮点列表）"""
+        store = cls(capacity=len(records))
+        for record in records:
+            store.append(record['doc_id'], record['chunk_id'], record['text'], record.get('page'))
+        return store
+    
+    def save(self, directory: Path):
+        """保存为若干 .npy 列文件和一个文本字节区文件"""
+        directory = Path(directory)
+        np.save(directory / self.FILES['doc_ids'], self.doc_ids)
+        np.save(directory / self.FILES['chunk_ids'], self.chunk_ids)
+        np.save(directory / self.FILES['pages'], self.pages)
+        np.save(directory / self.FILES['offsets'], self.offsets)
+        with open(directory / self.TEXT_FILE, 'wb') as f:
+            f.write(self._arena[:self._offsets[self._size]])
+    
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        directory = Path(directory)
+        return all((directory / name).exists() for name in cls.FILES.values()) and (directory / cls.TEXT_FILE).exists()
+    
+    @classmethod
+    def load(cls, directory: Path, use_mmap: bool = False) -> 'ChunkStore':
+        """
+        从目录加载
+        
+        Args:
+            directory: 存储目录
+            use_mmap: 是否以只读内存映射方式加载（多个进程可共享同一份页缓存）
+        """
+        directory = Path(directory)
+        mmap_mode = 'r' if use_mmap else None
+        store = cls.__new__(cls)
+        store._doc_ids = np.load(directory / cls.FILES['doc_ids'], mmap_mode=mmap_mode)
+        store._chunk_ids = np.load(directory / cls.FILES['chunk_ids'], mmap_mode=mmap_mode)
+        store._pages = np.load(directory / cls.FILES['pages'], mmap_mode=mmap_mode)
+        store._offsets = np.load(directory / cls.FILES['offsets'], mmap_mode=mmap_mode)
+        store._size = len(store._doc_ids)
+        
+        text_file = directory / cls.TEXT_FILE
+        if use_mmap and text_file.stat().st_size > 0:
+            with open(text_file, 'rb') as f:
+                store._arena = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(text_file, 'rb') as f:
+                store._arena = bytearray(f.read())
+        return store
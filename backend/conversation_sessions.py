@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多轮问答会话
+会话保存已发送给Ollama的文档内容、问答历史以及Ollama返回的 context（提示词与答案的token序列）。
+后续轮次只发送新增文档和新问题，并带上 context，Ollama可复用该前缀的KV缓存，
+不必每轮重新处理整段文档内容；会话按空闲时间过期，并受token数与总内存上限约束
+
+环境变量:
+    KB_SESSION_TTL            会话空闲过期时间（秒，默认 1800）
+    KB_SESSION_MAX            会话数量上限（默认 256，超出时淘汰最久未使用的会话）
+    KB_SESSION_MAX_TOKENS     单个会话保留的 context token 上限（默认 8192）
+    KB_SESSION_MAX_MEMORY_MB  所有会话占用内存的上限（MB，默认 64）
+"""
+
+import os
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class SessionNotFoundError(Exception):
+    """会话不存在或已过期"""
+
+
+class ConversationSession:
+    """单个问答会话"""
+    
+    def __init__(self, session_id: str, collection: Optional[str] = None):
+        self.session_id = session_id
+        self.collection = collection
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.turns = 0
+        # Ollama返回的 context 只在生成它的节点与模型上有效
+        self.endpoint = None
+        self.model = None
+        self.tokens = array('i')
+        self.sources = []        # 已发送给模型的检索结果，编号与提示词中的“文档 N”一致
+        self.chunk_keys = set()
+        self.history = []        # (问题, 答案)
+        self.prompt_tokens = 0   # Ollama实际处理的提示词token累计
+        self.reused_turns = 0
+        # 同一会话的各轮按顺序执行
+        self.lock = threading.Lock()
+    
+    def has_context(self) -> bool:
+        return len(self.tokens) > 0
+    
+    def reset_context(self):
+        """丢弃 context，下一轮由文档内容与历史重新构建完整提示词"""
+        self.endpoint = None
+        self.model = None
+        self.tokens = array('i')
+    
+    def memory_bytes(self) -> int:
+        """估算会话占用的内存（context token 与已保存文本）"""
+        text = sum(len(result['text']) for result in self.sources)
+        text += sum(len(question) + len(answer) for question, answer in self.history)
+        return self.tokens.itemsize * len(self.tokens) + text * 2
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'collection': self.collection,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.created_at)),
+            'idle_seconds': round(time.monotonic() - self.last_used, 1),
+            'turns': self.turns,
+            'documents': len(self.sources),
+            'context_tokens': len(self.tokens),
+            'endpoint': self.endpoint,
+            'prompt_tokens': self.prompt_tokens,
+            'reused_turns': self.reused_turns
+        }
+
+
+class SessionStore:
+    """
+    会话存储
+    
+    按最近使用顺序保存会话，超过空闲时间的会话在访问时清理；
+    会话数量或总内存超出上限时淘汰最久未使用的会话。
+    """
+    
+    def __init__(self, ttl: float = 1800.0, max_sessions: int = 256, max_context_tokens: int = 8192,
+                 max_memory_bytes: int = 64 * 1024 * 1024, max_documents: int = 20, max_history: int = 6):
+        """
+        初始化会话存储
+        
+        Args:
+            ttl: 空闲过期时间（秒）
+            max_sessions: 会话数量上限
+            max_context_tokens: 单个会话的 context token 上限，超出时丢弃 context 并在下一轮重建
+            max_memory_bytes: 所有会话的内存上限（字节）
+            max_documents: 单个会话累计发送的文档块上限
+            max_history: 重建提示词时保留的最近问答轮数
+        """
+        self.ttl = ttl
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_context_tokens = max_context_tokens
+        self.max_memory_bytes = max_memory_bytes
+        self.max_documents = max_documents
+        self.max_history = max_history
+        self._sessions = OrderedDict()
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._created = 0
+        self._expired = 0
+        self._evicted = 0
+        self._context_resets = 0
+    
+    @classmethod
+    def from_env(cls) -> 'SessionStore':
+        return cls(
+            ttl=float(os.getenv('KB_SESSION_TTL', '1800')),
+            max_sessions=int(os.getenv('KB_SESSION_MAX', '256')),
+            max_context_tokens=int(os.getenv('KB_SESSION_MAX_TOKENS', '8192')),
+            max_memory_bytes=int(float(os.getenv('KB_SESSION_MAX_MEMORY_MB', '64')) * 1024 * 1024)
+        )
+    
+    def create(self, collection: Optional[str] = None) -> ConversationSession:
+        """创建新会话"""
+        session = ConversationSession(uuid.uuid4().hex, collection)
+        with self._lock:
+            self._purge_expired_locked()
+            self._sessions[session.session_id] = session
+            self._memory[session.session_id] = 0
+            self._created += 1
+            self._evict_locked()
+        return session
+    
+    def get(self, session_id: str) -> ConversationSession:
+        """
+        获取会话并刷新其最近使用时间
+        
+        Raises:
+            SessionNotFoundError: 会话不存在或已过期
+        """
+        with self._lock:
+            self._purge_expired_locked()
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise SessionNotFoundError(f"会话不存在或已过期: {session_id}")
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+    
+    def update(self, session: ConversationSession, tokens: Optional[List[int]],
+               endpoint: Optional[str], model: Optional[str]):
+        """
+        保存一轮问答后的 context，并执行单会话与总内存上限
+        
+        Args:
+            session: 会话
+            tokens: Ollama返回的 context（为None时丢弃）
+            endpoint: 生成该 context 的节点URL
+            model: 生成该 context 的模型
+        """
+        if tokens and len(tokens) <= self.max_context_tokens:
+            session.tokens = array('i', tokens)
+            session.endpoint = endpoint
+            session.model = model
+        else:
+            if tokens:
+                # 超出模型上下文窗口前主动丢弃，下一轮用文档与最近历史重建提示词
+                with self._lock:
+                    self._context_resets += 1
+            session.reset_context()
+        del session.history[:-self.max_history]
+        session.last_used = time.monotonic()
+        
+        with self._lock:
+            if session.session_id not in self._sessions:
+                return
+            self._memory[session.session_id] = session.memory_bytes()
+            self._sessions.move_to_end(session.session_id)
+            self._evict_locked()
+    
+    def close(self, session_id: str) -> bool:
+        """结束会话，返回会话是否存在"""
+        with self._lock:
+            self._memory.pop(session_id, None)
+            return self._sessions.pop(session_id, None) is not None
+    
+    def _purge_expired_locked(self):
+        now = time.monotonic()
+        # 按最近使用顺序排列，遇到未过期的会话即可停止
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._memory.pop(session_id, None)
+            self._expired += 1
+    
+    def _evict_locked(self):
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or
+                                           sum(self._memory.values()) > self.max_memory_bytes):
+            session_id, _ = self._sessions.popitem(last=False)
+            self._memory.pop(session_id, None)
+            self._evicted += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired_locked()
+            return {
+                'active': len(self._sessions),
+                'memory_bytes': sum(self._memory.values()),
+                'context_tokens': sum(len(s.tokens) for s in self._sessions.values()),
+                'created': self._created,
+                'expired': self._expired,
+                'evicted': self._evicted,
+                'context_resets': self._context_resets,
+                'ttl': self.ttl,
+                'max_sessions': self.max_sessions,
+                'max_context_tokens': self.max_context_tokens,
+                'max_memory_bytes': self.max_memory_bytes
+            }
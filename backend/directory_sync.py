@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录同步
+监视一个或多个源目录，只把新增、修改和删除的文件同步到知识库：
+新文件导入，修改过的文件替换旧版本，删除的文件从知识库中删除（墓碑，分片定期压缩）。
+有 watchdog（inotify/FSEvents/ReadDirectoryChangesW）时按文件系统事件触发，否则定期比较修改时间；
+一批密集的变化在安静 debounce 秒后合并处理并只保存一次，开销与变化量成正比，而不是定期全量重建。
+
+环境变量:
+    KB_SYNC_DIRS           要同步的目录（多个用 os.pathsep 分隔，未设置时不启用）
+    KB_SYNC_COLLECTION     同步到的集合（默认集合）
+    KB_SYNC_DEBOUNCE       最后一次变化后等待多久再处理（秒，默认 2）
+    KB_SYNC_POLL_INTERVAL  轮询模式的扫描间隔（秒，默认 10）
+    KB_SYNC_MODE           auto（有 watchdog 时用事件）/ poll
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from document_processor import DocumentProcessor
+from sharded_knowledge_base import KnowledgeBaseBusyError
+import metrics
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+FileState = Tuple[int, Optional[float]]
+
+
+class _EventHandler(FileSystemEventHandler):
+    """把文件系统事件转为待同步的路径"""
+    
+    def __init__(self, sync: 'DirectorySync'):
+        super().__init__()
+        self.sync = sync
+    
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        if event.is_directory:
+            # 目录整体移入或移出只有一个事件，其下文件的变化由下一批的全量对比发现
+            if event.event_type in ('moved', 'deleted', 'created'):
+                self.sync.request_rescan()
+            return
+        self.sync.notify(event.src_path)
+        if getattr(event, 'dest_path', None):
+            self.sync.notify(event.dest_path)
+
+
+class DirectorySync:
+    """
+    目录同步任务
+    
+    启动时先把目录与知识库中记录的 (文件大小, 修改时间) 做一次全量对比，之后只处理变化的路径。
+    同步状态（已知文件及其大小、修改时间）保存在内存中，由知识库中的文档记录初始化。
+    """
+    
+    def __init__(self, kb, directories: Iterable[str], collection: Optional[str] = None,
+                 debounce: float = 2.0, max_delay: float = 30.0, poll_interval: float = 10.0,
+                 mode: str = 'auto'):
+        """
+        初始化目录同步
+        
+        Args:
+            kb: ShardedKnowledgeBase 实例
+            directories: 要同步的目录
+            collection: 同步到的集合（默认集合为None）
+            debounce: 最后一次变化后等待的秒数，期间的变化合并为一批
+            max_delay: 持续有变化时，一批最多等待的秒数
+            poll_interval: 轮询模式的扫描间隔（秒）
+            mode: auto（有 watchdog 时按事件）/ poll（定期比较修改时间）
+        """
+        self.kb = kb
+        self.directories = [Path(d).resolve() for d in directories]
+        self.collection = collection
+        self.debounce = debounce
+        self.max_delay = max(debounce, max_delay)
+        self.poll_interval = poll_interval
+        self.mode = 'watch' if mode == 'auto' and Observer is not None else 'poll'
+        self.supported_formats = set(DocumentProcessor().supported_formats)
+        
+        self._known = {}
+        self._failed = {}
+        self._pending = set()
+        self._rescan = True
+        self._first_event = None
+        self._last_event = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+        self._observer = None
+        
+        self._stats = {'batches': 0, 'added': 0, 'updated': 0, 'removed': 0, 'failed': 0,
+                       'last_batch_seconds': None, 'last_sync': None}
+    
+    @classmethod
+    def from_env(cls, kb) -> Optional['DirectorySync']:
+        """按环境变量创建同步任务，KB_SYNC_DIRS 未设置时返回None"""
+        directories = [d for d in os.getenv('KB_SYNC_DIRS', '').split(os.pathsep) if d]
+        if not directories:
+            return None
+        return cls(kb, directories,
+                   collection=os.getenv('KB_SYNC_COLLECTION') or None,
+                   debounce=float(os.getenv('KB_SYNC_DEBOUNCE', '2')),
+                   poll_interval=float(os.getenv('KB_SYNC_POLL_INTERVAL', '10')),
+                   mode=os.getenv('KB_SYNC_MODE', 'auto'))
+    
+    def start(self):
+        """启动同步线程（首次全量对比也在后台进行，不阻塞服务启动）"""
+        for directory in self.directories:
+            directory.mkdir(parents=True, exist_ok=True)
+        self._threads.append(threading.Thread(target=self._run, name='kb-sync', daemon=True))
+        if self.mode == 'watch':
+            self._observer = Observer()
+            handler = _EventHandler(self)
+            for directory in self.directories:
+                self._observer.schedule(handler, str(directory), recursive=True)
+            self._observer.start()
+        else:
+            self._threads.append(threading.Thread(target=self._poll, name='kb-sync-poll', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        print(f"🔄 目录同步已启动（{'文件系统事件' if self.mode == 'watch' else '轮询'}）: "
+              f"{', '.join(str(d) for d in self.directories)}")
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+    
+    def notify(self, path: str):
+        """登记一个可能发生变化的路径"""
+        if Path(path).suffix.lower() not in self.supported_formats:
+            return
+        with self._cond:
+            self._pending.add(str(Path(path).resolve()))
+            self._touch_locked()
+    
+    def request_rescan(self):
+        """下一批做一次全量对比（目录被整体移动或删除时）"""
+        with self._cond:
+            self._rescan = True
+            self._touch_locked()
+    
+    def _touch_locked(self):
+        now = time.monotonic()
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+        self._cond.notify_all()
+    
+    def scan(self) -> Dict[str, FileState]:
+        """遍历同步目录，返回受支持文件的 (大小, 修改时间)"""
+        files = {}
+        for directory in self.directories:
+            for root, _, names in os.walk(directory):
+                for name in names:
+                    if Path(name).suffix.lower() not in self.supported_formats:
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (stat.st_size, stat.st_mtime)
+        return files
+    
+    def _load_known(self) -> Dict[str, FileState]:
+        """知识库中位于同步目录下的文档"""
+        try:
+            documents = self.kb.get_documents(self.collection)
+        except KeyError:
+            return {}
+        known = {}
+        for doc in documents:
+            path = doc['file_path']
+            if any(path.startswith(os.path.join(str(d), '')) for d in self.directories):
+                known[path] = (doc['file_size'], doc.get('file_mtime'))
+        return known
+    
+    def _poll(self):
+        """轮询模式：定期扫描并把与上一次扫描不同的路径登记为待同步"""
+        previous = self.scan()
+        while not self._wait(self.poll_interval):
+            current = self.scan()
+            for path in current.keys() | previous.keys():
+                if current.get(path) != previous.get(path):
+                    self.notify(path)
+            previous = current
+    
+    def _wait(self, seconds: float) -> bool:
+        with self._cond:
+            self._cond.wait_for(lambda: self._stopped, seconds)
+            return self._stopped
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                # 等到有变化，且最后一次变化后已安静 debounce 秒（或第一次变化后已超过 max_delay）
+                while not self._stopped:
+                    if self._rescan or self._pending:
+                        now = time.monotonic()
+                        if self._first_event is None:
+                            break
+                        due = min(self._last_event + self.debounce, self._first_event + self.max_delay)
+                        if now >= due:
+                            break
+                        self._cond.wait(due - now)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                rescan, self._rescan = self._rescan, False
+                batch, self._pending = self._pending, set()
+                self._first_event = self._last_event = None
+            
+            try:
+                self._sync_batch(batch, rescan)
+            except KnowledgeBaseBusyError:
+                # 影子重建期间不能写入，稍后整批重试
+                with self._cond:
+                    self._pending |= batch
+                    self._rescan |= rescan
+                    self._touch_locked()
+                self._wait(max(self.debounce, 5.0))
+            except Exception as e:
+                print(f"❌ 目录同步失败: {e}")
+    
+    def _sync_batch(self, paths: set, rescan: bool):
+        started = time.perf_counter()
+        if rescan:
+            # 全量对比：知识库可能在同步未运行期间被修改，或启用同步前已导入过这些目录
+            self._known = self._load_known()
+            current = self.scan()
+            paths = paths | {path for path in current.keys() | self._known.keys()
+                             if not self._unchanged(self._known.get(path), current.get(path))}
+        if not paths:
+            return
+        
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'failed': 0}
+        for path in sorted(paths):
+            self._sync_path(path, counts)
+        if counts['added'] or counts['updated'] or counts['removed']:
+            self.kb.save_knowledge_base()
+        
+        elapsed = time.perf_counter() - started
+        for key, value in counts.items():
+            self._stats[key] += value
+            if value:
+                metrics.SYNC_FILES.inc(value, action=key)
+        self._stats['batches'] += 1
+        self._stats['last_batch_seconds'] = round(elapsed, 3)
+        self._stats['last_sync'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        print(f"🔄 目录同步: 新增 {counts['added']}, 更新 {counts['updated']}, 删除 {counts['removed']}, "
+              f"失败 {counts['failed']}, 耗时 {elapsed:.2f}s")
+    
+    @staticmethod
+    def _unchanged(known: Optional[FileState], current: Optional[FileState]) -> bool:
+        if known is None or current is None:
+            return known is None and current is None
+        # 旧版本导入的文档没有记录修改时间，只比较大小
+        return known[0] == current[0] and (known[1] is None or known[1] == current[1])
+    
+    def _sync_path(self, path: str, counts: Dict[str, int]):
+        try:
+            stat = os.stat(path)
+            current = (stat.st_size, stat.st_mtime)
+        except OSError:
+            current = None
+        known = self._known.get(path)
+        
+        if current is None:
+            self._failed.pop(path, None)
+            if known is not None:
+                self.kb.remove_document(path, self.collection)
+                del self._known[path]
+                counts['removed'] += 1
+            return
+        if self._unchanged(known, current) or self._failed.get(path) == current:
+            return
+        try:
+            # 总是替换：同一路径也可能在启用同步前通过上传或批量构建导入过
+            doc_info = self.kb.add_document(path, self.collection, replace=True)
+        except KnowledgeBaseBusyError:
+            raise
+        except Exception as e:
+            # 同一版本的文件不再重试，文件再次修改后才重新导入
+            print(f"❌ 同步文件失败: {path} - {e}")
+            self._failed[path] = current
+            counts['failed'] += 1
+            return
+        self._failed.pop(path, None)
+        self._known[path] = (doc_info['file_size'], doc_info.get('file_mtime'))
+        counts['updated' if known is not None else 'added'] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'mode': self.mode,
+            'directories': [str(d) for d in self.directories],
+            'collection': self.collection,
+            'tracked_files': len(self._known),
+            'pending': pending,
+            **self._stats
+        }
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式文本提取
+用 lxml 增量解析 HTML 与 DOCX，边读文件边产出文本，不构建完整的文档树：
+HTML（以及 Markdown 渲染出的 HTML）使用解析器事件回调（target），跳过 script/style 等不可见内容，
+块级元素结束处换行以保留段落结构；DOCX 直接从 word/document.xml 按文档顺序流式读取段落与表格，
+表格每行输出一行、单元格以制表符分隔，已处理的元素随即释放，内存与文件大小无关。
+lxml 不可用时 DocumentProcessor 退回 BeautifulSoup / python-docx 解析
+"""
+
+import zipfile
+from typing import Iterator, List, Optional
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+# 文本提取后端：lxml 流式提取 / legacy 原有解析（BeautifulSoup、python-docx）
+EXTRACTION_BACKENDS = ('lxml', 'legacy')
+
+# 每次读入解析器的字节数
+READ_BLOCK_BYTES = 256 * 1024
+
+# 内容不可见、不提取文本的元素
+HTML_SKIP_TAGS = frozenset({'script', 'style', 'noscript', 'template', 'svg', 'math', 'iframe', 'object'})
+
+# 结束处换行的块级元素（行内元素的文本与前后文连在一起）
+HTML_BLOCK_TAGS = frozenset({
+    'address', 'article', 'aside', 'blockquote', 'body', 'br', 'caption', 'dd', 'details', 'div', 'dl',
+    'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'summary', 'table', 'title',
+    'tr', 'ul'
+})
+
+# 表格单元格之间用制表符分隔
+HTML_CELL_TAGS = frozenset({'td', 'th'})
+
+# Markdown 渲染结果中的代码：前后加标记便于识别（与原有解析一致）
+CODE_TAGS = frozenset({'code', 'pre'})
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def lxml_available() -> bool:
+    """lxml 是否可用"""
+    return etree is not None
+
+
+class _TextTarget:
+    """lxml 解析器事件回调：按文档顺序收集可见文本"""
+    
+    def __init__(self, mark_code: bool = False):
+        self.parts: List[str] = []
+        self.mark_code = mark_code
+        self._skip = 0
+        self._code = 0
+    
+    def start(self, tag, attrib):
+        if not isinstance(tag, str):
+            return
+        tag = tag.lower()
+        if tag in HTML_SKIP_TAGS:
+            self._skip += 1
+        elif self._skip:
+            return
+        elif self.mark_code and tag in CODE_TAGS:
+            if self._code == 0:
+                self.parts.append(' [代码块: ')
+            self._code += 1
+    
+    def end(self, tag):
+        if not isinstance(tag, str):
+            return
+        tag = tag.lower()
+        if tag in HTML_SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif self._skip:
+            return
+        elif self.mark_code and tag in CODE_TAGS:
+            self._code = max(0, self._code - 1)
+            if self._code == 0:
+                self.parts.append('] ')
+        elif tag in HTML_BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag in HTML_CELL_TAGS:
+            self.parts.append('\t')
+    
+    def data(self, text):
+        if not self._skip:
+            self.parts.append(text)
+    
+    def comment(self, text):
+        pass
+    
+    def close(self):
+        return None
+    
+    def drain(self) -> str:
+        text = ''.join(self.parts)
+        self.parts.clear()
+        return text
+
+
+def iter_html_text(file_path, mark_code: bool = False, encoding: Optional[str] = 'utf-8') -> Iterator[str]:
+    """
+    增量解析HTML文件，按读入顺序产出可见文本
+    
+    Args:
+        file_path: HTML文件路径
+        mark_code: 是否在 code/pre 内容前后加代码块标记
+        encoding: 文件编码（为None时由解析器按 meta 声明检测）
+    
+    Yields:
+        文本片段（片段之间直接拼接即为全文）
+    """
+    target = _TextTarget(mark_code)
+    parser = etree.HTMLParser(target=target, encoding=encoding, remove_comments=True, recover=True)
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            parser.feed(block)
+            text = target.drain()
+            if text:
+                yield text
+    parser.close()
+    text = target.drain()
+    if text:
+        yield text
+
+
+def html_string_text(html: str, mark_code: bool = False) -> str:
+    """提取HTML字符串中的可见文本（用于 Markdown 渲染结果）"""
+    target = _TextTarget(mark_code)
+    parser = etree.HTMLParser(target=target, remove_comments=True, recover=True)
+    parser.feed(html)
+    parser.close()
+    return target.drain()
+
+
+def _paragraph_text(paragraph) -> str:
+    """段落中各文本节点按顺序拼接，制表符与换行保留"""
+    parts = []
+    for node in paragraph.iter(_W + 't', _W + 'tab', _W + 'br', _W + 'cr'):
+        if node.tag == _W + 't':
+            parts.append(node.text or '')
+        elif node.tag == _W + 'tab':
+            parts.append('\t')
+        else:
+            parts.append('\n')
+    return ''.join(parts)
+
+
+def iter_docx_text(file_path) -> Iterator[str]:
+    """
+    从 word/document.xml 流式读取DOCX正文，段落与表格按文档顺序产出
+    
+    表格的每一行产出一行文本，单元格之间以制表符分隔，单元格内的多个段落以空格连接；
+    嵌套表格的行并入外层单元格。页眉页脚、批注与脚注不在正文中，不提取。
+    
+    Args:
+        file_path: DOCX文件路径
+    
+    Yields:
+        以换行结尾的段落或表格行
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as stream:
+        tables = []      # 每层表格：[当前行的单元格列表, 当前单元格的段落列表]
+        paragraph_depth = 0
+        for event, elem in etree.iterparse(stream, events=('start', 'end'),
+                                           tag=(_W + 'p', _W + 'tbl', _W + 'tr', _W + 'tc'), huge_tree=True):
+            tag = elem.tag
+            if event == 'start':
+                if tag == _W + 'p':
+                    paragraph_depth += 1
+                elif tag == _W + 'tbl':
+                    tables.append([[], []])
+                elif tag == _W + 'tr' and tables:
+                    tables[-1][0] = []
+                elif tag == _W + 'tc' and tables:
+                    tables[-1][1] = []
+                continue
+            
+            if tag == _W + 'p':
+                paragraph_depth -= 1
+                if paragraph_depth:
+                    # 文本框等嵌套段落的文本由外层段落一并提取
+                    continue
+                text = _paragraph_text(elem)
+                if tables:
+                    tables[-1][1].append(text)
+                else:
+                    yield text + '\n'
+            elif tag == _W + 'tc' and tables:
+                tables[-1][0].append(' '.join(t for t in tables[-1][1] if t))
+            elif tag == _W + 'tr' and tables:
+                row = '\t'.join(tables[-1][0])
+                if len(tables) > 1:
+                    tables[-2][1].append(row)
+                else:
+                    yield row + '\n'
+            elif tag == _W + 'tbl':
+                tables.pop()
+            
+            # 文本已取出，释放该元素；正文中的顶层元素另外删除已处理的前序兄弟节点
+            elem.clear()
+            if not tables and not paragraph_depth:
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+
+
+# 超长行（如没有换行的整页文本）没有换行可切时，累积到 min_chars 的该倍数后在空白处强制切分
+FORCED_CUT_FACTOR = 2
+
+_CUT_WHITESPACE = (' ', '\t', '\u3000')
+
+
+def iter_text_blocks(pieces: Iterator[str], min_chars: int = 64 * 1024) -> Iterator[str]:
+    """
+    把文本片段合并为按行边界切分的文本块
+    
+    按行清理的结果与整篇清理一致，切在换行处使各块可以独立清理，下游边解析边分块。
+    片段先收集在列表中，只在新片段中查找换行，切块时才拼接，总开销与文本长度成线性。
+    累积超过 FORCED_CUT_FACTOR * min_chars 仍没有换行时在最后一个空白处切分（没有空白则整段切出），
+    该处空白在下游相当于换行，超长行因此被分为多行，块的大小仍有上限。
+    
+    Args:
+        pieces: 文本片段
+        min_chars: 累积到该字符数后在最后一个换行处切出一块
+    
+    Yields:
+        文本块（块之间以换行分隔，末尾的换行已去掉；没有强制切分时以换行连接各块即为原文）
+    """
+    parts: List[str] = []
+    size = 0
+    newline = None      # 已累积内容中最后一个换行的位置：(parts 下标, 片段内偏移)
+    cut_at_newline = False
+    for piece in pieces:
+        if not piece:
+            continue
+        offset = piece.rfind('\n')
+        if offset >= 0:
+            newline = (len(parts), offset)
+        parts.append(piece)
+        size += len(piece)
+        if size < min_chars:
+            continue
+        
+        if newline is not None:
+            index, offset = newline
+            head = parts[index]
+            yield ''.join(parts[:index]) + head[:offset]
+            parts = ([head[offset + 1:]] if offset + 1 < len(head) else []) + parts[index + 1:]
+            cut_at_newline = True
+        elif size >= FORCED_CUT_FACTOR * min_chars:
+            cut_at_newline = False
+            buffer = ''.join(parts)
+            cut = max(buffer.rfind(space) for space in _CUT_WHITESPACE)
+            if cut < 0:
+                yield buffer
+                parts = []
+            else:
+                yield buffer[:cut]
+                parts = [buffer[cut + 1:]] if cut + 1 < len(buffer) else []
+        else:
+            continue
+        newline = None
+        size = sum(len(part) for part in parts)
+    if parts or cut_at_newline:
+        # 切在最后一个字符（换行）上时仍产出空的末块，换行不会丢失
+        yield ''.join(parts)
+
+
+def default_backend() -> str:
+    """lxml 可用时使用流式提取"""
+    return 'lxml' if lxml_available() else 'legacy'
+
+
+def resolve_backend(backend: Optional[str]) -> str:
+    """校验提取后端名称（为None时使用默认后端）"""
+    if backend is None:
+        return default_backend()
+    if backend not in EXTRACTION_BACKENDS:
+        raise ValueError(f"不支持的提取后端: {backend}")
+    if backend == 'lxml' and not lxml_available():
+        raise ValueError("lxml 未安装，无法使用 lxml 提取后端")
+    return backend
@@ -5,21 +5,72 @@
 支持多种格式文档的解析和内容提取
 """
 
+import multiprocessing
 import os
 import re
+import time
 import jieba
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import PyPDF2
 from docx import Document
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
 import markdown
 from bs4 import BeautifulSoup
 
+from document_extractors import (html_string_text, iter_docx_text, iter_html_text, iter_text_blocks,
+                                 resolve_backend)
+import metrics
+
+
+# 解析或清理逻辑变化时递增，使解析结果缓存中的旧条目失效
+PARSER_VERSION = 3
+
+# lxml 后端下边解析边产出文本段的格式
+STREAMING_FORMATS = ('.html', '.htm', '.docx')
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """在子进程中提取PDF指定页范围的文本（需为模块级函数以便pickle）"""
+    texts = []
+    with open(file_path, 'rb') as f:
+        pdf_reader = PyPDF2.PdfReader(f)
+        for page_no in range(start, end):
+            try:
+                texts.append(pdf_reader.pages[page_no].extract_text() or "")
+            except Exception as e:
+                print(f"⚠️ PDF第{page_no + 1}页提取失败: {str(e)}")
+                texts.append("")
+    return texts
+
 
 class DocumentProcessor:
     """文档处理器类"""
     
-    def __init__(self):
+    def __init__(self, pdf_workers: Optional[int] = None, pdf_parallel_min_pages: int = 64,
+                 pdf_pages_per_task: int = 16, parse_cache=None, extraction_backend: Optional[str] = None):
+        """
+        初始化文档处理器
+        
+        Args:
+            pdf_workers: PDF并行提取的进程数（None表示CPU核数，1表示不并行）
+            pdf_parallel_min_pages: 页数达到该值时才启用多进程提取
+            pdf_pages_per_task: 每个子进程任务提取的页数
+            parse_cache: 解析结果缓存（ParseCache，为None时每次都重新解析）
+            extraction_backend: HTML/Markdown/DOCX 的文本提取后端 lxml/legacy（None 时 lxml 可用则用 lxml）
+        """
+        self.parse_cache = parse_cache
+        self.extraction_backend = resolve_backend(extraction_backend)
+        # 两种后端提取的文本不同，解析缓存按后端区分
+        self.parser_version = f'{PARSER_VERSION}-{self.extraction_backend}'
+        # 本处理器的缓存命中情况，供导入摘要报告节省的解析时间
+        self.parse_cache_stats = {'hits': 0, 'misses': 0, 'parse_seconds': 0.0, 'saved_seconds': 0.0}
+        self.pdf_workers = pdf_workers if pdf_workers is not None else (os.cpu_count() or 1)
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        self.pdf_pages_per_task = pdf_pages_per_task
         self.supported_formats = {
             '.txt': self._process_txt,
             '.md': self._process_markdown,
@@ -40,23 +91,19 @@ class DocumentProcessor:
             包含文档信息的字典
         """
         file_path = Path(file_path)
-        
-        if not file_path.exists():
-            raise FileNotFoundError(f"文件不存在: {file_path}")
-        
-        file_ext = file_path.suffix.lower()
-        if file_ext not in self.supported_formats:
-            raise ValueError(f"不支持的文件格式: {file_ext}")
+        self._check_file(file_path)
         
         try:
-            # 提取文档内容
-            content = self.supported_formats[file_ext](file_path)
-            
-            # 清理和预处理文本
-            cleaned_content = self._clean_text(content)
+            # 流式提取、清理并分块（PDF按页流式处理）
+            segments = list(self.iter_segments(file_path))
+            stats = {'word_count': 0}
+            chunks = []
+            chunk_pages = []
+            for chunk, page in self.iter_chunks(segments, stats=stats):
+                chunks.append(chunk)
+                chunk_pages.append(page)
             
-            # 分块处理
-            chunks = self._chunk_text(cleaned_content)
+            cleaned_content = '\n'.join(text for _, text in segments)
             
             return {
                 'file_path': str(file_path),
@@ -64,13 +111,24 @@ class DocumentProcessor:
                 'file_size': file_path.stat().st_size,
                 'content': cleaned_content,
                 'chunks': chunks,
+                'chunk_pages': chunk_pages,
                 'chunk_count': len(chunks),
-                'word_count': len(cleaned_content.split())
+                'word_count': stats['word_count']
             }
             
         except Exception as e:
             raise Exception(f"处理文档失败 {file_path}: {str(e)}")
     
+    def _check_file(self, file_path: Path) -> str:
+        """检查文件是否存在且格式受支持，返回小写扩展名"""
+        if not file_path.exists():
+            raise FileNotFoundError(f"文件不存在: {file_path}")
+        
+        file_ext = file_path.suffix.lower()
+        if file_ext not in self.supported_formats:
+            raise ValueError(f"不支持的文件格式: {file_ext}")
+        return file_ext
+    
     def _process_txt(self, file_path: Path) -> str:
         """处理TXT文件"""
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -98,6 +156,11 @@ class DocumentProcessor:
             # 如果扩展不可用，使用基本转换
             html = markdown.markdown(md_content)
         
+        if self.extraction_backend == 'lxml':
+            # 代码块加标记、跳过内嵌的 script/style，不构建文档树
+            text = html_string_text(html, mark_code=True)
+            return '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+        
         soup = BeautifulSoup(html, 'html.parser')
         
         # 提取文本内容
@@ -118,23 +181,157 @@ class DocumentProcessor:
     
     def _process_pdf(self, file_path: Path) -> str:
         """处理PDF文件"""
-        content = ""
+        return "\n".join(text for _, text in self.iter_pdf_pages(file_path)) + "\n"
+    
+    def iter_pdf_pages(self, file_path: Path) -> Iterator[Tuple[int, str]]:
+        """
+        逐页流式提取PDF文本
+        
+        页数较多时按页范围分发到多个子进程并行提取，按页序产出结果，
+        同时最多只有 2 * pdf_workers 个任务在途，避免整本PDF的文本堆积在内存中。
+        
+        Args:
+            file_path: PDF文件路径
+            
+        Yields:
+            (页码(从1开始), 页面文本)
+        """
         with open(file_path, 'rb') as f:
             pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                content += page.extract_text() + "\n"
-        return content
+            page_count = len(pdf_reader.pages)
+            
+            if self.pdf_workers <= 1 or page_count < self.pdf_parallel_min_pages:
+                for page_no, page in enumerate(pdf_reader.pages, 1):
+                    try:
+                        text = page.extract_text() or ""
+                    except Exception as e:
+                        print(f"⚠️ PDF第{page_no}页提取失败: {str(e)}")
+                        text = ""
+                    yield page_no, text
+                return
+        
+        step = max(1, self.pdf_pages_per_task)
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        max_pending = self.pdf_workers * 2
+        
+        # 使用 spawn 启动子进程：服务进程中有检索线程与已加载的模型，fork 会复制它们持有的锁
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.pdf_workers, mp_context=context) as executor:
+            pending = []
+            next_range = 0
+            while next_range < len(ranges) or pending:
+                while next_range < len(ranges) and len(pending) < max_pending:
+                    start, end = ranges[next_range]
+                    pending.append((start, executor.submit(_extract_pdf_page_range, str(file_path), start, end)))
+                    next_range += 1
+                start, future = pending.pop(0)
+                for offset, text in enumerate(future.result()):
+                    yield start + offset + 1, text
+    
+    def iter_segments(self, file_path) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        按段产出清理后的文本：PDF每页一段并带页码；lxml 后端下 HTML/DOCX 按行边界分为多段，
+        其它格式整篇一段（页码均为None）
+        
+        逐段清理与整篇清理结果一致，因为清理是按行进行的，且空行会被丢弃。
+        配置了解析缓存时，文件内容与解析器版本未变则直接读取缓存的文本段。
+        
+        Args:
+            file_path: 文档路径
+        
+        Yields:
+            (页码, 清理后的文本)
+        """
+        file_path = Path(file_path)
+        file_ext = self._check_file(file_path)
+        if self.parse_cache is None:
+            yield from self._parse_segments(file_path, file_ext)
+            return
+        
+        stats = self.parse_cache_stats
+        load_started = time.perf_counter()
+        cached = self.parse_cache.get(file_path, file_ext, self.parser_version)
+        if cached is not None:
+            segments, parse_seconds = cached
+            saved = max(0.0, parse_seconds - (time.perf_counter() - load_started))
+            stats['hits'] += 1
+            stats['saved_seconds'] += saved
+            metrics.PARSE_CACHE_SAVED_SECONDS.inc(saved, format=file_ext)
+            yield from segments
+            return
+        
+        # 未命中：边解析边产出，只累计解析本身的耗时（不含下游处理各段的时间）
+        stats['misses'] += 1
+        stat_before = file_path.stat()
+        collected = []
+        parse_seconds = 0.0
+        t0 = time.perf_counter()
+        for segment in self._parse_segments(file_path, file_ext):
+            parse_seconds += time.perf_counter() - t0
+            collected.append(segment)
+            yield segment
+            t0 = time.perf_counter()
+        parse_seconds += time.perf_counter() - t0
+        stats['parse_seconds'] += parse_seconds
+        self.parse_cache.put(file_path, file_ext, self.parser_version, collected, parse_seconds, stat_before)
+    
+    def _parse_segments(self, file_path: Path, file_ext: str) -> Iterator[Tuple[Optional[int], str]]:
+        """实际解析文档并产出清理后的文本段"""
+        if file_ext == '.pdf':
+            pages = metrics.timed_iter(self.iter_pdf_pages(file_path), metrics.PARSE_SECONDS, format=file_ext)
+            for page_no, text in pages:
+                cleaned = self._clean_text(text)
+                if cleaned:
+                    yield page_no, cleaned
+        elif self.extraction_backend == 'lxml' and file_ext in STREAMING_FORMATS:
+            # 按行边界切成文本块逐块清理，下游边解析边分块
+            pieces = iter_docx_text(file_path) if file_ext == '.docx' else iter_html_text(file_path)
+            blocks = metrics.timed_iter(iter_text_blocks(pieces), metrics.PARSE_SECONDS, format=file_ext)
+            empty = True
+            for block in blocks:
+                cleaned = self._clean_text(block)
+                if cleaned:
+                    empty = False
+                    yield None, cleaned
+            if empty:
+                yield None, ''
+        else:
+            with metrics.timer(metrics.PARSE_SECONDS, format=file_ext):
+                content = self.supported_formats[file_ext](file_path)
+            yield None, self._clean_text(content)
     
     def _process_docx(self, file_path: Path) -> str:
-        """处理Word文档"""
+        """处理Word文档（段落与表格按文档顺序，两种后端的文本布局一致）"""
+        if self.extraction_backend == 'lxml':
+            return ''.join(iter_docx_text(file_path))
         doc = Document(file_path)
-        content = ""
-        for paragraph in doc.paragraphs:
-            content += paragraph.text + "\n"
-        return content
+        return ''.join(line + '\n' for line in self._docx_lines(doc.element.body, doc))
+    
+    def _docx_lines(self, container, parent) -> List[str]:
+        """
+        按文档顺序取出容器中的段落与表格行
+        
+        与 iter_docx_text 的布局相同：表格每行一行，单元格以制表符分隔，
+        单元格内的段落以空格连接，嵌套表格的行并入外层单元格。
+        """
+        lines = []
+        for child in container.iterchildren():
+            if child.tag == qn('w:p'):
+                lines.append(Paragraph(child, parent).text)
+            elif child.tag == qn('w:tbl'):
+                for row in child.iterchildren(qn('w:tr')):
+                    cells = [' '.join(text for text in self._docx_lines(cell, parent) if text)
+                             for cell in row.iterchildren(qn('w:tc'))]
+                    lines.append('\t'.join(cells))
+            else:
+                # 内容控件（w:sdt）等容器中的段落与表格
+                lines.extend(self._docx_lines(child, parent))
+        return lines
     
     def _process_html(self, file_path: Path) -> str:
         """处理HTML文件"""
+        if self.extraction_backend == 'lxml':
+            return ''.join(iter_html_text(file_path))
         with open(file_path, 'r', encoding='utf-8') as f:
             html_content = f.read()
         
@@ -202,6 +399,112 @@ class DocumentProcessor:
         
         return chunks
     
+    def iter_chunks(self, segments: Iterable[Tuple[Optional[int], str]], chunk_size: int = 500,
+                    overlap: int = 50, stats: Optional[Dict[str, int]] = None) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        对清理后的文本段流式分块
+        
+        分块结果与对整篇文本调用 _chunk_text 完全一致，但只在缓冲区中保留尚未
+        切出的尾部文本，因此耗时与文本长度线性相关，且可以边提取边分块。
+        
+        Args:
+            segments: (页码, 已清理文本) 的可迭代对象，段之间以换行连接
+            chunk_size: 每块大小
+            overlap: 重叠大小
+            stats: 可选的统计字典，会累加 word_count
+            
+        Yields:
+            (文本块, 文本块起始位置所在页码)
+        """
+        buffer = ""      # 尚未切出的文本
+        base = 0         # buffer[0] 在全文中的偏移
+        total = 0        # 目前已读入的全文长度
+        start = 0        # 下一块的起始偏移（全文坐标）
+        mark_offsets = []  # 各段在全文中的起始偏移
+        mark_pages = []    # 对应的页码
+        
+        # 分块自身耗时 = 总耗时 - 等待上游文本段的时间 - 消费方处理时间
+        started = time.perf_counter()
+        waited = 0.0
+        
+        def pull():
+            nonlocal waited
+            iterator = iter(segments)
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    waited += time.perf_counter() - t0
+                    return
+                waited += time.perf_counter() - t0
+                yield item
+        
+        def page_at(pos: int) -> Optional[int]:
+            i = bisect_right(mark_offsets, pos) - 1
+            return mark_pages[i] if i >= 0 else None
+        
+        def cut(end: int) -> Tuple[str, Optional[int]]:
+            raw = buffer[start - base:end - base]
+            lead = len(raw) - len(raw.lstrip())
+            return raw.strip(), page_at(start + lead)
+        
+        def find_end(limit: int) -> int:
+            end = start + chunk_size
+            if end < limit:
+                # 寻找最近的句号
+                for i in range(end, max(start + chunk_size // 2, end - 100), -1):
+                    if buffer[i - base] in '。！？\n':
+                        end = i + 1
+                        break
+            return end
+        
+        for page, text in pull():
+            if stats is not None:
+                stats['word_count'] = stats.get('word_count', 0) + len(text.split())
+            if total:
+                buffer += '\n'
+                total += 1
+            mark_offsets.append(total)
+            mark_pages.append(page)
+            buffer += text
+            total += len(text)
+            
+            # 只要确定后面还有文本，当前块的切分位置就与整篇分块时相同
+            while start + chunk_size < total:
+                end = find_end(total)
+                chunk, chunk_page = cut(end)
+                if chunk:
+                    t0 = time.perf_counter()
+                    yield chunk, chunk_page
+                    waited += time.perf_counter() - t0
+                start = end - overlap
+            
+            # 丢弃已切出的前缀，保持缓冲区有界
+            if start > base:
+                buffer = buffer[start - base:]
+                base = start
+                keep = max(0, bisect_right(mark_offsets, start) - 1)
+                del mark_offsets[:keep]
+                del mark_pages[:keep]
+        
+        if total <= chunk_size:
+            metrics.CHUNK_SECONDS.observe(time.perf_counter() - started - waited)
+            yield buffer, page_at(0)
+            return
+        
+        while start < total:
+            end = find_end(total)
+            chunk, chunk_page = cut(end)
+            if chunk:
+                t0 = time.perf_counter()
+                yield chunk, chunk_page
+                waited += time.perf_counter() - t0
+            start = end - overlap
+            if start >= total:
+                break
+        metrics.CHUNK_SECONDS.observe(time.perf_counter() - started - waited)
+    
     def process_directory(self, directory_path: str) -> List[Dict[str, Any]]:
         """
         处理目录中的所有文档
@@ -212,19 +515,32 @@ class DocumentProcessor:
         Returns:
             文档信息列表
         """
+        documents = []
+        
+        for file_path in self.iter_directory_files(directory_path):
+            try:
+                doc_info = self.process_document(str(file_path))
+                documents.append(doc_info)
+                print(f"✅ 处理完成: {file_path.name}")
+            except Exception as e:
+                print(f"❌ 处理失败: {file_path.name} - {str(e)}")
+        
+        return documents
+    
+    def iter_directory_files(self, directory_path: str) -> Iterator[Path]:
+        """
+        惰性遍历目录中所有受支持格式的文件
+        
+        Args:
+            directory_path: 目录路径
+            
+        Yields:
+            文件路径
+        """
         directory = Path(directory_path)
         if not directory.exists():
             raise FileNotFoundError(f"目录不存在: {directory_path}")
         
-        documents = []
-        
         for file_path in directory.rglob('*'):
             if file_path.is_file() and file_path.suffix.lower() in self.supported_formats:
-                try:
-                    doc_info = self.process_document(str(file_path))
-                    documents.append(doc_info)
-                    print(f"✅ 处理完成: {file_path.name}")
-                except Exception as e:
-                    print(f"❌ 处理失败: {file_path.name} - {str(e)}")
-        
-        return documents
+                yield file_path
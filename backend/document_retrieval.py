@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档级检索
+按文本块检索时，一篇很长的文档可能占满全部 top_k 名额。文档级检索先多取若干倍的文本块候选，
+按所属文档分组并聚合得分（最高分 / 总分 / 前 n 个的平均分），返回得分最高的文档及其最佳段落，
+段落再按文档记录的 chunk_start/chunk_end 带上相邻的文本块，不需要再次检索。
+分组用 NumPy 排序后按段归约完成，候选数很多时也不逐条循环
+"""
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# 文档得分的聚合方式：max 最高分，sum 总分（偏向命中多的长文档），mean 前 top_n 个得分的平均
+AGGREGATIONS = ('max', 'sum', 'mean')
+
+# 未指定候选数时，文本块候选为 top_k 的倍数
+DOCUMENT_OVERFETCH = 20
+
+
+def group_by_document(keys: np.ndarray, scores: np.ndarray, aggregate: str = 'max',
+                      top_n: int = 3) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    按文档分组聚合文本块得分
+    
+    Args:
+        keys: 每个命中所属文档的整数键
+        scores: 每个命中的相似度
+        aggregate: 聚合方式（见 AGGREGATIONS）
+        top_n: mean 聚合时参与平均的最高得分个数（命中不足 top_n 个时按实际个数平均）
+    
+    Returns:
+        (order, starts, counts, group_scores)：命中按 (文档, 得分降序) 排列的下标，
+        各文档在 order 中的起始位置与命中数，以及各文档的聚合得分
+    """
+    if aggregate not in AGGREGATIONS:
+        raise ValueError(f"不支持的聚合方式: {aggregate}")
+    keys = np.asarray(keys, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(keys):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, np.empty(0, dtype=np.float32)
+    
+    order = np.lexsort((-scores, keys))
+    sorted_keys, sorted_scores = keys[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    
+    if aggregate == 'max':
+        group_scores = sorted_scores[starts]
+    elif aggregate == 'sum':
+        group_scores = np.add.reduceat(sorted_scores, starts)
+    else:
+        top_n = max(1, int(top_n))
+        ranks = np.arange(len(keys)) - np.repeat(starts, counts)
+        top = ranks < top_n
+        groups = np.repeat(np.arange(len(starts)), counts)
+        group_scores = np.bincount(groups[top], weights=sorted_scores[top], minlength=len(starts)) \
+            / np.minimum(counts, top_n)
+    return order, starts, counts, group_scores.astype(np.float32)
+
+
+def rank_documents(hits: Sequence[Tuple[int, Any, np.ndarray, np.ndarray, int]], top_k: int = 5,
+                   aggregate: str = 'max', top_n: int = 3, passages: int = 3,
+                   neighbors: int = 1) -> List[Dict[str, Any]]:
+    """
+    把各分片的文本块命中聚合为文档级结果
+    
+    Args:
+        hits: [(分片编号, 分片, 相似度, 文本块下标, 文本块编号版本)]，分片为 VectorKnowledgeBase
+        top_k: 返回的文档数上限
+        aggregate: 聚合方式（见 AGGREGATIONS）
+        top_n: mean 聚合时参与平均的得分个数
+        passages: 每篇文档返回的最佳段落数
+        neighbors: 每个段落前后各带上的相邻文本块数
+    
+    Returns:
+        按聚合得分降序的文档结果
+    
+    Raises:
+        StaleSearchError: 检索之后某个分片被压缩，调用方应重新检索
+    """
+    if aggregate not in AGGREGATIONS:
+        raise ValueError(f"不支持的聚合方式: {aggregate}")
+    by_no = {shard_no: (shard, epoch) for shard_no, shard, _, _, epoch in hits}
+    shard_nos, owners, scores, indices = [], [], [], []
+    for shard_no, shard, shard_scores, shard_indices, epoch in hits:
+        if not len(shard_indices):
+            continue
+        shard_nos.append(np.full(len(shard_indices), shard_no, dtype=np.int64))
+        owners.append(shard.chunk_owners(shard_indices, epoch))
+        scores.append(np.asarray(shard_scores, dtype=np.float32))
+        indices.append(np.asarray(shard_indices, dtype=np.int64))
+    if not scores:
+        return []
+    shard_nos, owners = np.concatenate(shard_nos), np.concatenate(owners)
+    scores, indices = np.concatenate(scores), np.concatenate(indices)
+    
+    # 文档ID只在分片内唯一，分组键为 (分片编号, 文档ID)
+    order, starts, counts, group_scores = group_by_document((shard_nos << 32) | owners, scores, aggregate, top_n)
+    top = np.argsort(-group_scores, kind='stable')[:max(0, int(top_k))]
+    
+    results = []
+    for group in top:
+        rows = order[starts[group]:starts[group] + min(counts[group], max(1, int(passages)))]
+        shard_no = int(shard_nos[rows[0]])
+        shard, epoch = by_no[shard_no]
+        result = shard.materialize_document(int(owners[rows[0]]), scores[rows].tolist(), indices[rows].tolist(),
+                                            neighbors, epoch)
+        result['score'] = float(group_scores[group])
+        result['hits'] = int(counts[group])
+        result['shard'] = shard_no
+        results.append(result)
+    return results
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+影子索引重建
+在后台线程中用已保存的文本块（或源文件）构建新一代索引，期间旧一代照常提供检索；
+新一代写入磁盘后原子地切换 CURRENT 指针，再回收旧一代的文件。
+重建时可以同时更换向量模型、FAISS 索引类型与分片数
+"""
+
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from exact_vectors import ExactVectorStore
+from vector_knowledge_base import VectorKnowledgeBase, load_embedding_model, new_index, is_compressed
+import metrics
+
+
+# 重建的数据来源：已保存的文本块 / 重新解析源文件（源文件不存在时退回文本块）
+REBUILD_SOURCES = ('chunks', 'files')
+
+# 每一代目录中记录模型、索引类型与分片数的清单文件
+MANIFEST_FILE = 'generation.json'
+
+
+def convert_index(shard: VectorKnowledgeBase, index_type: str) -> Optional[str]:
+    """
+    把分片的精确索引转换为目标类型，需要训练时用该分片的全部向量训练一次
+    
+    Args:
+        shard: 索引为精确索引（IndexFlatIP）的分片
+        index_type: 目标 faiss.index_factory 描述串
+    
+    Returns:
+        无法训练而保留精确索引时的警告信息，否则为None
+    """
+    shard.index_type = index_type
+    if index_type == 'Flat':
+        return None
+    vectors = shard.index.reconstruct_n(0, shard.index.ntotal) if shard.index.ntotal \
+        else np.empty((0, shard.dimension), dtype='float32')
+    index = new_index(shard.dimension, index_type)
+    if not index.is_trained:
+        try:
+            index.train(vectors)
+        except RuntimeError as e:
+            # 向量太少（如少于IVF聚类数）时该分片保留精确索引
+            return f"{shard.storage_dir}: 无法训练 {index_type}，保留精确索引 ({e})"
+    index.add(vectors)
+    shard.index = index
+    # 量化索引另存原始向量，检索时精确重排
+    shard.exact_vectors = ExactVectorStore.from_array(vectors) if is_compressed(index) else None
+    return None
+
+
+class IndexRebuild:
+    """
+    一次影子重建任务
+    
+    由 ShardedKnowledgeBase.start_rebuild 创建并启动；任务期间知识库拒绝写入，
+    保证新一代包含切换时刻的全部文档。
+    """
+    
+    def __init__(self, kb, generation: int, target_dir: Path, model_name: str, index_type: str,
+                 num_shards: int, source: str = 'chunks', batch_size: int = 256):
+        """
+        初始化重建任务
+        
+        Args:
+            kb: ShardedKnowledgeBase 实例
+            generation: 新一代的编号
+            target_dir: 新一代的存储目录
+            model_name: 新一代使用的向量模型
+            index_type: 新一代使用的 faiss.index_factory 索引描述串
+            num_shards: 新一代每个集合的分片数
+            source: 数据来源（chunks/files）
+            batch_size: 复制或重新编码文本块的批大小
+        """
+        self.kb = kb
+        self.generation = generation
+        self.target_dir = Path(target_dir)
+        self.model_name = model_name
+        self.index_type = index_type
+        self.num_shards = max(1, int(num_shards))
+        self.source = source
+        self.batch_size = max(1, int(batch_size))
+        
+        self.status = 'pending'
+        self.phase = None
+        self.error = None
+        self.warnings = []
+        self.errors = []
+        self.total_documents = 0
+        self.total_chunks = 0
+        self.done_documents = 0
+        self.done_chunks = 0
+        self.reused_vectors = 0
+        self.encoded_chunks = 0
+        self.reparsed_documents = 0
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self._finished = None
+        self._thread = None
+    
+    def start(self):
+        """在后台线程中执行重建"""
+        self.status = 'running'
+        self._thread = threading.Thread(target=self._run, name='kb-rebuild', daemon=True)
+        self._thread.start()
+    
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """等待重建结束，返回是否已结束"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.status in ('completed', 'failed')
+    
+    def _run(self):
+        try:
+            self._build()
+            self.status = 'completed'
+            print(f"✅ 影子重建完成: 第 {self.generation} 代, {self.done_documents} 文档, "
+                  f"{self.done_chunks} 块, 耗时 {time.monotonic() - self._started:.1f}s")
+        except Exception as e:
+            self.status = 'failed'
+            self.error = str(e)
+            print(f"❌ 影子重建失败: {e}")
+            shutil.rmtree(self.target_dir, ignore_errors=True)
+        finally:
+            self._finished = time.monotonic()
+            self.phase = None
+            self.kb._rebuild_finished(self)
+    
+    def _build(self):
+        snapshot = self.kb._rebuild_snapshot()
+        # 已删除的文档不复制到新一代（重建同时完成压缩）
+        shard_stats = [shard.get_stats() for shards in snapshot.values() for shard in shards]
+        self.total_documents = sum(s['total_documents'] for s in shard_stats)
+        self.total_chunks = sum(s['total_vectors'] + s['duplicate_chunks'] for s in shard_stats)
+        print(f"🔄 影子重建开始: 第 {self.generation} 代, {self.total_documents} 文档, {self.total_chunks} 块, "
+              f"模型 {self.model_name}, 索引 {self.index_type}, {self.num_shards} 分片")
+        
+        self.phase = 'loading_model'
+        reuse_vectors = self.model_name == self.kb.model_name
+        model = self.kb.model if reuse_vectors else load_embedding_model(self.model_name)
+        dimension = model.get_sentence_embedding_dimension()
+        new_index(dimension, self.index_type)  # 索引描述串无效时尽早失败
+        
+        self.phase = 'building'
+        collections = {}
+        for name, old_shards in snapshot.items():
+            root = self.kb._collection_root(name, self.target_dir)
+            # 写入期间统一使用精确索引，全部向量就绪后再按目标类型训练并转换
+            new_shards = [
+                VectorKnowledgeBase(self.model_name, str(d), embed_batch_size=self.kb.embed_batch_size,
+                                    model=model, parse_cache=self.kb.parse_cache,
+                                    rescore_factor=self.kb.rescore_factor, dedup_distance=self.kb.dedup_distance,
+                                    pdf_workers=self.kb.pdf_workers)
+                for d in self.kb._shard_dirs(root, self.num_shards)
+            ]
+            for old in old_shards:
+                self._copy_shard(old, new_shards, reuse_vectors)
+            collections[name] = new_shards
+        
+        self.phase = 'training'
+        for shards in collections.values():
+            for shard in shards:
+                warning = convert_index(shard, self.index_type)
+                if warning:
+                    self.warnings.append(warning)
+        
+        self.phase = 'saving'
+        for shards in collections.values():
+            for shard in shards:
+                shard.save_knowledge_base()
+        with open(self.target_dir / MANIFEST_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generation': self.generation,
+                'model_name': self.model_name,
+                'index_type': self.index_type,
+                'num_shards': self.num_shards,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'total_documents': self.done_documents,
+                'total_chunks': self.done_chunks
+            }, f, ensure_ascii=False, indent=2)
+        
+        self.phase = 'swapping'
+        self.kb._swap_generation(self, collections, model)
+    
+    def _copy_shard(self, old: VectorKnowledgeBase, new_shards: List[VectorKnowledgeBase], reuse_vectors: bool):
+        """把一个旧分片的文档按新的分片数重新路由并写入新一代"""
+        with old._lock:
+            documents = [dict(doc) for doc in old.documents]
+            doc_ids = old.chunks.doc_ids.copy()
+        # 按文档分组文本块下标（旧版本的文档记录中没有 chunk_start/chunk_end）
+        order = np.argsort(doc_ids, kind='stable')
+        bounds = np.searchsorted(doc_ids[order], np.arange(len(documents) + 1))
+        
+        for doc_id, doc in enumerate(documents):
+            if doc.get('deleted'):
+                continue
+            # 别名指向的规范块按原顺序复制，新一代中按目标分片重新去重
+            ids, pages = old.document_chunk_ids(doc, order[bounds[doc_id]:bounds[doc_id + 1]])
+            target = new_shards[self.kb.route_index(doc['file_path'], len(new_shards))]
+            if self.source == 'files' and Path(doc['file_path']).exists():
+                try:
+                    target.add_document(doc['file_path'])
+                    self.reparsed_documents += 1
+                    self._advance(len(ids))
+                    continue
+                except Exception as e:
+                    # 解析失败时 add_document 不会写入任何记录，改用已保存的文本块
+                    self.errors.append({'file_path': doc['file_path'], 'error': str(e)})
+            self._copy_document(old, doc, ids, pages, target, reuse_vectors)
+    
+    def _copy_document(self, old: VectorKnowledgeBase, doc: Dict[str, Any], ids: np.ndarray,
+                       pages: List[Optional[int]], target: VectorKnowledgeBase, reuse_vectors: bool):
+        new_doc = target.start_document(doc['file_path'], doc.get('file_size', 0), doc.get('file_mtime'))
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            with old._lock:
+                texts = [old.chunks.text(i) for i in batch]
+                vectors = old.reconstruct_vectors(batch) if reuse_vectors else None
+            if vectors is None:
+                vectors = target._encode(texts, 'ingest')
+                self.encoded_chunks += len(texts)
+            else:
+                self.reused_vectors += len(texts)
+            target.append_chunks(new_doc, texts, pages[start:start + self.batch_size], vectors)
+            self._advance(len(texts), documents=0)
+        target.finish_document(new_doc, doc.get('word_count', 0))
+        self.done_documents += 1
+    
+    def _advance(self, chunks: int, documents: int = 1):
+        self.done_chunks += chunks
+        self.done_documents += documents
+        if self.total_chunks:
+            metrics.REBUILD_PROGRESS.set(self.done_chunks / self.total_chunks)
+    
+    def get_progress(self) -> Dict[str, Any]:
+        """重建进度与吞吐"""
+        elapsed = (self._finished or time.monotonic()) - self._started
+        rate = self.done_chunks / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_chunks - self.done_chunks
+        return {
+            'status': self.status,
+            'phase': self.phase,
+            'generation': self.generation,
+            'model_name': self.model_name,
+            'index_type': self.index_type,
+            'num_shards': self.num_shards,
+            'source': self.source,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'elapsed_seconds': round(elapsed, 2),
+            'total_documents': self.total_documents,
+            'done_documents': self.done_documents,
+            'total_chunks': self.total_chunks,
+            'done_chunks': self.done_chunks,
+            'progress': round(self.done_chunks / self.total_chunks, 4) if self.total_chunks else
+                        (1.0 if self.status == 'completed' else 0.0),
+            'chunks_per_second': round(rate, 1),
+            'eta_seconds': round(remaining / rate, 1) if self.status == 'running' and rate > 0 else None,
+            'reused_vectors': self.reused_vectors,
+            'encoded_chunks': self.encoded_chunks,
+            'reparsed_documents': self.reparsed_documents,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            'error': self.error
+        }
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式导入流水线
+解析 → 分块 → 批量向量化 → 写入索引，各阶段之间通过有界队列和在途字节预算相连
+"""
+
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Iterable, Optional
+
+from document_processor import DocumentProcessor
+import metrics
+
+
+# 队列结束标记
+_DONE = object()
+
+
+class InFlightBudget:
+    """
+    在途字节预算
+    
+    上游阶段放入数据前申请字节数，下游阶段处理完成后归还；预算用尽时上游阻塞，
+    从而形成反压。单个条目超过总预算时，只要当前没有其它在途数据也允许通过，避免死锁。
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(1, int(max_bytes))
+        self.in_flight = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+    
+    def acquire(self, nbytes: int) -> float:
+        """申请字节，返回因反压而阻塞的秒数"""
+        waited = 0.0
+        with self._cond:
+            if self.in_flight + nbytes > self.max_bytes and self.in_flight > 0:
+                start = time.perf_counter()
+                while self.in_flight + nbytes > self.max_bytes and self.in_flight > 0:
+                    self._cond.wait()
+                waited = time.perf_counter() - start
+            self.in_flight += nbytes
+            self.peak = max(self.peak, self.in_flight)
+        return waited
+    
+    def release(self, nbytes: int):
+        """归还字节"""
+        with self._cond:
+            self.in_flight -= nbytes
+            self._cond.notify_all()
+    
+    def close(self):
+        """取消预算限制并唤醒所有等待者（流水线异常退出时使用）"""
+        with self._cond:
+            self.max_bytes = float('inf')
+            self._cond.notify_all()
+
+
+class StageStats:
+    """单个阶段的吞吐统计"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        busy = self.busy_seconds
+        return {
+            'items': self.items,
+            'bytes': self.bytes,
+            'busy_seconds': round(busy, 4),
+            'blocked_seconds': round(self.blocked_seconds, 4),
+            'items_per_second': round(self.items / busy, 2) if busy > 0 else 0.0,
+            'mb_per_second': round(self.bytes / busy / 1e6, 3) if busy > 0 else 0.0
+        }
+
+
+class IngestPipeline:
+    """
+    有界内存的流式导入流水线
+    
+    四个阶段各占一个线程：
+      parse  - 逐个文件提取并清理文本段（PDF按页）
+      chunk  - 对文本段流式分块
+      embed  - 跨文档攒批后调用模型编码
+      index  - 按顺序写入知识库
+    解析阶段与分块阶段各使用一半的在途字节预算，任意时刻驻留内存的文本与向量都不超过
+    max_inflight_bytes（单个超大条目除外），与目录总大小无关。
+    """
+    
+    def __init__(self, kb, processor: Optional[DocumentProcessor] = None,
+                 max_inflight_bytes: int = 64 * 1024 * 1024, queue_size: int = 256,
+                 embed_batch_size: Optional[int] = None, flush_interval: float = 0.05):
+        """
+        初始化流水线
+        
+        Args:
+            kb: 目标向量知识库（需提供 start_document/encode_chunks/append_chunks/finish_document）
+            processor: 文档处理器
+            max_inflight_bytes: 各阶段之间在途数据的字节上限
+            queue_size: 阶段间队列的最大条目数
+            embed_batch_size: 每批编码的文本块数量（默认沿用知识库配置）
+            flush_interval: 上游暂时无数据时，向量化阶段提交未满批次前的等待秒数
+        """
+        self.kb = kb
+        self.processor = processor or DocumentProcessor()
+        self.max_inflight_bytes = max_inflight_bytes
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size or getattr(kb, 'embed_batch_size', 64)
+        self.flush_interval = flush_interval
+        self.stages = {name: StageStats(name) for name in ('parse', 'chunk', 'embed', 'index')}
+        self._vector_bytes = int(getattr(kb, 'dimension', 0)) * 4
+    
+    def run_directory(self, directory_path: str) -> Dict[str, Any]:
+        """导入目录中的所有受支持文档"""
+        return self.run(self.processor.iter_directory_files(directory_path))
+    
+    def run(self, file_paths: Iterable) -> Dict[str, Any]:
+        """
+        导入一组文件
+        
+        Args:
+            file_paths: 文件路径的可迭代对象（可以是惰性生成器）
+        
+        Returns:
+            导入摘要：documents、errors、各阶段吞吐统计、在途字节峰值，
+            启用解析缓存时另含 parse_cache（命中数与节省的解析时间）
+        """
+        self._parse_budget = InFlightBudget(self.max_inflight_bytes // 2)
+        self._chunk_budget = InFlightBudget(self.max_inflight_bytes - self.max_inflight_bytes // 2)
+        self._parse_queue = queue.Queue(maxsize=self.queue_size)
+        self._chunk_queue = queue.Queue(maxsize=self.queue_size)
+        self._embed_queue = queue.Queue(maxsize=max(1, self.queue_size // self.embed_batch_size) + 1)
+        self._documents = []
+        self._errors = []
+        self._failure = None
+        
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._guard, args=(self._parse_stage, file_paths), name='ingest-parse', daemon=True),
+            threading.Thread(target=self._guard, args=(self._chunk_stage,), name='ingest-chunk', daemon=True),
+            threading.Thread(target=self._guard, args=(self._embed_stage,), name='ingest-embed', daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        # 写入阶段在调用线程中执行，保证对知识库的修改都发生在同一线程
+        self._guard(self._index_stage)
+        for thread in threads:
+            while thread.is_alive():
+                if self._failure is not None:
+                    self._drain()
+                thread.join(0.1)
+        
+        if self._failure is not None:
+            raise self._failure
+        
+        summary = {
+            'documents': self._documents,
+            'errors': self._errors,
+            'document_count': len(self._documents),
+            'chunk_count': sum(doc['chunk_count'] for doc in self._documents),
+            'elapsed_seconds': round(time.perf_counter() - started, 4),
+            'max_inflight_bytes': self.max_inflight_bytes,
+            'peak_inflight_bytes': self._parse_budget.peak + self._chunk_budget.peak,
+            'stages': {name: stats.to_dict() for name, stats in self.stages.items()}
+        }
+        if self.processor.parse_cache is not None:
+            cache = self.processor.parse_cache_stats
+            summary['parse_cache'] = {
+                'hits': cache['hits'],
+                'misses': cache['misses'],
+                'parse_seconds': round(cache['parse_seconds'], 4),
+                'saved_seconds': round(cache['saved_seconds'], 4)
+            }
+        return summary
+    
+    def _guard(self, stage, *args):
+        """执行阶段函数；出现未预期异常时记录并解除所有阻塞，避免整条流水线挂起"""
+        try:
+            stage(*args)
+        except Exception as e:
+            self._failure = e
+            self._parse_budget.close()
+            self._chunk_budget.close()
+            self._drain()
+    
+    def _drain(self):
+        """异常退出时清空队列并放入结束标记，使各阶段尽快结束"""
+        for q in (self._parse_queue, self._chunk_queue, self._embed_queue):
+            try:
+                while True:
+                    q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(_DONE)
+            except queue.Full:
+                pass
+    
+    def _put(self, q: queue.Queue, item, stats: StageStats):
+        start = time.perf_counter()
+        q.put(item)
+        stats.blocked_seconds += time.perf_counter() - start
+    
+    def _parse_stage(self, file_paths: Iterable):
+        stats = self.stages['parse']
+        for file_path in file_paths:
+            if self._failure is not None:
+                break
+            path = Path(file_path)
+            started = False
+            error = None
+            t0 = time.perf_counter()
+            try:
+                # 解析前记录文件状态，解析期间被修改的文件会在下一次目录同步时重新导入
+                stat = path.stat()
+                segments = self.processor.iter_segments(path)
+                for page, text in segments:
+                    nbytes = len(text.encode('utf-8'))
+                    stats.busy_seconds += time.perf_counter() - t0
+                    stats.blocked_seconds += self._parse_budget.acquire(nbytes)
+                    if not started:
+                        self._put(self._parse_queue, ('start', {
+                            'file_path': str(path),
+                            'file_name': path.name,
+                            'file_size': stat.st_size,
+                            'file_mtime': stat.st_mtime
+                        }), stats)
+                        started = True
+                    self._put(self._parse_queue, ('segment', page, text, nbytes), stats)
+                    stats.items += 1
+                    stats.bytes += nbytes
+                    t0 = time.perf_counter()
+                stats.busy_seconds += time.perf_counter() - t0
+            except Exception as e:
+                stats.busy_seconds += time.perf_counter() - t0
+                error = f"{path.name}: {str(e)}"
+                print(f"❌ 处理失败: {path.name} - {str(e)}")
+            
+            if error and not started:
+                self._errors.append(error)
+                metrics.DOCUMENTS_INGESTED.inc(status='error')
+                continue
+            if not started:
+                # 没有任何文本的文档也照常入库（与 add_document 行为一致）
+                self._put(self._parse_queue, ('start', {
+                    'file_path': str(path),
+                    'file_name': path.name,
+                    'file_size': stat.st_size,
+                    'file_mtime': stat.st_mtime
+                }), stats)
+            self._put(self._parse_queue, ('end', error), stats)
+        self._parse_queue.put(_DONE)
+    
+    def _iter_document_segments(self, state: Dict[str, Any]):
+        """从解析队列中读出一个文档的文本段，直到遇到 'end' 消息"""
+        stats = self.stages['chunk']
+        while True:
+            start = time.perf_counter()
+            msg = self._parse_queue.get()
+            stats.blocked_seconds += time.perf_counter() - start
+            if msg is _DONE:
+                state['done'] = True
+                return
+            if msg[0] == 'end':
+                state['error'] = msg[1]
+                return
+            _, page, text, nbytes = msg
+            yield page, text
+            # 文本已被分块器复制进缓冲区，归还解析阶段的预算
+            self._parse_budget.release(nbytes)
+    
+    def _chunk_stage(self):
+        stats = self.stages['chunk']
+        while True:
+            msg = self._parse_queue.get()
+            if msg is _DONE:
+                break
+            # 非 'start' 消息只会在上游异常时出现，直接丢弃
+            if msg[0] != 'start':
+                continue
+            self._put(self._chunk_queue, msg, stats)
+            state = {}
+            counts = {'word_count': 0}
+            t0 = time.perf_counter()
+            for chunk, page in self.processor.iter_chunks(self._iter_document_segments(state), stats=counts):
+                nbytes = len(chunk.encode('utf-8')) + self._vector_bytes
+                stats.busy_seconds += time.perf_counter() - t0
+                stats.blocked_seconds += self._chunk_budget.acquire(nbytes)
+                self._put(self._chunk_queue, ('chunk', chunk, page, nbytes), stats)
+                stats.items += 1
+                stats.bytes += nbytes
+                t0 = time.perf_counter()
+            stats.busy_seconds += time.perf_counter() - t0
+            if state.get('done'):
+                break
+            self._put(self._chunk_queue, ('end', counts['word_count'], state.get('error')), stats)
+        self._chunk_queue.put(_DONE)
+    
+    def _embed_stage(self):
+        stats = self.stages['embed']
+        pending = []
+        pending_chunks = 0
+        pending_bytes = 0
+        # 攒批数据占到分块预算一半时立即提交，否则上游会因预算耗尽而空等
+        flush_bytes = self._chunk_budget.max_bytes // 2
+        done = False
+        while not done:
+            try:
+                timeout = self.flush_interval if pending_chunks else None
+                start = time.perf_counter()
+                msg = self._chunk_queue.get(timeout=timeout)
+                stats.blocked_seconds += time.perf_counter() - start
+            except queue.Empty:
+                msg = None
+            
+            if msg is _DONE:
+                done = True
+            elif msg is not None:
+                pending.append(msg)
+                if msg[0] == 'chunk':
+                    pending_chunks += 1
+                    pending_bytes += msg[3]
+                if pending_chunks < self.embed_batch_size and pending_bytes < flush_bytes:
+                    continue
+            
+            if not pending:
+                continue
+            texts = [m[1] for m in pending if m[0] == 'chunk']
+            t0 = time.perf_counter()
+            # 由知识库编码（记录编码指标；开启去重时近重复文本块复用已有向量）
+            embeddings = self.kb.encode_chunks(texts) if texts else None
+            stats.busy_seconds += time.perf_counter() - t0
+            stats.items += len(texts)
+            stats.bytes += sum(m[3] for m in pending if m[0] == 'chunk')
+            self._put(self._embed_queue, (pending, embeddings), stats)
+            pending = []
+            pending_chunks = 0
+            pending_bytes = 0
+        self._embed_queue.put(_DONE)
+    
+    def _index_stage(self):
+        stats = self.stages['index']
+        doc = None
+        while True:
+            start = time.perf_counter()
+            msg = self._embed_queue.get()
+            stats.blocked_seconds += time.perf_counter() - start
+            if msg is _DONE:
+                break
+            batch, embeddings = msg
+            t0 = time.perf_counter()
+            row = 0
+            i = 0
+            while i < len(batch):
+                kind = batch[i][0]
+                if kind == 'start':
+                    meta = batch[i][1]
+                    doc = self.kb.start_document(meta['file_path'], meta['file_size'], meta.get('file_mtime'))
+                    i += 1
+                elif kind == 'end':
+                    _, word_count, error = batch[i]
+                    self.kb.finish_document(doc, word_count)
+                    self._documents.append(doc)
+                    if error:
+                        self._errors.append(error)
+                    print(f"✅ 文档已添加: {doc['file_name']} ({doc['chunk_count']} 块)")
+                    doc = None
+                    i += 1
+                else:
+                    # 同一文档中连续的文本块一次性写入
+                    j = i
+                    while j < len(batch) and batch[j][0] == 'chunk':
+                        j += 1
+                    group = batch[i:j]
+                    self.kb.append_chunks(doc, [m[1] for m in group], [m[2] for m in group],
+                                          embeddings[row:row + len(group)])
+                    row += len(group)
+                    nbytes = sum(m[3] for m in group)
+                    self._chunk_budget.release(nbytes)
+                    stats.items += len(group)
+                    stats.bytes += nbytes
+                    i = j
+            stats.busy_seconds += time.perf_counter() - t0
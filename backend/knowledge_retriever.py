@@ -7,15 +7,45 @@
 
 import requests
 import json
+import re
 import time
-from typing import List, Dict, Any
-from vector_knowledge_base import VectorKnowledgeBase
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from sharded_knowledge_base import ShardedKnowledgeBase
+from llm_scheduler import LLMScheduler, SchedulerRejectedError
+from ollama_pool import OllamaPool
+from conversation_sessions import ConversationSession, SessionStore
+from semantic_cache import SemanticCache
+import metrics
+import tracing
+
+
+# 句子切分：中文句末标点之后、英文句末标点后的空白处、换行处
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[。！？；!?;])|(?<=[.])\s+|\n+')
+
+ANSWER_MODES = ('auto', 'llm', 'extractive')
+
+
+class LLMUnavailableError(Exception):
+    """Ollama不可用（连接失败、超时、模型未安装或多次重试失败），消息为面向用户的说明"""
+
+
+def split_sentences(text: str, min_chars: int = 4) -> List[str]:
+    """把文本块切分为句子，丢弃过短的片段"""
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s and len(s.strip()) >= min_chars]
 
 
 class KnowledgeRetriever:
     """知识检索器类"""
     
-    def __init__(self, knowledge_base: VectorKnowledgeBase, ollama_url: str = "http://localhost:11434", ollama_model: str = "gemma2:2b"):
+    def __init__(self, knowledge_base: ShardedKnowledgeBase, ollama_url: str = "http://localhost:11434", ollama_model: str = "gemma2:2b",
+                 min_similarity: Optional[float] = None, relative_cutoff: Optional[float] = None,
+                 max_gap: Optional[float] = None, extractive_confidence: Optional[float] = None,
+                 extractive_fallback: bool = True, llm_retry_after: float = 30.0,
+                 scheduler: Optional[LLMScheduler] = None, pool: Optional[OllamaPool] = None,
+                 sessions: Optional[SessionStore] = None, semantic_cache: Optional[SemanticCache] = None):
         """
         初始化知识检索器
         
@@ -23,67 +53,415 @@ class KnowledgeRetriever:
             knowledge_base: 向量知识库实例
             ollama_url: Ollama服务地址
             ollama_model: Ollama模型名称
+            min_similarity: 默认最低相似度，低于该值的检索结果不进入提示词
+            relative_cutoff: 默认相对最高分的保留比例
+            max_gap: 默认相邻结果相似度的最大落差
+            extractive_confidence: 置信度不低于该值时直接返回抽取式答案（None为不启用）
+            extractive_fallback: Ollama不可用时是否退回抽取式答案
+            llm_retry_after: Ollama调用失败后，这段时间（秒）内直接使用抽取式答案
+            scheduler: LLM调用调度器（为None时不限制并发）
+            pool: Ollama节点池（为None时只使用 ollama_url / ollama_model 一个节点）
+            sessions: 多轮问答会话存储（为None时使用默认上限）
+            semantic_cache: 问题语义缓存（为None时不缓存答案）
         """
         self.kb = knowledge_base
-        self.ollama_url = ollama_url
-        self.ollama_model = ollama_model
+        self.pool = pool or OllamaPool([(ollama_url, ollama_model)])
+        self.ollama_url = self.pool.primary.url
+        self.ollama_model = self.pool.primary.model
+        self.min_similarity = min_similarity
+        self.relative_cutoff = relative_cutoff
+        self.max_gap = max_gap
+        self.extractive_confidence = extractive_confidence
+        self.extractive_fallback = extractive_fallback
+        self.llm_retry_after = llm_retry_after
+        self._llm_down_until = 0.0
+        self.scheduler = scheduler
+        self.sessions = sessions or SessionStore()
+        self.semantic_cache = semantic_cache
+        if semantic_cache is not None:
+            # 来源文档重新导入或集合被清空时，引用它们的缓存答案失效
+            knowledge_base.add_change_listener(semantic_cache.invalidate)
     
-    def search(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 10, collection: Optional[str] = None,
+               min_similarity: Optional[float] = None, relative_cutoff: Optional[float] = None,
+               max_gap: Optional[float] = None, query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         搜索相关文档
         
         Args:
             query: 查询文本
-            top_k: 返回结果数量
-            
+            top_k: 返回结果数量上限
+            collection: 集合名称（默认集合为None）
+            min_similarity: 最低相似度（为None时使用默认值）
+            relative_cutoff: 相对最高分的保留比例（为None时使用默认值）
+            max_gap: 相邻结果相似度的最大落差（为None时使用默认值）
+            query_embedding: 已编码的查询向量（为None时编码 query）
+        
         Returns:
             搜索结果列表
         """
-        return self.kb.search(query, top_k)
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        relative_cutoff = self.relative_cutoff if relative_cutoff is None else relative_cutoff
+        max_gap = self.max_gap if max_gap is None else max_gap
+        if query_embedding is not None:
+            with metrics.timer(metrics.KB_SEARCH_SECONDS):
+                return self.kb.search_vectors(query_embedding, top_k, collection, min_similarity,
+                                              relative_cutoff, max_gap)
+        return self.kb.search(query, top_k, collection=collection, min_similarity=min_similarity,
+                              relative_cutoff=relative_cutoff, max_gap=max_gap)
+    
+    def search_documents(self, query: str, top_k: int = 5, collection: Optional[str] = None,
+                         min_similarity: Optional[float] = None, **options) -> List[Dict[str, Any]]:
+        """
+        文档级检索（按文档聚合文本块得分，见 ShardedKnowledgeBase.search_documents）
+        
+        Args:
+            query: 查询文本
+            top_k: 返回的文档数上限
+            collection: 集合名称（默认集合为None）
+            min_similarity: 文本块的最低相似度（为None时使用默认值）
+            **options: aggregate、top_n、passages、neighbors、candidates
+        
+        Returns:
+            文档结果列表
+        """
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        return self.kb.search_documents(query, top_k, collection, min_similarity=min_similarity, **options)
     
-    def ask_question(self, question: str, top_k: int = 5) -> Dict[str, Any]:
+    def ask_question(self, question: str, top_k: int = 5, collection: Optional[str] = None,
+                     min_similarity: Optional[float] = None, mode: str = 'auto',
+                     priority: int = 0, timeout: Optional[float] = None, use_cache: bool = True,
+                     relative_cutoff: Optional[float] = None, max_gap: Optional[float] = None) -> Dict[str, Any]:
         """
         基于知识库进行问答
         
+        没有检索结果达到相似度阈值时直接返回，不调用Ollama。
+        mode 为 auto 时，置信度达到 extractive_confidence 或Ollama不可用时返回抽取式答案。
+        启用语义缓存时，与之前某个问题足够相似且检索参数一致的问题直接返回缓存的LLM答案。
+        
         Args:
             question: 用户问题
-            top_k: 检索相关文档数量
-            
+            top_k: 检索相关文档数量上限
+            collection: 集合名称（默认集合为None）
+            min_similarity: 最低相似度（为None时使用默认值）
+            mode: 答案模式 auto/llm/extractive
+            priority: LLM调度优先级（越大越先执行）
+            timeout: 等待与调用LLM的截止时间（秒，None使用调度器默认值）
+            use_cache: 是否使用语义缓存
+            relative_cutoff: 相对最高分的保留比例（为None时使用默认值）
+            max_gap: 相邻结果相似度的最大落差（为None时使用默认值）
+        
         Returns:
-            问答结果
+            问答结果（含 mode：llm/extractive，无检索结果时为 none；抽取式答案另含 highlights；
+            缓存命中时另含 cached_question）
+        
+        Raises:
+            SchedulerRejectedError: LLM调度队列已满或超过截止时间
         """
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"不支持的答案模式: {mode}")
+        with metrics.timer(metrics.ASK_SECONDS):
+            return self._ask_question(question, top_k, collection, (min_similarity, relative_cutoff, max_gap),
+                                      mode, priority, timeout, use_cache)
+    
+    def _ask_question(self, question: str, top_k: int, collection: Optional[str], cutoffs: Tuple,
+                      mode: str, priority: int, timeout: Optional[float], use_cache: bool = True) -> Dict[str, Any]:
+        # 0. 语义缓存：问题只编码一次，未命中时复用于检索
+        query_embedding, cache_params = None, self._cache_params(top_k, collection, cutoffs, mode, use_cache)
+        if cache_params is not None:
+            query_embedding = self.kb.encode_query(question)
+            cached = self._cache_lookup(question, query_embedding, cache_params)
+            if cached is not None:
+                return cached
+        
         # 1. 检索相关文档
-        search_results = self.search(question, top_k)
+        search_results = self.search(question, top_k, collection, *cutoffs, query_embedding=query_embedding)
         
         if not search_results:
+            return self._no_results(question)
+        
+        confidence = self._calculate_confidence(search_results)
+        
+        # 2. 高置信度或Ollama近期不可用时直接抽取答案句
+        if mode == 'extractive' or (mode == 'auto' and self._prefer_extractive(confidence)):
+            return self._extractive_result(question, search_results, confidence)
+        
+        # 3. 构建上下文
+        with metrics.timer(metrics.CONTEXT_BUILD_SECONDS), tracing.span('context_build'):
+            context = self._build_context(search_results)
+        
+        # 4. 调用Ollama生成答案
+        try:
+            if self.scheduler is not None:
+                answer = self.scheduler.run(self._traced_generate, question, context,
+                                            priority=priority, timeout=timeout)
+            else:
+                answer = self._traced_generate(question, context)
+        except LLMUnavailableError as e:
+            fallback = self._llm_unavailable(e, question, search_results, confidence, mode)
+            if fallback is not None:
+                return fallback
+            answer = str(e)
+            cache_params = None
+        
+        return self._llm_result(question, answer, search_results, confidence, query_embedding, cache_params)
+    
+    def _cache_params(self, top_k: int, collection: Optional[str], cutoffs: Tuple,
+                      mode: str, use_cache: bool) -> Optional[Tuple]:
+        """
+        语义缓存的检索参数（不使用缓存时为None）
+        
+        cutoffs 为本次请求的 (min_similarity, relative_cutoff, max_gap)，未指定的取默认值后计入，
+        不同阈值下得到的答案不会互相命中。
+        """
+        if self.semantic_cache is None or not use_cache or mode == 'extractive':
+            return None
+        defaults = (self.min_similarity, self.relative_cutoff, self.max_gap)
+        return (collection or self.kb.DEFAULT_COLLECTION, top_k,
+                *(default if value is None else value for value, default in zip(cutoffs, defaults)))
+    
+    def _cache_lookup(self, question: str, query_embedding: np.ndarray,
+                      cache_params: Tuple) -> Optional[Dict[str, Any]]:
+        with tracing.span('semantic_cache'):
+            cached = self.semantic_cache.lookup(query_embedding, cache_params)
+        if cached is not None:
+            tracing.annotate(cache='hit')
+            cached['question'] = question
+        return cached
+    
+    def _no_results(self, question: str) -> Dict[str, Any]:
+        """没有检索结果达到阈值时的回答（不调用Ollama）"""
+        metrics.ASK_SKIPPED_LLM.inc()
+        return {
+            'question': question,
+            'answer': '抱歉，我在知识库中没有找到相关信息。',
+            'sources': [],
+            'confidence': 0.0,
+            'mode': 'none'
+        }
+    
+    def _llm_unavailable(self, error: Exception, question: str, search_results: List[Dict[str, Any]],
+                         confidence: float, mode: str) -> Optional[Dict[str, Any]]:
+        """记录Ollama不可用；auto 模式且允许时返回抽取式答案，否则返回None"""
+        self._llm_down_until = time.monotonic() + self.llm_retry_after
+        if mode == 'auto' and self.extractive_fallback:
+            print("⚠️ Ollama不可用，返回抽取式答案")
+            result = self._extractive_result(question, search_results, confidence)
+            result['llm_error'] = str(error)
+            return result
+        return None
+    
+    def _llm_result(self, question: str, answer: str, search_results: List[Dict[str, Any]], confidence: float,
+                    query_embedding: Optional[np.ndarray], cache_params: Optional[Tuple]) -> Dict[str, Any]:
+        """构建LLM问答结果，并写入语义缓存"""
+        metrics.ASK_ANSWERS.inc(mode='llm')
+        result = {
+            'question': question,
+            'answer': answer,
+            'sources': search_results,
+            'confidence': confidence,
+            'mode': 'llm'
+        }
+        if cache_params is not None:
+            self.semantic_cache.store(query_embedding, question, cache_params, result, cache_params[0])
+        return result
+    
+    def ask_in_session(self, question: str, session_id: Optional[str] = None, top_k: int = 5,
+                       collection: Optional[str] = None, min_similarity: Optional[float] = None,
+                       priority: int = 0, timeout: Optional[float] = None,
+                       relative_cutoff: Optional[float] = None, max_gap: Optional[float] = None) -> Dict[str, Any]:
+        """
+        多轮会话问答
+        
+        每轮仍按问题检索，但只把会话中尚未发送过的文档块追加到提示词。Ollama返回的 context
+        保存在会话中，后续轮次只发送新增文档与新问题并带上 context，从而复用前缀的KV缓存；
+        context 不可用（首轮、节点切换、超出token上限）时发送包含文档内容与最近几轮问答的完整提示词。
+        
+        Args:
+            question: 用户问题
+            session_id: 会话ID（为None时创建新会话）
+            top_k: 检索相关文档数量上限
+            collection: 新会话使用的集合（已有会话沿用创建时的集合）
+            min_similarity: 最低相似度（为None时使用默认值）
+            priority: LLM调度优先级（越大越先执行）
+            timeout: 等待与调用LLM的截止时间（秒，None使用调度器默认值）
+            relative_cutoff: 相对最高分的保留比例（为None时使用默认值）
+            max_gap: 相邻结果相似度的最大落差（为None时使用默认值）
+        
+        Returns:
+            问答结果（含 session_id、turn 与 context_reused）
+        
+        Raises:
+            SessionNotFoundError: 会话不存在或已过期
+            SchedulerRejectedError: LLM调度队列已满或超过截止时间
+        """
+        session = self.sessions.get(session_id) if session_id else self.sessions.create(collection)
+        with metrics.timer(metrics.ASK_SECONDS), session.lock:
+            tracing.annotate(session_id=session.session_id, turn=session.turns + 1)
+            try:
+                return self._ask_in_session(session, question, top_k, (min_similarity, relative_cutoff, max_gap),
+                                            priority, timeout)
+            except KeyError:
+                # 集合不存在：不保留刚创建的会话
+                if not session_id:
+                    self.sessions.close(session.session_id)
+                raise
+    
+    def _ask_in_session(self, session: ConversationSession, question: str, top_k: int, cutoffs: Tuple,
+                        priority: int, timeout: Optional[float]) -> Dict[str, Any]:
+        search_results = self.search(question, top_k, session.collection, *cutoffs)
+        
+        if not search_results and not session.sources:
+            metrics.ASK_SKIPPED_LLM.inc()
             return {
                 'question': question,
                 'answer': '抱歉，我在知识库中没有找到相关信息。',
                 'sources': [],
-                'confidence': 0.0
+                'confidence': 0.0,
+                'mode': 'none',
+                'session_id': session.session_id,
+                'turn': session.turns
             }
         
-        # 2. 构建上下文
-        context = self._build_context(search_results)
+        confidence = self._calculate_confidence(search_results)
         
-        # 3. 调用Ollama生成答案
-        answer = self._generate_answer(question, context)
+        if not session.has_context():
+            # 没有可复用的 context 时从本轮检索结果重新编号，完整提示词不随轮数增长
+            session.sources, session.chunk_keys = [], set()
         
-        # 4. 计算置信度
-        confidence = self._calculate_confidence(search_results)
+        # 只追加会话中尚未发送过的文档块，编号接续之前的文档
+        new_results = [r for r in search_results if (r.get('shard'), r['chunk_id']) not in session.chunk_keys]
+        new_results = new_results[:max(0, self.sessions.max_documents - len(session.sources))]
+        with metrics.timer(metrics.CONTEXT_BUILD_SECONDS), tracing.span('context_build'):
+            prompt = self._build_prompt(question, self._build_context(session.sources + new_results),
+                                        session.history)
+            resume = None
+            if session.has_context():
+                followup = ""
+                if new_results:
+                    followup = f"补充文档内容：\n{self._build_context(new_results, start=len(session.sources) + 1)}\n"
+                resume = {
+                    'endpoint': session.endpoint,
+                    'model': session.model,
+                    'context': session.tokens.tolist(),
+                    'prompt': f"{followup}问题：{question}\n\n请基于上述文档内容回答问题："
+                }
+        
+        try:
+            if self.scheduler is not None:
+                result = self.scheduler.run(self._traced_session_generate, prompt, resume,
+                                            priority=priority, timeout=timeout)
+            else:
+                result = self._traced_session_generate(prompt, resume)
+        except LLMUnavailableError as e:
+            # 本轮未完成，会话保持不变
+            self._llm_down_until = time.monotonic() + self.llm_retry_after
+            if self.extractive_fallback and search_results:
+                print("⚠️ Ollama不可用，返回抽取式答案")
+                result = self._extractive_result(question, search_results, confidence)
+                result['llm_error'] = str(e)
+            else:
+                metrics.ASK_ANSWERS.inc(mode='llm')
+                result = {'question': question, 'answer': str(e), 'sources': search_results,
+                          'confidence': confidence, 'mode': 'llm'}
+            result.update(session_id=session.session_id, turn=session.turns)
+            return result
+        
+        session.sources.extend(new_results)
+        session.chunk_keys.update((r.get('shard'), r['chunk_id']) for r in new_results)
+        session.history.append((question, result['response']))
+        session.turns += 1
+        session.prompt_tokens += result['prompt_eval_count'] or 0
+        if result['resumed']:
+            session.reused_turns += 1
+        self.sessions.update(session, result['context'], result['endpoint'], result['model'])
         
+        metrics.ASK_ANSWERS.inc(mode='llm')
+        return {
+            'question': question,
+            'answer': result['response'],
+            'sources': search_results,
+            'confidence': confidence,
+            'mode': 'llm',
+            'session_id': session.session_id,
+            'turn': session.turns,
+            'context_reused': result['resumed'],
+            'prompt_eval_count': result['prompt_eval_count']
+        }
+    
+    def _prefer_extractive(self, confidence: float) -> bool:
+        """判断 auto 模式下是否跳过LLM"""
+        if self.extractive_confidence is not None and confidence >= self.extractive_confidence:
+            return True
+        return self.extractive_fallback and time.monotonic() < self._llm_down_until
+    
+    def _extractive_result(self, question: str, search_results: List[Dict[str, Any]],
+                           confidence: float) -> Dict[str, Any]:
+        """构建抽取式问答结果"""
+        with tracing.span('extractive'):
+            answer, highlights = self._extractive_answer(question, search_results)
+        metrics.ASK_ANSWERS.inc(mode='extractive')
         return {
             'question': question,
             'answer': answer,
             'sources': search_results,
-            'confidence': confidence
+            'confidence': confidence,
+            'mode': 'extractive',
+            'highlights': highlights
         }
     
-    def _build_context(self, search_results: List[Dict[str, Any]]) -> str:
-        """构建上下文"""
+    def _extractive_answer(self, question: str, search_results: List[Dict[str, Any]],
+                           max_chunks: int = 3, max_sentences: int = 3) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        抽取式答案：在前几个文本块中按句子与问题的向量相似度挑选最相关的句子
+        
+        问题与所有候选句子在一次 encode 调用中批量编码。
+        
+        Args:
+            question: 用户问题
+            search_results: 检索结果（按相似度降序）
+            max_chunks: 参与抽取的文本块数量
+            max_sentences: 返回的句子数量
+        
+        Returns:
+            (答案文本, 高亮句子列表)
+        """
+        candidates = []
+        for source, result in enumerate(search_results[:max_chunks], 1):
+            for sentence in split_sentences(result['text']):
+                candidates.append((sentence, source, result))
+        if not candidates:
+            result = search_results[0]
+            candidates = [(result['text'].strip(), 1, result)]
+        
+        with metrics.timer(metrics.EMBED_SECONDS, kind='extractive'):
+            embeddings = np.asarray(self.kb.model.encode([question] + [c[0] for c in candidates]), dtype='float32')
+        metrics.EMBED_TEXTS.inc(len(candidates) + 1, kind='extractive')
+        norms = np.linalg.norm(embeddings, axis=1)
+        norms[norms == 0] = 1.0
+        embeddings /= norms[:, None]
+        scores = embeddings[1:] @ embeddings[0]
+        
+        highlights = []
+        for i in np.argsort(-scores, kind='stable')[:max_sentences].tolist():
+            sentence, source, result = candidates[i]
+            highlights.append({
+                'text': sentence,
+                'score': float(scores[i]),
+                'source': source,
+                'file_name': result['file_name'],
+                'chunk_id': result['chunk_id'],
+                'page': result.get('page')
+            })
+        
+        answer = "\n".join(f"{h['text']}（来源: 文档 {h['source']} {h['file_name']}）" for h in highlights)
+        return answer, highlights
+    
+    def _build_context(self, search_results: List[Dict[str, Any]], start: int = 1) -> str:
+        """构建上下文（start 为第一个文档的编号）"""
         context_parts = []
         
-        for i, result in enumerate(search_results, 1):
+        for i, result in enumerate(search_results, start):
             context_parts.append(f"文档 {i}: {result['file_name']}")
             context_parts.append(f"内容: {result['text']}")
             context_parts.append(f"相似度: {result['similarity']:.3f}")
@@ -91,102 +469,199 @@ class KnowledgeRetriever:
         
         return "\n".join(context_parts)
     
-    def _generate_answer(self, question: str, context: str) -> str:
-        """使用Ollama生成答案"""
-        prompt = f"""基于以下文档内容回答问题。请根据提供的文档内容给出准确、详细的答案。如果文档中没有相关信息，请明确说明。
+    def _traced_generate(self, question: str, context: str, deadline: Optional[float] = None) -> str:
+        with tracing.span('llm_generate', model=self.ollama_model):
+            return self._generate_answer(question, context, deadline)
+    
+    def _build_prompt(self, question: str, context: str, history: List[Tuple[str, str]] = ()) -> str:
+        """构建完整提示词（history 为会话中之前的问答）"""
+        history_text = "".join(f"问题：{q}\n回答：{a}\n\n" for q, a in history)
+        if history_text:
+            history_text = f"之前的对话：\n{history_text}"
+        return f"""基于以下文档内容回答问题。请根据提供的文档内容给出准确、详细的答案。如果文档中没有相关信息，请明确说明。
 
 文档内容：
 {context}
 
-问题：{question}
+{history_text}问题：{question}
 
 请基于上述文档内容回答问题："""
-
-        # 添加重试机制
-        max_retries = 3
+    
+    def _traced_session_generate(self, prompt: str, resume: Optional[Dict[str, Any]],
+                                 deadline: Optional[float] = None) -> Dict[str, Any]:
+        with tracing.span('llm_generate', model=self.ollama_model, resumed=resume is not None):
+            return self._generate(prompt, deadline, resume)
+    
+    def _generate_answer(self, question: str, context: str, deadline: Optional[float] = None) -> str:
+        """
+        使用Ollama生成答案
+        
+        Args:
+            question: 用户问题
+            context: 检索上下文
+            deadline: 截止时间点（time.monotonic()），各次尝试的超时不超过剩余时间
+        
+        Raises:
+            LLMUnavailableError: Ollama不可用
+            SchedulerRejectedError: 重试过程中超过截止时间
+        """
+        return self._generate(self._build_prompt(question, context), deadline)['response']
+    
+    def _generate(self, prompt: str, deadline: Optional[float] = None,
+                  resume: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        调用Ollama生成，失败时重试或切换节点
+        
+        resume 包含会话的 endpoint、model、context（token序列）与 prompt（只含新增内容的提示词）。
+        选中的节点与 context 所属节点和模型一致时发送 resume 的提示词并带上 context，
+        否则（如该节点已被摘除）发送完整提示词。
+        
+        Args:
+            prompt: 完整提示词
+            deadline: 截止时间点（time.monotonic()），各次尝试的超时不超过剩余时间
+            resume: 可复用的会话 context
+        
+        Returns:
+            response（答案）、context、endpoint、model、resumed 与 prompt_eval_count
+        
+        Raises:
+            LLMUnavailableError: Ollama不可用
+            SchedulerRejectedError: 重试过程中超过截止时间
+        """
+        # 添加重试机制：配置了多个节点时，失败后优先换到尚未尝试过的节点
+        max_retries = max(3, len(self.pool))
+        tried = set()
         for attempt in range(max_retries):
+            request_timeout = 60  # 增加超时时间
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SchedulerRejectedError("生成答案超过截止时间，请稍后重试", 'deadline')
+                request_timeout = min(request_timeout, remaining)
+            endpoint, probe = self.pool.acquire(exclude=tried, prefer=resume['endpoint'] if resume else None)
+            tried.add(endpoint.url)
+            resumed = resume is not None and endpoint.url == resume['endpoint'] and endpoint.model == resume['model']
+            payload = {
+                "model": endpoint.model,
+                "prompt": resume['prompt'] if resumed else prompt,
+                "stream": False,
+                "options": {
+                    "temperature": 0.7,
+                    "top_p": 0.9,
+                    "max_tokens": 1000
+                }
+            }
+            if resumed:
+                payload["context"] = resume['context']
+            started = time.perf_counter()
+            ok, error, eject = False, None, False
             try:
-                print(f"🔄 尝试调用Ollama (第{attempt + 1}次)...")
+                print(f"🔄 尝试调用Ollama (第{attempt + 1}次, {endpoint.url})...")
                 response = requests.post(
-                    f"{self.ollama_url}/api/generate",
-                    json={
-                        "model": self.ollama_model,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.7,
-                            "top_p": 0.9,
-                            "max_tokens": 1000
-                        }
-                    },
-                    timeout=60  # 增加超时时间
+                    f"{endpoint.url}/api/generate",
+                    json=payload,
+                    timeout=request_timeout
                 )
                 
                 if response.status_code == 200:
                     result = response.json()
+                    ok = True
+                    self._record_llm_attempt('ok', started)
                     print("✅ Ollama调用成功")
-                    return result.get('response', '抱歉，无法生成答案。')
+                    return {
+                        'response': result.get('response', '抱歉，无法生成答案。'),
+                        'context': result.get('context'),
+                        'endpoint': endpoint.url,
+                        'model': endpoint.model,
+                        'resumed': resumed,
+                        'prompt_eval_count': result.get('prompt_eval_count')
+                    }
                 else:
                     error_text = response.text
+                    error = f"HTTP {response.status_code}"
+                    self._record_llm_attempt(f'http_{response.status_code}', started)
                     print(f"⚠️ Ollama返回错误: {response.status_code}")
                     
                     # 检查是否是模型不存在的错误
                     if "model" in error_text.lower() and ("not found" in error_text.lower() or "does not exist" in error_text.lower()):
+                        error, eject = "模型未安装", True
+                        if self.pool.has_alternative(tried):
+                            print(f"🔄 节点 {endpoint.url} 缺少模型 {endpoint.model}，切换到其他节点...")
+                            continue
                         error_msg = f"""
-❌ 错误: Ollama模型 '{self.ollama_model}' 未找到或未下载
+❌ 错误: Ollama模型 '{endpoint.model}' 未找到或未下载
 
 解决方案:
 1. 检查模型是否已安装: ollama list
-2. 如果未安装，运行: ollama pull {self.ollama_model}
+2. 如果未安装，运行: ollama pull {endpoint.model}
 3. 安装完成后重新启动服务
 
-当前请求的模型: {self.ollama_model}
+当前请求的模型: {endpoint.model}
 """
                         print(error_msg)
-                        return f"错误: 模型 {self.ollama_model} 未安装，请运行 'ollama pull {self.ollama_model}' 安装模型"
+                        raise LLMUnavailableError(f"错误: 模型 {endpoint.model} 未安装，请运行 'ollama pull {endpoint.model}' 安装模型")
                     
                     if attempt < max_retries - 1:
-                        print(f"🔄 等待2秒后重试...")
-                        time.sleep(2)
+                        self._retry_pause(tried, 2)
                         continue
-                    return f"Ollama服务错误: {response.status_code} - {error_text}"
+                    raise LLMUnavailableError(f"Ollama服务错误: {response.status_code} - {error_text}")
                     
             except requests.exceptions.ConnectionError as e:
+                error, eject = "无法连接", True
+                self._record_llm_attempt('connection_error', started)
                 print(f"❌ 连接错误: {e}")
                 if attempt < max_retries - 1:
-                    print(f"🔄 等待3秒后重试...")
-                    time.sleep(3)
+                    self._retry_pause(tried, 3)
                     continue
-                error_msg = """
+                error_msg = f"""
 ❌ 错误: 无法连接到Ollama服务
 
 解决方案:
 1. 检查Ollama服务是否运行: ollama list
 2. 如果未运行，启动Ollama: ollama serve
-3. 确保Ollama服务地址正确: http://localhost:11434
+3. 确保Ollama服务地址正确: {endpoint.url}
 4. 如果未安装Ollama，访问 https://ollama.ai 下载安装
 
 注意: 即使没有Ollama，搜索功能仍然可以正常使用
 """
                 print(error_msg)
-                return "无法连接到Ollama服务，请确保Ollama正在运行。"
+                raise LLMUnavailableError("无法连接到Ollama服务，请确保Ollama正在运行。")
             except requests.exceptions.Timeout as e:
+                error = "超时"
+                self._record_llm_attempt('timeout', started)
                 print(f"⏰ 超时错误: {e}")
                 if attempt < max_retries - 1:
-                    print(f"🔄 等待2秒后重试...")
-                    time.sleep(2)
+                    self._retry_pause(tried, 2)
                     continue
-                return "Ollama服务响应超时，请稍后重试。"
+                raise LLMUnavailableError("Ollama服务响应超时，请稍后重试。")
+            except LLMUnavailableError:
+                raise
             except Exception as e:
+                error = str(e)
+                self._record_llm_attempt('error', started)
                 print(f"❌ 未知错误: {e}")
                 if attempt < max_retries - 1:
-                    print(f"🔄 等待2秒后重试...")
-                    time.sleep(2)
+                    self._retry_pause(tried, 2)
                     continue
-                return f"生成答案时发生错误: {str(e)}"
+                raise LLMUnavailableError(f"生成答案时发生错误: {str(e)}")
+            finally:
+                self.pool.release(endpoint, ok, time.perf_counter() - started, error, eject, probe)
         
-        return "多次重试失败，请检查Ollama服务状态。"
+        raise LLMUnavailableError("多次重试失败，请检查Ollama服务状态。")
+    
+    def _record_llm_attempt(self, status: str, started: float):
+        """记录单次Ollama调用的耗时与结果"""
+        metrics.LLM_REQUESTS.inc(status=status)
+        metrics.LLM_SECONDS.observe(time.perf_counter() - started, status=status)
     
+    def _retry_pause(self, tried: set, seconds: float):
+        """还有未尝试过的可用节点时立即切换，否则等待后重试"""
+        if self.pool.has_alternative(tried):
+            print("🔄 切换到其他Ollama节点重试...")
+            return
+        print(f"🔄 等待{seconds}秒后重试...")
+        time.sleep(seconds)
+
     def _calculate_confidence(self, search_results: List[Dict[str, Any]]) -> float:
         """计算答案置信度"""
         if not search_results:
@@ -201,21 +676,36 @@ class KnowledgeRetriever:
         return confidence
     
     def get_ollama_models(self) -> List[str]:
-        """获取可用的Ollama模型列表"""
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                return [model['name'] for model in data.get('models', [])]
-            else:
-                return []
-        except:
-            return []
+        """获取可用的Ollama模型列表（所有可连接节点的并集）"""
+        models = []
+        for endpoint in self.pool.endpoints:
+            try:
+                response = requests.get(f"{endpoint.url}/api/tags", timeout=10)
+                if response.status_code == 200:
+                    data = response.json()
+                    models.extend(m['name'] for m in data.get('models', []) if m['name'] not in models)
+            except:
+                continue
+        return models
     
     def check_ollama_connection(self) -> bool:
-        """检查Ollama连接状态"""
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
+        """检查Ollama连接状态（任一节点可连接即为True）"""
+        for endpoint in self.pool.endpoints:
+            try:
+                response = requests.get(f"{endpoint.url}/api/tags", timeout=5)
+                if response.status_code == 200:
+                    return True
+            except:
+                continue
+        return False
+    
+    def check_ollama_endpoints(self) -> List[Dict[str, Any]]:
+        """
+        检查每个Ollama节点：能否连接、所配置的模型是否已安装
+        
+        不可用的节点会被暂时摘除，生成请求只发往可用节点。
+        
+        Returns:
+            各节点的检查结果（url、model、reachable、model_installed、models）
+        """
+        return self.pool.check_health()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM调用调度器
+限制同时进行的Ollama调用数量，超出的请求进入有界优先级队列等待；
+队列已满时立即拒绝（HTTP 503），等待超过请求截止时间时放弃，
+使突发流量下的尾延迟有上界而不是让所有请求一起变慢。
+线程中的调用使用 run，事件循环中的协程使用 run_async，两者共用同一组槽位与队列
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+import metrics
+import tracing
+
+
+class SchedulerRejectedError(Exception):
+    """调度器拒绝了请求（队列已满或等待超过截止时间），应返回 503"""
+    
+    def __init__(self, message: str, reason: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('granted', 'cancelled', 'future')
+    
+    def __init__(self, future: Optional[asyncio.Future] = None):
+        self.granted = False
+        self.cancelled = False
+        # 协程等待者：槽位交给它时在其事件循环中完成该 future，而不是唤醒条件变量
+        self.future = future
+    
+    def wake(self):
+        """槽位已交给协程等待者（可能在其他线程中调用）"""
+        self.future.get_loop().call_soon_threadsafe(self._resolve)
+    
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class LLMScheduler:
+    """
+    LLM调用调度器
+    
+    同一优先级内先进先出；priority 越大越先获得槽位。
+    """
+    
+    def __init__(self, max_concurrency: int = 1, max_queue: int = 16, default_timeout: float = 120.0,
+                 wait_window: int = 1000):
+        """
+        初始化调度器
+        
+        Args:
+            max_concurrency: 同时进行的LLM调用上限
+            max_queue: 等待队列长度上限，超出时拒绝
+            default_timeout: 默认截止时间（秒，从提交时算起，包含排队与调用）
+            wait_window: 统计等待时间分位数时保留的最近样本数
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.default_timeout = default_timeout
+        
+        self._cond = threading.Condition()
+        self._heap = []  # (-priority, 序号, waiter)
+        self._seq = itertools.count()
+        self._active = 0
+        self._queued = 0
+        
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._rejected = {'queue_full': 0, 'deadline': 0}
+        self._max_queue_depth = 0
+        self._waits = deque(maxlen=wait_window)
+    
+    def _acquire(self, priority: int, deadline: float) -> float:
+        """获取调用槽位，返回排队等待的秒数"""
+        start = time.monotonic()
+        with self._cond:
+            waiter = self._enqueue_locked(priority, _Waiter())
+            if waiter is None:
+                return 0.0
+            
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # 留在堆中的条目标记为取消，出队时跳过
+                    waiter.cancelled = True
+                    self._queued -= 1
+                    self._reject('deadline')
+                    self._update_gauges()
+                    raise SchedulerRejectedError("等待LLM调用超过截止时间，请稍后重试", 'deadline',
+                                                 retry_after=self._retry_after())
+                self._cond.wait(remaining)
+        
+        waited = time.monotonic() - start
+        return waited
+    
+    def _enqueue_locked(self, priority: int, waiter: _Waiter) -> Optional[_Waiter]:
+        """有空闲槽位时直接占用并返回None，否则把 waiter 放入等待队列；队列已满时拒绝"""
+        self._submitted += 1
+        if self._active < self.max_concurrency and self._queued == 0:
+            self._active += 1
+            self._update_gauges()
+            return None
+        
+        if self._queued >= self.max_queue:
+            self._reject('queue_full')
+            raise SchedulerRejectedError(
+                f"LLM请求队列已满（{self.max_queue}），请稍后重试", 'queue_full',
+                retry_after=self._retry_after())
+        
+        heapq.heappush(self._heap, (-priority, next(self._seq), waiter))
+        self._queued += 1
+        self._max_queue_depth = max(self._max_queue_depth, self._queued)
+        self._update_gauges()
+        return waiter
+    
+    async def _acquire_async(self, priority: int, deadline: float) -> float:
+        """在事件循环中获取调用槽位，排队期间不占用线程；协程被取消时退出队列"""
+        start = time.monotonic()
+        with self._cond:
+            waiter = self._enqueue_locked(priority, _Waiter(asyncio.get_running_loop().create_future()))
+            if waiter is None:
+                return 0.0
+        
+        try:
+            await asyncio.wait_for(waiter.future, max(0.0, deadline - time.monotonic()))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                granted = waiter.granted
+                if not granted:
+                    waiter.cancelled = True
+                    self._queued -= 1
+                    self._update_gauges()
+                    if isinstance(e, asyncio.TimeoutError):
+                        self._reject('deadline')
+            if granted:
+                # 槽位在超时或取消的同时交给了本协程，转交下一个等待者
+                self._release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise SchedulerRejectedError("等待LLM调用超过截止时间，请稍后重试", 'deadline',
+                                             retry_after=self._retry_after())
+            raise
+        return time.monotonic() - start
+    
+    def _release(self):
+        """释放槽位，直接交给优先级最高的等待者"""
+        with self._cond:
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self._queued -= 1
+                self._update_gauges()
+                if waiter.future is not None:
+                    waiter.wake()
+                else:
+                    self._cond.notify_all()
+                return
+            self._active -= 1
+            self._update_gauges()
+    
+    def _reject(self, reason: str):
+        self._rejected[reason] += 1
+        metrics.LLM_REJECTED.inc(reason=reason)
+    
+    def _retry_after(self) -> float:
+        """按最近的等待时间估计客户端重试间隔"""
+        if not self._waits:
+            return 1.0
+        return max(1.0, round(float(np.percentile(self._waits, 50)), 1))
+    
+    def _update_gauges(self):
+        metrics.LLM_QUEUE_DEPTH.set(self._queued)
+        metrics.LLM_ACTIVE.set(self._active)
+    
+    def run(self, fn: Callable, *args, priority: int = 0, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        在调度器的并发限制下执行 fn(*args, deadline=..., **kwargs)
+        
+        fn 会收到关键字参数 deadline（time.monotonic() 时间点），可据此缩短自身的超时。
+        
+        Args:
+            fn: LLM调用函数
+            priority: 优先级，越大越先执行
+            timeout: 截止时间（秒，None 使用默认值，且不超过默认值）
+        
+        Returns:
+            fn 的返回值
+        
+        Raises:
+            SchedulerRejectedError: 队列已满或排队超过截止时间
+        """
+        timeout = self.default_timeout if timeout is None else min(timeout, self.default_timeout)
+        deadline = time.monotonic() + timeout
+        with tracing.span('llm_queue', priority=priority):
+            waited = self._acquire(priority, deadline)
+        with self._cond:
+            self._waits.append(waited)
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(waited)
+        try:
+            result = fn(*args, deadline=deadline, **kwargs)
+        except SchedulerRejectedError as e:
+            # fn 在重试过程中用尽了截止时间
+            with self._cond:
+                self._reject(e.reason)
+            raise
+        except Exception:
+            with self._cond:
+                self._failed += 1
+            raise
+        else:
+            with self._cond:
+                self._completed += 1
+            return result
+        finally:
+            self._release()
+    
+    async def run_async(self, fn: Callable, *args, priority: int = 0, timeout: Optional[float] = None,
+                        **kwargs) -> Any:
+        """
+        run 的协程版本：在调度器的并发限制下 await fn(*args, deadline=..., **kwargs)
+        
+        排队等待不占用线程；协程被取消（如客户端断开）时退出队列或释放槽位。
+        
+        Args:
+            fn: 返回协程的LLM调用函数
+            priority: 优先级，越大越先执行
+            timeout: 截止时间（秒，None 使用默认值，且不超过默认值）
+        
+        Returns:
+            fn 的返回值
+        
+        Raises:
+            SchedulerRejectedError: 队列已满或排队超过截止时间
+        """
+        timeout = self.default_timeout if timeout is None else min(timeout, self.default_timeout)
+        deadline = time.monotonic() + timeout
+        with tracing.span('llm_queue', priority=priority):
+            waited = await self._acquire_async(priority, deadline)
+        with self._cond:
+            self._waits.append(waited)
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(waited)
+        try:
+            result = await fn(*args, deadline=deadline, **kwargs)
+        except SchedulerRejectedError as e:
+            with self._cond:
+                self._reject(e.reason)
+            raise
+        except asyncio.CancelledError:
+            with self._cond:
+                self._cancelled += 1
+            raise
+        except Exception:
+            with self._cond:
+                self._failed += 1
+            raise
+        else:
+            with self._cond:
+                self._completed += 1
+            return result
+        finally:
+            self._release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """调度器统计：并发、队列深度、等待时间分位数与拒绝次数"""
+        with self._cond:
+            waits = np.asarray(self._waits, dtype=np.float64) * 1000.0
+            return {
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'queue_depth': self._queued,
+                'max_queue_depth': self._max_queue_depth,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'cancelled': self._cancelled,
+                'rejected': dict(self._rejected),
+                'wait_ms': {
+                    'mean': round(float(waits.mean()), 2) if waits.size else 0.0,
+                    'p50': round(float(np.percentile(waits, 50)), 2) if waits.size else 0.0,
+                    'p95': round(float(np.percentile(waits, 95)), 2) if waits.size else 0.0,
+                    'max': round(float(waits.max()), 2) if waits.size else 0.0
+                }
+            }
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+提供计数器与直方图，并以 Prometheus 文本格式导出；
+通过环境变量 KB_METRICS=0 关闭后，埋点只剩一次布尔判断的开销
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+_enabled = os.getenv('KB_METRICS', '1').lower() not in ('0', 'false', 'off', 'no')
+
+# 默认延迟分桶（秒），覆盖从亚毫秒级的向量检索到数十秒的LLM生成
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def enabled() -> bool:
+    """指标采集是否开启"""
+    return _enabled
+
+
+def set_enabled(value: bool):
+    """运行时开启/关闭指标采集"""
+    global _enabled
+    _enabled = bool(value)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    """单调递增计数器"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+    
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value:g}'
+
+
+class Gauge:
+    """可增可减的瞬时值（如队列深度）"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def set(self, value: float, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = float(value)
+    
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+    
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value:g}'
+
+
+class Histogram:
+    """累积分桶直方图"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [各桶计数..., 总和, 次数]
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+    
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return series[-1] if series else 0
+    
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%g"' % bound)
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f'{self.name}_bucket{labels} {series[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]:g}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}'
+
+
+class _NullTimer:
+    """指标关闭时使用的空计时器"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def timer(histogram: Histogram, **labels):
+    """
+    返回计时上下文管理器；指标关闭时返回共享的空对象，不读取时钟
+    
+    用法:
+        with metrics.timer(metrics.KB_SEARCH_SECONDS):
+            ...
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(histogram, labels)
+
+
+def timed_iter(iterable: Iterable, histogram: Histogram, **labels) -> Iterator:
+    """
+    包装迭代器，累计产出各元素所花费的时间（不含消费方处理时间），迭代结束时记录一次
+    
+    适用于按页流式解析这类生成器。
+    """
+    if not _enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        histogram.observe(elapsed, **labels)
+
+
+class MetricsRegistry:
+    """指标注册表"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Optional[Tuple[float, ...]] = None) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets or DEFAULT_BUCKETS))
+    
+    def render(self) -> str:
+        """导出 Prometheus 文本格式（0.0.4）"""
+        lines = []
+        if not _enabled:
+            lines.append('# metrics collection is disabled (KB_METRICS=0)')
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# ---- 检索 ----
+KB_SEARCH_SECONDS = REGISTRY.histogram(
+    'kb_search_seconds', '知识库检索总耗时（含查询编码与结果合并）')
+EMBED_SECONDS = REGISTRY.histogram(
+    'kb_embed_seconds', 'model.encode 耗时', ['kind'])
+EMBED_TEXTS = REGISTRY.counter(
+    'kb_embed_texts_total', '送入 model.encode 的文本数量', ['kind'])
+INDEX_SEARCH_SECONDS = REGISTRY.histogram(
+    'kb_index_search_seconds', '单个分片 FAISS index.search 耗时')
+
+# ---- 导入 ----
+PARSE_SECONDS = REGISTRY.histogram(
+    'kb_document_parse_seconds', '按格式统计的文档解析耗时', ['format'])
+CHUNK_SECONDS = REGISTRY.histogram(
+    'kb_document_chunk_seconds', '单个文档的分块耗时')
+DOCUMENTS_INGESTED = REGISTRY.counter(
+    'kb_documents_ingested_total', '导入文档数量', ['status'])
+CHUNKS_INGESTED = REGISTRY.counter(
+    'kb_chunks_ingested_total', '写入索引的文本块数量')
+DUPLICATE_CHUNKS = REGISTRY.counter(
+    'kb_duplicate_chunks_total', '作为近重复别名登记、未写入索引的文本块数量')
+EMBED_REUSED = REGISTRY.counter(
+    'kb_embed_reused_total', '复用近重复文本块的已有向量、未送入 model.encode 的文本数量')
+PARSE_CACHE_LOOKUPS = REGISTRY.counter(
+    'kb_parse_cache_lookups_total', '解析结果缓存查找次数（hit/miss）', ['result', 'format'])
+PARSE_CACHE_SAVED_SECONDS = REGISTRY.counter(
+    'kb_parse_cache_saved_seconds_total', '解析结果缓存命中节省的解析耗时', ['format'])
+
+# ---- 问答 ----
+ASK_SECONDS = REGISTRY.histogram(
+    'kb_ask_seconds', '问答总耗时')
+CONTEXT_BUILD_SECONDS = REGISTRY.histogram(
+    'kb_context_build_seconds', '构建LLM上下文耗时')
+LLM_SECONDS = REGISTRY.histogram(
+    'kb_llm_generate_seconds', '调用Ollama生成答案耗时', ['status'])
+LLM_REQUESTS = REGISTRY.counter(
+    'kb_llm_requests_total', 'Ollama生成请求次数（含重试）', ['status'])
+ASK_SKIPPED_LLM = REGISTRY.counter(
+    'kb_ask_skipped_llm_total', '没有结果达到相似度阈值而跳过LLM调用的问答次数')
+ASK_CANCELLED = REGISTRY.counter(
+    'kb_ask_cancelled_total', '客户端断开后取消的问答（异步服务）', ['stage'])
+ASK_ANSWERS = REGISTRY.counter(
+    'kb_ask_answers_total', '按答案模式统计的问答次数（llm/extractive）', ['mode'])
+
+# ---- LLM调度 ----
+LLM_QUEUE_DEPTH = REGISTRY.gauge(
+    'kb_llm_queue_depth', '等待LLM调用槽位的请求数')
+LLM_ACTIVE = REGISTRY.gauge(
+    'kb_llm_active', '正在进行的LLM调用数')
+LLM_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'kb_llm_queue_wait_seconds', '请求在LLM调度队列中的等待时间')
+LLM_REJECTED = REGISTRY.counter(
+    'kb_llm_rejected_total', '被调度器拒绝的LLM调用（queue_full/deadline）', ['reason'])
+
+# ---- 语义缓存 ----
+SEMANTIC_CACHE_LOOKUPS = REGISTRY.counter(
+    'kb_semantic_cache_lookups_total', '问题语义缓存查找次数（hit/miss）', ['result'])
+SEMANTIC_CACHE_ENTRIES = REGISTRY.gauge(
+    'kb_semantic_cache_entries', '问题语义缓存中的条目数')
+
+# ---- 持久化 ----
+PERSIST_SECONDS = REGISTRY.histogram(
+    'kb_persist_seconds', '知识库分片保存/加载耗时', ['operation'])
+SYNC_FILES = REGISTRY.counter(
+    'kb_sync_files_total', '目录同步处理的文件数（added/updated/removed/failed）', ['action'])
+REBUILD_PROGRESS = REGISTRY.gauge(
+    'kb_rebuild_progress', '影子重建进度（已写入新一代的文本块比例，0~1）')
+
+# ---- HTTP ----
+HTTP_REQUESTS = REGISTRY.counter(
+    'kb_http_requests_total', 'HTTP请求数量', ['method', 'path', 'status'])
+HTTP_SECONDS = REGISTRY.histogram(
+    'kb_http_request_seconds', 'HTTP请求处理耗时', ['method', 'path'])
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+近重复文本块检测
+对每个文本块计算 64 位 SimHash（归一化文本的字符 4-gram），汉明距离不超过阈值的两个文本块为近重复候选；
+候选只有在归一化文本（小写、去掉空白与标点）完全相同时才视为重复，只差一个数字或实体的段落各自保留。
+查找使用 LSH 分段：64 位签名分成 (阈值 + 1) 段，距离不超过阈值的两个签名至少有一段完全相同，
+只需比较落在同一段桶中的候选；每段按值排序后二分查找，新追加的签名先放在未排序的尾部，
+积累到一定数量再合并排序，查找开销与文本块总数基本无关
+"""
+
+import re
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+SIGNATURE_BITS = 64
+
+# 归一化后短于该长度的文本块（标题、页眉等）不参与去重，签名记为 0
+MIN_TEXT_CHARS = 32
+
+# 字符 n-gram 的长度（字符级特征对中文与英文同样适用）
+SHINGLE_CHARS = 4
+
+_NON_WORD = re.compile(r'[\W_]+')
+_SHIFTS = np.arange(SIGNATURE_BITS, dtype=np.uint64)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_HASH_PRIME = np.uint64(0x100000001B3)
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 的末尾混合，让相近的 n-gram 哈希在 64 位上均匀分布"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def normalize_text(text: str) -> str:
+    """转小写并去掉空白与标点：导出网页或不同版本文档中只有排版差异的文本块归一化后相同"""
+    return _NON_WORD.sub('', text.lower())
+
+
+def simhash(text: str) -> int:
+    """
+    计算单个文本的 SimHash（基于 normalize_text 的结果）
+    
+    Returns:
+        64 位签名，文本过短时为 0
+    """
+    normalized = normalize_text(text)
+    if len(normalized) < MIN_TEXT_CHARS:
+        return 0
+    codes = np.frombuffer(normalized.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    n = len(codes) - SHINGLE_CHARS + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for offset in range(SHINGLE_CHARS):
+            hashes = hashes * _HASH_PRIME + codes[offset:offset + n]
+        hashes = _mix64(np.unique(hashes))
+    # 每一位按全部 n-gram 投票
+    ones = ((hashes[:, None] >> _SHIFTS) & np.uint64(1)).sum(axis=0)
+    bits = (ones * 2 > len(hashes)).astype(np.uint64)
+    signature = int(np.bitwise_or.reduce(bits << _SHIFTS))
+    # 0 保留为“不参与去重”
+    return signature or 1
+
+
+def simhash_many(texts: Sequence[str]) -> np.ndarray:
+    """批量计算 SimHash，返回 uint64 数组"""
+    return np.fromiter((simhash(text) for text in texts), dtype=np.uint64, count=len(texts))
+
+
+def hamming_distances(signatures: np.ndarray, signature: int) -> np.ndarray:
+    """一组签名与某个签名的汉明距离"""
+    xor = np.ascontiguousarray(np.asarray(signatures, dtype=np.uint64) ^ np.uint64(signature))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class SimHashIndex:
+    """
+    文本块签名索引
+    
+    签名按文本块下标顺序追加保存（签名为 0 的文本块不参与查找），
+    每一段保存排序后的段值与对应下标，尾部未排序的部分逐个比较。
+    """
+    
+    FILE = 'chunks_simhash.npy'
+    
+    def __init__(self, max_distance: int = 3, signatures: Optional[np.ndarray] = None):
+        """
+        初始化签名索引
+        
+        Args:
+            max_distance: 视为近重复的最大汉明距离
+            signatures: 已有的签名（下标即文本块下标）
+        """
+        self.max_distance = max(0, int(max_distance))
+        bands = min(self.max_distance + 1, SIGNATURE_BITS)
+        width = SIGNATURE_BITS // bands
+        # 最后一段包含除不尽时余下的位
+        self._band_shifts = [np.uint64(b * width) for b in range(bands)]
+        self._band_masks = [np.uint64((1 << width) - 1) for _ in range(bands - 1)]
+        self._band_masks.append(np.uint64((1 << (SIGNATURE_BITS - (bands - 1) * width)) - 1))
+        
+        signatures = np.asarray(signatures if signatures is not None else [], dtype=np.uint64)
+        self._signatures = np.empty(max(1024, len(signatures)), dtype=np.uint64)
+        self._signatures[:len(signatures)] = signatures
+        self._size = len(signatures)
+        self._sorted_values = None
+        self._sorted_ids = None
+        self._indexed = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._signatures[:self._size]
+    
+    def _bands(self, signatures: np.ndarray) -> List[np.ndarray]:
+        return [(signatures >> shift) & mask for shift, mask in zip(self._band_shifts, self._band_masks)]
+    
+    def append(self, signature: int):
+        """追加一个文本块的签名（下标为当前长度）"""
+        if self._size == len(self._signatures):
+            grown = np.empty(len(self._signatures) * 2, dtype=np.uint64)
+            grown[:self._size] = self.signatures
+            self._signatures = grown
+        self._signatures[self._size] = signature
+        self._size += 1
+    
+    def extend(self, signatures: np.ndarray):
+        for signature in np.asarray(signatures, dtype=np.uint64):
+            self.append(signature)
+    
+    def _merge_tail(self):
+        """尾部过长时把全部签名重新按段排序"""
+        tail = self._size - self._indexed
+        if self._sorted_values is not None and tail <= max(4096, int(np.sqrt(self._size)) * 16):
+            return
+        ids = np.nonzero(self.signatures)[0]
+        self._sorted_values, self._sorted_ids = [], []
+        for values in self._bands(self.signatures[ids]):
+            order = np.argsort(values, kind='stable')
+            self._sorted_values.append(values[order])
+            self._sorted_ids.append(ids[order])
+        self._indexed = self._size
+    
+    def candidates(self, signature: int) -> np.ndarray:
+        """至少有一段与 signature 相同的文本块下标"""
+        self._merge_tail()
+        keys = self._bands(np.asarray([signature], dtype=np.uint64))
+        parts = []
+        for key, values, ids in zip(keys, self._sorted_values, self._sorted_ids):
+            lo, hi = np.searchsorted(values, key[0], 'left'), np.searchsorted(values, key[0], 'right')
+            parts.append(ids[lo:hi])
+        tail = self._signatures[self._indexed:self._size]
+        if len(tail):
+            match = np.zeros(len(tail), dtype=bool)
+            for key, values in zip(keys, self._bands(tail)):
+                match |= values == key[0]
+            match &= tail != 0
+            parts.append(np.nonzero(match)[0] + self._indexed)
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+    
+    def find(self, signature: int, exclude: Optional[np.ndarray] = None,
+             accept: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+        """
+        查找与 signature 最相近的近重复文本块
+        
+        Args:
+            signature: 待查签名（为 0 时不查找）
+            exclude: 排除的文本块下标（如已删除的文本块），需已排序
+            accept: 校验候选的函数（如比较归一化文本），按距离由近到远逐个校验
+        
+        Returns:
+            距离最小（相同时下标最小）且通过校验的文本块下标，没有时为None
+        """
+        if not signature or not self._size:
+            return None
+        ids = self.candidates(signature)
+        if exclude is not None and len(exclude) and len(ids):
+            ids = ids[~np.isin(ids, exclude, assume_unique=True)]
+        if not len(ids):
+            return None
+        distances = hamming_distances(self._signatures[ids], signature)
+        for i in np.argsort(distances, kind='stable'):
+            if distances[i] > self.max_distance:
+                break
+            if accept is None or accept(int(ids[i])):
+                return int(ids[i])
+        return None
+    
+    def take(self, ids: np.ndarray) -> 'SimHashIndex':
+        """按新的下标顺序取出部分签名（压缩分片时重新编号）"""
+        return SimHashIndex(self.max_distance, self.signatures[np.asarray(ids, dtype=np.int64)])
+    
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (Path(directory) / cls.FILE).exists()
+    
+    @classmethod
+    def load(cls, directory: Path, max_distance: int) -> 'SimHashIndex':
+        return cls(max_distance, np.load(Path(directory) / cls.FILE))
+    
+    def save(self, directory: Path):
+        np.save(Path(directory) / self.FILE, self.signatures)
+
+
+def encode_deduplicated(texts: List[str], shards: Sequence, encode: Callable[[List[str]], np.ndarray]
+                        ) -> Tuple[np.ndarray, int]:
+    """
+    编码待写入的文本块，与已存储文本块重复（归一化文本相同）的直接取回其向量，不再调用模型
+    
+    Args:
+        texts: 文本块
+        shards: 查找近重复的分片（VectorKnowledgeBase，需提供 duplicate_vectors）
+        encode: 编码函数
+    
+    Returns:
+        (与 texts 对齐的向量, 复用已有向量的文本块数)
+    """
+    signatures = simhash_many(texts)
+    missing = np.arange(len(texts))
+    found_rows, found_vectors = [], []
+    for shard in shards:
+        if not len(missing):
+            break
+        rows, vectors = shard.duplicate_vectors(signatures[missing], [texts[row] for row in missing])
+        if len(rows):
+            found_rows.append(missing[rows])
+            found_vectors.append(vectors)
+            missing = np.delete(missing, rows)
+    
+    # 同一批中完全相同的文本只编码一次
+    first = {}
+    for row in missing:
+        first.setdefault(texts[row], row)
+    unique_rows = np.fromiter(first.values(), dtype=np.int64, count=len(first))
+    encoded = np.asarray(encode([texts[row] for row in unique_rows]), dtype='float32') if len(unique_rows) \
+        else None
+    
+    dimension = encoded.shape[1] if encoded is not None else found_vectors[0].shape[1]
+    embeddings = np.empty((len(texts), dimension), dtype='float32')
+    for rows, vectors in zip(found_rows, found_vectors):
+        embeddings[rows] = vectors
+    if encoded is not None:
+        position = {text: i for i, text in enumerate(first)}
+        embeddings[missing] = encoded[[position[texts[row]] for row in missing]]
+    return embeddings, len(texts) - len(unique_rows)
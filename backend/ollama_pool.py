@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ollama服务节点池
+在多个Ollama实例之间按“在途请求最少”分配生成请求，连续失败的节点被暂时摘除，
+摘除到期后放行一个探测请求（半开），成功即恢复；每个节点可配置各自使用的模型
+
+环境变量:
+    OLLAMA_ENDPOINTS   逗号分隔的节点列表，每项为 URL 或 URL=模型，如
+                       http://10.0.0.2:11434=gemma2:2b,http://10.0.0.3:11434=qwen2:1.5b
+    OLLAMA_URL         未设置 OLLAMA_ENDPOINTS 时使用的单个节点（默认 http://localhost:11434）
+    OLLAMA_MODEL       节点未指定模型时使用的模型（默认 gemma2:2b）
+    OLLAMA_FAILURE_THRESHOLD  连续失败多少次后摘除节点（默认 2）
+    OLLAMA_EJECT_SECONDS      摘除时长（秒，默认 30）
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import requests
+
+
+class OllamaEndpoint:
+    """单个Ollama节点及其运行状态"""
+    
+    def __init__(self, url: str, model: str):
+        self.url = url.rstrip('/')
+        self.model = model
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+        self.latency_ewma = None
+        self.last_error = None
+    
+    def available(self, now: float) -> bool:
+        """未被摘除，或摘除已到期且没有探测请求在途"""
+        return self.ejected_until <= now and not self.probing
+    
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'model': self.model,
+            'healthy': self.ejected_until <= now,
+            'ejected_for_seconds': round(max(0.0, self.ejected_until - now), 1),
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'latency_ms': round(self.latency_ewma * 1000.0, 1) if self.latency_ewma is not None else None,
+            'last_error': self.last_error
+        }
+
+
+class OllamaPool:
+    """
+    Ollama节点池
+    
+    acquire() 选出节点并计入在途请求，调用结束后必须以它返回的 probe 标记调用 release()。
+    """
+    
+    def __init__(self, endpoints: Iterable[Union[Tuple[str, str], OllamaEndpoint]],
+                 failure_threshold: int = 2, eject_seconds: float = 30.0):
+        """
+        初始化节点池
+        
+        Args:
+            endpoints: (URL, 模型) 列表
+            failure_threshold: 连续失败多少次后摘除节点
+            eject_seconds: 摘除时长（秒），到期后放行一个探测请求
+        """
+        self.endpoints = [e if isinstance(e, OllamaEndpoint) else OllamaEndpoint(*e) for e in endpoints]
+        if not self.endpoints:
+            raise ValueError("至少需要一个Ollama节点")
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+        self._next = 0
+    
+    @classmethod
+    def from_env(cls, default_url: str = "http://localhost:11434", default_model: str = "gemma2:2b") -> 'OllamaPool':
+        """从环境变量 OLLAMA_ENDPOINTS / OLLAMA_URL / OLLAMA_MODEL 构建节点池"""
+        model = os.getenv('OLLAMA_MODEL') or default_model
+        spec = os.getenv('OLLAMA_ENDPOINTS', '').strip()
+        endpoints = parse_endpoints(spec, model) if spec else [(os.getenv('OLLAMA_URL') or default_url, model)]
+        return cls(endpoints,
+                   failure_threshold=int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '2')),
+                   eject_seconds=float(os.getenv('OLLAMA_EJECT_SECONDS', '30')))
+    
+    def __len__(self) -> int:
+        return len(self.endpoints)
+    
+    @property
+    def primary(self) -> OllamaEndpoint:
+        return self.endpoints[0]
+    
+    def acquire(self, exclude: Iterable[str] = (), prefer: Optional[str] = None) -> Tuple[OllamaEndpoint, bool]:
+        """
+        选择在途请求最少的可用节点
+        
+        优先选择不在 exclude 中的节点（用于故障转移）；全部节点都被摘除时，
+        选择最早到期的节点，保证请求仍有机会成功。
+        
+        Args:
+            exclude: 本次请求已尝试过的节点URL
+            prefer: 可用时优先选择的节点URL（如会话的KV缓存所在节点）
+        
+        Returns:
+            (选中的节点, 是否为半开探测请求)
+        """
+        exclude = set(exclude)
+        with self._lock:
+            now = time.monotonic()
+            n = len(self.endpoints)
+            # 从轮转起点开始遍历，在途数相同时请求均匀分散
+            ordered = [self.endpoints[(self._next + i) % n] for i in range(n)]
+            self._next = (self._next + 1) % n
+            
+            candidates = [e for e in ordered if e.available(now) and e.url not in exclude]
+            if not candidates:
+                candidates = [e for e in ordered if e.available(now)]
+            preferred = [e for e in candidates if e.url == prefer]
+            if preferred:
+                endpoint = preferred[0]
+            elif candidates:
+                endpoint = min(candidates, key=lambda e: e.outstanding)
+            else:
+                endpoint = min(ordered, key=lambda e: (e.ejected_until, e.outstanding))
+            probe = endpoint.ejected_until > 0 and not endpoint.probing
+            if probe:
+                # 摘除到期后的第一个请求作为探测请求，结果出来前不再放行其他请求
+                endpoint.probing = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint, probe
+    
+    def release(self, endpoint: OllamaEndpoint, ok: Optional[bool], latency: Optional[float] = None,
+                error: Optional[str] = None, eject: bool = False, probe: bool = False):
+        """
+        归还节点并记录结果
+        
+        Args:
+            endpoint: acquire 返回的节点
+            ok: 调用是否成功（为None时表示请求被取消，不计入成功或失败）
+            latency: 调用耗时（秒）
+            error: 失败原因
+            eject: 是否立即摘除（如连接被拒绝、模型未安装）
+            probe: acquire 返回的探测标记；只有探测请求结束时才放行下一个请求，
+                摘除前已在途的普通请求结束不影响探测状态
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if probe:
+                endpoint.probing = False
+            if ok is None:
+                return
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.0
+                if latency is not None:
+                    endpoint.latency_ewma = latency if endpoint.latency_ewma is None \
+                        else 0.8 * endpoint.latency_ewma + 0.2 * latency
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_error = error
+            if eject or endpoint.consecutive_failures >= self.failure_threshold:
+                if endpoint.ejected_until <= time.monotonic():
+                    print(f"⚠️ Ollama节点已摘除 {self.eject_seconds:.0f} 秒: {endpoint.url} ({error})")
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+    
+    def has_alternative(self, tried: Iterable[str]) -> bool:
+        """是否还有未尝试过的可用节点"""
+        tried = set(tried)
+        now = time.monotonic()
+        with self._lock:
+            return any(e.available(now) and e.url not in tried for e in self.endpoints)
+    
+    def check_health(self, timeout: float = 5.0) -> List[Dict[str, Any]]:
+        """
+        探测所有节点：能否连接、所配置的模型是否已安装
+        
+        不可达或缺少模型的节点被摘除，正常的节点立即恢复。
+        
+        Returns:
+            各节点的探测结果
+        """
+        results = []
+        for endpoint in self.endpoints:
+            status = {'url': endpoint.url, 'model': endpoint.model, 'reachable': False,
+                      'model_installed': False, 'models': []}
+            try:
+                response = requests.get(f"{endpoint.url}/api/tags", timeout=timeout)
+                if response.status_code == 200:
+                    status['reachable'] = True
+                    status['models'] = [m['name'] for m in response.json().get('models', [])]
+                    status['model_installed'] = model_installed(endpoint.model, status['models'])
+            except requests.exceptions.RequestException as e:
+                status['error'] = str(e)
+            
+            with self._lock:
+                if status['reachable'] and status['model_installed']:
+                    endpoint.consecutive_failures = 0
+                    endpoint.ejected_until = 0.0
+                else:
+                    endpoint.last_error = status.get('error') or \
+                        ('模型未安装' if status['reachable'] else '无法连接')
+                    endpoint.ejected_until = time.monotonic() + self.eject_seconds
+            results.append(status)
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            endpoints = [e.to_dict(now) for e in self.endpoints]
+        return {
+            'endpoints': endpoints,
+            'healthy': sum(1 for e in endpoints if e['healthy']),
+            'total': len(endpoints)
+        }
+
+
+def parse_endpoints(spec: str, default_model: str) -> List[Tuple[str, str]]:
+    """解析 OLLAMA_ENDPOINTS：逗号分隔，每项为 URL 或 URL=模型"""
+    endpoints = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, model = item.partition('=')
+        endpoints.append((url.strip(), model.strip() or default_model))
+    return endpoints
+
+
+def model_installed(model: str, installed: Iterable[str]) -> bool:
+    """模型是否已安装（与Ollama一致，未写标签视为 :latest）"""
+    def normalize(name: str) -> str:
+        name = name.lower()
+        return name if ':' in name else name + ':latest'
+    model = normalize(model)
+    return any(normalize(name) == model for name in installed)
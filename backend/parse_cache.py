@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档解析结果缓存
+把解析并清理后的文本段（PDF每页一段）以 zlib 压缩的 JSON 保存在磁盘上，
+键由 (路径, 大小, 修改时间, 内容哈希, 解析器版本, 格式) 决定。
+更换分块参数或向量模型后重新导入时，未变化的文件无需再经过 PyPDF2/python-docx/BeautifulSoup 解析
+
+环境变量:
+    KB_PARSE_CACHE         是否启用解析缓存（默认 1）
+    KB_PARSE_CACHE_MB      缓存占用磁盘上限（MB，默认 512，超出时删除最久未使用的条目）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+
+Segments = List[Tuple[Optional[int], str]]
+
+
+class ParseCache:
+    """
+    磁盘上的解析结果缓存
+    
+    内容哈希按 (路径, 大小, 修改时间) 记忆在内存中，文件未变化时不必重新读取计算；
+    条目按内容哈希寻址，同一内容的文件移动或复制后仍可命中。
+    """
+    
+    def __init__(self, directory, max_bytes: int = 512 * 1024 * 1024, compress_level: int = 6,
+                 max_memo: int = 65536):
+        """
+        初始化解析缓存
+        
+        Args:
+            directory: 缓存目录
+            max_bytes: 缓存文件总大小上限（字节）
+            compress_level: zlib 压缩级别
+            max_memo: 内存中记忆的 (路径, 大小, 修改时间) → 内容哈希 条目上限
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.max_memo = max_memo
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._total_bytes = sum(f.stat().st_size for f in self.directory.glob('*/*.json.z'))
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evicted = 0
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+    
+    @classmethod
+    def from_env(cls, directory) -> Optional['ParseCache']:
+        """按环境变量创建缓存，KB_PARSE_CACHE 关闭时返回None"""
+        if os.getenv('KB_PARSE_CACHE', '1').lower() in ('0', 'false', 'off', 'no'):
+            return None
+        return cls(directory, max_bytes=int(float(os.getenv('KB_PARSE_CACHE_MB', '512')) * 1024 * 1024))
+    
+    def _content_hash(self, file_path: Path, stat: os.stat_result) -> str:
+        memo_key = (str(file_path.resolve()), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._memo.get(memo_key)
+        if digest is not None:
+            return digest
+        
+        hasher = hashlib.blake2b(digest_size=20)
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        with self._lock:
+            if len(self._memo) >= self.max_memo:
+                self._memo.clear()
+            self._memo[memo_key] = digest
+        return digest
+    
+    def _entry_path(self, file_path: Path, file_format: str, parser_version: str) -> Tuple[Path, os.stat_result]:
+        stat = file_path.stat()
+        content_hash = self._content_hash(file_path, stat)
+        key = hashlib.blake2b(f'{content_hash}|{file_format}|{parser_version}'.encode('utf-8'),
+                              digest_size=20).hexdigest()
+        return self.directory / key[:2] / f'{key}.json.z', stat
+    
+    def get(self, file_path, file_format: str, parser_version: str) -> Optional[Tuple[Segments, float]]:
+        """
+        读取缓存的解析结果
+        
+        Args:
+            file_path: 文档路径
+            file_format: 小写扩展名（如 .pdf）
+            parser_version: 解析器版本（含提取后端）
+        
+        Returns:
+            (文本段列表, 当初解析耗时秒数)，未命中时返回None
+        """
+        path, _ = self._entry_path(Path(file_path), file_format, parser_version)
+        try:
+            with open(path, 'rb') as f:
+                payload = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+            os.utime(path)  # 记录最近使用时间，供淘汰时参考
+        except (OSError, ValueError, zlib.error):
+            with self._lock:
+                self._misses += 1
+            metrics.PARSE_CACHE_LOOKUPS.inc(result='miss', format=file_format)
+            return None
+        
+        with self._lock:
+            self._hits += 1
+        metrics.PARSE_CACHE_LOOKUPS.inc(result='hit', format=file_format)
+        return [(page, text) for page, text in payload['segments']], payload['parse_seconds']
+    
+    def put(self, file_path, file_format: str, parser_version: str, segments: Segments, parse_seconds: float,
+            stat_before: Optional[os.stat_result] = None):
+        """
+        保存解析结果（解析期间文件发生变化时不保存）
+        
+        Args:
+            file_path: 文档路径
+            file_format: 小写扩展名
+            parser_version: 解析器版本（含提取后端）
+            segments: 清理后的文本段
+            parse_seconds: 解析耗时（秒）
+            stat_before: 解析开始前的文件状态
+        """
+        file_path = Path(file_path)
+        path, stat = self._entry_path(file_path, file_format, parser_version)
+        if stat_before is not None and (stat.st_size, stat.st_mtime_ns) != (stat_before.st_size, stat_before.st_mtime_ns):
+            return
+        
+        raw = json.dumps({
+            'file_path': str(file_path),
+            'format': file_format,
+            'parser_version': parser_version,
+            'parse_seconds': round(parse_seconds, 6),
+            'segments': segments
+        }, ensure_ascii=False).encode('utf-8')
+        data = zlib.compress(raw, self.compress_level)
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            old_size = path.stat().st_size if path.exists() else 0
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ 写入解析缓存失败: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+        
+        with self._lock:
+            self._stores += 1
+            self._raw_bytes += len(raw)
+            self._stored_bytes += len(data)
+            self._total_bytes += len(data) - old_size
+            over = self._total_bytes > self.max_bytes
+        if over:
+            self._evict()
+    
+    def _evict(self):
+        """删除最久未使用的条目，直到总大小降到上限的 90%"""
+        entries = []
+        for f in self.directory.glob('*/*.json.z'):
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, f))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, f in entries:
+            if total <= target:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._total_bytes = total
+            self._evicted += evicted
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'directory': str(self.directory),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'stores': self._stores,
+                'evicted': self._evicted,
+                'disk_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'compression_ratio': round(self._raw_bytes / self._stored_bytes, 2) if self._stored_bytes else None
+            }
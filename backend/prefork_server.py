@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程预派生服务
+主进程加载向量模型、把知识库发布为一代只读目录后预先 fork 出工作进程，工作进程共享同一个监听套接字。
+工作进程以只读内存映射方式打开 FAISS 索引与文本块，N 个进程共用一份页缓存与模型权重，
+检索吞吐随CPU核数扩展，而不是每个进程各持一份索引。
+
+写入只发生在一个写入进程中（监听本机端口）：工作进程把上传、添加文档、重建与多轮会话请求转发给它；
+写入进程保存时发布新一代（未改动的分片硬链接），工作进程发现 CURRENT 变化后切换。
+主进程只负责监督，子进程退出后自动拉起
+
+环境变量:
+    KB_WORKERS           工作进程数（大于 1 时 api_server 以本模式启动）
+    KB_WRITER_PORT       写入进程监听的本机端口（默认随机空闲端口）
+    KB_REFRESH_INTERVAL  检查新一代的间隔（秒，默认 1；写入进程据此热加载离线批量构建安装的一代）
+    KB_SYNC_DIRS         目录同步只在写入进程中运行（见 directory_sync.py）
+"""
+
+import os
+import signal
+import socket
+import sys
+import time
+from http.server import ThreadingHTTPServer
+
+# 添加backend目录到Python路径
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, backend_dir)
+
+from directory_sync import DirectorySync
+from sharded_knowledge_base import ShardedKnowledgeBase
+import api_server
+from api_server import APIHandler
+
+
+# 子进程启动后这么快就退出时，拉起前先等待，避免崩溃循环占满CPU
+RESPAWN_BACKOFF_SECONDS = 1.0
+
+
+class _InheritedSocketServer(ThreadingHTTPServer):
+    """使用主进程已绑定并监听的套接字，所有工作进程在同一个套接字上 accept"""
+    
+    daemon_threads = True
+    
+    def __init__(self, sock: socket.socket):
+        super().__init__(sock.getsockname()[:2], APIHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+
+
+def _knowledge_base_options():
+    # 与 run_server 相同的环境变量
+    return {
+        'num_shards': int(os.getenv('KB_SHARDS', '1')),
+        'index_type': os.getenv('KB_INDEX_TYPE', 'Flat'),
+        'rescore_factor': int(os.getenv('KB_RESCORE_FACTOR', '4')),
+        'compact_ratio': float(os.getenv('KB_COMPACT_RATIO', '0.25')),
+        'dedup_distance': int(os.getenv('KB_DEDUP_DISTANCE', '-1')),
+        'pdf_workers': int(os.getenv('KB_PDF_WORKERS', '1'))
+    }
+
+
+def _run_writer(writer_socket: socket.socket, public_socket: socket.socket, model):
+    """写入进程：唯一可以修改知识库的进程，保存时发布新一代"""
+    public_socket.close()
+    kb = ShardedKnowledgeBase(publish_on_save=True, model=model, **_knowledge_base_options())
+    kb.watch_generations(float(os.getenv('KB_REFRESH_INTERVAL', '1')))
+    APIHandler._kb = kb
+    APIHandler._retriever = api_server.create_retriever(kb)
+    APIHandler._behind_workers = True
+    APIHandler._initialized = True
+    APIHandler._sync = DirectorySync.from_env(kb)
+    if APIHandler._sync is not None:
+        APIHandler._sync.start()
+    print(f"✍️ 写入进程 {os.getpid()} 已就绪: 127.0.0.1:{writer_socket.getsockname()[1]}")
+    _InheritedSocketServer(writer_socket).serve_forever()
+
+
+def _run_worker(public_socket: socket.socket, writer_socket: socket.socket, model, model_name: str):
+    """工作进程：以只读内存映射方式打开当前一代，处理检索与问答"""
+    writer_port = writer_socket.getsockname()[1]
+    writer_socket.close()
+    kb = ShardedKnowledgeBase(model_name=model_name, read_only=True, model=model, **_knowledge_base_options())
+    kb.watch_generations(float(os.getenv('KB_REFRESH_INTERVAL', '1')))
+    APIHandler._kb = kb
+    APIHandler._retriever = api_server.create_retriever(kb)
+    APIHandler._writer_url = f"http://127.0.0.1:{writer_port}"
+    APIHandler._initialized = True
+    print(f"👷 工作进程 {os.getpid()} 已就绪: 第 {kb.generation} 代, {kb.get_stats()['total_vectors']} 向量")
+    _InheritedSocketServer(public_socket).serve_forever()
+
+
+def _spawn(target, *args) -> int:
+    """fork 一个子进程执行 target，返回子进程ID"""
+    # 先刷新输出缓冲，否则子进程退出时会再输出一遍主进程缓冲中的内容
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    # 子进程：恢复默认信号处理，由主进程统一发送 SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    code = 0
+    try:
+        target(*args)
+    except BaseException as e:
+        print(f"❌ 子进程 {os.getpid()} 异常退出: {e}")
+        code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+def run_prefork(port: int = 5000, workers: int = 2):
+    """
+    以多进程预派生模式启动服务
+    
+    Args:
+        port: 对外监听端口（地址由环境变量 HOST 决定）
+        workers: 工作进程数
+    """
+    print("=" * 60)
+    print(f"🚀 本地向量知识库 API服务器（多进程模式，{workers} 个工作进程）")
+    print("=" * 60)
+    # 工作进程各自有检索线程池，避免 tokenizers 在 fork 后再开线程池
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+    
+    print("🔄 正在加载向量模型...")
+    kb = ShardedKnowledgeBase(publish_on_save=True, **_knowledge_base_options())
+    if kb.generation == 0:
+        # 旧布局会被原地改写，先发布为一代，工作进程只读映射的文件从此不再被修改
+        kb.publish()
+    model, model_name = kb.model, kb.model_name
+    stats = kb.get_stats()
+    print(f"📊 知识库状态: 第 {kb.generation} 代, {stats['total_documents']} 文档, {stats['total_vectors']} 向量")
+    try:
+        api_server.check_ollama(api_server.create_retriever(kb))
+    except Exception as e:
+        print(f"⚠️ {e}，问答功能可能不可用")
+    # 主进程不持有索引，只保留模型供子进程通过 fork 共享
+    del kb, stats
+    
+    host = os.getenv('HOST', '127.0.0.1')
+    public_socket = socket.create_server((host, port), backlog=128)
+    writer_socket = socket.create_server(('127.0.0.1', int(os.getenv('KB_WRITER_PORT', '0'))), backlog=128)
+    writer_port = writer_socket.getsockname()[1]
+    
+    roles = {}
+    
+    def spawn(role):
+        if role == 'writer':
+            pid = _spawn(_run_writer, writer_socket, public_socket, model)
+        else:
+            pid = _spawn(_run_worker, public_socket, writer_socket, model, model_name)
+        roles[pid] = (role, time.monotonic())
+    
+    stopping = False
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(roles):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    spawn('writer')
+    for i in range(workers):
+        spawn(f'worker-{i}')
+    
+    print("=" * 60)
+    print("✅ 服务器已就绪，可以接受连接")
+    print(f"📡 监听在: {host}:{port}（写入进程 127.0.0.1:{writer_port}）")
+    print("按 Ctrl+C 停止服务器")
+    print("=" * 60)
+    
+    while roles:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        role, started = roles.pop(pid, (None, 0.0))
+        if role is None or stopping:
+            continue
+        print(f"⚠️ {role} 进程 {pid} 已退出（状态 {status}），重新启动")
+        if time.monotonic() - started < RESPAWN_BACKOFF_SECONDS:
+            time.sleep(RESPAWN_BACKOFF_SECONDS)
+        spawn(role)
+    
+    public_socket.close()
+    writer_socket.close()
+    print("\n🛑 服务器已停止")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+问题语义缓存
+用一个小型 FAISS 内积索引保存历史问题的向量（归一化后即余弦相似度），映射到当时的答案与来源文本块。
+新问题与某个历史问题足够相似、且检索参数一致时直接返回缓存的答案，不再调用Ollama；
+来源文档发生变化（重新导入、清空集合）时对应条目失效，条目数超过上限时淘汰最久未命中的条目
+
+环境变量:
+    KB_SEMANTIC_CACHE_SIZE       缓存条目上限（默认 0 关闭缓存，需显式开启：只差一个数字或实体的问题向量也很相近，
+                                 可能命中彼此的答案，适合问题重复度高、措辞固定的场景）
+    KB_SEMANTIC_CACHE_THRESHOLD  命中所需的问题相似度（默认 0.95）
+    KB_SEMANTIC_CACHE_TTL        条目有效期（秒，默认 3600，0 表示不过期）
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import metrics
+
+
+class _CacheEntry:
+    __slots__ = ('entry_id', 'question', 'params', 'result', 'files', 'created', 'hits')
+    
+    def __init__(self, entry_id: int, question: str, params: Tuple, result: Dict[str, Any], files: set):
+        self.entry_id = entry_id
+        self.question = question
+        self.params = params
+        self.result = result
+        self.files = files
+        self.created = time.monotonic()
+        self.hits = 0
+
+
+class SemanticCache:
+    """
+    问题语义缓存
+    
+    params 为影响答案的检索参数（集合、top_k、相似度阈值、答案模式），
+    只有参数完全一致的条目才可能命中；条目按 (集合, 文件路径) 建立反向索引以便失效。
+    """
+    
+    def __init__(self, dimension: int, threshold: float = 0.95, max_entries: int = 1024,
+                 ttl: Optional[float] = 3600.0, candidates: int = 8):
+        """
+        初始化语义缓存
+        
+        Args:
+            dimension: 问题向量维度
+            threshold: 命中所需的最低余弦相似度
+            max_entries: 条目数量上限
+            ttl: 条目有效期（秒，None或0表示不过期）
+            candidates: 每次查找检查的近邻条目数
+        """
+        self.dimension = dimension
+        self.threshold = threshold
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl or None
+        self.candidates = candidates
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self._entries = OrderedDict()
+        self._by_file = defaultdict(set)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+        self._invalidated = 0
+    
+    @classmethod
+    def from_env(cls, dimension: int) -> Optional['SemanticCache']:
+        """按环境变量创建缓存，KB_SEMANTIC_CACHE_SIZE 为 0 时返回None"""
+        size = int(os.getenv('KB_SEMANTIC_CACHE_SIZE', '0'))
+        if size <= 0:
+            return None
+        return cls(dimension,
+                   threshold=float(os.getenv('KB_SEMANTIC_CACHE_THRESHOLD', '0.95')),
+                   max_entries=size,
+                   ttl=float(os.getenv('KB_SEMANTIC_CACHE_TTL', '3600')))
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+    
+    def lookup(self, embedding: np.ndarray, params: Tuple) -> Optional[Dict[str, Any]]:
+        """
+        查找与问题相似且参数一致的缓存答案
+        
+        Args:
+            embedding: 问题向量
+            params: 检索参数
+        
+        Returns:
+            缓存结果的副本（附 cached_question 与 cache_similarity），未命中时返回None
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._ensure_dimension_locked(vector.shape[1])
+            if self.index.ntotal == 0:
+                self._misses += 1
+                metrics.SEMANTIC_CACHE_LOOKUPS.inc(result='miss')
+                return None
+            scores, ids = self.index.search(vector, min(self.candidates, self.index.ntotal))
+            now = time.monotonic()
+            for score, entry_id in zip(scores[0].tolist(), ids[0].tolist()):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self._entries.get(entry_id)
+                if entry is None or entry.params != params:
+                    continue
+                if self.ttl is not None and now - entry.created > self.ttl:
+                    self._remove_locked(entry_id)
+                    continue
+                entry.hits += 1
+                self._entries.move_to_end(entry_id)
+                self._hits += 1
+                metrics.SEMANTIC_CACHE_LOOKUPS.inc(result='hit')
+                result = copy.deepcopy(entry.result)
+                result['cached_question'] = entry.question
+                result['cache_similarity'] = round(score, 4)
+                return result
+            self._misses += 1
+            metrics.SEMANTIC_CACHE_LOOKUPS.inc(result='miss')
+            return None
+    
+    def store(self, embedding: np.ndarray, question: str, params: Tuple, result: Dict[str, Any],
+              collection: str):
+        """
+        缓存一个答案
+        
+        Args:
+            embedding: 问题向量
+            question: 问题原文
+            params: 检索参数
+            result: 问答结果（会被复制）
+            collection: 集合名称，与来源文件路径一起用于失效
+        """
+        files = {(collection, source['file_path']) for source in result.get('sources', [])}
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._ensure_dimension_locked(vector.shape[1])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _CacheEntry(entry_id, question, params, copy.deepcopy(result), files)
+            self.index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+            for key in files:
+                self._by_file[key].add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+                self._evicted += 1
+            metrics.SEMANTIC_CACHE_ENTRIES.set(len(self._entries))
+    
+    def invalidate(self, collection: str, file_paths: Optional[Iterable[str]] = None) -> int:
+        """
+        使引用了指定文件的条目失效
+        
+        Args:
+            collection: 集合名称
+            file_paths: 发生变化的文件路径（为None时使整个集合的条目失效）
+        
+        Returns:
+            失效的条目数
+        """
+        with self._lock:
+            if file_paths is None:
+                stale = {entry_id for (name, _), ids in self._by_file.items() if name == collection
+                         for entry_id in ids}
+            else:
+                stale = set()
+                for path in file_paths:
+                    stale.update(self._by_file.get((collection, str(path)), ()))
+            for entry_id in stale:
+                self._remove_locked(entry_id)
+            self._invalidated += len(stale)
+            metrics.SEMANTIC_CACHE_ENTRIES.set(len(self._entries))
+            return len(stale)
+    
+    def clear(self):
+        with self._lock:
+            self.index.reset()
+            self._entries.clear()
+            self._by_file.clear()
+            metrics.SEMANTIC_CACHE_ENTRIES.set(0)
+    
+    def _ensure_dimension_locked(self, dimension: int):
+        """知识库重建更换了向量模型后，旧向量不可比较，清空缓存并按新维度重建索引"""
+        if dimension == self.dimension:
+            return
+        self.dimension = dimension
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self._entries.clear()
+        self._by_file.clear()
+        metrics.SEMANTIC_CACHE_ENTRIES.set(0)
+    
+    def _remove_locked(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self.index.remove_ids(np.array([entry_id], dtype='int64'))
+        for key in entry.files:
+            ids = self._by_file.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._by_file[key]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evicted': self._evicted,
+                'invalidated': self._invalidated
+            }
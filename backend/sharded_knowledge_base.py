@@ -0,0 +1,914 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片知识库
+将知识库按命名集合划分，每个集合再按文件路径哈希拆分为多个独立持久化的分片，
+检索时在线程池中并发查询各分片并合并 top-k
+"""
+
+import base64
+import binascii
+import heapq
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Dict, Any, Optional
+
+import numpy as np
+
+from document_processor import DocumentProcessor
+from document_retrieval import DOCUMENT_OVERFETCH, rank_documents
+from index_rebuild import IndexRebuild, MANIFEST_FILE, REBUILD_SOURCES
+from ingest_pipeline import IngestPipeline
+from parse_cache import ParseCache
+from vector_knowledge_base import (VectorKnowledgeBase, DOCUMENT_SORT_KEYS, load_embedding_model, new_index,
+                                   retry_stale, score_cutoff, shard_files)
+import metrics
+import tracing
+
+
+# 集合名只允许字母、数字、下划线、连字符和中文，避免路径穿越
+_COLLECTION_NAME_RE = re.compile(r'^[A-Za-z0-9_\-\u4e00-\u9fff]{1,64}$')
+
+# 影子重建产生的各代目录：storage_dir/gen_N，CURRENT 文件记录当前使用的目录名
+_GENERATION_RE = re.compile(r'^gen_(\d+)$')
+CURRENT_FILE = 'CURRENT'
+
+
+def read_current(storage_dir: Path) -> Optional[str]:
+    """CURRENT 指向的目录名，没有指针（重建前的布局）时返回None"""
+    try:
+        return (Path(storage_dir) / CURRENT_FILE).read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_current(storage_dir: Path, name: str):
+    """原子地把 CURRENT 指向 name：先写临时文件再 rename，任何时刻都指向一个完整的目录"""
+    tmp = Path(storage_dir) / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+    tmp.write_text(name, encoding='utf-8')
+    os.replace(tmp, Path(storage_dir) / CURRENT_FILE)
+
+
+def next_generation(storage_dir: Path, current: int = 0) -> int:
+    """下一代的编号：大于当前一代及目录中已有的任何一代（其他进程可能已建好更新的一代）"""
+    existing = [int(m.group(1)) for m in (_GENERATION_RE.match(p.name) for p in Path(storage_dir).iterdir()) if m]
+    return max([current, *existing]) + 1
+
+
+def collection_root(data_dir: Path, name: str) -> Path:
+    """集合在一代目录中的根目录：默认集合即该目录本身，命名集合位于 collections/<name>"""
+    if name == ShardedKnowledgeBase.DEFAULT_COLLECTION:
+        return Path(data_dir)
+    return Path(data_dir) / "collections" / name
+
+
+def scan_collections(data_dir: Path) -> List[str]:
+    """默认集合及目录中已存在的命名集合"""
+    names = [ShardedKnowledgeBase.DEFAULT_COLLECTION]
+    collections_dir = Path(data_dir) / "collections"
+    if collections_dir.exists():
+        for path in sorted(collections_dir.iterdir()):
+            if path.is_dir() and _COLLECTION_NAME_RE.match(path.name):
+                names.append(path.name)
+    return names
+
+
+class KnowledgeBaseBusyError(RuntimeError):
+    """知识库正在影子重建（或重建无法开始，因为有写入在进行），应返回 409"""
+
+
+class KnowledgeBaseReadOnlyError(RuntimeError):
+    """只读知识库（多进程模式的工作进程）不能写入，写入由写入进程负责"""
+
+
+class _CollectionWriter:
+    """
+    供 IngestPipeline 使用的写入适配器
+    
+    按文件路径把文档路由到集合内的某个分片，对流水线表现为单个知识库。
+    """
+    
+    def __init__(self, owner: 'ShardedKnowledgeBase', collection: str):
+        self.owner = owner
+        self.collection = collection
+        self.model = owner.model
+        self.dimension = owner.dimension
+        self.embed_batch_size = owner.embed_batch_size
+        self._doc_shards = {}
+    
+    def start_document(self, file_path: str, file_size: int, file_mtime: Optional[float] = None) -> Dict[str, Any]:
+        shard = self.owner._route(self.collection, file_path)
+        doc = shard.start_document(file_path, file_size, file_mtime)
+        self._doc_shards[id(doc)] = shard
+        return doc
+    
+    def encode_chunks(self, texts: List[str]):
+        # 可复用集合内任一分片中近重复文本块的向量（写入时再在所属分片内去重）
+        shards = self.owner._open_collection(self.collection)
+        return shards[0].encode_chunks(texts, shards)
+    
+    def append_chunks(self, doc: Dict[str, Any], texts, pages, embeddings):
+        self._doc_shards[id(doc)].append_chunks(doc, texts, pages, embeddings)
+    
+    def finish_document(self, doc: Dict[str, Any], word_count: int):
+        shard = self._doc_shards.pop(id(doc))
+        shard.finish_document(doc, word_count)
+        self.owner._dirty.add(id(shard))
+        self.owner._notify_change(self.collection, [doc['file_path']])
+
+
+class ShardedKnowledgeBase:
+    """
+    分片知识库类
+    
+    存储布局（num_shards 为 1 时不建 shard_N 子目录，与单索引知识库的目录完全兼容）：
+        storage_dir/                        默认集合
+        storage_dir/shard_N/                默认集合的第 N 个分片
+        storage_dir/collections/<name>/     命名集合（其下同样可再分 shard_N）
+    
+    影子重建后数据位于 storage_dir/gen_N/ 下（布局同上），storage_dir/CURRENT 记录当前一代，
+    gen_N/generation.json 记录该代的模型、索引类型与分片数。
+    
+    多进程模式下只有一个写入进程（publish_on_save），保存时把改动的分片写入新一代目录、
+    未改动的分片硬链接过去，再切换 CURRENT；各工作进程以只读模式（read_only）通过内存映射
+    打开当前一代，发现 CURRENT 变化后重新打开，已映射的旧文件不会被原地改写。
+    """
+    
+    DEFAULT_COLLECTION = 'default'
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", storage_dir: str = "./knowledge_base",
+                 num_shards: int = 1, max_workers: Optional[int] = None, embed_batch_size: int = 64,
+                 index_type: str = 'Flat', read_only: bool = False, publish_on_save: bool = False,
+                 model=None, rescore_factor: int = 4, compact_ratio: float = 0.25,
+                 dedup_distance: Optional[int] = None, pdf_workers: Optional[int] = None):
+        """
+        初始化分片知识库
+        
+        Args:
+            model_name: 句子转换模型名称
+            storage_dir: 存储根目录
+            num_shards: 每个集合的分片数量
+            max_workers: 并发检索线程数（默认CPU核数）
+            embed_batch_size: 添加文档时每批编码的文本块数量
+            index_type: FAISS索引类型（faiss.index_factory 描述串，需要训练的类型通过重建生成）
+            read_only: 只读模式（工作进程），分片以内存映射方式打开，通过 refresh() 跟随新一代
+            publish_on_save: 保存时发布新一代而不是原地改写文件（多进程模式的写入进程）
+            model: 已加载的模型实例（为None时按 model_name 加载）
+            rescore_factor: 量化索引（如 SQ8）先取 top_k 的多少倍候选再用原始向量精确重排（0 不重排）
+            compact_ratio: 分片中已删除的文本块超过该比例时压缩（0 不压缩，影子重建时总会去除）
+            dedup_distance: 近重复文本块的 SimHash 汉明距离阈值（None 或负数不去重，去重在分片内进行）
+            pdf_workers: 导入PDF时并行提取的进程数（None表示CPU核数，1表示不并行）
+        """
+        self.model_name = model_name
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.num_shards = max(1, int(num_shards))
+        self.embed_batch_size = embed_batch_size
+        self.index_type = index_type
+        self.read_only = read_only
+        self.publish_on_save = publish_on_save
+        self.rescore_factor = rescore_factor
+        self.compact_ratio = compact_ratio
+        self.dedup_distance = dedup_distance if dedup_distance is not None and dedup_distance >= 0 else None
+        self.pdf_workers = pdf_workers
+        self.generation, self.data_dir = self._load_current_generation()
+        # 本进程切换 CURRENT 前它指向的目录名（发布模式下工作进程可能仍在打开它）
+        self._previous_current = None
+        if self.model_name != model_name:
+            # 传入的模型实例与当前一代的模型不一致（如重建更换了模型），改为按清单加载
+            model = None
+        # 解析结果缓存不随集合清空而删除，重新导入时未变化的文件无需再次解析
+        self.parse_cache = None if read_only else ParseCache.from_env(self.storage_dir / "parse_cache")
+        
+        # 所有分片共享同一个模型
+        self.model = model if model is not None else load_embedding_model(self.model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                            thread_name_prefix='kb-shard')
+        self._collections = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self._change_listeners = []
+        self._active_writes = 0
+        self._rebuild = None
+        self._last_rebuild = None
+        self._watcher = None
+        
+        # 加载默认集合及磁盘上已存在的命名集合
+        for name in self._scan_collections(self.data_dir):
+            self._collections[name] = self._load_shards(name, self.data_dir, self.model_name, self.model,
+                                                        self.index_type, self.num_shards)
+    
+    @property
+    def shards(self) -> List[VectorKnowledgeBase]:
+        """所有集合的全部分片"""
+        return [shard for shards in self._collections.values() for shard in shards]
+    
+    def list_collections(self) -> List[str]:
+        """列出所有集合名称"""
+        return list(self._collections.keys())
+    
+    def add_change_listener(self, listener: Callable[[str, Optional[List[str]]], None]):
+        """
+        注册文档变更回调
+        
+        listener(collection, file_paths) 在文档导入完成或集合被清空后调用，
+        file_paths 为None表示整个集合都发生了变化。
+        """
+        self._change_listeners.append(listener)
+    
+    def _notify_change(self, collection: str, file_paths: Optional[List[str]]):
+        for listener in self._change_listeners:
+            try:
+                listener(collection, file_paths)
+            except Exception as e:
+                print(f"⚠️ 文档变更回调失败: {e}")
+    
+    def _read_current(self) -> Optional[str]:
+        return read_current(self.storage_dir)
+    
+    def _read_generation(self, name: str):
+        """读取一代的目录与清单，返回 (编号, 目录, 清单)"""
+        match = _GENERATION_RE.match(name)
+        if not match or not (self.storage_dir / name).is_dir():
+            raise ValueError(f"CURRENT 指向无效的目录: {name}")
+        manifest = {}
+        manifest_file = self.storage_dir / name / MANIFEST_FILE
+        if manifest_file.exists():
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        return int(match.group(1)), self.storage_dir / name, manifest
+    
+    def _load_current_generation(self):
+        """读取 CURRENT 指针与该代的清单；没有指针时使用 storage_dir 本身（重建前的布局）"""
+        name = self._read_current()
+        if name is None:
+            return 0, self.storage_dir
+        generation, data_dir, manifest = self._read_generation(name)
+        # 索引数据依赖生成它时的模型与分片数，以清单为准
+        if manifest.get('model_name', self.model_name) != self.model_name:
+            print(f"⚠️ 第 {generation} 代使用模型 {manifest['model_name']}，忽略参数 {self.model_name}")
+        self.model_name = manifest.get('model_name', self.model_name)
+        self.index_type = manifest.get('index_type', self.index_type)
+        self.num_shards = int(manifest.get('num_shards', self.num_shards))
+        return generation, data_dir
+    
+    def _scan_collections(self, data_dir: Path) -> List[str]:
+        return scan_collections(data_dir)
+    
+    def _collection_root(self, name: str, data_dir: Optional[Path] = None) -> Path:
+        return collection_root(data_dir or self.data_dir, name)
+    
+    @staticmethod
+    def _shard_dirs(root: Path, num_shards: int) -> List[Path]:
+        if num_shards == 1:
+            return [root]
+        return [root / f"shard_{i}" for i in range(num_shards)]
+    
+    @staticmethod
+    def route_index(file_path: str, num_shards: int) -> int:
+        """按文件路径的稳定哈希计算分片编号"""
+        return zlib.crc32(str(file_path).encode('utf-8')) % num_shards
+    
+    def _open_collection(self, name: str) -> List[VectorKnowledgeBase]:
+        """打开（必要时创建）集合的全部分片"""
+        with self._lock:
+            return self._open_collection_locked(name)
+    
+    def _open_collection_locked(self, name: str) -> List[VectorKnowledgeBase]:
+        if name in self._collections:
+            return self._collections[name]
+        if not _COLLECTION_NAME_RE.match(name):
+            raise ValueError(f"非法的集合名称: {name}")
+        
+        if self.read_only:
+            raise KnowledgeBaseReadOnlyError(f"只读知识库中不存在集合: {name}")
+        shards = self._load_shards(name, self.data_dir, self.model_name, self.model, self.index_type,
+                                   self.num_shards)
+        self._collections[name] = shards
+        return shards
+    
+    def _load_shards(self, name: str, data_dir: Path, model_name: str, model, index_type: str,
+                     num_shards: int) -> List[VectorKnowledgeBase]:
+        root = self._collection_root(name, data_dir)
+        dirs = self._shard_dirs(root, num_shards)
+        if num_shards > 1:
+            # 分片数调整前写在集合根目录下的数据继续作为额外分片参与检索
+            if (root / "config.json").exists():
+                print(f"⚠️ 集合 {name} 根目录下存在未分片的旧数据，将作为额外分片加载")
+                dirs.append(root)
+        
+        return [
+            VectorKnowledgeBase(model_name, str(d), embed_batch_size=self.embed_batch_size, model=model,
+                                parse_cache=self.parse_cache, index_type=index_type, read_only=self.read_only,
+                                rescore_factor=self.rescore_factor, dedup_distance=self.dedup_distance,
+                                pdf_workers=self.pdf_workers)
+            for d in dirs
+        ]
+    
+    def _get_collection(self, name: Optional[str]) -> List[VectorKnowledgeBase]:
+        """获取已存在的集合，不存在时抛出 KeyError"""
+        name = name or self.DEFAULT_COLLECTION
+        if name not in self._collections:
+            raise KeyError(f"集合不存在: {name}")
+        return self._collections[name]
+    
+    def _route(self, collection: str, file_path: str) -> VectorKnowledgeBase:
+        """按文件路径的稳定哈希选择分片（同一文件的所有文本块位于同一分片）"""
+        shards = self._open_collection(collection)
+        return shards[self.route_index(file_path, self.num_shards)]
+    
+    @contextmanager
+    def _writing(self):
+        """登记一次写入；影子重建进行中时拒绝写入，切换后的新一代才不会漏掉文档"""
+        if self.read_only:
+            raise KnowledgeBaseReadOnlyError("只读知识库不能写入")
+        with self._lock:
+            if self._rebuild is not None:
+                raise KnowledgeBaseBusyError("知识库正在重建，暂时不能写入")
+            self._active_writes += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_writes -= 1
+    
+    def add_document(self, file_path: str, collection: Optional[str] = None, replace: bool = False) -> Dict[str, Any]:
+        """
+        添加单个文档到指定集合
+        
+        Args:
+            file_path: 文档路径
+            collection: 集合名称（默认集合为None）
+            replace: 写入后删除同一路径的旧版本
+        
+        Returns:
+            处理结果
+        """
+        collection = collection or self.DEFAULT_COLLECTION
+        with self._writing():
+            shard = self._route(collection, file_path)
+            doc_info = shard.add_document(file_path, replace=replace)
+            self._dirty.add(id(shard))
+            if replace:
+                self._maybe_compact(shard)
+        doc_info['collection'] = collection
+        self._notify_change(collection, [doc_info.get('file_path', str(file_path))])
+        return doc_info
+    
+    def remove_document(self, file_path: str, collection: Optional[str] = None) -> int:
+        """
+        从指定集合中删除一个文件的文档（源文件已删除时由目录同步调用）
+        
+        Args:
+            file_path: 文档路径（与导入时的路径一致）
+            collection: 集合名称（默认集合为None）
+        
+        Returns:
+            删除的文档记录数（集合或文档不存在时为 0）
+        """
+        collection = collection or self.DEFAULT_COLLECTION
+        with self._writing():
+            if collection not in self._collections:
+                return 0
+            shard = self._route(collection, file_path)
+            removed = shard.remove_document(file_path)
+            if removed:
+                self._dirty.add(id(shard))
+                self._maybe_compact(shard)
+        if removed:
+            self._notify_change(collection, [str(file_path)])
+        return removed
+    
+    def _maybe_compact(self, shard: VectorKnowledgeBase):
+        """已删除的文本块超过 compact_ratio 时压缩分片，检索开销不随删除累积"""
+        if self.compact_ratio and shard.deleted_ratio > self.compact_ratio:
+            shard.compact()
+    
+    def add_directory(self, directory_path: str, collection: Optional[str] = None,
+                      max_inflight_bytes: int = 64 * 1024 * 1024) -> List[Dict[str, Any]]:
+        """
+        通过流式流水线把目录中的所有文档添加到指定集合
+        
+        Args:
+            directory_path: 目录路径
+            collection: 集合名称（默认集合为None）
+            max_inflight_bytes: 流水线中在途文本与向量的字节上限
+        
+        Returns:
+            处理结果列表
+        """
+        writer = _CollectionWriter(self, collection or self.DEFAULT_COLLECTION)
+        pipeline = IngestPipeline(writer, DocumentProcessor(pdf_workers=self.pdf_workers, parse_cache=self.parse_cache),
+                                  max_inflight_bytes=max_inflight_bytes)
+        with self._writing():
+            summary = pipeline.run_directory(directory_path)
+        print(f"📊 导入完成: {summary['document_count']} 文档, {summary['chunk_count']} 块, "
+              f"耗时 {summary['elapsed_seconds']}s")
+        if 'parse_cache' in summary:
+            cache = summary['parse_cache']
+            print(f"   解析缓存 命中 {cache['hits']}/{cache['hits'] + cache['misses']}, "
+                  f"节省解析 {cache['saved_seconds']}s")
+        return summary['documents']
+    
+    def search(self, query: str, top_k: int = 10, collection: Optional[str] = None,
+               min_similarity: Optional[float] = None, relative_cutoff: Optional[float] = None,
+               max_gap: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        在指定集合中搜索
+        
+        查询只编码一次，然后在线程池中并发检索各分片（FAISS检索期间释放GIL），
+        最后按相似度合并各分片的 top-k，只为截断后的全局结果物化记录。
+        
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量上限
+            collection: 集合名称（默认集合为None）
+            min_similarity: 最低相似度（各分片使用 range_search）
+            relative_cutoff: 相对全局最高分的保留比例
+            max_gap: 相邻结果相似度的最大落差
+        
+        Returns:
+            搜索结果列表（可能少于 top_k 条）
+        """
+        if all(len(shard.chunks) == 0 for shard in self._get_collection(collection)):
+            return []
+        
+        with metrics.timer(metrics.KB_SEARCH_SECONDS):
+            query_embedding = self.encode_query(query)
+            return self.search_vectors(query_embedding, top_k, collection, min_similarity, relative_cutoff, max_gap)
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """编码查询文本，返回形状为 (1, dimension) 的向量"""
+        with metrics.timer(metrics.EMBED_SECONDS, kind='query'), tracing.span('query_encode'):
+            query_embedding = self.model.encode([query])
+        metrics.EMBED_TEXTS.inc(1, kind='query')
+        return query_embedding
+    
+    def search_vectors(self, query_embedding: np.ndarray, top_k: int = 10, collection: Optional[str] = None,
+                       min_similarity: Optional[float] = None, relative_cutoff: Optional[float] = None,
+                       max_gap: Optional[float] = None) -> List[Dict[str, Any]]:
+        """使用已编码的查询向量在指定集合中搜索"""
+        shards = [(no, shard) for no, shard in enumerate(self._get_collection(collection)) if len(shard.chunks) > 0]
+        if not shards:
+            return []
+        
+        def search():
+            hits = self._search_shards(shards, query_embedding, top_k, min_similarity)
+            candidates = [
+                (score, shard_no, idx)
+                for shard_no, _, scores, indices, _ in hits
+                for score, idx in zip(scores.tolist(), indices.tolist())
+            ]
+            top = heapq.nlargest(top_k, candidates, key=lambda c: c[0])
+            keep = score_cutoff([c[0] for c in top], relative_cutoff=relative_cutoff, max_gap=max_gap)
+            
+            # 物化时核对各分片的文本块编号版本，检索之后被压缩（如目录同步删除文档）的分片会触发重新检索
+            by_no = {shard_no: (shard, epoch) for shard_no, shard, _, _, epoch in hits}
+            results = []
+            with tracing.span('materialize'):
+                for score, shard_no, idx in top[:keep]:
+                    shard, epoch = by_no[shard_no]
+                    for result in shard.materialize([score], [idx], epoch):
+                        result['shard'] = shard_no
+                        results.append(result)
+            return results
+        return retry_stale(search)
+    
+    def _search_shards(self, shards: List[tuple], query_embedding: np.ndarray, top_k: int,
+                       min_similarity: Optional[float]) -> List[tuple]:
+        """在线程池中并发检索各分片，返回 [(分片编号, 分片, 相似度, 文本块下标, 文本块编号版本)]"""
+        def search_shard(item):
+            shard_no, shard = item
+            return (shard_no, shard, *shard.search_raw(query_embedding, top_k, min_similarity))
+        
+        if len(shards) == 1:
+            return [search_shard(shards[0])]
+        return list(self._executor.map(tracing.propagate(search_shard), shards))
+    
+    def search_documents(self, query: str, top_k: int = 5, collection: Optional[str] = None,
+                         aggregate: str = 'max', top_n: int = 3, passages: int = 3, neighbors: int = 1,
+                         candidates: Optional[int] = None, min_similarity: Optional[float] = None,
+                         query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        文档级检索：各分片多取文本块候选，按 (分片, 文档) 聚合得分后返回得分最高的文档
+        
+        Args:
+            query: 查询文本
+            top_k: 返回的文档数上限
+            collection: 集合名称（默认集合为None）
+            aggregate: 文档得分的聚合方式 max/sum/mean（前 top_n 个得分的平均）
+            top_n: mean 聚合时参与平均的得分个数
+            passages: 每篇文档返回的最佳段落数
+            neighbors: 每个段落前后各带上的相邻文本块数
+            candidates: 每个分片参与聚合的文本块候选数（默认 top_k 的 DOCUMENT_OVERFETCH 倍）
+            min_similarity: 文本块的最低相似度
+            query_embedding: 已编码的查询向量（为None时编码 query）
+        
+        Returns:
+            文档结果列表，每篇文档含聚合得分 score、命中数 hits 与段落 passages
+        """
+        shards = [(no, shard) for no, shard in enumerate(self._get_collection(collection)) if len(shard.chunks) > 0]
+        if not shards:
+            return []
+        
+        with metrics.timer(metrics.KB_SEARCH_SECONDS):
+            if query_embedding is None:
+                query_embedding = self.encode_query(query)
+            
+            def search():
+                hits = self._search_shards(shards, query_embedding, candidates or top_k * DOCUMENT_OVERFETCH,
+                                           min_similarity)
+                with tracing.span('materialize'):
+                    return rank_documents(hits, top_k, aggregate, top_n, passages, neighbors)
+            results = retry_stale(search)
+        for result in results:
+            result['collection'] = collection or self.DEFAULT_COLLECTION
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取知识库统计信息（汇总所有集合，并附各集合明细）"""
+        collections = {}
+        for name, shards in self._collections.items():
+            shard_stats = [shard.get_stats() for shard in shards]
+            collections[name] = {
+                'total_vectors': sum(s['total_vectors'] for s in shard_stats),
+                'total_documents': sum(s['total_documents'] for s in shard_stats),
+                'unique_files': sum(s['unique_files'] for s in shard_stats),
+                'deleted_vectors': sum(s['deleted_vectors'] for s in shard_stats),
+                'duplicate_chunks': sum(s['duplicate_chunks'] for s in shard_stats),
+                'shards': len(shards),
+                # 索引常驻内存（量化索引的原始向量以内存映射方式按需读取，不计入；含压缩前的已删除向量）
+                'index_bytes': sum(s['index_bytes_per_vector'] * (s['total_vectors'] + s['deleted_vectors'])
+                                   for s in shard_stats),
+                'exact_rescore': any(s['exact_rescore'] for s in shard_stats)
+            }
+        
+        return {
+            'total_vectors': sum(c['total_vectors'] for c in collections.values()),
+            'total_documents': sum(c['total_documents'] for c in collections.values()),
+            'unique_files': sum(c['unique_files'] for c in collections.values()),
+            'duplicate_chunks': sum(c['duplicate_chunks'] for c in collections.values()),
+            'model_name': str(self.model_name),
+            'dimension': int(self.dimension),
+            'num_shards': self.num_shards,
+            'index_type': self.index_type,
+            'index_bytes': sum(c['index_bytes'] for c in collections.values()),
+            'rescore_factor': self.rescore_factor,
+            'generation': self.generation,
+            'parse_cache': self.parse_cache.get_stats() if self.parse_cache else None,
+            'collections': collections
+        }
+    
+    def get_documents(self, collection: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取文档信息（collection 为None时返回所有集合）"""
+        names = [collection] if collection else list(self._collections.keys())
+        documents = []
+        for name in names:
+            for shard in self._get_collection(name):
+                for doc in shard.get_documents():
+                    doc['collection'] = name
+                    documents.append(doc)
+        return documents
+    
+    def list_documents(self, collection: Optional[str] = None, sort: str = 'name', order: str = 'asc',
+                       cursor: Optional[str] = None, limit: int = 100, query: Optional[str] = None,
+                       file_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        分页列出文档
+        
+        各分片按排序键维护有序的文档列表，每页从各分片取出游标之后的前 limit + 1 个文档再归并，
+        开销与页大小和分片数成正比，与文档总数无关。全局顺序为 (排序值, 路径, 集合, 分片, 文档ID)，
+        游标记录上一页最后一个文档在该顺序中的位置，翻页期间的写入与删除不会造成重复或遗漏。
+        
+        Args:
+            collection: 只列出该集合（为None时列出所有集合）
+            sort: 排序键 name/path/size/chunks/mtime
+            order: asc/desc
+            cursor: 上一页返回的 next_cursor
+            limit: 每页文档数
+            query: 文件名包含的文字（不区分大小写）
+            file_type: 文件扩展名（如 pdf）
+        
+        Returns:
+            {'documents', 'next_cursor'（没有下一页时为None）, 'total'（带过滤条件时为None）}
+        
+        Raises:
+            ValueError: 排序键、顺序或游标无效
+            KeyError: 集合不存在
+        """
+        if sort not in DOCUMENT_SORT_KEYS:
+            raise ValueError(f"不支持的排序键: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"不支持的排序顺序: {order}")
+        limit = max(1, int(limit))
+        descending = order == 'desc'
+        position = self._decode_cursor(cursor, sort, order) if cursor else None
+        
+        match = None
+        query = (query or '').strip().lower()
+        suffix = (file_type or '').strip().lower().lstrip('.')
+        if query or suffix:
+            suffix = f".{suffix}" if suffix else ''
+            
+            def match(doc):
+                file_name = doc['file_name'].lower()
+                return query in file_name and file_name.endswith(suffix)
+        
+        names = [collection] if collection else list(self._collections.keys())
+        candidates = []
+        total = 0
+        for name in names:
+            for shard_no, shard in enumerate(self._get_collection(name)):
+                after = None
+                if position is not None:
+                    value, path, cursor_name, cursor_shard, doc_id = position
+                    # 排序值与路径相同时，按 (集合, 分片, 文档ID) 区分先后
+                    if (name, shard_no) != (cursor_name, cursor_shard):
+                        doc_id = -1 if (name, shard_no) > (cursor_name, cursor_shard) else np.iinfo(np.int64).max
+                    after = (value, path, doc_id)
+                for (value, path, doc_id), doc in shard.list_documents(sort, after, descending, limit + 1, match):
+                    doc['collection'] = name
+                    candidates.append(((value, path, name, shard_no, doc_id), doc))
+                total += shard.get_stats()['total_documents']
+        
+        candidates.sort(key=lambda c: c[0], reverse=descending)
+        page = candidates[:limit]
+        return {
+            'documents': [doc for _, doc in page],
+            'next_cursor': self._encode_cursor(page[-1][0], sort, order) if len(candidates) > limit else None,
+            'total': None if match else total,
+            'sort': sort,
+            'order': order
+        }
+    
+    @staticmethod
+    def _encode_cursor(position: tuple, sort: str, order: str) -> str:
+        data = json.dumps([sort, order, *position], ensure_ascii=False, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str, order: str) -> tuple:
+        """解析游标，返回 (排序值, 路径, 集合, 分片, 文档ID)"""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            cursor_sort, cursor_order, value, path, name, shard_no, doc_id = data
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise ValueError("无效的游标")
+        if (cursor_sort, cursor_order) != (sort, order):
+            raise ValueError("游标与排序方式不一致")
+        return value, str(path), str(name), int(shard_no), int(doc_id)
+    
+    def save_knowledge_base(self):
+        """保存有改动的分片（各分片独立持久化；publish_on_save 时发布为新一代）"""
+        if self.read_only:
+            return
+        if self.publish_on_save:
+            self.publish()
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for shard in self.shards:
+            if id(shard) in dirty:
+                shard.save_knowledge_base()
+    
+    def clear_knowledge_base(self, collection: Optional[str] = None):
+        """清空指定集合（为None时清空所有集合）"""
+        names = [collection] if collection else list(self._collections.keys())
+        with self._writing():
+            for name in names:
+                for shard in self._get_collection(name):
+                    shard.clear_knowledge_base()
+                    self._dirty.add(id(shard))
+                self._notify_change(name, None)
+    
+    def start_rebuild(self, model_name: Optional[str] = None, index_type: Optional[str] = None,
+                      num_shards: Optional[int] = None, source: str = 'chunks') -> IndexRebuild:
+        """
+        在后台开始影子重建，旧一代在切换前照常提供检索
+        
+        Args:
+            model_name: 新一代的向量模型（默认不变，不变时直接复用旧索引中的向量）
+            index_type: 新一代的索引类型（默认不变）
+            num_shards: 新一代每个集合的分片数（默认不变）
+            source: 数据来源，chunks 使用已保存的文本块，files 重新解析仍存在的源文件
+        
+        Returns:
+            重建任务（get_progress() 查看进度）
+        
+        Raises:
+            KnowledgeBaseBusyError: 已有重建或写入在进行
+            ValueError: 参数无效
+        """
+        if self.read_only:
+            raise KnowledgeBaseReadOnlyError("只读知识库不能重建")
+        if source not in REBUILD_SOURCES:
+            raise ValueError(f"source 必须是 {', '.join(REBUILD_SOURCES)} 之一")
+        model_name = model_name or self.model_name
+        index_type = index_type or self.index_type
+        num_shards = int(num_shards or self.num_shards)
+        if num_shards < 1:
+            raise ValueError("num_shards 必须大于 0")
+        if model_name == self.model_name:
+            try:
+                new_index(self.dimension, index_type)
+            except RuntimeError:
+                raise ValueError(f"无效的索引类型: {index_type}")
+        
+        # 重建前先把未保存的改动写盘，崩溃恢复时旧一代仍然完整
+        self.save_knowledge_base()
+        with self._lock:
+            if self._rebuild is not None:
+                raise KnowledgeBaseBusyError("已有重建任务在进行")
+            if self._active_writes:
+                raise KnowledgeBaseBusyError("有文档正在写入，请稍后再开始重建")
+            # 清理之前失败或中断的重建留下的目录
+            self._collect_generations()
+            generation = next_generation(self.storage_dir, self.generation)
+            rebuild = IndexRebuild(self, generation, self.storage_dir / f"gen_{generation}", model_name,
+                                   index_type, num_shards, source)
+            self._rebuild = rebuild
+            metrics.REBUILD_PROGRESS.set(0)
+        rebuild.start()
+        return rebuild
+    
+    @property
+    def rebuilding(self) -> bool:
+        return self._rebuild is not None
+    
+    def get_rebuild_progress(self) -> Optional[Dict[str, Any]]:
+        """进行中（或最近一次）重建的进度，从未重建时返回None"""
+        rebuild = self._rebuild or self._last_rebuild
+        return rebuild.get_progress() if rebuild else None
+    
+    def _rebuild_snapshot(self) -> Dict[str, List[VectorKnowledgeBase]]:
+        with self._lock:
+            return {name: list(shards) for name, shards in self._collections.items()}
+    
+    def _swap_generation(self, rebuild: IndexRebuild, collections: Dict[str, List[VectorKnowledgeBase]], model):
+        """原子地切换到新一代并回收旧一代"""
+        with self._lock:
+            self._write_current(rebuild.target_dir.name)
+            old_dir, old_collections = self.data_dir, self._collections
+            self._collections = collections
+            self.generation, self.data_dir = rebuild.generation, rebuild.target_dir
+            self.model, self.model_name = model, rebuild.model_name
+            self.dimension = model.get_sentence_embedding_dimension()
+            self.index_type, self.num_shards = rebuild.index_type, rebuild.num_shards
+            self._dirty = set()
+        print(f"🔁 已切换到第 {self.generation} 代索引: {self.data_dir}")
+        
+        for name in set(old_collections) | set(collections):
+            self._notify_change(name, None)
+        # 进行中的检索仍持有旧分片对象（数据在内存中），删除其文件不影响这些请求
+        self._remove_generation(old_dir, [shard.storage_dir for shards in old_collections.values()
+                                          for shard in shards])
+    
+    def publish(self) -> int:
+        """
+        把内存中的数据发布为新一代（多进程模式的写入进程保存时调用）
+        
+        改动过的分片写入新目录，未改动的分片硬链接过去，最后原子切换 CURRENT；
+        工作进程映射着的旧文件从不被原地改写。
+        
+        Returns:
+            当前一代的编号
+        """
+        if self.read_only:
+            raise KnowledgeBaseReadOnlyError("只读知识库不能发布")
+        with self._lock:
+            if self._rebuild is not None:
+                # 重建期间拒绝写入，没有需要发布的改动；重建完成时会切换到它自己的新一代
+                return self.generation
+            if not self._dirty and self.generation > 0:
+                return self.generation
+            dirty, self._dirty = self._dirty, set()
+            generation = next_generation(self.storage_dir, self.generation)
+            target = self.storage_dir / f"gen_{generation}"
+            
+            old_dir, old_dirs = self.data_dir, []
+            for shards in self._collections.values():
+                for shard in shards:
+                    old_dirs.append(shard.storage_dir)
+                    shard_dir = target / shard.storage_dir.relative_to(old_dir)
+                    if id(shard) in dirty or not (shard.storage_dir / "config.json").exists():
+                        shard.save_knowledge_base(shard_dir)
+                    else:
+                        shard.link_files(shard_dir)
+            with open(target / MANIFEST_FILE, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'generation': generation,
+                    'model_name': self.model_name,
+                    'index_type': self.index_type,
+                    'num_shards': self.num_shards,
+                    'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+                }, f, ensure_ascii=False, indent=2)
+            self._write_current(target.name)
+            self.generation, self.data_dir = generation, target
+        print(f"📢 已发布第 {generation} 代索引（改动分片 {len(dirty)} 个）")
+        self._remove_generation(old_dir, old_dirs)
+        return generation
+    
+    def refresh(self) -> bool:
+        """
+        CURRENT 指向其他进程发布的新一代时重新打开各集合
+        
+        只读模式（工作进程）跟随写入进程；可写模式下用于热加载离线批量构建安装的一代，
+        有未保存的改动、写入或重建在进行时本轮不切换。
+        
+        Returns:
+            是否切换到了新一代
+        """
+        name = self._read_current()
+        if name is None or name == self.data_dir.name or not self._can_refresh():
+            return False
+        generation, data_dir, manifest = self._read_generation(name)
+        model_name = manifest.get('model_name', self.model_name)
+        model = self.model if model_name == self.model_name else load_embedding_model(model_name)
+        index_type = manifest.get('index_type', self.index_type)
+        num_shards = int(manifest.get('num_shards', self.num_shards))
+        collections = {
+            collection: self._load_shards(collection, data_dir, model_name, model, index_type, num_shards)
+            for collection in self._scan_collections(data_dir)
+        }
+        
+        with self._lock:
+            if not self._can_refresh():
+                return False
+            old_dir, old_collections = self.data_dir, self._collections
+            self._collections = collections
+            self.generation, self.data_dir = generation, data_dir
+            self.model, self.model_name = model, model_name
+            self.dimension = model.get_sentence_embedding_dimension()
+            self.index_type, self.num_shards = index_type, num_shards
+        for collection in set(old_collections) | set(collections):
+            self._notify_change(collection, None)
+        if not self.read_only:
+            # 可写模式下旧一代的数据已在内存中，由本进程回收
+            self._remove_generation(old_dir, [shard.storage_dir for shards in old_collections.values()
+                                              for shard in shards])
+        return True
+    
+    def _can_refresh(self) -> bool:
+        if self.read_only:
+            return True
+        return self._rebuild is None and not self._active_writes and not self._dirty
+    
+    def watch_generations(self, interval: float = 1.0):
+        """启动后台线程，定期检查 CURRENT 并切换到写入进程发布的新一代"""
+        if self._watcher is not None:
+            return
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.refresh():
+                        print(f"🔁 进程 {os.getpid()} 已切换到第 {self.generation} 代索引")
+                except Exception as e:
+                    # 新一代可能正在被回收或尚未写完，下一轮重试
+                    print(f"⚠️ 打开新一代索引失败，稍后重试: {e}")
+        
+        self._watcher = threading.Thread(target=watch, name='kb-generation-watch', daemon=True)
+        self._watcher.start()
+    
+    def _write_current(self, name: str):
+        self._previous_current = self._read_current()
+        write_current(self.storage_dir, name)
+    
+    def _remove_generation(self, data_dir: Path, shard_dirs: List[Path]):
+        if data_dir == self.storage_dir:
+            # 重建前的布局直接位于 storage_dir 下，只删除分片文件，保留 CURRENT、解析缓存与新一代目录
+            for shard_dir in shard_dirs:
+                for name in shard_files():
+                    (shard_dir / name).unlink(missing_ok=True)
+                if shard_dir != self.storage_dir:
+                    shutil.rmtree(shard_dir, ignore_errors=True)
+            shutil.rmtree(self.storage_dir / "collections", ignore_errors=True)
+        self._collect_generations()
+    
+    def _collect_generations(self):
+        """删除不再使用的各代目录；发布模式下保留上次发布的一代，正在打开它的工作进程不受影响"""
+        # CURRENT 可能已指向其他进程（如离线批量构建）刚安装、本进程尚未切换到的一代
+        keep = {self.data_dir.name, self._read_current()}
+        if self.publish_on_save:
+            # 编号可能不连续（失败的重建会占用编号），按切换前 CURRENT 实际指向的目录保留
+            keep.add(self._previous_current)
+        for path in self.storage_dir.iterdir():
+            if _GENERATION_RE.match(path.name) and path.is_dir() and path.name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+    
+    def _rebuild_finished(self, rebuild: IndexRebuild):
+        with self._lock:
+            if self._rebuild is rebuild:
+                self._rebuild = None
+            self._last_rebuild = rebuild
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公共设置
+backend 目录加入导入路径；未安装 sentence_transformers 时注册一个纯 Python 的假模型，
+知识库测试不下载模型也能运行。假模型把文本按词哈希到固定维度并归一化，含相同词的文本向量相近
+"""
+
+import hashlib
+import os
+import re
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeSentenceTransformer:
+    """词袋哈希向量模型，接口与 SentenceTransformer 中知识库用到的部分一致"""
+    
+    dimension = 64
+    
+    def __init__(self, model_name: str = 'fake', **kwargs):
+        self.model_name = model_name
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+    
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                vectors[row, int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dimension] += 1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+
+try:
+    import sentence_transformers  # noqa: F401
+except ImportError:
+    module = types.ModuleType('sentence_transformers')
+    module.SentenceTransformer = FakeSentenceTransformer
+    sys.modules['sentence_transformers'] = module
+
+
+@pytest.fixture
+def fake_model() -> FakeSentenceTransformer:
+    return FakeSentenceTransformer()
+
+
+@pytest.fixture
+def write_docs(tmp_path):
+    """在临时目录中写入文本文档，返回 名称 -> 路径"""
+    def write(docs, directory: str = 'docs'):
+        root = tmp_path / directory
+        root.mkdir(exist_ok=True)
+        paths = {}
+        for name, text in docs.items():
+            path = root / name
+            path.write_text(text, encoding='utf-8')
+            paths[name] = str(path)
+        return paths
+    return write
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式文本提取测试：DOCX 在 lxml 与 legacy 后端下提取的文本一致（含表格与嵌套表格），
+iter_text_blocks 按换行切块可还原原文，没有换行的超长行块大小有上限
+"""
+
+import random
+
+import pytest
+from docx import Document
+
+from document_extractors import FORCED_CUT_FACTOR, iter_text_blocks, lxml_available
+from document_processor import DocumentProcessor
+
+
+requires_lxml = pytest.mark.skipif(not lxml_available(), reason="需要 lxml")
+
+
+@pytest.fixture
+def docx_path(tmp_path):
+    doc = Document()
+    doc.add_heading('Quarterly report', level=1)
+    paragraph = doc.add_paragraph('Revenue\tgrew ')
+    paragraph.add_run('strongly').bold = True
+    paragraph.add_run().add_break()
+    paragraph.add_run('in every region.')
+    
+    table = doc.add_table(rows=2, cols=3)
+    for cell, text in zip(table.rows[0].cells, ['Region', 'Q1', 'Q2']):
+        cell.text = text
+    north, q1, q2 = table.rows[1].cells
+    north.text = 'North'
+    north.add_paragraph('including islands')
+    q1.text = '120'
+    # 嵌套表格：行并入外层单元格
+    nested = q2.add_table(rows=2, cols=2)
+    for cell, text in zip(nested.rows[0].cells + nested.rows[1].cells, ['plan', '130', 'actual', '']):
+        cell.text = text
+    
+    doc.add_paragraph('')
+    doc.add_paragraph('中文段落：季度总结。')
+    path = tmp_path / 'report.docx'
+    doc.save(str(path))
+    return path
+
+
+def extract(path, backend):
+    processor = DocumentProcessor(extraction_backend=backend)
+    return processor._process_docx(path), '\n'.join(text for _, text in processor.iter_segments(path))
+
+
+@requires_lxml
+def test_docx_backends_extract_identical_text(docx_path):
+    raw, cleaned = extract(docx_path, 'lxml')
+    legacy_raw, legacy_cleaned = extract(docx_path, 'legacy')
+    assert raw == legacy_raw
+    assert cleaned == legacy_cleaned
+    
+    lines = raw.split('\n')
+    assert 'Revenue\tgrew strongly' in lines
+    assert 'Region\tQ1\tQ2' in lines
+    assert 'North including islands\t120\tplan\t130 actual\t' in lines
+    assert cleaned.split('\n')[-2:] == ['North including islands 120 plan 130 actual', '中文段落：季度总结。']
+
+
+def split_randomly(text, rng, max_piece=9):
+    pieces, start = [], 0
+    while start < len(text):
+        end = start + rng.randint(0, max_piece)
+        pieces.append(text[start:end])
+        start = end
+    return pieces
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_text_blocks_round_trip(seed):
+    rng = random.Random(seed)
+    lines = [' '.join('w' * rng.randint(1, 6) for _ in range(rng.randint(0, 12))) for _ in range(200)]
+    text = '\n'.join(lines) + '\n' * rng.randint(0, 2)
+    # 行都短于 FORCED_CUT_FACTOR * min_chars，只在换行处切分
+    min_chars = rng.choice([48, 64, 256])
+    assert max(map(len, lines)) < FORCED_CUT_FACTOR * min_chars
+    
+    blocks = list(iter_text_blocks(split_randomly(text, rng), min_chars))
+    assert len(blocks) > 1
+    assert '\n'.join(blocks) == text
+
+
+def test_text_blocks_round_trip_edge_cases():
+    for pieces in (['\n'], ['a\nb\n'], ['ab\n', '\n', 'c'], ['', 'x', '', '\n\n']):
+        for min_chars in (1, 2, 100):
+            assert '\n'.join(iter_text_blocks(pieces, min_chars)) == ''.join(pieces)
+    assert list(iter_text_blocks([], 10)) == []
+
+
+@pytest.mark.parametrize('separator', [' ', ''])
+def test_text_blocks_bounded_without_newlines(separator):
+    rng = random.Random(7)
+    min_chars = 50
+    text = separator.join('word%d' % i for i in range(2000))
+    pieces = split_randomly(text, rng)
+    
+    blocks = list(iter_text_blocks(pieces, min_chars))
+    assert len(blocks) > 1
+    assert max(len(block) for block in blocks) < FORCED_CUT_FACTOR * min_chars + max(map(len, pieces))
+    # 强制切分只消耗切分处的一个空白；没有空白时整段切出
+    assert separator.join(blocks) == text
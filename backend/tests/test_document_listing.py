@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档列表分页测试：游标翻页期间插入与删除文档时不重复、不遗漏
+"""
+
+import pytest
+
+from sharded_knowledge_base import ShardedKnowledgeBase
+
+
+WORDS = ['amber', 'birch', 'cedar', 'delta', 'ember', 'fjord', 'grove', 'heron', 'inlet', 'juniper']
+
+
+@pytest.fixture
+def kb(tmp_path, fake_model):
+    return ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=fake_model, num_shards=3)
+
+
+def add_docs(kb, write_docs, names, directory='docs'):
+    # 文本长度相同，按 size 排序时全部相等，只能靠 (路径, 集合, 分片, 文档ID) 区分先后
+    paths = write_docs({name: f"{name[:-4]} notes about the {name[:-4]} valley".ljust(48, '.')
+                        for name in names}, directory)
+    for path in paths.values():
+        kb.add_document(path)
+    return paths
+
+
+def pages(kb, between_pages=None, key='file_name', **options):
+    listed, cursor, page_no = [], None, 0
+    while True:
+        page = kb.list_documents(cursor=cursor, limit=3, **options)
+        listed += [doc[key] for doc in page['documents']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            return listed
+        if between_pages:
+            between_pages(page_no)
+        page_no += 1
+
+
+def test_cursor_pages_are_stable_across_inserts(kb, write_docs):
+    paths = add_docs(kb, write_docs, [f"{word}.txt" for word in WORDS])
+    
+    def write_between_pages(page_no):
+        if page_no == 0:
+            # 排在游标之前与之后的新文档各一个，并删除一个尚未列出的文档
+            add_docs(kb, write_docs, ['aaa.txt', 'zulu.txt'], 'more')
+            kb.remove_document(paths['inlet.txt'])
+    
+    names = pages(kb, write_between_pages, sort='name')
+    expected = sorted(f"{word}.txt" for word in WORDS if word != 'inlet') + ['zulu.txt']
+    assert names == expected
+
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_cursor_pages_break_ties_without_duplicates(kb, write_docs, order):
+    add_docs(kb, write_docs, [f"{word}.txt" for word in WORDS])
+    # 另一个目录中的同名文档：文件名与大小都相同
+    add_docs(kb, write_docs, ['amber.txt', 'birch.txt'], 'copies')
+    before = pages(kb, key='file_path', sort='size', order=order)
+    assert len(before) == len(set(before)) == 12
+    
+    late = []
+    
+    def insert_between_pages(page_no):
+        if page_no == 1:
+            late.extend(add_docs(kb, write_docs, ['cedar.txt'], 'late').values())
+    
+    listed = pages(kb, insert_between_pages, key='file_path', sort='size', order=order)
+    after = [doc['file_path'] for doc in kb.list_documents(sort='size', order=order, limit=100)['documents']]
+    # 已有文档各出现一次且顺序与一次性列出一致；翻页期间插入的文档按位置决定是否出现
+    assert [path for path in listed if path not in late] == before
+    assert listed in (before, after)
+
+
+def test_invalid_cursor_is_rejected(kb, write_docs):
+    add_docs(kb, write_docs, [f"{word}.txt" for word in WORDS[:4]])
+    cursor = kb.list_documents(sort='name', limit=2)['next_cursor']
+    with pytest.raises(ValueError):
+        kb.list_documents(sort='size', cursor=cursor)
+    with pytest.raises(ValueError):
+        kb.list_documents(cursor='not-a-cursor')
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档级检索测试：文本块得分按文档聚合（max/sum/mean），长文档不再占满全部名额
+"""
+
+import numpy as np
+import pytest
+
+from document_retrieval import group_by_document
+from sharded_knowledge_base import ShardedKnowledgeBase
+
+
+def test_group_by_document_aggregates():
+    keys = np.array([7, 3, 7, 7, 3, 9])
+    scores = np.array([0.5, 0.9, 0.8, 0.2, 0.1, 0.4])
+    
+    order, starts, counts, maxima = group_by_document(keys, scores, 'max')
+    # 文档按键升序，文档内命中按得分降序
+    assert keys[order].tolist() == [3, 3, 7, 7, 7, 9]
+    assert scores[order].tolist() == [0.9, 0.1, 0.8, 0.5, 0.2, 0.4]
+    assert (starts.tolist(), counts.tolist()) == ([0, 2, 5], [2, 3, 1])
+    assert maxima == pytest.approx([0.9, 0.8, 0.4])
+    
+    assert group_by_document(keys, scores, 'sum')[3] == pytest.approx([1.0, 1.5, 0.4])
+    # mean 只平均前 top_n 个得分，命中不足 top_n 个时按实际个数平均
+    assert group_by_document(keys, scores, 'mean', top_n=2)[3] == pytest.approx([0.5, 0.65, 0.4])
+    assert group_by_document(keys, scores, 'mean', top_n=0)[3] == pytest.approx([0.9, 0.8, 0.4])
+
+
+def test_group_by_document_edge_cases():
+    order, starts, counts, group_scores = group_by_document(np.array([]), np.array([]), 'mean')
+    assert len(order) == len(starts) == len(counts) == len(group_scores) == 0
+    with pytest.raises(ValueError):
+        group_by_document(np.array([1]), np.array([0.5]), 'median')
+
+
+QUERY = 'apples orchard harvest'
+LONG_TEXT = '\n\n'.join(
+    f"Section {i}: the apples orchard harvest {i} keeps pickers busy while {word} crates, ladders and "
+    f"baskets of {word} fill the barn; " * 4
+    for i, word in enumerate(['amber', 'birch', 'cedar', 'ember', 'fjord', 'grove']))
+
+
+@pytest.fixture
+def kb(tmp_path, fake_model, write_docs):
+    paths = write_docs({
+        'long.txt': LONG_TEXT,
+        'exact.txt': QUERY,
+        'rivers.txt': 'bridges span the wide river near the old harbour town',
+    })
+    kb = ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=fake_model, num_shards=2)
+    for path in paths.values():
+        kb.add_document(path)
+    return kb
+
+
+def test_search_documents_groups_chunks_by_document(kb):
+    # 按文本块检索时长文档占满名额
+    chunks = kb.search(QUERY, top_k=4, min_similarity=0.0)
+    assert {r['file_name'] for r in chunks} == {'long.txt', 'exact.txt'}
+    assert sum(r['file_name'] == 'long.txt' for r in chunks) == 3
+    
+    documents = kb.search_documents(QUERY, top_k=3, passages=2, min_similarity=0.0)
+    names = [d['file_name'] for d in documents]
+    assert len(names) == len(set(names))
+    assert names[0] == 'exact.txt'
+    scores = [d['score'] for d in documents]
+    assert scores == sorted(scores, reverse=True)
+    
+    long_doc = documents[names.index('long.txt')]
+    assert long_doc['hits'] == long_doc['chunk_count'] > 2
+    assert len(long_doc['passages']) == 2
+    similarities = [p['similarity'] for p in long_doc['passages']]
+    assert similarities == sorted(similarities, reverse=True)
+    assert long_doc['score'] == pytest.approx(similarities[0])
+    # 段落带上文档内相邻的文本块，已作为段落返回的不重复
+    passage_ids = {p['chunk_id'] for p in long_doc['passages']}
+    for passage in long_doc['passages']:
+        assert all(n['chunk_id'] not in passage_ids for n in passage['neighbors'])
+        assert all(abs(n['chunk_id'] - passage['chunk_id']) == 1 for n in passage['neighbors'])
+
+
+def test_search_documents_aggregation_changes_ranking(kb):
+    # 总分偏向命中多的长文档，最高分与平均分偏向完全匹配的短文档
+    ranked = {aggregate: [d['file_name'] for d in kb.search_documents(QUERY, top_k=2, aggregate=aggregate,
+                                                                     min_similarity=0.0)]
+              for aggregate in ('max', 'sum', 'mean')}
+    assert ranked == {'max': ['exact.txt', 'long.txt'], 'sum': ['long.txt', 'exact.txt'],
+                      'mean': ['exact.txt', 'long.txt']}
+    
+    top = kb.search_documents(QUERY, top_k=1, aggregate='sum', passages=1, neighbors=0)[0]
+    assert top['passages'][0]['neighbors'] == []
+    with pytest.raises(ValueError):
+        kb.search_documents(QUERY, aggregate='median')
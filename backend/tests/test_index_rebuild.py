@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+影子重建测试：CURRENT 原子切换时，已打开旧一代的只读进程照常检索，刷新后切换到完整的新一代
+"""
+
+import threading
+
+from index_rebuild import MANIFEST_FILE
+from sharded_knowledge_base import ShardedKnowledgeBase, read_current
+
+
+DOCS = {
+    'alpha.txt': 'alpha apples grow in the northern orchard every autumn season',
+    'bravo.txt': 'bravo bridges span the wide river near the old harbour town',
+    'charlie.txt': 'charlie cherries ripen early on the southern hillside farms',
+    'delta.txt': 'delta dolphins swim along the warm coastal waters at dawn',
+}
+
+
+def top_files(kb):
+    return [kb.search(text, top_k=1)[0]['file_name'] for text in DOCS.values()]
+
+
+def test_swap_with_reader_open(tmp_path, fake_model, write_docs):
+    storage_dir = str(tmp_path / 'kb')
+    writer = ShardedKnowledgeBase(storage_dir=storage_dir, model=fake_model, publish_on_save=True)
+    for path in write_docs(DOCS).values():
+        writer.add_document(path)
+    writer.save_knowledge_base()
+    reader = ShardedKnowledgeBase(storage_dir=storage_dir, model=fake_model, read_only=True)
+    old_generation = reader.generation
+    assert top_files(reader) == list(DOCS)
+    
+    # 重建期间持续读取 CURRENT：任何时刻都指向一个写完清单的完整目录
+    pointers, stop = set(), threading.Event()
+    
+    def watch_current():
+        while not stop.is_set():
+            name = read_current(writer.storage_dir)
+            pointers.add((name, (writer.storage_dir / name / MANIFEST_FILE).exists()))
+    
+    watcher = threading.Thread(target=watch_current)
+    watcher.start()
+    try:
+        rebuild = writer.start_rebuild(num_shards=2)
+        assert rebuild.join(30)
+    finally:
+        stop.set()
+        watcher.join()
+    assert rebuild.get_progress()['status'] == 'completed'
+    assert {complete for _, complete in pointers} == {True}
+    assert read_current(writer.storage_dir) == f"gen_{writer.generation}"
+    
+    # 切换后、刷新前，只读进程仍用已打开的旧一代检索
+    assert reader.generation == old_generation
+    assert top_files(reader) == list(DOCS)
+    
+    assert reader.refresh()
+    assert (reader.generation, len(reader.shards)) == (writer.generation, 2)
+    assert top_files(reader) == list(DOCS)
+    assert not reader.refresh()
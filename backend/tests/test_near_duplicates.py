@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+近重复去重测试：别名引用的规范文本块在原文档删除、压缩与重新加载后仍可检索
+"""
+
+from sharded_knowledge_base import ShardedKnowledgeBase
+
+
+TEXT = 'golden lanterns glow above the quiet canal while boats drift past the market'
+DOCS = {
+    'original.txt': TEXT,
+    'copy.txt': TEXT,
+    'other.txt': 'silver trains cross the snowy pass before sunrise every winter morning',
+}
+
+
+def open_kb(tmp_path, model):
+    return ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=model, dedup_distance=3,
+                                compact_ratio=0.1)
+
+
+def test_alias_survives_removal_of_original(tmp_path, fake_model, write_docs):
+    paths = write_docs(DOCS)
+    kb = open_kb(tmp_path, fake_model)
+    for name in ('original.txt', 'copy.txt', 'other.txt'):
+        kb.add_document(paths[name])
+    # 副本的文本块只登记为别名，不再写入向量
+    assert kb.shards[0].index.ntotal == 2
+    
+    kb.remove_document(paths['original.txt'])
+    results = kb.search(TEXT, top_k=3)
+    assert [r['file_name'] for r in results][:1] == ['copy.txt']
+    assert results[0]['text'] == TEXT
+    assert 'original.txt' not in {r['file_name'] for r in results}
+    assert kb.search_documents(TEXT, top_k=1)[0]['file_name'] == 'copy.txt'
+    
+    # 压缩保留仍被别名引用的文本块，保存后重新打开别名仍然有效
+    kb.shards[0].compact()
+    kb.save_knowledge_base()
+    reopened = open_kb(tmp_path, fake_model)
+    results = reopened.search(TEXT, top_k=3)
+    assert (results[0]['file_name'], results[0]['text']) == ('copy.txt', TEXT)
+    
+    # 最后一个引用者也删除后，规范文本块不再出现
+    reopened.remove_document(paths['copy.txt'])
+    assert {r['file_name'] for r in reopened.search(TEXT, top_k=3)} == {'other.txt'}
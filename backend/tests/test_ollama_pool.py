@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ollama节点池测试
+启动多个本地桩 Ollama 服务（只实现 /api/generate），验证按在途请求最少选点、
+连接失败与模型未安装时切换到未尝试过的节点并摘除故障节点、摘除到期后的半开探测，
+以及 OLLAMA_ENDPOINTS 中 URL=模型 的逐节点模型配置
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollama_pool import OllamaPool, parse_endpoints
+
+try:
+    from knowledge_retriever import KnowledgeRetriever
+    from async_ollama import AsyncOllamaClient
+except ImportError:
+    # 检索器依赖 sentence_transformers / faiss，缺少时只测试节点池本身
+    KnowledgeRetriever = AsyncOllamaClient = None
+
+requires_retriever = unittest.skipIf(KnowledgeRetriever is None, "需要 sentence_transformers 与 faiss")
+
+
+class StubOllama:
+    """
+    桩 Ollama 服务
+    
+    mode 为 ok 时返回以服务名为内容的答案，为 missing 时返回模型未找到；
+    hold 被清除时请求阻塞到它被重新设置（用于制造在途请求）。
+    """
+    
+    def __init__(self, name: str, mode: str = 'ok'):
+        self.name = name
+        self.mode = mode
+        self.models = []
+        self.hold = threading.Event()
+        self.hold.set()
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.models.append(payload['model'])
+                stub.hold.wait(10)
+                if stub.mode == 'missing':
+                    status, body = 404, {'error': f"model '{payload['model']}' not found, try pulling it first"}
+                else:
+                    status, body = 200, {'response': stub.name, 'context': [1, 2, 3], 'done': True}
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    @property
+    def calls(self) -> int:
+        return len(self.models)
+    
+    def close(self):
+        self.hold.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def closed_port_url() -> str:
+    """没有服务监听的地址（连接被拒绝）"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+class OllamaPoolTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.stubs = []
+    
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.close()
+    
+    def stub(self, name: str, mode: str = 'ok') -> StubOllama:
+        stub = StubOllama(name, mode)
+        self.stubs.append(stub)
+        return stub
+    
+    def retriever(self, pool: OllamaPool) -> 'KnowledgeRetriever':
+        return KnowledgeRetriever(None, pool=pool)
+    
+    def test_acquire_prefers_least_outstanding(self):
+        pool = OllamaPool([('http://a', 'm'), ('http://b', 'm'), ('http://c', 'm')])
+        busy, _ = pool.acquire()
+        other, _ = pool.acquire()
+        self.assertNotEqual(busy.url, other.url)
+        pool.release(other, True)
+        
+        # busy 仍有一个在途请求，之后的请求都不会选它
+        for _ in range(6):
+            endpoint, _ = pool.acquire()
+            self.assertNotEqual(endpoint.url, busy.url)
+            pool.release(endpoint, True)
+        pool.release(busy, True)
+        self.assertEqual(sum(e.outstanding for e in pool.endpoints), 0)
+    
+    @requires_retriever
+    def test_generate_routes_around_busy_endpoint(self):
+        slow, fast = self.stub('slow'), self.stub('fast')
+        retriever = self.retriever(OllamaPool([(slow.url, 'm'), (fast.url, 'm')]))
+        
+        slow.hold.clear()
+        pending = threading.Thread(target=retriever._generate_answer, args=('q', ''))
+        pending.start()
+        deadline = time.monotonic() + 5
+        while slow.calls + fast.calls == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        busy = slow if slow.calls else fast
+        idle = fast if busy is slow else slow
+        
+        # 一个请求阻塞在 busy 上时，后续请求按在途数全部发往 idle（轮转会交替发往两者）
+        answers = [retriever._generate_answer('q', '') for _ in range(4)]
+        self.assertEqual(answers, [idle.name] * 4)
+        self.assertEqual(busy.calls, 1)
+        busy.hold.set()
+        pending.join(5)
+    
+    @requires_retriever
+    def test_connection_error_fails_over_and_ejects(self):
+        healthy = self.stub('healthy')
+        dead_url = closed_port_url()
+        pool = OllamaPool([(dead_url, 'm'), (healthy.url, 'm')], eject_seconds=60)
+        retriever = self.retriever(pool)
+        
+        for _ in range(3):
+            self.assertEqual(retriever._generate_answer('q', ''), 'healthy')
+        
+        dead = pool.endpoints[0]
+        self.assertFalse(dead.to_dict(time.monotonic())['healthy'])
+        self.assertEqual(dead.last_error, '无法连接')
+        # 摘除后不再尝试故障节点
+        self.assertLessEqual(dead.requests, 1)
+        self.assertEqual(healthy.calls, 3)
+    
+    @requires_retriever
+    def test_missing_model_fails_over_and_ejects(self):
+        missing, healthy = self.stub('missing', mode='missing'), self.stub('healthy')
+        pool = OllamaPool([(missing.url, 'm'), (healthy.url, 'm')], eject_seconds=60)
+        retriever = self.retriever(pool)
+        
+        for _ in range(3):
+            self.assertEqual(retriever._generate_answer('q', ''), 'healthy')
+        
+        self.assertEqual(missing.calls, 1)
+        self.assertFalse(pool.get_stats()['endpoints'][0]['healthy'])
+        self.assertEqual(pool.endpoints[0].last_error, '模型未安装')
+        self.assertEqual(pool.get_stats()['healthy'], 1)
+    
+    @requires_retriever
+    def test_async_client_fails_over_and_ejects(self):
+        missing, healthy = self.stub('missing', mode='missing'), self.stub('healthy')
+        pool = OllamaPool([(closed_port_url(), 'm'), (missing.url, 'm'), (healthy.url, 'm')], eject_seconds=60)
+        client = AsyncOllamaClient(pool)
+        
+        result = asyncio.run(client.generate('q'))
+        self.assertEqual(result['response'], 'healthy')
+        self.assertEqual(pool.get_stats()['healthy'], 1)
+    
+    @requires_retriever
+    def test_async_stream_closes_connection_after_done(self):
+        closed = []
+        
+        async def post_lines(url, payload):
+            # done 之后连接仍未结束（如 Ollama 保持连接），读取方不应等到生成器被回收才关闭
+            try:
+                yield {'response': 'ok', 'done': True}
+                yield {'response': 'late'}
+            finally:
+                closed.append(url)
+        
+        async def stream():
+            with mock.patch('async_ollama._post_lines', post_lines):
+                answer, final = await AsyncOllamaClient(OllamaPool([('http://a', 'm')]))._stream('http://a', {})
+            return answer, final, list(closed)
+        
+        answer, final, closed_on_return = asyncio.run(stream())
+        self.assertEqual((answer, final['done']), ('ok', True))
+        self.assertEqual(closed_on_return, ['http://a/api/generate'])
+    
+    def test_half_open_probe_after_eject_seconds(self):
+        pool = OllamaPool([('http://a', 'm'), ('http://b', 'm')], failure_threshold=2, eject_seconds=0.2)
+        a, b = pool.endpoints
+        
+        # 连续失败达到阈值后摘除
+        for _ in range(2):
+            endpoint, probe = pool.acquire(exclude={b.url})
+            self.assertIs(endpoint, a)
+            self.assertFalse(probe)
+            pool.release(endpoint, False, error='HTTP 500')
+        self.assertFalse(a.available(time.monotonic()))
+        for _ in range(3):
+            endpoint, _ = pool.acquire()
+            self.assertIs(endpoint, b)
+            pool.release(endpoint, True)
+        
+        # 到期后只放行一个探测请求，探测失败重新摘除
+        time.sleep(0.25)
+        endpoint, probe = pool.acquire(exclude={b.url})
+        self.assertIs(endpoint, a)
+        self.assertTrue(probe)
+        self.assertTrue(a.probing)
+        self.assertEqual(pool.acquire(exclude={b.url}), (b, False))
+        pool.release(b, True)
+        pool.release(a, False, error='HTTP 500', probe=True)
+        self.assertFalse(a.available(time.monotonic()))
+        
+        # 再次到期后探测成功即恢复
+        time.sleep(0.25)
+        endpoint, probe = pool.acquire(exclude={b.url})
+        self.assertIs(endpoint, a)
+        pool.release(a, True, probe=probe)
+        self.assertFalse(a.probing)
+        self.assertEqual(a.consecutive_failures, 0)
+        self.assertTrue(pool.get_stats()['endpoints'][0]['healthy'])
+    
+    def test_ordinary_release_keeps_probe_in_flight(self):
+        pool = OllamaPool([('http://a', 'm'), ('http://b', 'm')], failure_threshold=1, eject_seconds=0.2)
+        a, b = pool.endpoints
+        
+        # 两个普通请求在途时节点被摘除
+        first, _ = pool.acquire(exclude={b.url})
+        straggler, _ = pool.acquire(exclude={b.url})
+        self.assertIs(first, a)
+        self.assertIs(straggler, a)
+        pool.release(a, False, error='HTTP 500')
+        
+        time.sleep(0.25)
+        endpoint, probe = pool.acquire(exclude={b.url})
+        self.assertIs(endpoint, a)
+        self.assertTrue(probe)
+        
+        # 摘除前在途的请求结束（无论结果如何）不会放行第二个请求
+        pool.release(a, None)
+        self.assertTrue(a.probing)
+        self.assertEqual(pool.acquire(exclude={b.url}), (b, False))
+        pool.release(b, True)
+        
+        pool.release(a, True, probe=True)
+        self.assertFalse(a.probing)
+        self.assertTrue(a.available(time.monotonic()))
+        self.assertEqual(a.outstanding, 0)
+    
+    @requires_retriever
+    def test_half_open_probe_recovers_endpoint(self):
+        flaky, healthy = self.stub('flaky', mode='missing'), self.stub('healthy')
+        pool = OllamaPool([(flaky.url, 'm'), (healthy.url, 'm')], eject_seconds=0.2)
+        retriever = self.retriever(pool)
+        
+        self.assertEqual(retriever._generate_answer('q', ''), 'healthy')
+        self.assertEqual(pool.get_stats()['healthy'], 1)
+        
+        # 节点装好模型、摘除到期后，探测请求成功，节点重新参与分配
+        flaky.mode = 'ok'
+        time.sleep(0.25)
+        answers = {retriever._generate_answer('q', '') for _ in range(2)}
+        self.assertIn('flaky', answers)
+        self.assertEqual(pool.get_stats()['healthy'], 2)
+    
+    def test_parse_endpoints_per_endpoint_model(self):
+        endpoints = parse_endpoints(' http://a:11434=qwen2:1.5b , http://b:11434 ,, http://c=', 'gemma2:2b')
+        self.assertEqual(endpoints, [('http://a:11434', 'qwen2:1.5b'), ('http://b:11434', 'gemma2:2b'),
+                                     ('http://c', 'gemma2:2b')])
+    
+    @requires_retriever
+    def test_from_env_sends_each_endpoint_its_model(self):
+        first, second = self.stub('first'), self.stub('second')
+        env = {'OLLAMA_ENDPOINTS': f"{first.url}=qwen2:1.5b,{second.url}", 'OLLAMA_MODEL': 'gemma2:2b',
+               'OLLAMA_EJECT_SECONDS': '5'}
+        with mock.patch.dict(os.environ, env):
+            pool = OllamaPool.from_env()
+        self.assertEqual([(e.url, e.model) for e in pool.endpoints],
+                         [(first.url, 'qwen2:1.5b'), (second.url, 'gemma2:2b')])
+        self.assertEqual(pool.eject_seconds, 5.0)
+        
+        retriever = self.retriever(pool)
+        answers = {retriever._generate_answer('q', '') for _ in range(4)}
+        self.assertEqual(answers, {'first', 'second'})
+        self.assertEqual(set(first.models), {'qwen2:1.5b'})
+        self.assertEqual(set(second.models), {'gemma2:2b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
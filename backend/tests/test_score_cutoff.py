@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索结果截断测试：score_cutoff 的边界情况，以及问答路径按请求的阈值截断
+"""
+
+import numpy as np
+import pytest
+
+from knowledge_retriever import KnowledgeRetriever, LLMUnavailableError
+from sharded_knowledge_base import ShardedKnowledgeBase
+from vector_knowledge_base import score_cutoff
+
+
+@pytest.mark.parametrize('scores, options, expected', [
+    # 没有结果或没有阈值
+    ([], {'min_similarity': 0.5, 'relative_cutoff': 0.5, 'max_gap': 0.1}, 0),
+    ([0.9, 0.1], {}, 2),
+    # 绝对阈值包含等于阈值的结果，全部低于阈值时为空
+    ([0.8, 0.5, 0.49], {'min_similarity': 0.5}, 2),
+    ([0.3, 0.2], {'min_similarity': 0.5}, 0),
+    # 相对阈值按最高分的比例截断；最高分不为正时不生效
+    ([0.8, 0.4, 0.39], {'relative_cutoff': 0.5}, 2),
+    ([0.0, -0.1], {'relative_cutoff': 0.5}, 2),
+    ([-0.2, -0.5], {'relative_cutoff': 0.9}, 2),
+    # 落差严格大于 max_gap 才截断，只在第一个大落差处截断
+    ([0.9, 0.7, 0.5], {'max_gap': 0.25}, 3),
+    ([0.9, 0.8, 0.3, 0.2, -0.4], {'max_gap': 0.3}, 2),
+    ([0.9], {'max_gap': 0.0}, 1),
+    # 组合时依次应用：绝对阈值之后的结果不参与落差判断
+    ([0.9, 0.85, 0.2], {'min_similarity': 0.5, 'max_gap': 0.3}, 2),
+    ([0.9, 0.6, 0.55], {'min_similarity': 0.5, 'relative_cutoff': 0.65, 'max_gap': 0.01}, 1),
+])
+def test_score_cutoff(scores, options, expected):
+    assert score_cutoff(np.asarray(scores, dtype='float32'), **options) == expected
+    assert score_cutoff(scores, **options) == expected
+
+
+DOCS = {
+    'alpha.txt': 'alpha apples grow in the northern orchard every autumn season',
+    'bravo.txt': 'bravo apples ripen in the southern orchard every summer season',
+    'charlie.txt': 'charlie dolphins swim along the warm coastal waters at dawn',
+}
+
+
+@pytest.fixture
+def retriever(tmp_path, fake_model, write_docs):
+    kb = ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=fake_model)
+    for path in write_docs(DOCS).values():
+        kb.add_document(path)
+    return KnowledgeRetriever(kb, min_similarity=0.0)
+
+
+def test_ask_applies_request_cutoffs(retriever, monkeypatch):
+    def llm_down(*args):
+        raise LLMUnavailableError('down')
+    
+    # 会话问答总是调用LLM，模拟其不可用以得到抽取式答案
+    monkeypatch.setattr(retriever, '_traced_session_generate', llm_down)
+    question = 'alpha apples in the northern orchard'
+    everything = retriever.ask_question(question, top_k=3, mode='extractive')
+    assert len(everything['sources']) == 3
+    
+    # 请求中的阈值覆盖默认值，在会话问答中同样生效
+    nearest = retriever.ask_question(question, top_k=3, mode='extractive', relative_cutoff=0.99)
+    assert [s['file_name'] for s in nearest['sources']] == ['alpha.txt']
+    session = retriever.ask_in_session(question, top_k=3, max_gap=0.0)
+    assert len(session['sources']) == 1
+    
+    nothing = retriever.ask_question(question, top_k=3, min_similarity=1.01)
+    assert nothing['sources'] == [] and nothing['mode'] == 'none'
+
+
+def test_cache_params_include_request_cutoffs(retriever):
+    retriever.semantic_cache = object()
+    defaults = retriever._cache_params(3, None, (None, None, None), 'auto', True)
+    assert defaults == (retriever.kb.DEFAULT_COLLECTION, 3, 0.0, None, None)
+    assert retriever._cache_params(3, None, (None, 0.5, None), 'auto', True) != defaults
+    assert retriever._cache_params(3, None, (0.0, None, None), 'auto', True) == defaults
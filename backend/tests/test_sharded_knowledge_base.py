@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片知识库测试：删除、压缩与检索并发时结果的正确性
+"""
+
+import pytest
+
+from sharded_knowledge_base import ShardedKnowledgeBase
+from vector_knowledge_base import StaleSearchError
+
+
+DOCS = {
+    'alpha.txt': 'alpha apples grow in the northern orchard every autumn season',
+    'bravo.txt': 'bravo bridges span the wide river near the old harbour town',
+    'charlie.txt': 'charlie cherries ripen early on the southern hillside farms',
+    'delta.txt': 'delta dolphins swim along the warm coastal waters at dawn',
+}
+
+
+@pytest.fixture
+def kb(tmp_path, fake_model, write_docs):
+    paths = write_docs(DOCS)
+    kb = ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=fake_model, compact_ratio=0)
+    for path in paths.values():
+        kb.add_document(path)
+    kb.paths = paths
+    return kb
+
+
+def test_materialize_rejects_results_from_before_compaction(kb):
+    shard = kb.shards[0]
+    scores, indices, epoch = shard.search_raw(kb.encode_query('delta dolphins'), 1)
+    
+    kb.remove_document(kb.paths['alpha.txt'])
+    assert shard.compact() > 0
+    
+    with pytest.raises(StaleSearchError):
+        shard.materialize(scores.tolist(), indices.tolist(), epoch)
+    with pytest.raises(StaleSearchError):
+        shard.chunk_owners(indices, epoch)
+
+
+def test_search_retries_when_shard_is_compacted_mid_search(kb, monkeypatch):
+    shard = kb.shards[0]
+    search_raw = shard.search_raw
+    calls = []
+    
+    def search_then_compact(*args, **kwargs):
+        # 第一次检索之后、物化之前删除并压缩（目录同步删除文件），文本块重新编号
+        result = search_raw(*args, **kwargs)
+        if not calls:
+            kb.remove_document(kb.paths['alpha.txt'])
+            shard.compact()
+        calls.append(result[2])
+        return result
+    
+    monkeypatch.setattr(shard, 'search_raw', search_then_compact)
+    results = kb.search('delta dolphins', top_k=1)
+    
+    assert len(calls) == 2 and calls[0] != calls[1]
+    assert results[0]['file_name'] == 'delta.txt'
+    assert results[0]['text'] == DOCS['delta.txt']
+    
+    documents = kb.search_documents('charlie cherries', top_k=1)
+    assert documents[0]['file_name'] == 'charlie.txt'
+
+
+def test_search_after_remove_and_compact_returns_surviving_chunks(tmp_path, fake_model, write_docs):
+    docs = dict(DOCS, **{
+        'echo.txt': 'echo eagles nest high in the granite mountain cliffs',
+        'foxtrot.txt': 'foxtrot foxes hunt quietly through the frozen winter forest',
+    })
+    paths = write_docs(docs)
+    kb = ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=fake_model, num_shards=2,
+                              compact_ratio=0.1)
+    for path in paths.values():
+        kb.add_document(path)
+    
+    # 删除后已删除比例超过 compact_ratio，分片立即压缩，存活的文本块重新编号
+    removed = {'alpha.txt', 'charlie.txt', 'echo.txt'}
+    for name in removed:
+        kb.remove_document(paths[name])
+    assert any(shard.epoch for shard in kb.shards)
+    assert all(shard.deleted_ratio == 0 for shard in kb.shards)
+    
+    for name, text in docs.items():
+        results = kb.search(text, top_k=len(docs))
+        assert removed.isdisjoint(r['file_name'] for r in results)
+        if name not in removed:
+            assert (results[0]['file_name'], results[0]['text']) == (name, text)
+            assert kb.search_documents(text, top_k=1)[0]['file_name'] == name
+    
+    # 压缩后重新导入的文档追加在新编号之后
+    kb.add_document(paths['alpha.txt'])
+    results = kb.search(docs['alpha.txt'], top_k=1)
+    assert (results[0]['file_name'], results[0]['text']) == ('alpha.txt', docs['alpha.txt'])
+
+
+def test_publish_keeps_previously_published_generation(tmp_path, fake_model, write_docs):
+    paths = write_docs(DOCS)
+    kb = ShardedKnowledgeBase(storage_dir=str(tmp_path / 'kb'), model=fake_model, publish_on_save=True)
+    kb.add_document(paths['alpha.txt'])
+    kb.save_knowledge_base()
+    first = kb.data_dir.name
+    # 中断的重建留下的目录占用了下一个编号，新一代的编号不再连续
+    (kb.storage_dir / f"gen_{kb.generation + 1}").mkdir()
+    
+    kb.add_document(paths['bravo.txt'])
+    kb.save_knowledge_base()
+    second = kb.data_dir.name
+    generations = sorted(path.name for path in kb.storage_dir.glob('gen_*'))
+    assert generations == sorted([first, second])
+    
+    kb.add_document(paths['charlie.txt'])
+    kb.save_knowledge_base()
+    generations = sorted(path.name for path in kb.storage_dir.glob('gen_*'))
+    assert generations == sorted([second, kb.data_dir.name])
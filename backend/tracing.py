@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求追踪
+为每个请求分配请求ID并记录各阶段耗时（查询编码、向量检索、结果物化、上下文构建、LLM调用、序列化），
+超过阈值的请求写入滚动的慢查询日志；另提供可在运行时开关的采样式 cProfile 分析器
+
+环境变量:
+    KB_TRACING           是否记录阶段耗时（默认 1）
+    KB_SLOW_QUERY_MS     慢查询阈值（毫秒，默认 1000，<=0 关闭慢查询日志）
+    KB_SLOW_QUERY_LOG    慢查询日志文件（默认 ./logs/slow_queries.log）
+"""
+
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Optional
+
+
+_enabled = os.getenv('KB_TRACING', '1').lower() not in ('0', 'false', 'off', 'no')
+_current = contextvars.ContextVar('kb_trace', default=None)
+
+
+class Trace:
+    """单个请求的追踪记录"""
+    
+    def __init__(self, request_id: Optional[str] = None, name: str = ''):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.end = None
+        self.spans = []       # (名称, 相对开始时间, 耗时, 属性)
+        self.attributes = {}
+    
+    def annotate(self, **attributes):
+        """附加请求级属性（如 query、top_k、index_type）"""
+        self.attributes.update(attributes)
+    
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+    
+    def stage_timings(self) -> Dict[str, float]:
+        """按阶段名汇总耗时（毫秒）；同名阶段（如多个分片的检索）取最长者"""
+        timings = {}
+        for name, _, duration, _ in self.spans:
+            timings[name] = max(timings.get(name, 0.0), round(duration * 1000.0, 3))
+        return timings
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'name': self.name,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'total_ms': round(self.duration * 1000.0, 3),
+            'attributes': self.attributes,
+            'stages': self.stage_timings(),
+            'spans': [
+                {'name': name, 'offset_ms': round(offset * 1000.0, 3),
+                 'duration_ms': round(duration * 1000.0, 3), **attrs}
+                for name, offset, duration, attrs in self.spans
+            ]
+        }
+    
+    def server_timing(self) -> str:
+        """生成 Server-Timing 响应头，浏览器开发者工具可直接展示"""
+        return ', '.join(f'{name};dur={ms}' for name, ms in self.stage_timings().items())
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, trace: Trace, name: str, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.trace.spans.append((self.name, self.start - self.trace.start, end - self.start, self.attributes))
+        return False
+    
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool):
+    global _enabled
+    _enabled = bool(value)
+
+
+def start_trace(request_id: Optional[str] = None, name: str = '') -> Trace:
+    """开始追踪当前请求（无论是否记录阶段耗时都会分配请求ID）"""
+    trace = Trace(request_id, name)
+    _current.set(trace)
+    return trace
+
+
+def finish_trace() -> Optional[Trace]:
+    """结束当前请求的追踪并返回追踪记录"""
+    trace = _current.get()
+    if trace is not None:
+        trace.end = time.perf_counter()
+        _current.set(None)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def span(name: str, **attributes):
+    """
+    记录一个阶段；当前没有进行中的追踪或追踪关闭时返回共享的空对象
+    
+    用法:
+        with tracing.span('ann_search', shard=0):
+            ...
+    """
+    trace = _current.get()
+    if trace is None or not _enabled:
+        return _NULL_SPAN
+    return _Span(trace, name, attributes)
+
+
+def annotate(**attributes):
+    """为当前请求附加属性"""
+    trace = _current.get()
+    if trace is not None:
+        trace.annotate(**attributes)
+
+
+def propagate(fn):
+    """
+    包装在线程池中执行的函数，使其继承调用方的追踪上下文
+    
+    每次调用使用上下文的独立副本，可在多个线程中并发执行。
+    """
+    context = contextvars.copy_context()
+    
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+class SlowQueryLog:
+    """
+    慢查询日志
+    
+    请求总耗时超过阈值时，把请求ID、查询、top_k、索引类型和各阶段耗时
+    以单行 JSON 写入滚动日志文件。
+    """
+    
+    def __init__(self, path: Optional[str] = None, threshold_ms: Optional[float] = None,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        self.path = path or os.getenv('KB_SLOW_QUERY_LOG', os.path.join('logs', 'slow_queries.log'))
+        self.threshold_ms = float(os.getenv('KB_SLOW_QUERY_MS', '1000') if threshold_ms is None else threshold_ms)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._logger = None
+        self._lock = threading.Lock()
+    
+    def _get_logger(self) -> logging.Logger:
+        # 首次记录时才创建日志文件
+        with self._lock:
+            if self._logger is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                logger = logging.getLogger(f'kb.slow_query.{id(self)}')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                              backupCount=self.backup_count, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+                self._logger = logger
+            return self._logger
+    
+    def maybe_log(self, trace: Trace) -> bool:
+        """超过阈值时写入日志，返回是否写入"""
+        if self.threshold_ms <= 0 or trace is None:
+            return False
+        if trace.duration * 1000.0 < self.threshold_ms:
+            return False
+        self._get_logger().info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+        return True
+
+
+class SamplingProfiler:
+    """
+    采样式请求分析器
+    
+    开启后按采样率对请求启用 cProfile（只分析处理该请求的线程），
+    结果累积到同一份统计中，可通过管理接口查看或重置。
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.1
+        self.profiled_requests = 0
+        self._stats = None
+        self._lock = threading.Lock()
+    
+    def configure(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None, reset: bool = False):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if sample_rate is not None:
+                self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+            if reset:
+                self._stats = None
+                self.profiled_requests = 0
+    
+    def maybe_start(self) -> Optional[cProfile.Profile]:
+        """按采样率决定是否分析当前请求，返回已启用的分析器或None"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 同一线程上已有其他分析器在运行
+            return None
+        return profile
+    
+    def stop(self, profile: Optional[cProfile.Profile]):
+        if profile is None:
+            return
+        profile.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.profiled_requests += 1
+    
+    def report(self, limit: int = 30, sort: str = 'cumulative') -> Dict[str, Any]:
+        """返回开关状态与累计统计中最耗时的函数"""
+        with self._lock:
+            text = ''
+            if self._stats is not None:
+                stream = io.StringIO()
+                self._stats.stream = stream
+                self._stats.sort_stats(sort).print_stats(limit)
+                text = stream.getvalue()
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'profiled_requests': self.profiled_requests,
+                'sort': sort,
+                'report': text
+            }
+
+
+SLOW_QUERY_LOG = SlowQueryLog()
+PROFILER = SamplingProfiler()
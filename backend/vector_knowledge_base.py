@@ -8,252 +8,1165 @@
 import os
 import json
 import pickle
+import shutil
+import threading
+from bisect import bisect_left, bisect_right, insort
 import numpy as np
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import Callable, List, Dict, Any, Tuple, Optional
 from sentence_transformers import SentenceTransformer
 import faiss
 from document_processor import DocumentProcessor
+from chunk_store import ChunkStore
+from exact_vectors import ExactVectorStore
+from ingest_pipeline import IngestPipeline
+from near_duplicates import SimHashIndex, encode_deduplicated, normalize_text, simhash_many
+from document_retrieval import DOCUMENT_OVERFETCH, rank_documents
+import metrics
+import tracing
+
+
+def score_cutoff(scores: np.ndarray, min_similarity: Optional[float] = None,
+                 relative_cutoff: Optional[float] = None, max_gap: Optional[float] = None) -> int:
+    """
+    计算按相似度降序排列的结果中应保留的前缀长度
+    
+    Args:
+        scores: 降序排列的相似度
+        min_similarity: 绝对阈值，低于该值的结果丢弃
+        relative_cutoff: 相对阈值，低于 最高分 × relative_cutoff 的结果丢弃（最高分为正时生效）
+        max_gap: 相邻两个结果的相似度落差超过该值时，丢弃落差之后的全部结果
+    
+    Returns:
+        保留的结果数量
+    """
+    scores = np.asarray(scores)
+    keep = len(scores)
+    if keep == 0:
+        return 0
+    if min_similarity is not None:
+        keep = int(np.count_nonzero(scores >= min_similarity))
+    if relative_cutoff is not None and keep > 0 and scores[0] > 0:
+        keep = min(keep, int(np.count_nonzero(scores[:keep] >= scores[0] * relative_cutoff)))
+    if max_gap is not None and keep > 1:
+        gaps = np.nonzero(scores[:keep - 1] - scores[1:keep] > max_gap)[0]
+        if gaps.size:
+            keep = int(gaps[0]) + 1
+    return keep
+
+
+# 检索与物化之间分片被压缩（文本块重新编号）时，重新检索的次数上限
+STALE_SEARCH_RETRIES = 3
+
+
+class StaleSearchError(RuntimeError):
+    """检索结果的文本块下标已因分片压缩或清空而失效"""
+
+
+def retry_stale(search: Callable[[], Any]) -> Any:
+    """
+    执行一次 检索 + 物化，其间分片被压缩导致文本块下标失效时重新检索
+    
+    Args:
+        search: 检索并物化结果的函数（下标失效时抛出 StaleSearchError）
+    
+    Returns:
+        search 的返回值
+    """
+    for attempt in range(STALE_SEARCH_RETRIES):
+        try:
+            return search()
+        except StaleSearchError:
+            if attempt == STALE_SEARCH_RETRIES - 1:
+                raise
+            print("🔄 分片在检索期间被压缩，重新检索")
+
+
+# 文档列表的排序键：文件名（不区分大小写）、路径、文件大小、文本块数、修改时间
+DOCUMENT_SORT_KEYS = {
+    'name': lambda doc: doc['file_name'].lower(),
+    'path': lambda doc: doc['file_path'],
+    'size': lambda doc: int(doc.get('file_size', 0)),
+    'chunks': lambda doc: int(doc['chunk_count']),
+    'mtime': lambda doc: float(doc.get('file_mtime') or 0.0)
+}
+
+
+# 只读加载索引时使用内存映射：多个进程共享同一份页缓存（IO_FLAG_MMAP_IFC 覆盖 Flat 与 IVF 的向量数据）
+INDEX_MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+def shard_files() -> List[str]:
+    """一个分片目录中由知识库管理的文件名"""
+    return ["faiss_index.bin", "documents.json", "config.json", "chunks.json",
+            ChunkStore.TEXT_FILE, *ChunkStore.FILES.values(), ExactVectorStore.FILE, SimHashIndex.FILE]
+
+
+def link_shard_files(source_dir: Path, target_dir: Path):
+    """把分片目录中的文件硬链接到另一个目录（不支持硬链接时复制）"""
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for name in shard_files():
+        source = Path(source_dir) / name
+        if not source.exists():
+            continue
+        try:
+            os.link(source, target_dir / name)
+        except OSError:
+            shutil.copy2(source, target_dir / name)
+
+
+def is_compressed(index: faiss.Index) -> bool:
+    """索引是否只保存量化后的编码（如 SQ8、SQfp16、PQ），这类索引的相似度是近似值"""
+    return getattr(index, 'code_size', index.d * 4) < index.d * 4
+
+
+def new_index(dimension: int, index_type: str = 'Flat') -> faiss.Index:
+    """
+    创建内积索引
+    
+    Args:
+        dimension: 向量维度
+        index_type: faiss.index_factory 描述串（如 Flat、IVF256,Flat、HNSW32）
+    
+    Returns:
+        FAISS索引（需要训练的类型返回未训练的索引）
+    """
+    if index_type == 'Flat':
+        return faiss.IndexFlatIP(dimension)
+    return faiss.index_factory(dimension, index_type, faiss.METRIC_INNER_PRODUCT)
+
+
+def load_embedding_model(model_name: str) -> SentenceTransformer:
+    """
+    加载句子向量模型，失败时打印排查建议后抛出异常
+    
+    Args:
+        model_name: 句子转换模型名称
+        
+    Returns:
+        SentenceTransformer 模型实例
+    """
+    print(f"🔄 加载模型: {model_name}")
+    try:
+        # 设置环境变量增加超时时间（在导入SentenceTransformer之前设置）
+        os.environ['HF_HUB_DOWNLOAD_TIMEOUT'] = '300'  # 5分钟超时
+        
+        # 尝试加载模型
+        # SentenceTransformer会自动使用本地缓存，如果模型已下载则不会重新下载
+        model = SentenceTransformer(model_name)
+        print(f"✅ 模型加载成功")
+        return model
+    except Exception as e:
+        error_msg = str(e)
+        print(f"❌ 模型加载失败: {error_msg}")
+        print("=" * 60)
+        print("💡 解决方案:")
+        if "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
+            print("   网络连接超时，请尝试:")
+            print("   1. 检查网络连接")
+            print("   2. 如果模型已下载，检查缓存目录: ~/.cache/huggingface/")
+            print("   3. 可以手动下载模型到本地缓存")
+        elif "connection" in error_msg.lower():
+            print("   网络连接问题，请检查:")
+            print("   1. 是否可以访问 huggingface.co")
+            print("   2. 是否需要配置代理")
+        else:
+            print("   请检查错误信息并尝试:")
+            print("   1. 重新启动服务")
+            print("   2. 检查模型名称是否正确")
+        print("=" * 60)
+        raise
 
 
 class VectorKnowledgeBase:
     """向量知识库类"""
     
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", storage_dir: str = "./knowledge_base"):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", storage_dir: str = "./knowledge_base",
+                 embed_batch_size: int = 64, model: Optional[SentenceTransformer] = None,
+                 parse_cache=None, index_type: str = 'Flat', read_only: bool = False,
+                 rescore_factor: int = 4, dedup_distance: Optional[int] = None,
+                 pdf_workers: Optional[int] = None):
         """
         初始化向量知识库
         
         Args:
             model_name: 句子转换模型名称
             storage_dir: 存储目录
-            use_reranker: 是否使用重排模型
+            embed_batch_size: 添加文档时每批编码的文本块数量
+            model: 已加载的模型实例（为None时按 model_name 加载）
+            parse_cache: 解析结果缓存（ParseCache，为None时不缓存）
+            index_type: FAISS索引类型（faiss.index_factory 描述串）
+            read_only: 只读模式，索引与文本块以内存映射方式加载，不允许写入
+            rescore_factor: 量化索引先取 top_k 的多少倍候选，再用原始向量精确重排（0 不重排）
+            dedup_distance: 近重复文本块的 SimHash 汉明距离阈值（None 或负数不去重），
+                签名相近且归一化文本相同的文本块只记为已有文本块的别名，不再写入向量
+            pdf_workers: 导入PDF时并行提取的进程数（None表示CPU核数，1表示不并行）
         """
         self.model_name = model_name
+        self.embed_batch_size = embed_batch_size
+        self.parse_cache = parse_cache
+        self.pdf_workers = pdf_workers
+        self.index_type = index_type
+        self.read_only = read_only
+        self.rescore_factor = max(0, int(rescore_factor))
+        self.dedup_distance = dedup_distance if dedup_distance is not None and dedup_distance >= 0 else None
         self.storage_dir = Path(storage_dir)
-        self.storage_dir.mkdir(exist_ok=True)
-        # 初始化模型
-        print(f"🔄 加载模型: {model_name}")
-        try:
-            # 设置环境变量增加超时时间（在导入SentenceTransformer之前设置）
-            os.environ['HF_HUB_DOWNLOAD_TIMEOUT'] = '300'  # 5分钟超时
-            
-            # 尝试加载模型
-            # SentenceTransformer会自动使用本地缓存，如果模型已下载则不会重新下载
-            self.model = SentenceTransformer(model_name)
-            self.dimension = self.model.get_sentence_embedding_dimension()
-            print(f"✅ 模型加载成功")
-        except Exception as e:
-            error_msg = str(e)
-            print(f"❌ 模型加载失败: {error_msg}")
-            print("=" * 60)
-            print("💡 解决方案:")
-            if "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-                print("   网络连接超时，请尝试:")
-                print("   1. 检查网络连接")
-                print("   2. 如果模型已下载，检查缓存目录: ~/.cache/huggingface/")
-                print("   3. 可以手动下载模型到本地缓存")
-            elif "connection" in error_msg.lower():
-                print("   网络连接问题，请检查:")
-                print("   1. 是否可以访问 huggingface.co")
-                print("   2. 是否需要配置代理")
-            else:
-                print("   请检查错误信息并尝试:")
-                print("   1. 重新启动服务")
-                print("   2. 检查模型名称是否正确")
-            print("=" * 60)
-            raise
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # 初始化模型（分片知识库中多个分片共享同一个模型实例）
+        self.model = model if model is not None else load_embedding_model(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
         
         # 初始化FAISS索引
-        self.index = faiss.IndexFlatIP(self.dimension)  # 内积相似度
+        self.index = self._new_index()  # 内积相似度
+        self.exact_vectors = self._new_exact_vectors()
         self.documents = []
-        self.chunks = []
+        self.chunks = ChunkStore()
+        # 已删除文档的文本块下标（墓碑），检索时过滤，压缩时才真正移除
+        self._deleted = np.empty(0, dtype=np.int64)
+        # 文本块编号的版本：压缩或清空使已有下标失效时递增，物化时据此发现过期的检索结果
+        self.epoch = 0
+        self._search_params = None
+        # 文本块签名（开启去重时在首次写入前加载或补算）与 规范块下标 -> 以其为别名的文档ID
+        self.signatures = None
+        self._alias_refs = {}
+        # 文件路径 -> 未删除的文档ID，统计与删除不必遍历全部文档记录
+        self._live_docs = {}
+        self._live_count = 0
+        self._duplicate_count = 0
+        # 排序键 -> 按 (排序值, 路径, 文档ID) 排序的文档列表，首次按该键分页时建立，之后增量维护
+        self._catalogs = {}
+        # 正在写入的文档ID，写入完成后才出现在文档列表中
+        self._open_doc = None
+        self.last_ingest_summary = None
+        # 多线程服务器下，写入（索引追加、保存、清空）与检索互斥
+        self._lock = threading.RLock()
         
         # 加载已存在的知识库
         self._load_knowledge_base()
     
-    def add_document(self, file_path: str) -> Dict[str, Any]:
+    def _new_index(self) -> faiss.Index:
+        """创建空索引；需要训练的索引类型只能由重建任务训练，空分片先使用精确索引"""
+        index = new_index(self.dimension, self.index_type)
+        if not index.is_trained:
+            return faiss.IndexFlatIP(self.dimension)
+        return index
+    
+    def _new_exact_vectors(self) -> Optional[ExactVectorStore]:
+        """量化索引另存原始向量供精确重排，精确索引不需要"""
+        return ExactVectorStore(self.dimension) if is_compressed(self.index) else None
+    
+    def add_document(self, file_path: str, replace: bool = False) -> Dict[str, Any]:
         """
         添加单个文档到知识库
         
         Args:
             file_path: 文档路径
+            replace: 新版本写入后删除同一路径的旧版本（目录同步更新已修改的文件）
             
         Returns:
             处理结果
         """
         try:
-            processor = DocumentProcessor()
-            doc_info = processor.process_document(file_path)
+            processor = DocumentProcessor(pdf_workers=self.pdf_workers, parse_cache=self.parse_cache)
+            doc_info = self._process_and_encode(processor, file_path)
+            embeddings = doc_info.pop('embeddings')
             
-            # 生成向量
-            embeddings = self.model.encode(doc_info['chunks'])
-            
-            # 添加到FAISS索引
-            self.index.add(embeddings.astype('float32'))
-            
-            # 保存文档信息
-            doc_id = len(self.documents)
-            doc_info['doc_id'] = doc_id
-            doc_info['chunk_start'] = len(self.chunks)
-            doc_info['chunk_end'] = len(self.chunks) + len(doc_info['chunks'])
-            
-            self.documents.append(doc_info)
-            
-            # 保存文本块
-            for i, chunk in enumerate(doc_info['chunks']):
-                self.chunks.append({
-                    'doc_id': doc_id,
-                    'chunk_id': i,
-                    'text': chunk,
-                    'embedding': embeddings[i].tolist()
-                })
+            # 知识库中只保留文档元数据，全文与文本块不重复存储
+            doc = self.start_document(doc_info['file_path'], doc_info['file_size'], doc_info['file_mtime'])
+            self.append_chunks(doc, doc_info['chunks'], doc_info['chunk_pages'], embeddings)
+            self.finish_document(doc, doc_info['word_count'])
+            if replace:
+                self.remove_document(doc['file_path'], keep=doc['doc_id'])
+            doc_info.update(doc)
             
             print(f"✅ 文档已添加: {doc_info['file_name']} ({doc_info['chunk_count']} 块)")
             return doc_info
             
         except Exception as e:
+            metrics.DOCUMENTS_INGESTED.inc(status='error')
             print(f"❌ 添加文档失败: {file_path} - {str(e)}")
             raise
     
-    def add_directory(self, directory_path: str) -> List[Dict[str, Any]]:
+    def _process_and_encode(self, processor: DocumentProcessor, file_path: str) -> Dict[str, Any]:
+        """
+        流式解析文档并分批编码
+        
+        文本块一边从解析器（PDF为逐页、可多进程）产出，一边按 embed_batch_size
+        分批送入模型编码，解析与向量化流水线进行，无需等待整篇文档提取完成。
+        
+        Returns:
+            与 DocumentProcessor.process_document 相同的文档信息，外加 'embeddings'
+        """
+        path = Path(file_path)
+        # 解析前记录修改时间：解析期间文件又被修改时，目录同步会再导入一次
+        stat = path.stat()
+        segments = []
+        
+        def tee(stream):
+            for page, text in stream:
+                segments.append(text)
+                yield page, text
+        
+        stats = {'word_count': 0}
+        chunks = []
+        chunk_pages = []
+        parts = []
+        encoded = 0
+        for chunk, page in processor.iter_chunks(tee(processor.iter_segments(path)), stats=stats):
+            chunks.append(chunk)
+            chunk_pages.append(page)
+            if len(chunks) - encoded >= self.embed_batch_size:
+                parts.append(self.encode_chunks(chunks[encoded:]))
+                encoded = len(chunks)
+        if encoded < len(chunks):
+            parts.append(self.encode_chunks(chunks[encoded:]))
+        
+        return {
+            'file_path': str(path),
+            'file_name': path.name,
+            'file_size': stat.st_size,
+            'file_mtime': stat.st_mtime,
+            'content': '\n'.join(segments),
+            'chunks': chunks,
+            'chunk_pages': chunk_pages,
+            'chunk_count': len(chunks),
+            'word_count': stats['word_count'],
+            'embeddings': np.vstack(parts)
+        }
+    
+    def _encode(self, texts: List[str], kind: str) -> np.ndarray:
+        """调用模型编码并记录耗时（kind: query/ingest）"""
+        with metrics.timer(metrics.EMBED_SECONDS, kind=kind):
+            embeddings = self.model.encode(texts)
+        metrics.EMBED_TEXTS.inc(len(texts), kind=kind)
+        return embeddings
+    
+    def encode_chunks(self, texts: List[str], shards: Optional[List['VectorKnowledgeBase']] = None) -> np.ndarray:
+        """
+        编码待写入的文本块；开启去重时，与已存储文本块近重复的直接取回其向量，不再调用模型
+        
+        Args:
+            texts: 文本块
+            shards: 查找近重复的分片（默认只查本分片）
+        """
+        if self.dedup_distance is None:
+            return self._encode(texts, 'ingest')
+        embeddings, reused = encode_deduplicated(texts, shards or [self], lambda batch: self._encode(batch, 'ingest'))
+        metrics.EMBED_REUSED.inc(reused)
+        return embeddings
+    
+    def duplicate_vectors(self, signatures: np.ndarray, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查找与各文本块重复（签名相近且归一化文本相同）的已存储文本块，取回其向量
+        
+        Args:
+            signatures: 待写入文本块的 SimHash
+            texts: 对应的文本块
+        
+        Returns:
+            (找到近重复的签名下标, 对应的向量)；索引不支持取回向量时两者皆为空
+        """
+        rows, ids = [], []
+        with self._lock:
+            index = self._signatures_locked()
+            if index is not None:
+                for row, signature in enumerate(signatures):
+                    canonical = index.find(int(signature), exclude=self._deleted,
+                                           accept=self._same_text_locked(texts[row]))
+                    if canonical is not None:
+                        rows.append(row)
+                        ids.append(canonical)
+            vectors = self.reconstruct_vectors(np.asarray(ids, dtype=np.int64)) if ids else None
+        if vectors is None:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimension), dtype='float32')
+        return np.asarray(rows, dtype=np.int64), np.asarray(vectors, dtype='float32')
+    
+    def _signatures_locked(self) -> Optional[SimHashIndex]:
+        """开启去重时返回与文本块对齐的签名索引，缺少的签名（如关闭去重期间写入的文本块）补算"""
+        if self.dedup_distance is None:
+            return None
+        if self.signatures is None or len(self.signatures) > len(self.chunks):
+            self.signatures = SimHashIndex(self.dedup_distance)
+        if len(self.signatures) < len(self.chunks):
+            missing = range(len(self.signatures), len(self.chunks))
+            self.signatures.extend(simhash_many([self.chunks.text(i) for i in missing]))
+        return self.signatures
+    
+    def start_document(self, file_path: str, file_size: int, file_mtime: Optional[float] = None) -> Dict[str, Any]:
+        """
+        登记一个新文档，之后通过 append_chunks 追加文本块
+        
+        同一时刻只能有一个文档处于写入状态，以保证其文本块在索引中连续。
+        
+        Args:
+            file_path: 文档路径
+            file_size: 文件大小
+            file_mtime: 文件修改时间（目录同步据此判断文件是否变化）
+            
+        Returns:
+            文档元数据记录
+        """
+        self._check_writable()
+        with self._lock:
+            doc = {
+                'file_path': str(file_path),
+                'file_name': Path(file_path).name,
+                'file_size': int(file_size),
+                'doc_id': len(self.documents),
+                'chunk_start': len(self.chunks),
+                'chunk_end': len(self.chunks),
+                'chunk_count': 0,
+                'word_count': 0
+            }
+            if file_mtime is not None:
+                doc['file_mtime'] = float(file_mtime)
+            self.documents.append(doc)
+            self._live_docs.setdefault(doc['file_path'], []).append(doc['doc_id'])
+            self._live_count += 1
+            self._open_doc = doc['doc_id']
+            return doc
+    
+    def append_chunks(self, doc: Dict[str, Any], texts: List[str], pages: List[Any], embeddings: np.ndarray):
+        """
+        向正在写入的文档追加一批文本块及其向量
+        
+        Args:
+            doc: start_document 返回的文档记录
+            texts: 文本块
+            pages: 每个文本块的起始页码（无页码为None）
+            embeddings: 文本块向量
+        
+        开启去重时，与已存储（或本批中更早的）文本块重复（签名相近且归一化文本相同）的文本块不写入索引与文本块存储，
+        只在文档记录的 aliases 中登记 [文档内序号, 规范块下标, 页码]。
+        """
+        if not texts:
+            return
+        embeddings = np.asarray(embeddings, dtype='float32')
+        # chunk_count 为文档的全部文本块数（含别名），文本块序号在别名处留空
+        total = len(texts)
+        ordinals = np.arange(doc['chunk_count'], doc['chunk_count'] + total, dtype=np.int32)
+        
+        with self._lock:
+            keep = self._register_duplicates_locked(doc, texts, pages, ordinals)
+            if keep is not None:
+                texts = [texts[i] for i in keep]
+                pages = [pages[i] for i in keep]
+                embeddings = embeddings[keep]
+                ordinals = ordinals[keep]
+            
+            # 添加到FAISS索引
+            self.index.add(embeddings)
+            if self.exact_vectors is not None:
+                self.exact_vectors.extend(embeddings)
+            
+            # 保存文本块（向量只存于FAISS索引中）
+            self.chunks.extend(doc['doc_id'], ordinals, texts, pages)
+            
+            doc['chunk_count'] += total
+            doc['chunk_end'] = len(self.chunks)
+        metrics.CHUNKS_INGESTED.inc(len(texts))
+    
+    def _register_duplicates_locked(self, doc: Dict[str, Any], texts: List[str], pages: List[Any],
+                                    ordinals: np.ndarray) -> Optional[List[int]]:
+        """登记近重复文本块为别名，返回需要写入的文本块位置（未开启去重时为None）"""
+        index = self._signatures_locked()
+        if index is None:
+            return None
+        keep = []
+        pending = {}     # 本批中新文本块的下标 -> 归一化文本（尚未写入文本块存储）
+        aliases = doc.setdefault('aliases', [])
+        for i, signature in enumerate(simhash_many(texts)):
+            canonical = index.find(int(signature), exclude=self._deleted,
+                                   accept=self._same_text_locked(texts[i], pending))
+            if canonical is None:
+                # 新文本块的下标即签名索引的当前长度，本批中后面的文本块也能以它为规范块
+                pending[len(index)] = normalize_text(texts[i])
+                index.append(signature)
+                keep.append(i)
+            else:
+                aliases.append([int(ordinals[i]), canonical, pages[i]])
+                self._alias_refs.setdefault(canonical, []).append(doc['doc_id'])
+        if not aliases:
+            del doc['aliases']
+        duplicates = len(texts) - len(keep)
+        if duplicates:
+            self._duplicate_count += duplicates
+            metrics.DUPLICATE_CHUNKS.inc(duplicates)
+        return keep
+    
+    def _same_text_locked(self, text: str, pending: Optional[Dict[int, str]] = None) -> Callable[[int], bool]:
+        """
+        候选校验：签名相近只是候选，归一化文本相同才登记为别名，只差一个数字的段落各自保留原文
+        
+        Args:
+            text: 待写入的文本块
+            pending: 本批中尚未写入文本块存储的规范块（下标 -> 归一化文本）
+        """
+        normalized = normalize_text(text)
+        
+        def accept(chunk: int) -> bool:
+            if pending and chunk in pending:
+                return pending[chunk] == normalized
+            return normalize_text(self.chunks.text(chunk)) == normalized
+        return accept
+    
+    def finish_document(self, doc: Dict[str, Any], word_count: int):
+        """结束文档写入，记录词数"""
+        with self._lock:
+            doc['word_count'] = int(word_count)
+            if self._open_doc == doc['doc_id']:
+                self._open_doc = None
+            for sort, catalog in self._catalogs.items():
+                insort(catalog, self._catalog_entry(sort, doc))
+        metrics.DOCUMENTS_INGESTED.inc(status='ok')
+    
+    def remove_document(self, file_path: str, keep: Optional[int] = None) -> int:
+        """
+        删除一个文件的所有文档记录
+        
+        文档记录标记为 deleted，其文本块下标加入墓碑，检索时通过 FAISS 的 ID 过滤器排除，
+        索引与文本块不做移动，耗时与被删除的文本块数成正比；compact() 时才真正移除。
+        仍被其他文档作为别名引用的文本块保留，由引用它的文档继续提供。
+        
+        Args:
+            file_path: 文档路径
+            keep: 保留的文档ID（替换时保留刚写入的新版本）
+        
+        Returns:
+            删除的文档记录数
+        """
+        self._check_writable()
+        with self._lock:
+            doc_ids = self._live_docs.get(str(file_path), [])
+            removed = [self.documents[d] for d in doc_ids if d != keep]
+            if not removed:
+                return 0
+            if keep in doc_ids:
+                self._live_docs[str(file_path)] = [keep]
+            else:
+                del self._live_docs[str(file_path)]
+            for doc in removed:
+                doc['deleted'] = True
+                self._live_count -= 1
+                self._duplicate_count -= len(doc.get('aliases', ()))
+                for sort, catalog in self._catalogs.items():
+                    entry = self._catalog_entry(sort, doc)
+                    i = bisect_left(catalog, entry)
+                    if i < len(catalog) and catalog[i] == entry:
+                        del catalog[i]
+            # 被删除文档引用的规范块，其所属文档已删除且不再被引用时一并删除
+            canonicals = {canonical for doc in removed for _, canonical, _ in doc.get('aliases', ())}
+            orphans = [c for c in canonicals if self.documents[int(self.chunks.doc_ids[c])].get('deleted')]
+            dead = np.union1d(self._chunk_ids_of(removed), np.asarray(orphans, dtype=np.int64))
+            dead = dead[~np.isin(dead, self._alias_targets_locked())]
+            self._deleted = np.union1d(self._deleted, dead)
+            self._search_params = None
+        return len(removed)
+    
+    def _alias_targets_locked(self) -> np.ndarray:
+        """仍被未删除文档作为别名引用的文本块下标"""
+        return np.asarray([canonical for canonical, doc_ids in self._alias_refs.items()
+                           if any(not self.documents[d].get('deleted') for d in doc_ids)], dtype=np.int64)
+    
+    def _index_aliases_locked(self):
+        """由文档记录重建别名的反向索引"""
+        self._alias_refs = {}
+        for doc in self.documents:
+            for _, canonical, _ in doc.get('aliases', ()):
+                self._alias_refs.setdefault(canonical, []).append(doc['doc_id'])
+    
+    def _index_documents_locked(self):
+        """由文档记录重建按路径的文档索引与统计计数，文档列表的排序在下次分页时重建"""
+        self._live_docs = {}
+        self._duplicate_count = 0
+        for doc in self.documents:
+            if not doc.get('deleted'):
+                self._live_docs.setdefault(doc['file_path'], []).append(doc['doc_id'])
+                self._duplicate_count += len(doc.get('aliases', ()))
+        self._live_count = sum(len(doc_ids) for doc_ids in self._live_docs.values())
+        self._catalogs = {}
+        self._open_doc = None
+    
+    @staticmethod
+    def _catalog_entry(sort: str, doc: Dict[str, Any]) -> Tuple[Any, str, int]:
+        return DOCUMENT_SORT_KEYS[sort](doc), doc['file_path'], doc['doc_id']
+    
+    def list_documents(self, sort: str = 'name', after: Optional[Tuple[Any, str, int]] = None,
+                       descending: bool = False, limit: int = 100,
+                       match: Optional[Callable[[Dict[str, Any]], bool]] = None
+                       ) -> List[Tuple[Tuple[Any, str, int], Dict[str, Any]]]:
+        """
+        按排序键分页列出文档
+        
+        每个排序键的有序列表在首次使用时建立，之后随写入与删除增量维护；
+        分页从 after 处二分定位，开销与页大小成正比（带 match 过滤时与扫过的文档数成正比）。
+        
+        Args:
+            sort: 排序键（见 DOCUMENT_SORT_KEYS）
+            after: 上一页最后一个文档的 (排序值, 路径, 文档ID)，只返回排在其后的文档
+            descending: 是否降序
+            limit: 最多返回的文档数
+            match: 文档过滤条件
+        
+        Returns:
+            [((排序值, 路径, 文档ID), 文档信息)]
+        """
+        with self._lock:
+            catalog = self._catalogs.get(sort)
+            if catalog is None:
+                catalog = sorted(self._catalog_entry(sort, doc) for doc in self.documents
+                                 if not doc.get('deleted') and doc['doc_id'] != self._open_doc)
+                self._catalogs[sort] = catalog
+            if descending:
+                end = bisect_left(catalog, after) if after is not None else len(catalog)
+                positions = range(end - 1, -1, -1)
+            else:
+                start = bisect_right(catalog, after) if after is not None else 0
+                positions = range(start, len(catalog))
+            page = []
+            for i in positions:
+                if len(page) >= limit:
+                    break
+                doc = self.documents[catalog[i][2]]
+                if match is None or match(doc):
+                    page.append((catalog[i], self._document_info(doc)))
+            return page
+    
+    def _chunk_ids_of(self, docs: List[Dict[str, Any]]) -> np.ndarray:
+        """文档的全部文本块下标（旧版本的文档记录中没有 chunk_start/chunk_end，按 doc_ids 查找）"""
+        parts = [np.empty(0, dtype=np.int64)]
+        legacy = []
+        for doc in docs:
+            if 'chunk_start' in doc:
+                parts.append(np.arange(doc['chunk_start'], doc['chunk_end'], dtype=np.int64))
+            else:
+                legacy.append(doc['doc_id'])
+        if legacy:
+            parts.append(np.nonzero(np.isin(self.chunks.doc_ids, legacy))[0].astype(np.int64))
+        return np.concatenate(parts)
+    
+    def document_chunk_ids(self, doc: Dict[str, Any], ids: np.ndarray) -> Tuple[np.ndarray, List[Optional[int]]]:
+        """
+        文档按原顺序的全部文本块：自身存储的文本块与别名指向的规范块
+        
+        Args:
+            doc: 文档记录
+            ids: 该文档自身存储的文本块下标
+        
+        Returns:
+            (文本块下标, 页码)，按文档内序号排列
+        """
+        with self._lock:
+            pages = [int(p) if p >= 0 else None for p in self.chunks.pages[ids]]
+            aliases = doc.get('aliases')
+            if not aliases:
+                return ids, pages
+            ordinals = np.concatenate([self.chunks.chunk_ids[ids], [alias[0] for alias in aliases]])
+            all_ids = np.concatenate([ids, np.asarray([alias[1] for alias in aliases], dtype=ids.dtype)])
+            pages += [alias[2] for alias in aliases]
+        order = np.argsort(ordinals, kind='stable')
+        return all_ids[order], [pages[i] for i in order]
+    
+    @property
+    def deleted_ratio(self) -> float:
+        """已删除文本块占全部文本块的比例"""
+        return len(self._deleted) / len(self.chunks) if len(self.chunks) else 0.0
+    
+    def reconstruct_vectors(self, ids: np.ndarray) -> Optional[np.ndarray]:
+        """
+        取回指定文本块的原向量：量化索引优先读原始向量文件，
+        否则从索引重建；索引不支持重建时返回None（调用方改为重新编码）
+        """
+        with self._lock:
+            if self._can_rescore_locked():
+                return self.exact_vectors.take(ids)
+            try:
+                return self.index.reconstruct_batch(np.asarray(ids, dtype='int64'))
+            except RuntimeError:
+                return None
+    
+    def compact(self) -> int:
+        """
+        移除已删除文档的文本块与向量，文档与文本块重新编号
+        
+        沿用已训练的索引（复制后清空再写入存活的向量），不需要重新训练。
+        已删除但仍被别名引用的文本块连同其文档记录（仍标记为 deleted）一起保留，别名按新下标改写。
+        
+        Returns:
+            移除的文本块数
+        """
+        self._check_writable()
+        with self._lock:
+            if not len(self._deleted):
+                return 0
+            live = np.ones(len(self.chunks), dtype=bool)
+            live[self._deleted] = False
+            ids = np.nonzero(live)[0]
+            vectors = self.reconstruct_vectors(ids) if len(ids) else None
+            if vectors is None and len(ids):
+                vectors = self._encode([self.chunks.text(i) for i in ids], 'ingest')
+            
+            index = faiss.clone_index(self.index)
+            index.reset()
+            chunks = ChunkStore(capacity=max(1, len(ids)))
+            documents = []
+            doc_ids = self.chunks.doc_ids[ids]
+            order = np.argsort(doc_ids, kind='stable')
+            bounds = np.searchsorted(doc_ids[order], np.arange(len(self.documents) + 1))
+            rows = []
+            for old_id, doc in enumerate(self.documents):
+                doc_rows = order[bounds[old_id]:bounds[old_id + 1]]
+                if doc.get('deleted'):
+                    if not len(doc_rows):
+                        continue
+                    doc = {key: value for key, value in doc.items() if key != 'aliases'}
+                doc = dict(doc, doc_id=len(documents), chunk_start=len(chunks))
+                if len(doc_rows):
+                    chunks.extend(doc['doc_id'], self.chunks.chunk_ids[ids[doc_rows]],
+                                  [self.chunks.text(i) for i in ids[doc_rows]],
+                                  [int(p) if p >= 0 else None for p in self.chunks.pages[ids[doc_rows]]])
+                    rows.append(doc_rows)
+                doc['chunk_end'] = len(chunks)
+                documents.append(doc)
+            
+            kept = ids[np.concatenate(rows)] if rows else np.empty(0, dtype=np.int64)
+            new_ids = np.full(len(self.chunks), -1, dtype=np.int64)
+            new_ids[kept] = np.arange(len(kept))
+            for doc in documents:
+                if 'aliases' in doc:
+                    doc['aliases'] = [[ordinal, int(new_ids[canonical]), page]
+                                      for ordinal, canonical, page in doc['aliases'] if new_ids[canonical] >= 0]
+            if self.signatures is not None:
+                self.signatures = self.signatures.take(kept) if len(self.signatures) == len(self.chunks) else None
+            
+            removed = len(self._deleted)
+            self.index = index
+            self.exact_vectors = self._new_exact_vectors()
+            if rows:
+                vectors = np.asarray(vectors, dtype='float32')[np.concatenate(rows)]
+                self.index.add(vectors)
+                if self.exact_vectors is not None:
+                    self.exact_vectors.extend(vectors)
+            self.documents = documents
+            self.chunks = chunks
+            self._index_aliases_locked()
+            self._index_documents_locked()
+            self._deleted = np.empty(0, dtype=np.int64)
+            self._search_params = None
+            self.epoch += 1
+        print(f"🧹 分片已压缩: {self.storage_dir}（移除 {removed} 个已删除的文本块）")
+        return removed
+    
+    def add_directory(self, directory_path: str, max_inflight_bytes: int = 64 * 1024 * 1024) -> List[Dict[str, Any]]:
         """
         添加目录中的所有文档
         
+        通过流式流水线导入（解析 → 分块 → 批量向量化 → 写入索引），
+        内存占用由 max_inflight_bytes 限定，与目录总大小无关。
+        各阶段吞吐统计保存在 self.last_ingest_summary 中。
+        
         Args:
             directory_path: 目录路径
+            max_inflight_bytes: 流水线中在途文本与向量的字节上限
             
         Returns:
             处理结果列表
         """
-        processor = DocumentProcessor()
-        documents = processor.process_directory(directory_path)
+        pipeline = IngestPipeline(self, DocumentProcessor(pdf_workers=self.pdf_workers, parse_cache=self.parse_cache),
+                                  max_inflight_bytes=max_inflight_bytes)
+        summary = pipeline.run_directory(directory_path)
+        self.last_ingest_summary = summary
         
-        results = []
-        for doc_info in documents:
-            try:
-                # 生成向量
-                embeddings = self.model.encode(doc_info['chunks'])
-                
-                # 添加到FAISS索引
-                self.index.add(embeddings.astype('float32'))
-                
-                # 保存文档信息
-                doc_id = len(self.documents)
-                doc_info['doc_id'] = doc_id
-                doc_info['chunk_start'] = len(self.chunks)
-                doc_info['chunk_end'] = len(self.chunks) + len(doc_info['chunks'])
-                
-                self.documents.append(doc_info)
-                
-                # 保存文本块
-                for i, chunk in enumerate(doc_info['chunks']):
-                    self.chunks.append({
-                        'doc_id': doc_id,
-                        'chunk_id': i,
-                        'text': chunk,
-                        'embedding': embeddings[i].tolist()
-                    })
-                
-                results.append(doc_info)
-                print(f"✅ 文档已添加: {doc_info['file_name']} ({doc_info['chunk_count']} 块)")
-                
-            except Exception as e:
-                print(f"❌ 添加文档失败: {doc_info['file_name']} - {str(e)}")
+        print(f"📊 导入完成: {summary['document_count']} 文档, {summary['chunk_count']} 块, "
+              f"耗时 {summary['elapsed_seconds']}s, 在途峰值 {summary['peak_inflight_bytes'] / 1e6:.1f}MB")
+        for name, stage in summary['stages'].items():
+            print(f"   {name:<6} {stage['items']} 项, {stage['items_per_second']} 项/秒, "
+                  f"忙碌 {stage['busy_seconds']}s, 阻塞 {stage['blocked_seconds']}s")
+        if 'parse_cache' in summary:
+            cache = summary['parse_cache']
+            print(f"   解析缓存 命中 {cache['hits']}/{cache['hits'] + cache['misses']}, "
+                  f"节省解析 {cache['saved_seconds']}s")
         
-        return results
+        return summary['documents']
     
-    def search(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 10, min_similarity: Optional[float] = None,
+               relative_cutoff: Optional[float] = None, max_gap: Optional[float] = None) -> List[Dict[str, Any]]:
         """
         搜索相关文档
         
         Args:
             query: 查询文本
-            top_k: 返回结果数量
+            top_k: 返回结果数量上限
+            min_similarity: 最低相似度（设置后使用 range_search，弱相关结果不参与物化）
+            relative_cutoff: 相对最高分的保留比例
+            max_gap: 相邻结果相似度的最大落差
+        
+        Returns:
+            搜索结果列表（可能少于 top_k 条）
+        """
+        if len(self.chunks) == 0:
+            return []
+        
+        with metrics.timer(metrics.KB_SEARCH_SECONDS):
+            # 生成查询向量
+            with tracing.span('query_encode'):
+                query_embedding = self._encode([query], 'query')
             
+            return self.search_vectors(query_embedding, top_k, min_similarity, relative_cutoff, max_gap)
+    
+    def search_vectors(self, query_embedding: np.ndarray, top_k: int = 10, min_similarity: Optional[float] = None,
+                       relative_cutoff: Optional[float] = None, max_gap: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        使用已编码的查询向量搜索
+        
+        Args:
+            query_embedding: 形状为 (1, dimension) 的查询向量
+            top_k: 返回结果数量上限
+            min_similarity: 最低相似度
+            relative_cutoff: 相对最高分的保留比例
+            max_gap: 相邻结果相似度的最大落差
+        
         Returns:
             搜索结果列表
         """
         if len(self.chunks) == 0:
             return []
         
-        # 生成查询向量
-        query_embedding = self.model.encode([query])
+        def search():
+            scores, indices, epoch = self.search_raw(query_embedding, top_k, min_similarity)
+            keep = score_cutoff(scores, relative_cutoff=relative_cutoff, max_gap=max_gap)
+            with tracing.span('materialize'):
+                return self.materialize(scores[:keep].tolist(), indices[:keep].tolist(), epoch)
+        return retry_stale(search)
+    
+    def search_documents(self, query: str, top_k: int = 5, aggregate: str = 'max', top_n: int = 3,
+                         passages: int = 3, neighbors: int = 1, candidates: Optional[int] = None,
+                         min_similarity: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        文档级检索：多取文本块候选，按文档聚合得分后返回得分最高的文档
+        
+        Args:
+            query: 查询文本
+            top_k: 返回的文档数上限
+            aggregate: 文档得分的聚合方式 max/sum/mean（前 top_n 个得分的平均）
+            top_n: mean 聚合时参与平均的得分个数
+            passages: 每篇文档返回的最佳段落数
+            neighbors: 每个段落前后各带上的相邻文本块数
+            candidates: 参与聚合的文本块候选数（默认 top_k 的 DOCUMENT_OVERFETCH 倍）
+            min_similarity: 文本块的最低相似度
+        
+        Returns:
+            文档结果列表，每篇文档含聚合得分 score、命中数 hits 与段落 passages
+        """
+        if len(self.chunks) == 0:
+            return []
+        
+        with metrics.timer(metrics.KB_SEARCH_SECONDS):
+            with tracing.span('query_encode'):
+                query_embedding = self._encode([query], 'query')
+            
+            def search():
+                scores, indices, epoch = self.search_raw(query_embedding, candidates or top_k * DOCUMENT_OVERFETCH,
+                                                         min_similarity)
+                with tracing.span('materialize'):
+                    return rank_documents([(0, self, scores, indices, epoch)], top_k, aggregate, top_n, passages,
+                                          neighbors)
+            return retry_stale(search)
+    
+    def search_raw(self, query_embedding: np.ndarray, top_k: int = 10,
+                   min_similarity: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        只做向量检索，不物化结果记录
+        
+        设置 min_similarity 时使用 index.range_search 只取出超过阈值的命中，
+        再从中选出 top_k；索引不支持范围检索时退回 top_k 检索后过滤。
+        量化索引保存了原始向量时，先取 rescore_factor 倍的候选，再按精确内积重排。
+        
+        Returns:
+            (相似度, 文本块下标, 文本块编号版本)，按相似度降序，已去除无效下标；
+            物化时传回版本号，检索之后分片被压缩则物化抛出 StaleSearchError
+        """
+        query = np.asarray(query_embedding, dtype='float32')
+        index_type = type(self.index).__name__
+        tracing.annotate(index_type=index_type)
+        with self._lock:
+            rescore = self._can_rescore_locked()
+            candidates = top_k * self.rescore_factor if rescore else top_k
+            scores, indices = self._search_index_locked(query, candidates, min_similarity, index_type)
+            if rescore and len(indices):
+                with tracing.span('rescore', candidates=len(indices)):
+                    scores = self.exact_vectors.rescore(query[0], indices)
+                    order = np.argsort(-scores, kind='stable')[:top_k]
+                    scores, indices = scores[order], indices[order]
+            epoch = self.epoch
+        keep = score_cutoff(scores, min_similarity=min_similarity)
+        return scores[:keep], indices[:keep], epoch
+    
+    def _can_rescore_locked(self) -> bool:
+        return (self.rescore_factor > 0 and self.exact_vectors is not None
+                and len(self.exact_vectors) == self.index.ntotal)
+    
+    def _search_params_locked(self):
+        """
+        排除已删除文本块的检索参数：没有删除时为None；
+        索引不支持 ID 过滤（如 PQ）时为False，改为多取候选后过滤
+        """
+        if not len(self._deleted):
+            return None
+        if self._search_params is None:
+            selected = faiss.IDSelectorBatch(self._deleted)
+            selector = faiss.IDSelectorNot(selected)
+            ivf = faiss.try_extract_index_ivf(self.index)
+            params = faiss.SearchParameters(sel=selector) if ivf is None \
+                else faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+            try:
+                self.index.search(np.zeros((1, self.dimension), dtype='float32'), 1, params=params)
+            except RuntimeError:
+                self._search_params = (False,)
+            else:
+                # 参数对象不持有过滤器的引用，一并保存以免被回收
+                self._search_params = (params, selector, selected)
+        return self._search_params[0]
+    
+    def _search_index_locked(self, query: np.ndarray, top_k: int, min_similarity: Optional[float],
+                             index_type: str) -> Tuple[np.ndarray, np.ndarray]:
+        """在索引上检索，返回按（近似）相似度降序、已去除无效下标与已删除文本块的候选"""
+        params = self._search_params_locked()
+        filter_deleted = params is False
+        if filter_deleted:
+            params = None
+        fetch = min(top_k + len(self._deleted), self.index.ntotal) if filter_deleted else top_k
+        with metrics.timer(metrics.INDEX_SEARCH_SECONDS), \
+                tracing.span('ann_search', index_type=index_type, range=min_similarity is not None):
+            if min_similarity is not None:
+                # 内积索引的范围检索保留 score > radius，半径下调一个 float32 精度单位以包含等于阈值的命中
+                radius = float(np.nextafter(np.float32(min_similarity), np.float32(-np.inf)))
+                try:
+                    lims, scores, indices = self.index.range_search(query[:1], radius, params=params)
+                except RuntimeError:
+                    # 部分索引类型（如 HNSW）不支持范围检索
+                    pass
+                else:
+                    scores, indices = scores[lims[0]:lims[1]], indices[lims[0]:lims[1]]
+                    if filter_deleted:
+                        live = ~np.isin(indices, self._deleted)
+                        scores, indices = scores[live], indices[live]
+                    if len(scores) > top_k:
+                        selected = np.argpartition(-scores, top_k - 1)[:top_k]
+                        scores, indices = scores[selected], indices[selected]
+                    order = np.argsort(-scores, kind='stable')
+                    return scores[order], indices[order].astype(np.int64)
+            
+            scores, indices = self.index.search(query, fetch, params=params)
         
-        # 搜索相似向量
-        scores, indices = self.index.search(query_embedding.astype('float32'), top_k)
+        scores, indices = scores[0], indices[0]
+        valid = indices >= 0
+        if filter_deleted:
+            valid &= ~np.isin(indices, self._deleted)
+        return scores[valid][:top_k], indices[valid][:top_k]
+    
+    def materialize(self, scores: List[float], indices: List[int], epoch: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        只为 top-k 命中物化结果记录
         
-        # 构建结果
+        Raises:
+            StaleSearchError: epoch 与当前文本块编号版本不一致（检索之后分片被压缩）
+        """
+        with self._lock:
+            self._check_epoch_locked(epoch)
+            return self._materialize_locked(scores, indices)
+    
+    def _check_epoch_locked(self, epoch: Optional[int]):
+        if epoch is not None and epoch != self.epoch:
+            raise StaleSearchError(f"文本块编号已变化: {self.storage_dir}")
+    
+    def _materialize_locked(self, scores: List[float], indices: List[int]) -> List[Dict[str, Any]]:
         results = []
-        for score, idx in zip(scores[0], indices[0]):
-            # 确保索引是Python int类型
-            idx = int(idx)
-            if idx < len(self.chunks):
+        for score, idx in zip(scores, indices):
+            if 0 <= idx < len(self.chunks):
                 chunk = self.chunks[idx]
-                doc = self.documents[chunk['doc_id']]
+                doc_id, chunk_index, page = chunk['doc_id'], chunk['chunk_id'], chunk['page']
+                holders = [d for d in dict.fromkeys(self._alias_refs.get(idx, ()))
+                           if not self.documents[d].get('deleted')]
+                if holders and self.documents[doc_id].get('deleted'):
+                    # 所属文档已删除，由第一个引用它的文档提供
+                    doc_id = holders.pop(0)
+                    chunk_index, page = next((ordinal, alias_page) for ordinal, canonical, alias_page
+                                             in self.documents[doc_id]['aliases'] if canonical == idx)
+                duplicate_files = [self.documents[d]['file_path'] for d in holders if d != doc_id]
+                doc = self.documents[doc_id]
                 
-                results.append({
-                    'chunk_id': int(idx),
-                    'doc_id': int(chunk['doc_id']),
+                result = {
+                    'chunk_id': idx,
+                    'doc_id': doc_id,
                     'file_path': str(doc['file_path']),
                     'file_name': str(doc['file_name']),
-                    'text': str(chunk['text']),
-                    'similarity': float(score),
-                    'chunk_index': int(chunk['chunk_id'])
-                })
+                    'text': chunk['text'],
+                    'similarity': score,
+                    'chunk_index': chunk_index,
+                    'page': page
+                }
+                if duplicate_files:
+                    # 近重复的文本块只保存一份，其他包含它的文件
+                    result['duplicate_files'] = duplicate_files
+                results.append(result)
         
         return results
     
+    def chunk_owners(self, indices: np.ndarray, epoch: Optional[int] = None) -> np.ndarray:
+        """
+        文本块所属的文档ID
+        
+        所属文档已删除、仍作为别名被引用的规范块归第一个引用它的文档，与 materialize 一致。
+        
+        Raises:
+            StaleSearchError: epoch 与当前文本块编号版本不一致
+        """
+        with self._lock:
+            self._check_epoch_locked(epoch)
+            owners = self.chunks.doc_ids[np.asarray(indices, dtype=np.int64)].astype(np.int64)
+            for doc_id in np.unique(owners).tolist():
+                if not self.documents[doc_id].get('deleted'):
+                    continue
+                for i in np.flatnonzero(owners == doc_id):
+                    holders = [d for d in self._alias_refs.get(int(indices[i]), ())
+                               if not self.documents[d].get('deleted')]
+                    if holders:
+                        owners[i] = holders[0]
+            return owners
+    
+    def materialize_document(self, doc_id: int, scores: List[float], indices: List[int],
+                             neighbors: int = 1, epoch: Optional[int] = None) -> Dict[str, Any]:
+        """
+        物化一篇文档的检索结果
+        
+        每个段落按文档记录的 chunk_start/chunk_end 带上前后各 neighbors 个文本块（已作为段落返回的除外），
+        直接读取文本块存储，不再检索。别名段落与旧版本的文档记录没有可用的文本块范围，不带相邻文本块。
+        
+        Args:
+            doc_id: 文档ID
+            scores: 段落的相似度
+            indices: 段落的文本块下标
+            neighbors: 每个段落前后各带上的相邻文本块数
+            epoch: search_raw 返回的文本块编号版本（为None时不检查）
+        
+        Returns:
+            文档结果（段落位于 passages）
+        
+        Raises:
+            StaleSearchError: epoch 与当前文本块编号版本不一致
+        """
+        with self._lock:
+            self._check_epoch_locked(epoch)
+            doc = self.documents[doc_id]
+            passages = self._materialize_locked(scores, indices)
+            hit_ids = set(indices)
+            start, end = doc.get('chunk_start', 0), doc.get('chunk_end', 0)
+            for passage in passages:
+                for key in ('doc_id', 'file_path', 'file_name'):
+                    passage.pop(key)
+                idx = passage['chunk_id']
+                context = []
+                if neighbors > 0 and start <= idx < end:
+                    for i in range(max(start, idx - neighbors), min(end, idx + neighbors + 1)):
+                        if i not in hit_ids:
+                            chunk = self.chunks[i]
+                            context.append({'chunk_id': i, 'chunk_index': chunk['chunk_id'], 'page': chunk['page'],
+                                            'text': chunk['text']})
+                passage['neighbors'] = context
+            return {
+                'doc_id': doc_id,
+                'file_path': str(doc['file_path']),
+                'file_name': str(doc['file_name']),
+                'chunk_count': int(doc['chunk_count']),
+                'passages': passages
+            }
+    
     def get_stats(self) -> Dict[str, Any]:
         """获取知识库统计信息"""
-        total_chunks = len(self.chunks)
-        total_documents = len(self.documents)
-        unique_files = len(set(doc['file_path'] for doc in self.documents))
-        
+        # 计数随写入与删除增量维护，不遍历文档记录
         return {
-            'total_vectors': int(total_chunks),
-            'total_documents': int(total_documents),
-            'unique_files': int(unique_files),
+            'total_vectors': int(len(self.chunks) - len(self._deleted)),
+            'total_documents': int(self._live_count),
+            'unique_files': len(self._live_docs),
+            'deleted_vectors': int(len(self._deleted)),
+            'duplicate_chunks': int(self._duplicate_count),
             'model_name': str(self.model_name),
-            'dimension': int(self.dimension)
+            'dimension': int(self.dimension),
+            'index_bytes_per_vector': int(getattr(self.index, 'code_size', self.dimension * 4)),
+            'exact_rescore': self._can_rescore_locked()
         }
     
     def get_documents(self) -> List[Dict[str, Any]]:
         """获取所有文档信息"""
-        return [
-            {
-                'file_path': str(doc['file_path']),
-                'file_name': str(doc['file_name']),
-                'chunk_count': int(doc['chunk_count']),
-                'word_count': int(doc['word_count']),
-                'file_size': int(doc['file_size'])
-            }
-            for doc in self.documents
-        ]
+        return [self._document_info(doc) for doc in self.documents if not doc.get('deleted')]
     
-    def save_knowledge_base(self):
-        """保存知识库到磁盘"""
-        # 保存FAISS索引
+    @staticmethod
+    def _document_info(doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'file_path': str(doc['file_path']),
+            'file_name': str(doc['file_name']),
+            'chunk_count': int(doc['chunk_count']),
+            'word_count': int(doc['word_count']),
+            'file_size': int(doc['file_size']),
+            'file_mtime': doc.get('file_mtime'),
+            'duplicate_chunks': len(doc.get('aliases', ()))
+        }
+    
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"只读分片不能写入: {self.storage_dir}")
+    
+    def save_knowledge_base(self, directory: Optional[Path] = None):
+        """
+        保存知识库到磁盘
+        
+        Args:
+            directory: 保存到该目录并以其为新的存储位置（默认原目录）
+        """
+        self._check_writable()
+        with self._lock, metrics.timer(metrics.PERSIST_SECONDS, operation='save'):
+            if directory is not None:
+                self.storage_dir = Path(directory)
+                self.storage_dir.mkdir(parents=True, exist_ok=True)
+            self._save_files()
+        print(f"💾 知识库已保存到: {self.storage_dir}")
+    
+    def _save_files(self):
+        """写入索引、文档、文本块与配置文件"""
+        # 保存FAISS索引（量化索引另存原始向量）
         faiss.write_index(self.index, str(self.storage_dir / "faiss_index.bin"))
+        if self.exact_vectors is not None:
+            self.exact_vectors.save(self.storage_dir)
+        else:
+            (self.storage_dir / ExactVectorStore.FILE).unlink(missing_ok=True)
+        # 去重签名与文本块对齐，不完整（关闭去重期间写入过文本块）时不保存，下次开启去重时补算
+        if self.signatures is not None and len(self.signatures) == len(self.chunks):
+            self.signatures.save(self.storage_dir)
+        else:
+            (self.storage_dir / SimHashIndex.FILE).unlink(missing_ok=True)
         
         # 保存文档信息
         with open(self.storage_dir / "documents.json", 'w', encoding='utf-8') as f:
             json.dump(self.documents, f, ensure_ascii=False, indent=2)
         
-        # 保存文本块
-        with open(self.storage_dir / "chunks.json", 'w', encoding='utf-8') as f:
-            json.dump(self.chunks, f, ensure_ascii=False, indent=2)
+        # 保存文本块（列式二进制文件，替代旧版 chunks.json）
+        self.chunks.save(self.storage_dir)
+        legacy_chunks_file = self.storage_dir / "chunks.json"
+        if legacy_chunks_file.exists():
+            legacy_chunks_file.unlink()
         
         # 保存配置
         config = {
             'model_name': self.model_name,
             'dimension': self.dimension,
+            'index_type': self.index_type,
             'total_documents': len(self.documents),
             'total_chunks': len(self.chunks)
         }
         with open(self.storage_dir / "config.json", 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=2)
-        
-        print(f"💾 知识库已保存到: {self.storage_dir}")
     
     def _load_knowledge_base(self):
         """从磁盘加载知识库"""
@@ -263,42 +1176,86 @@ class VectorKnowledgeBase:
             return
         
         try:
-            # 加载配置
-            with open(config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            
-            # 加载FAISS索引
-            index_file = self.storage_dir / "faiss_index.bin"
-            if index_file.exists():
-                self.index = faiss.read_index(str(index_file))
-            
-            # 加载文档信息
-            docs_file = self.storage_dir / "documents.json"
-            if docs_file.exists():
-                with open(docs_file, 'r', encoding='utf-8') as f:
-                    self.documents = json.load(f)
-            
-            # 加载文本块
-            chunks_file = self.storage_dir / "chunks.json"
-            if chunks_file.exists():
-                with open(chunks_file, 'r', encoding='utf-8') as f:
-                    self.chunks = json.load(f)
-            
-            # 知识库加载完成，统计信息会在api_server中显示
-            pass
-            
+            with metrics.timer(metrics.PERSIST_SECONDS, operation='load'):
+                self._load_files()
         except Exception as e:
             print(f"⚠️ 加载知识库失败: {str(e)}")
             print("📝 将创建新的知识库")
     
+    def _load_files(self):
+        """读取索引、文档与文本块文件"""
+        # 加载FAISS索引
+        index_file = self.storage_dir / "faiss_index.bin"
+        if index_file.exists():
+            if self.read_only:
+                self.index = faiss.read_index(str(index_file), INDEX_MMAP_FLAGS)
+            else:
+                self.index = faiss.read_index(str(index_file))
+        # 原始向量总是以内存映射方式打开，只有重排时读到的候选才会被载入
+        self.exact_vectors = None
+        if is_compressed(self.index):
+            if ExactVectorStore.exists(self.storage_dir):
+                self.exact_vectors = ExactVectorStore.load(self.storage_dir)
+            else:
+                print(f"⚠️ {self.storage_dir} 缺少原始向量文件，检索结果不做精确重排")
+        
+        # 加载文档信息
+        docs_file = self.storage_dir / "documents.json"
+        if docs_file.exists():
+            with open(docs_file, 'r', encoding='utf-8') as f:
+                self.documents = json.load(f)
+            # 旧版本在文档记录中重复保存了全文和文本块，加载时丢弃
+            for doc in self.documents:
+                doc.pop('content', None)
+                doc.pop('chunks', None)
+        
+        # 加载文本块（兼容旧版 chunks.json）
+        chunks_file = self.storage_dir / "chunks.json"
+        if ChunkStore.exists(self.storage_dir):
+            self.chunks = ChunkStore.load(self.storage_dir, use_mmap=self.read_only)
+        elif chunks_file.exists():
+            with open(chunks_file, 'r', encoding='utf-8') as f:
+                self.chunks = ChunkStore.from_records(json.load(f))
+        
+        self.signatures = None
+        if self.dedup_distance is not None and not self.read_only and SimHashIndex.exists(self.storage_dir):
+            self.signatures = SimHashIndex.load(self.storage_dir, self.dedup_distance)
+        self._index_aliases_locked()
+        self._index_documents_locked()
+        deleted = np.unique(self._chunk_ids_of([doc for doc in self.documents if doc.get('deleted')]))
+        self._deleted = deleted[~np.isin(deleted, self._alias_targets_locked())]
+        self._search_params = None
+    
+    def delete_files(self):
+        """删除本分片的存储文件（同一目录下的其他文件，如重建清单，不受影响）"""
+        for name in shard_files():
+            (self.storage_dir / name).unlink(missing_ok=True)
+    
+    def link_files(self, target_dir: Path):
+        """
+        把未改动的分片文件硬链接到新目录（不支持硬链接时复制），之后该分片以新目录为存储位置
+        
+        硬链接与原文件共享数据，发布新一代时未改动的分片不产生额外的写入与磁盘占用。
+        """
+        target_dir = Path(target_dir)
+        with self._lock:
+            link_shard_files(self.storage_dir, target_dir)
+            self.storage_dir = target_dir
+    
     def clear_knowledge_base(self):
         """清空知识库"""
-        self.index = faiss.IndexFlatIP(self.dimension)
-        self.documents = []
-        self.chunks = []
-        
-        # 删除存储文件
-        for file in self.storage_dir.glob("*"):
-            file.unlink()
+        self._check_writable()
+        with self._lock:
+            self.index = self._new_index()
+            self.exact_vectors = self._new_exact_vectors()
+            self.documents = []
+            self.chunks = ChunkStore()
+            self._deleted = np.empty(0, dtype=np.int64)
+            self._search_params = None
+            self.epoch += 1
+            self.signatures = None
+            self._alias_refs = {}
+            self._index_documents_locked()
+            self.delete_files()
         
         print("🗑️ 知识库已清空")
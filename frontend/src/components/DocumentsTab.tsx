@@ -17,7 +17,10 @@ interface DocumentsTabProps {
 
 const DocumentsTab: React.FC<DocumentsTabProps> = ({ onUpload }) => {
   const [documents, setDocuments] = useState<Document[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [totalDocuments, setTotalDocuments] = useState(0)
   const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [uploading, setUploading] = useState(false)
   const [filePath, setFilePath] = useState('')
   const [message, setMessage] = useState<{ type: 'success' | 'error', text: string } | null>(null)
@@ -30,6 +33,8 @@ const DocumentsTab: React.FC<DocumentsTabProps> = ({ onUpload }) => {
     try {
       const data = await getDocuments()
       setDocuments(data.documents || [])
+      setNextCursor(data.next_cursor || null)
+      setTotalDocuments(data.total ?? (data.documents || []).length)
     } catch (error) {
       console.error('Failed to load documents:', error)
     } finally {
@@ -37,6 +42,20 @@ const DocumentsTab: React.FC<DocumentsTabProps> = ({ onUpload }) => {
     }
   }
 
+  const loadMoreDocuments = async () => {
+    if (!nextCursor) return
+    setLoadingMore(true)
+    try {
+      const data = await getDocuments({ cursor: nextCursor })
+      setDocuments((current) => [...current, ...(data.documents || [])])
+      setNextCursor(data.next_cursor || null)
+    } catch (error) {
+      console.error('Failed to load documents:', error)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handleFileUpload = async (e: React.ChangeEvent<HTMLInputElement>) => {
     const files = e.target.files
     if (!files || files.length === 0) return
@@ -259,6 +278,9 @@ const DocumentsTab: React.FC<DocumentsTabProps> = ({ onUpload }) => {
         <h3 className="text-lg font-semibold text-white mb-4 flex items-center gap-2">
           <FileText size={20} className="text-blue-400" />
           文档列表
+          {totalDocuments > 0 && (
+            <span className="text-sm font-normal text-white/60">({totalDocuments})</span>
+          )}
         </h3>
         
         {loading ? (
@@ -278,7 +300,7 @@ const DocumentsTab: React.FC<DocumentsTabProps> = ({ onUpload }) => {
                 key={index}
                 initial={{ opacity: 0, y: 20 }}
                 animate={{ opacity: 1, y: 0 }}
-                transition={{ delay: index * 0.1 }}
+                transition={{ delay: Math.min(index, 10) * 0.1 }}
                 className="flex items-center justify-between p-4 rounded-xl bg-white/5 border border-white/10 hover:border-white/20 transition-all duration-300"
                 whileHover={{ scale: 1.02, y: -2 }}
               >
@@ -293,6 +315,15 @@ const DocumentsTab: React.FC<DocumentsTabProps> = ({ onUpload }) => {
                 </div>
               </motion.div>
             ))}
+            {nextCursor && (
+              <button
+                onClick={loadMoreDocuments}
+                disabled={loadingMore}
+                className="mt-2 px-4 py-2 rounded-xl bg-white/10 border border-white/20 text-white/80 text-sm hover:bg-white/20 disabled:opacity-50 disabled:cursor-not-allowed transition-all"
+              >
+                {loadingMore ? '加载中...' : `加载更多（已显示 ${documents.length} / ${totalDocuments}）`}
+              </button>
+            )}
           </div>
         )}
       </motion.div>
@@ -22,6 +22,7 @@ const FileUploadPanel: React.FC<FileUploadPanelProps> = ({ onUploadSuccess, onRe
   const [resetting, setResetting] = useState(false)
   const [message, setMessage] = useState<{ type: 'success' | 'error', text: string } | null>(null)
   const [documents, setDocuments] = useState<Document[]>([])
+  const [totalDocuments, setTotalDocuments] = useState(0)
   const [, setLoadingDocuments] = useState(false)
   const fileInputRef = useRef<HTMLInputElement>(null)
 
@@ -31,9 +32,11 @@ const FileUploadPanel: React.FC<FileUploadPanelProps> = ({ onUploadSuccess, onRe
       setLoadingDocuments(true)
       const data = await getDocuments()
       setDocuments(data.documents || [])
+      setTotalDocuments(data.total ?? (data.documents || []).length)
     } catch (error) {
       console.error('加载文档列表失败:', error)
       setDocuments([])
+      setTotalDocuments(0)
     } finally {
       setLoadingDocuments(false)
     }
@@ -279,7 +282,7 @@ const FileUploadPanel: React.FC<FileUploadPanelProps> = ({ onUploadSuccess, onRe
         <div className="mt-3 space-y-2">
           <div className="flex items-center gap-1.5">
             <CheckCircle size={12} className="text-green-400" />
-            <p className="text-sm font-medium text-white/80">已上传文件 ({documents.length})</p>
+            <p className="text-sm font-medium text-white/80">已上传文件 ({totalDocuments})</p>
           </div>
           <div className="max-h-32 overflow-y-auto space-y-1.5 pr-1">
             {documents.map((doc, index) => (
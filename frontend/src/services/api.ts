@@ -73,26 +73,45 @@ export const getStats = async () => {
 }
 
 // 搜索文档
-export const searchDocuments = async (query: string, topK: number = 10) => {
+export const searchDocuments = async (query: string, topK: number = 10, collection?: string) => {
   const response = await api.post('/search', {
     query,
-    top_k: topK
+    top_k: topK,
+    collection
   })
   return response.data
 }
 
 // 问答
-export const askQuestion = async (question: string, topK: number = 5) => {
+export const askQuestion = async (question: string, topK: number = 5, collection?: string) => {
   const response = await api.post('/ask', {
     question,
-    top_k: topK
+    top_k: topK,
+    collection
   })
   return response.data
 }
 
-// 获取文档列表
-export const getDocuments = async () => {
-  const response = await api.get('/documents')
+// 获取集合列表
+export const getCollections = async () => {
+  const response = await api.get('/collections')
+  return response.data
+}
+
+// 文档列表的分页、排序与过滤参数
+export interface DocumentListParams {
+  limit?: number
+  cursor?: string  // 上一页返回的 next_cursor
+  sort?: 'name' | 'path' | 'size' | 'chunks' | 'mtime'
+  order?: 'asc' | 'desc'
+  collection?: string
+  q?: string  // 文件名包含的文字
+  type?: string  // 文件扩展名
+}
+
+// 获取文档列表（分页，next_cursor 为空时没有下一页）
+export const getDocuments = async (params: DocumentListParams = {}) => {
+  const response = await api.get('/documents', { params })
   return response.data
 }
 